@@ -0,0 +1,252 @@
+"""Retries, circuit breakers and failover for AI provider requests.
+
+Proxies fail intermittently (rate limits, 5xx errors, dropped connections).
+Instead of turning every such failure into an error message in Discord:
+- Transient failures are retried with jittered exponential backoff
+- Each endpoint (base URL) has a circuit breaker that stops sending traffic to
+  it after repeated failures and lets a single probe through after a cool-down
+- Requests fail over to the next saved API config in the channel's or
+  server's failover list when an endpoint keeps failing or its circuit is open
+"""
+import asyncio
+import random
+import time
+from typing import Dict, Any, Optional, Tuple, List, Callable, Awaitable
+
+import openai
+
+from bot_logging import get_logger
+
+logger = get_logger("generation")
+
+# HTTP status codes worth retrying besides 5xx: request timeout, conflict, rate limited
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+
+class CircuitOpenError(Exception):
+    """Raised when every candidate endpoint has an open circuit."""
+
+
+def _retry_after_seconds(response) -> Optional[float]:
+    """Read a retry delay from a provider response's headers, if present."""
+    if response is None:
+        return None
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        # HTTP-date retry-after values are rare for AI providers; use backoff instead
+        pass
+    return None
+
+
+def classify_error(error: Exception) -> Tuple[bool, Optional[float]]:
+    """Decide whether a failed request is worth retrying.
+
+    OpenAIClient wraps provider errors in a friendlier exception but keeps
+    the original as __cause__, so both forms are accepted.
+
+    Returns:
+        (retryable, retry_after) where retry_after is the provider's requested
+        delay in seconds, or None
+    """
+    cause = error.__cause__ if error.__cause__ is not None else error
+    if isinstance(cause, openai.APIStatusError):
+        status = cause.status_code
+        retryable = status in RETRYABLE_STATUS_CODES or status >= 500
+        return retryable, _retry_after_seconds(cause.response)
+    if isinstance(cause, (openai.APIConnectionError, asyncio.TimeoutError, ConnectionError)):
+        # Includes openai.APITimeoutError
+        return True, None
+    return False, None
+
+
+class RetryPolicy:
+    """How often and how long to wait before retrying a transient failure."""
+
+    def __init__(self, max_retries: int = 2, base_delay: float = 1.0, max_delay: float = 20.0):
+        self.max_retries = max(0, int(max_retries))
+        self.base_delay = max(0.0, float(base_delay))
+        self.max_delay = max(self.base_delay, float(max_delay))
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Get the wait before retry number attempt + 1 ("full jitter" backoff).
+
+        A retry-after from the provider is respected, up to max_delay.
+        """
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            backoff = max(backoff, retry_after)
+        return min(self.max_delay, backoff)
+
+
+class CircuitBreaker:
+    """Per-endpoint circuit breaker (closed -> open -> half-open -> closed)."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = max(0.0, float(reset_timeout))
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.probe_in_flight = False
+        self.total_failures = 0
+        self.total_successes = 0
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        """Whether a request may be sent to this endpoint now."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            # Cool-down over: let one probe request through
+            self.state = self.HALF_OPEN
+            self.probe_in_flight = False
+        if self.probe_in_flight:
+            return False
+        self.probe_in_flight = True
+        return True
+
+    def record_success(self) -> None:
+        self.total_successes += 1
+        self.consecutive_failures = 0
+        self.probe_in_flight = False
+        self.state = self.CLOSED
+
+    def record_failure(self) -> None:
+        self.total_failures += 1
+        self.consecutive_failures += 1
+        self.probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def release_probe(self) -> None:
+        """Give back a half-open probe that ended without a verdict (e.g. cancelled)."""
+        self.probe_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        retry_in = None
+        if self.state == self.OPEN:
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "total_failures": self.total_failures,
+            "total_successes": self.total_successes,
+            "times_opened": self.times_opened,
+            "retry_in_seconds": retry_in
+        }
+
+
+class ResilientCaller:
+    """Run a request against an ordered list of API configs with retries and failover."""
+
+    def __init__(self, policy: Optional[RetryPolicy] = None, failure_threshold: int = 5,
+                 reset_timeout: float = 30.0):
+        self.policy = policy or RetryPolicy()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.retries = 0
+        self.failovers = 0
+
+    def configure(self, max_retries: int = 2, base_delay: float = 1.0, max_delay: float = 20.0,
+                  failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        """Apply new settings; existing breakers keep their state."""
+        self.policy = RetryPolicy(max_retries, base_delay, max_delay)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        for breaker in self.breakers.values():
+            breaker.failure_threshold = max(1, int(failure_threshold))
+            breaker.reset_timeout = max(0.0, float(reset_timeout))
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        """Get (or create) the circuit breaker for an endpoint."""
+        endpoint = (endpoint or "").strip().rstrip("/")
+        if endpoint not in self.breakers:
+            self.breakers[endpoint] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return self.breakers[endpoint]
+
+    async def call(
+        self,
+        candidates: List[Tuple[str, Any]],
+        attempt: Callable[[Any], Awaitable[Any]],
+        can_retry: Optional[Callable[[], bool]] = None
+    ) -> Any:
+        """Call attempt(client) until it succeeds, retrying and failing over as needed.
+
+        Args:
+            candidates: Ordered (config name, OpenAIClient) pairs - primary first
+            attempt: Coroutine function that performs the request with one client
+            can_retry: Checked after a failure; return False when a retry is no
+                longer safe (e.g. part of a streamed reply was already shown)
+
+        Returns:
+            The result of the first successful attempt
+
+        Raises:
+            The last error if every candidate failed, CircuitOpenError if no
+            candidate could be tried, or any non-transient error immediately
+        """
+        last_error: Optional[Exception] = None
+
+        for index, (name, client) in enumerate(candidates):
+            breaker = self.breaker(client.base_url)
+            if not breaker.allow():
+                logger.warning("Skipping '%s' - circuit open for %s", name, client.base_url)
+                continue
+            if index > 0 and last_error is not None:
+                self.failovers += 1
+                logger.warning("Failing over to '%s' (%s)", name, client.base_url)
+
+            for attempt_number in range(self.policy.max_retries + 1):
+                try:
+                    result = await attempt(client)
+                except asyncio.CancelledError:
+                    breaker.release_probe()
+                    raise
+                except Exception as e:
+                    retryable, retry_after = classify_error(e)
+                    if not retryable:
+                        # Auth, content or context-length problems won't fix themselves
+                        breaker.release_probe()
+                        raise
+                    breaker.record_failure()
+                    last_error = e
+                    logger.warning("'%s' failed (attempt %s): %s", name, attempt_number + 1,
+                                   str(e).splitlines()[0][:120] if str(e) else type(e).__name__)
+                    if can_retry and not can_retry():
+                        raise
+                    if attempt_number >= self.policy.max_retries or not breaker.allow():
+                        break
+                    self.retries += 1
+                    await asyncio.sleep(self.policy.delay(attempt_number, retry_after))
+                    continue
+                breaker.record_success()
+                return result
+
+        if last_error is not None:
+            raise last_error
+        raise CircuitOpenError(
+            "All configured API endpoints are temporarily unavailable after repeated failures. "
+            "Please try again in a little while."
+        )
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "retries": self.retries,
+            "failovers": self.failovers,
+            "circuit_breakers": {endpoint: breaker.snapshot() for endpoint, breaker in list(self.breakers.items())}
+        }
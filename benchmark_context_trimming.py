@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark context trimming with 5,000-message histories (the !setcontext maximum).
+
+Compares the previous trimming algorithm (three token passes per call and
+insert(0, ...) for every kept message, rerun from scratch each turn) with the
+way build_chat_messages cuts history now (the channel's incremental
+HistoryTokenIndex plus the token budget), over a simulated session of new
+messages and swipes.
+"""
+
+import io
+import sys
+import os
+import time
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from context_trimmer import ContextTrimmer, HistoryWindow, RESPONSE_RESERVE
+from token_budget import BudgetPlanner, DEFAULT_COMPONENTS
+from tokenizer import TokenizerRegistry, TokenCounter
+
+HISTORY_SIZE = 5000
+TURNS = 50
+
+
+def previous_trim(messages, max_tokens, estimate_tokens):
+    """The trimming algorithm the bot used before context_trimmer.py."""
+    total_tokens = sum(estimate_tokens(msg['content']) for msg in messages)
+    if total_tokens <= max_tokens:
+        return messages
+    system_messages = [msg for msg in messages if msg.get('role') == 'system']
+    non_system_messages = [msg for msg in messages if msg.get('role') != 'system']
+    system_tokens = sum(estimate_tokens(msg['content']) for msg in system_messages)
+    last_message = non_system_messages[-1]
+    other_messages = non_system_messages[:-1]
+    available_tokens = max(max_tokens - system_tokens - estimate_tokens(last_message['content']) - 500, 0)
+    trimmed_messages = []
+    current_tokens = 0
+    for msg in reversed(other_messages):
+        msg_tokens = estimate_tokens(msg['content'])
+        if current_tokens + msg_tokens <= available_tokens:
+            trimmed_messages.insert(0, msg)
+            current_tokens += msg_tokens
+        else:
+            break
+    result = system_messages + trimmed_messages + [last_message]
+    sum(estimate_tokens(msg['content']) for msg in result)
+    return result
+
+
+def budget_trim(trimmer, planner, key, head, history, last_message, max_tokens, count_tokens):
+    """Cut history the way build_chat_messages does, for a head of system messages."""
+    index = trimmer.index_for(key, count_tokens)
+    index.sync(history)
+    requested = {name: 0 for name in DEFAULT_COMPONENTS}
+    requested["system"] = sum(count_tokens(message["content"]) for message in head)
+    requested["history"] = index.total()
+    requested["user_message"] = count_tokens(last_message["content"])
+    allocation = planner.plan(max_tokens, requested, RESPONSE_RESERVE)
+    history_start = index.fitting_start(allocation.granted["history"]) if allocation.trimmed else 0
+    return head + list(HistoryWindow(history, history_start)) + [last_message]
+
+
+def make_history(size):
+    history = []
+    for i in range(size):
+        role = "user" if i % 2 == 0 else "assistant"
+        history.append({"role": role, "content": f"Message {i}: " + "the quick brown fox jumps over the lazy dog " * (1 + i % 7)})
+    return history
+
+
+def run_session(trim, max_tokens):
+    """Simulate TURNS turns: each adds a user/assistant pair, then swipes the reply once."""
+    history = make_history(HISTORY_SIZE)
+    head = [{"role": "system", "content": "You are a helpful roleplay partner. " * 20}]
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        for turn in range(TURNS):
+            user_message = {"role": "user", "content": f"Turn {turn}: what happens next?"}
+            trim(head, history, user_message, max_tokens)
+            history.append(user_message)
+            history.append({"role": "assistant", "content": f"Reply {turn}"})
+            # Swipe: the reply is popped, the prompt rebuilt, and the new reply replaces it
+            reply = history.pop()
+            trim(head, history, {"role": "user", "content": user_message["content"]}, max_tokens)
+            history.append(reply)
+            history[-1] = {"role": "assistant", "content": f"Reply {turn} (swiped)"}
+    return (time.perf_counter() - start) / (TURNS * 2)
+
+
+def main():
+    print("=" * 70)
+    print(f"CONTEXT TRIMMING BENCHMARK ({HISTORY_SIZE} messages, {TURNS} turns + swipes)")
+    print("=" * 70)
+
+    for max_tokens in (8000, 128000, 2000000):
+        counter = TokenCounter(TokenizerRegistry("does-not-exist"))
+        count_tokens = lambda text: counter.count(text)
+
+        def old(head, history, last_message, limit):
+            return previous_trim(head + history + [last_message], limit, count_tokens)
+
+        trimmer = ContextTrimmer()
+        planner = BudgetPlanner()
+
+        def new(head, history, last_message, limit):
+            return budget_trim(trimmer, planner, "channel", head, history, last_message, limit, count_tokens)
+
+        old_time = run_session(old, max_tokens)
+        new_time = run_session(new, max_tokens)
+        print(f"\nmax_tokens={max_tokens}:")
+        print(f"  previous:    {old_time * 1000:8.3f} ms per prompt")
+        print(f"  incremental: {new_time * 1000:8.3f} ms per prompt")
+        print(f"  speedup:     {old_time / new_time:8.1f}x")
+
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark lorebook keyword matching with 10,000-entry world-info books.
+
+Compares the previous matching (every keyword of every entry checked against
+the message with a substring test) with the compiled KeywordAutomaton, which
+finds all triggered entries in one pass over the text.
+"""
+
+import random
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from keyword_automaton import KeywordAutomaton
+
+ENTRY_COUNTS = (1000, 10000)
+KEYWORDS_PER_ENTRY = 3
+MESSAGES = 200
+
+SYLLABLES = ["ka", "lo", "ri", "an", "mor", "thel", "va", "dun", "is", "or", "eth", "ul", "zar", "wyn", "bra"]
+
+
+def make_entries(count, rng):
+    entries = []
+    for i in range(count):
+        keywords = ["".join(rng.choice(SYLLABLES) for _ in range(3)) + str(i) for _ in range(KEYWORDS_PER_ENTRY)]
+        entries.append({"key": f"Entry {i}", "content": f"Lore for entry {i}.", "keywords": keywords})
+    return entries
+
+
+def make_messages(entries, rng):
+    """Roleplay-sized messages that mention a few entries each."""
+    messages = []
+    for _ in range(MESSAGES):
+        words = ["the", "traveller", "walked", "towards", "a", "gate", "and", "said", "hello"] * 20
+        for entry in rng.sample(entries, 3):
+            words.insert(rng.randrange(len(words)), rng.choice(entry["keywords"]).title())
+        messages.append(" ".join(words))
+    return messages
+
+
+def previous_match(entries, text):
+    """The matching the lorebook manager used before keyword_automaton.py."""
+    text_lower = text.lower()
+    return [entry for entry in entries if any(keyword.lower() in text_lower for keyword in entry["keywords"])]
+
+
+def main():
+    print("=" * 70)
+    print(f"LOREBOOK KEYWORD MATCHING BENCHMARK ({MESSAGES} messages)")
+    print("=" * 70)
+
+    rng = random.Random(42)
+    for count in ENTRY_COUNTS:
+        entries = make_entries(count, rng)
+        messages = make_messages(entries, rng)
+
+        start = time.perf_counter()
+        automaton = KeywordAutomaton()
+        for position, entry in enumerate(entries):
+            for keyword in entry["keywords"]:
+                automaton.add(keyword, position)
+        automaton.build()
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        expected = [previous_match(entries, text) for text in messages]
+        old_time = (time.perf_counter() - start) / MESSAGES
+
+        start = time.perf_counter()
+        found = [[entries[position] for position in sorted(automaton.search(text))] for text in messages]
+        new_time = (time.perf_counter() - start) / MESSAGES
+
+        assert found == expected
+        print(f"\n{count} entries ({count * KEYWORDS_PER_ENTRY} keywords):")
+        print(f"  build once:  {build_time * 1000:8.3f} ms")
+        print(f"  previous:    {old_time * 1000:8.3f} ms per message")
+        print(f"  automaton:   {new_time * 1000:8.3f} ms per message")
+        print(f"  speedup:     {old_time / new_time:8.1f}x")
+
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark importing a large SillyTavern world info file.
+
+Compares the previous import (the whole file decoded at once, then
+import_lorebook_file) with the streaming LorebookImporter, for both storage
+backends. Reports time, entries per second and peak Python memory.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from lorebook_importer import LorebookImporter, map_sillytavern_entry
+from lorebook_manager import LorebookManager
+
+ENTRY_COUNT = 20000
+
+
+def write_world_info(path):
+    with open(path, "w") as f:
+        json.dump({"entries": {
+            str(uid): {
+                "uid": uid,
+                "key": [f"place{uid}", f"alias{uid}"],
+                "keysecondary": [],
+                "comment": f"Place {uid}",
+                "content": f"Place {uid} is a town on the river. " * 30,
+                "constant": False,
+                "order": 100,
+                "disable": False
+            }
+            for uid in range(ENTRY_COUNT)
+        }}, f)
+
+
+def previous_import(manager, path):
+    """The import before lorebook_importer.py: decode everything, then save everything."""
+    with open(path, "r") as f:
+        data = json.loads(f.read())
+    entries = {}
+    for entry in data["entries"].values():
+        mapped = map_sillytavern_entry(entry)
+        entries[mapped["key"]] = mapped
+    manager.import_lorebook_file({"name": "World", "entries": entries})
+
+
+def streaming_import(manager, path):
+    LorebookImporter(manager).import_path(path, "World")
+
+
+def measure(label, storage, path, run):
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = LorebookManager(os.path.join(tmp, "lorebook"), storage=storage)
+        tracemalloc.start()
+        start = time.perf_counter()
+        run(manager, path)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert len(manager.lorebooks["World"]["entries"]) == ENTRY_COUNT
+        if manager.store is not None:
+            manager.store.close()
+    print(f"  {label:<10} {elapsed:7.2f} s  {ENTRY_COUNT / elapsed:9.0f} entries/s  peak {peak / 1e6:7.1f} MB")
+
+
+def main():
+    print("=" * 70)
+    print(f"LOREBOOK IMPORT BENCHMARK ({ENTRY_COUNT} entries)")
+    print("=" * 70)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "world.json")
+        write_world_info(path)
+        print(f"\nFile size: {os.path.getsize(path) / 1e6:.1f} MB")
+        for storage in ("json", "sqlite"):
+            print(f"\n{storage} storage:")
+            measure("previous", storage, path, previous_import)
+            measure("streaming", storage, path, streaming_import)
+
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Leveled, non-blocking logging for the bot.
+
+Hot paths (!chat, prompt building, lorebook activation, context trimming)
+log through loggers under "bot" instead of printing. Records are put on a
+bounded in-memory queue and written to stdout by a background listener
+thread, so a slow or blocked stdout (container logs, journald back-pressure)
+never stalls the event loop. If the queue is full, records are dropped and
+counted rather than waited on.
+
+Each subsystem has its own logger ("bot.chat", "bot.lorebook", ...) whose
+level is set from the "logging" config section. Per-entry lorebook debug
+lines go to "bot.lorebook.entries" and can be sampled.
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+from typing import Dict, Any, Optional
+
+SUBSYSTEMS = ("chat", "lorebook", "context", "generation", "webhook", "config")
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+DATE_FORMAT = "%H:%M:%S"
+
+
+def get_logger(subsystem: str) -> logging.Logger:
+    """Get the logger of a subsystem, e.g. get_logger("lorebook") -> "bot.lorebook"."""
+    return logging.getLogger(f"bot.{subsystem}")
+
+
+class SamplingFilter(logging.Filter):
+    """Let through a fraction of the records (1.0 = all, 0.1 = every tenth)."""
+
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate = rate
+        self.passed = 0
+        self.sampled_out = 0
+        self._credit = 0.0
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        with self._lock:
+            self._credit += self.rate
+            if self._credit >= 1.0:
+                self._credit -= 1.0
+                self.passed += 1
+                return True
+            self.sampled_out += 1
+            return False
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: records are dropped when the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.queued = 0
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The listener runs in this process, so only merge the arguments into the
+        # message (they may change later); formatting happens on the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+            self.queued += 1
+        except queue.Full:
+            self.dropped += 1
+
+
+class ConsoleHandler(logging.StreamHandler):
+    """Write to whatever sys.stdout currently is (it can be replaced, e.g. by tests)."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.stream = sys.stdout
+        super().emit(record)
+
+
+class BotLogging:
+    """The queue, its listener and the per-subsystem levels of the "bot" loggers."""
+
+    def __init__(self):
+        self.handler: Optional[DroppingQueueHandler] = None
+        self.listener: Optional[logging.handlers.QueueListener] = None
+        self.entry_sampler = SamplingFilter()
+        self.queue_size = 10000
+        self._lock = threading.Lock()
+        get_logger("lorebook.entries").addFilter(self.entry_sampler)
+
+    def start(self, queue_size: int) -> None:
+        """Attach the queue handler to the "bot" logger and start the listener thread."""
+        with self._lock:
+            if self.listener is not None and queue_size == self.queue_size:
+                return
+            self.stop()
+            self.queue_size = queue_size
+            log_queue = queue.Queue(maxsize=queue_size)
+            console = ConsoleHandler()
+            console.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+            self.handler = DroppingQueueHandler(log_queue)
+            self.listener = logging.handlers.QueueListener(log_queue, console, respect_handler_level=True)
+            self.listener.start()
+            root = logging.getLogger("bot")
+            root.addHandler(self.handler)
+            root.propagate = False
+
+    def stop(self) -> None:
+        """Write out everything still queued and stop the listener thread."""
+        if self.listener is not None:
+            logging.getLogger("bot").removeHandler(self.handler)
+            self.listener.stop()
+            self.listener = None
+
+    def configure(self, logging_config: Dict[str, Any]) -> None:
+        """Apply a "logging" config section (see get_logging_config in discord_bot.py)."""
+        logging.getLogger("bot").setLevel(logging_config["level"])
+        for subsystem in SUBSYSTEMS:
+            level = logging_config["levels"].get(subsystem)
+            # Unset subsystems follow the default level
+            get_logger(subsystem).setLevel(level or logging.NOTSET)
+        self.entry_sampler.rate = logging_config["lorebook_entry_sample_rate"]
+        self.start(logging_config["queue_size"])
+
+    def snapshot(self) -> Dict[str, Any]:
+        handler = self.handler
+        return {
+            "level": logging.getLevelName(logging.getLogger("bot").getEffectiveLevel()),
+            "levels": {
+                subsystem: logging.getLevelName(get_logger(subsystem).getEffectiveLevel())
+                for subsystem in SUBSYSTEMS
+            },
+            "queued": handler.queued if handler else 0,
+            "pending": handler.queue.qsize() if handler else 0,
+            "dropped": handler.dropped if handler else 0,
+            "lorebook_entries_sampled_out": self.entry_sampler.sampled_out
+        }
+
+
+bot_logging = BotLogging()
+atexit.register(bot_logging.stop)
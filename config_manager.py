@@ -1,12 +1,100 @@
-"""Configuration manager for Discord bot."""
+"""Configuration manager for Discord bot.
+
+Changes are written behind: set(), update_config() and the saved API config
+helpers only mark the config dirty, and a writer thread persists it once
+the changes of a short window (save_delay) have been coalesced. Each write
+goes to a temporary file that is fsynced and renamed over config.json, so a
+crash never leaves a half-written file. A failed write keeps the changes
+pending and the writer retries it, waiting twice as long after each failure
+(up to RETRY_DELAY_MAX). flush() (also run at exit) writes pending changes
+immediately.
+"""
+import atexit
 import json
 import os
-from typing import Dict, Any
+import stat
+import tempfile
+import threading
+import time
+import weakref
+from typing import Dict, Any, List, Optional, Set
+from bot_logging import get_logger
+
+logger = get_logger("config")
+
+# Top-level config keys that every resolved channel config depends on
+CHANNEL_WIDE_KEYS = ("channel_configs", "server_configs", "saved_api_configs",
+                     "thinking_filter", "cp_tracking", "manual_send_enabled")
+
+# Longest wait before retrying a failed write, in seconds
+RETRY_DELAY_MAX = 30.0
+
+# Managers with a running writer thread, flushed at exit. Held weakly, so a
+# manager that is no longer used (e.g. by a finished test) is not kept alive.
+_writing_managers: "weakref.WeakSet[ConfigManager]" = weakref.WeakSet()
+
+
+def _flush_at_exit() -> None:
+    for manager in list(_writing_managers):
+        manager.flush()
+
+
+atexit.register(_flush_at_exit)
+
+
+class ResolvedChannelConfig:
+    """A channel's settings with channel > server > default inheritance already applied.
+    
+    Dict values (thinking_filter, cp_tracking, api_config) are the config's own
+    dicts, not copies, so in-place edits of them are seen without a rebuild.
+    """
+    
+    __slots__ = ("channel_id", "server_id", "api_config_name", "api_config", "failover_api_configs",
+                 "character", "thinking_filter", "cp_tracking", "manual_send_enabled")
+    
+    def __init__(self, config: Dict[str, Any], channel_id: str, server_id: Optional[str]):
+        channel_config = (config.get("channel_configs") or {}).get(channel_id) or {}
+        server_config = ((config.get("server_configs") or {}).get(server_id) or {}) if server_id else {}
+        self.channel_id = channel_id
+        self.server_id = server_id
+        self.api_config_name = channel_config.get("api_config") or server_config.get("api_config") or ""
+        self.api_config = (config.get("saved_api_configs") or {}).get(self.api_config_name) if self.api_config_name else None
+        self.failover_api_configs: List[str] = (
+            channel_config.get("failover_api_configs") or server_config.get("failover_api_configs") or []
+        )
+        self.character: Optional[str] = channel_config.get("character") or server_config.get("character") or None
+        self.thinking_filter: Dict[str, Any] = config.get("thinking_filter", {})
+        self.cp_tracking: Dict[str, Any] = config.get("cp_tracking", {})
+        self.manual_send_enabled: bool = config.get("manual_send_enabled", False)
+
 
 class ConfigManager:
-    def __init__(self, config_path: str = "config.json"):
+    def __init__(self, config_path: str = "config.json", save_delay: float = 0.5):
+        """
+        Args:
+            config_path: Path of the JSON config file
+            save_delay: Seconds to coalesce changes for before writing them (0 = write immediately)
+        """
         self.config_path = config_path
         self.config = self.load_config()
+        self.save_delay = save_delay
+        # Guards the config dict while it is changed or serialized
+        self._lock = threading.RLock()
+        # Write-behind state: dirty flag and deadline, the writer thread, and file write ordering
+        self._save_condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._dirty = False
+        self._save_deadline = 0.0
+        self._writer: Optional[threading.Thread] = None
+        self.save_requests = 0
+        self.writes = 0
+        # Failed writes since the last successful one (sets the retry backoff)
+        self.failed_writes = 0
+        # Resolved config per channel id, rebuilt on the next lookup after a write affects it
+        self.resolved_channels: Dict[str, ResolvedChannelConfig] = {}
+        self._server_channels: Dict[str, Set[str]] = {}
+        self._resolve_lock = threading.Lock()
+        self.resolve_builds = 0
     
     def load_config(self) -> Dict[str, Any]:
         """Load configuration from file."""
@@ -26,9 +114,118 @@ class ConfigManager:
             return json.load(f)
     
     def save_config(self) -> None:
-        """Save current configuration to file."""
-        with open(self.config_path, "w") as f:
-            json.dump(self.config, f, indent=2)
+        """Save current configuration to file now (atomically)."""
+        self._persist(force=True)
+    
+    def schedule_save(self) -> None:
+        """Mark the configuration changed; the writer thread saves it within save_delay."""
+        if self.save_delay <= 0:
+            self.save_config()
+            return
+        with self._save_condition:
+            self.save_requests += 1
+            if not self._dirty:
+                self._dirty = True
+                # Measured from the first unsaved change, so a stream of edits still saves regularly
+                self._save_deadline = time.monotonic() + self.save_delay
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_behind, name="config-writer", daemon=True)
+                self._writer.start()
+                _writing_managers.add(self)
+            self._save_condition.notify()
+    
+    def flush(self) -> bool:
+        """Write pending changes immediately. Returns whether anything was written."""
+        try:
+            return self._persist()
+        except Exception as e:
+            # The changes stay in memory and are saved again with the next change
+            logger.error("Could not save %s: %s", self.config_path, e)
+            return False
+    
+    def _write_behind(self) -> None:
+        while True:
+            with self._save_condition:
+                if not self._dirty:
+                    # Nothing pending: the next change starts a new writer
+                    self._writer = None
+                    _writing_managers.discard(self)
+                    return
+                remaining = self._save_deadline - time.monotonic()
+                if remaining > 0:
+                    self._save_condition.wait(remaining)
+                    continue
+            self.flush()
+    
+    def _persist(self, force: bool = False) -> bool:
+        # One write at a time, so an older snapshot never replaces a newer one
+        with self._write_lock:
+            with self._save_condition:
+                if not (self._dirty or force):
+                    return False
+                self._dirty = False
+                # Let a waiting writer thread see there is nothing left to do
+                self._save_condition.notify()
+            try:
+                with self._lock:
+                    data = json.dumps(self.config, indent=2)
+                self._write_file(data)
+            except Exception:
+                self._retry_later()
+                raise
+            self.failed_writes = 0
+            self.writes += 1
+            return True
+    
+    def _retry_later(self) -> None:
+        """Mark the changes of a failed write pending again, due after a backoff."""
+        with self._save_condition:
+            self.failed_writes += 1
+            delay = min(RETRY_DELAY_MAX, max(self.save_delay, 0.1) * 2 ** (self.failed_writes - 1))
+            if self._dirty:
+                # Changed again meanwhile; don't retry sooner than the backoff
+                self._save_deadline = max(self._save_deadline, time.monotonic() + delay)
+            else:
+                self._dirty = True
+                self._save_deadline = time.monotonic() + delay
+    
+    def _write_file(self, data: str) -> None:
+        """Write to a temporary file, fsync it and rename it over the config file."""
+        directory = os.path.dirname(os.path.abspath(self.config_path))
+        fd, temp_path = tempfile.mkstemp(prefix=".config-", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.exists(self.config_path):
+                # Keep the file's permissions (mkstemp creates it owner-only)
+                os.chmod(temp_path, stat.S_IMODE(os.stat(self.config_path).st_mode))
+            os.replace(temp_path, self.config_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        try:
+            # Persist the rename itself (not supported on Windows)
+            dir_fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(dir_fd)
+        except OSError:
+            pass
+        finally:
+            os.close(dir_fd)
+    
+    def persistence_snapshot(self) -> Dict[str, Any]:
+        return {
+            "save_delay": self.save_delay,
+            "save_requests": self.save_requests,
+            "writes": self.writes,
+            "failed_writes": self.failed_writes,
+            "pending": self._dirty
+        }
     
     def deep_update(self, target: Dict[str, Any], updates: Dict[str, Any]) -> None:
         """Recursively update target dict with updates dict."""
@@ -42,8 +239,16 @@ class ConfigManager:
     
     def update_config(self, updates: Dict[str, Any]) -> None:
         """Update configuration with new values using deep merge."""
-        self.deep_update(self.config, updates)
-        self.save_config()
+        with self._lock:
+            self.deep_update(self.config, updates)
+        for key, value in updates.items():
+            if key in ("channel_configs", "server_configs") and isinstance(value, dict):
+                # Only the channels and servers in the update are affected
+                for config_id in value:
+                    self.invalidate_resolved([key, str(config_id)])
+            else:
+                self.invalidate_resolved([key])
+        self.schedule_save()
     
     def get(self, key: str, default: Any = None) -> Any:
         """Get configuration value."""
@@ -59,25 +264,45 @@ class ConfigManager:
     def set(self, key: str, value: Any) -> None:
         """Set configuration value."""
         keys = key.split('.')
-        config = self.config
-        for k in keys[:-1]:
-            if k not in config:
-                config[k] = {}
-            config = config[k]
-        config[keys[-1]] = value
-        self.save_config()
+        with self._lock:
+            config = self.config
+            for k in keys[:-1]:
+                if k not in config:
+                    config[k] = {}
+                config = config[k]
+            config[keys[-1]] = value
+        self.invalidate_resolved(keys)
+        self.schedule_save()
+    
+    def delete(self, key: str) -> bool:
+        """Delete a configuration value. Returns whether it existed."""
+        keys = key.split('.')
+        with self._lock:
+            config = self.config
+            for k in keys[:-1]:
+                config = config.get(k)
+                if not isinstance(config, dict):
+                    return False
+            if keys[-1] not in config:
+                return False
+            del config[keys[-1]]
+        self.invalidate_resolved(keys)
+        self.schedule_save()
+        return True
     
     def save_api_config(self, name: str, api_key: str, base_url: str, model: str) -> None:
         """Save an API configuration with a given name."""
-        if 'saved_api_configs' not in self.config:
-            self.config['saved_api_configs'] = {}
-        
-        self.config['saved_api_configs'][name] = {
-            'api_key': api_key,
-            'base_url': base_url,
-            'model': model
-        }
-        self.save_config()
+        with self._lock:
+            if 'saved_api_configs' not in self.config:
+                self.config['saved_api_configs'] = {}
+            
+            self.config['saved_api_configs'][name] = {
+                'api_key': api_key,
+                'base_url': base_url,
+                'model': model
+            }
+        self.invalidate_resolved(['saved_api_configs'])
+        self.schedule_save()
     
     def get_api_configs(self) -> Dict[str, Any]:
         """Get all saved API configurations."""
@@ -90,8 +315,44 @@ class ConfigManager:
     
     def delete_api_config(self, name: str) -> bool:
         """Delete a saved API configuration."""
-        if 'saved_api_configs' in self.config and name in self.config['saved_api_configs']:
+        with self._lock:
+            if 'saved_api_configs' not in self.config or name not in self.config['saved_api_configs']:
+                return False
             del self.config['saved_api_configs'][name]
-            self.save_config()
-            return True
-        return False
+        self.invalidate_resolved(['saved_api_configs'])
+        self.schedule_save()
+        return True
+    
+    def resolve_channel(self, channel_id: Any, server_id: Any = None) -> ResolvedChannelConfig:
+        """Get a channel's resolved config (channel > server > default), a dict lookup once built.
+        
+        A channel belongs to one server, so a lookup without server_id reuses the
+        entry built with it.
+        """
+        channel_key = str(channel_id)
+        server_key = str(server_id) if server_id else None
+        resolved = self.resolved_channels.get(channel_key)
+        if resolved is not None and (server_key is None or resolved.server_id == server_key):
+            return resolved
+        with self._resolve_lock:
+            # Built under the lock so a concurrent invalidation can't be overwritten by a stale entry
+            resolved = ResolvedChannelConfig(self.config, channel_key, server_key)
+            self.resolved_channels[channel_key] = resolved
+            if server_key:
+                self._server_channels.setdefault(server_key, set()).add(channel_key)
+            self.resolve_builds += 1
+        return resolved
+    
+    def invalidate_resolved(self, keys: List[str]) -> None:
+        """Drop the resolved configs a write to the dotted key path keys affects."""
+        if keys[0] not in CHANNEL_WIDE_KEYS:
+            return
+        with self._resolve_lock:
+            if keys[0] == "channel_configs" and len(keys) > 1:
+                self.resolved_channels.pop(keys[1], None)
+            elif keys[0] == "server_configs" and len(keys) > 1:
+                for channel_key in self._server_channels.pop(keys[1], ()):
+                    self.resolved_channels.pop(channel_key, None)
+            else:
+                self.resolved_channels.clear()
+                self._server_channels.clear()
@@ -0,0 +1,250 @@
+"""Incremental context trimming.
+
+Trimming used to re-estimate every message three times per call and build the
+kept list with insert(0, ...), which is quadratic, and it ran from scratch on
+every turn and every swipe. With auto-loaded histories of up to 5,000 messages
+that dominated prompt assembly.
+
+HistoryTokenIndex keeps running token totals (prefix sums) for a channel's
+history and updates them incrementally as messages are appended, replaced at
+the end or dropped from the front. The cut point is found with a binary search
+and the kept history is handed out as a view over the original list.
+
+Messages are treated as immutable: the bot replaces message dicts rather than
+editing them in place, so a message is recognized by identity.
+"""
+from bisect import bisect_left
+from itertools import islice
+from typing import Dict, Any, List, Optional, Tuple, Callable, Hashable, Iterator, Sequence
+
+from bot_logging import get_logger
+
+logger = get_logger("context")
+
+# Tokens kept free for the model's reply when trimming
+RESPONSE_RESERVE = 500
+
+Message = Dict[str, Any]
+
+
+class HistoryWindow(Sequence):
+    """Read-only view of history[start:stop] that doesn't copy the list."""
+
+    __slots__ = ("items", "start", "stop")
+
+    def __init__(self, items: List[Message], start: int = 0, stop: Optional[int] = None):
+        self.items = items
+        self.start = start
+        self.stop = len(items) if stop is None else stop
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.items[i] for i in range(self.start, self.stop)[index]]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("history window index out of range")
+        return self.items[self.start + index]
+
+    def __iter__(self) -> Iterator[Message]:
+        return islice(self.items, self.start, self.stop)
+
+
+class HistoryTokenIndex:
+    """Prefix sums of token counts over one channel's history."""
+
+    def __init__(self, count_tokens: Callable[[str], int]):
+        self.count_tokens = count_tokens
+        self.entries: List[Message] = []
+        # prefix[i] is the token total of entries[:i]
+        self.prefix: List[int] = [0]
+        # system_prefix[i] is the number of system messages in entries[:i]
+        self.system_prefix: List[int] = [0]
+        # entries[:offset] have been dropped from the front of the history
+        self.offset = 0
+        self.positions: Dict[int, int] = {}
+        self.rebuilds = 0
+        self.counted = 0
+
+    def _append(self, message: Message) -> None:
+        self.positions[id(message)] = len(self.entries)
+        self.entries.append(message)
+        self.prefix.append(self.prefix[-1] + self.count_tokens(message.get("content") or ""))
+        self.system_prefix.append(self.system_prefix[-1] + (message.get("role") == "system"))
+        self.counted += 1
+
+    def _rebuild(self, history: List[Message]) -> None:
+        self.entries = []
+        self.prefix = [0]
+        self.system_prefix = [0]
+        self.offset = 0
+        self.positions = {}
+        self.rebuilds += 1
+        for message in history:
+            self._append(message)
+
+    def _compact(self) -> None:
+        """Forget messages dropped from the front once they make up half the index."""
+        base = self.prefix[self.offset]
+        self.entries = self.entries[self.offset:]
+        self.prefix = [total - base for total in self.prefix[self.offset:]]
+        system_base = self.system_prefix[self.offset]
+        self.system_prefix = [total - system_base for total in self.system_prefix[self.offset:]]
+        self.positions = {id(message): i for i, message in enumerate(self.entries)}
+        self.offset = 0
+
+    def sync(self, history: List[Message]) -> None:
+        """Bring the index in line with the current history.
+
+        Appends, replacing or popping the last messages and dropping messages
+        from the front cost O(changed messages + log n); anything else
+        rebuilds the index.
+        """
+        if not history:
+            if self.entries:
+                self._rebuild(history)
+            return
+
+        start = self.positions.get(id(history[0]))
+        if start is None or self.entries[start] is not history[0]:
+            self._rebuild(history)
+            return
+
+        # history should be entries[start:start + k] followed by new messages.
+        # Changes only happen at the end, so matching messages form a prefix -
+        # binary search for the first one that differs.
+        overlap = min(len(history), len(self.entries) - start)
+        if history[overlap - 1] is self.entries[start + overlap - 1]:
+            matched = overlap
+        else:
+            low, high = 1, overlap - 1
+            while low < high:
+                middle = (low + high) // 2
+                if history[middle] is self.entries[start + middle]:
+                    low = middle + 1
+                else:
+                    high = middle
+            matched = low
+
+        end = start + matched
+        for message in self.entries[end:]:
+            self.positions.pop(id(message), None)
+        del self.entries[end:]
+        del self.prefix[end + 1:]
+        del self.system_prefix[end + 1:]
+        for message in islice(history, matched, None):
+            self._append(message)
+
+        self.offset = start
+        if self.offset > 64 and self.offset * 2 > len(self.entries):
+            self._compact()
+
+    def __len__(self) -> int:
+        return len(self.entries) - self.offset
+
+    def total(self) -> int:
+        """Token total of the whole history."""
+        return self.prefix[-1] - self.prefix[self.offset]
+
+    def system_count(self) -> int:
+        """Number of system messages in the history."""
+        return self.system_prefix[-1] - self.system_prefix[self.offset]
+
+    def tokens_from(self, index: int) -> int:
+        """Token total of history[index:]."""
+        return self.prefix[-1] - self.prefix[self.offset + index]
+
+    def fitting_start(self, budget: int) -> int:
+        """Index of the oldest message such that history[index:] fits in budget."""
+        end = len(self.entries)
+        position = bisect_left(self.prefix, self.prefix[-1] - budget, self.offset, end)
+        return position - self.offset
+
+
+def _keep_tail(messages: List[Message], tokens: List[int], budget: int) -> Tuple[int, int]:
+    """Longest suffix of messages that fits in budget.
+
+    Returns:
+        (start index of the suffix, tokens it uses)
+    """
+    used = 0
+    start = len(messages)
+    while start > 0 and used + tokens[start - 1] <= budget:
+        start -= 1
+        used += tokens[start]
+    return start, used
+
+
+def trim_to_fit(
+    messages: List[Message],
+    max_tokens: int,
+    count_tokens: Callable[[str], int],
+    reserve: int = RESPONSE_RESERVE
+) -> List[Message]:
+    """Trim oldest non-system messages so messages fit within max_tokens.
+
+    System messages and the last non-system message (the current user
+    message) are always kept; when trimming is needed, system messages are
+    moved to the front. Each message is counted once.
+    """
+    tokens = [count_tokens(message['content']) for message in messages]
+    total_tokens = sum(tokens)
+    logger.debug("Total estimated tokens: %s, Max: %s", total_tokens, max_tokens)
+    if total_tokens <= max_tokens:
+        return messages
+
+    system_messages = []
+    system_tokens = 0
+    others = []
+    other_tokens = []
+    for message, count in zip(messages, tokens):
+        if message.get('role') == 'system':
+            system_messages.append(message)
+            system_tokens += count
+        else:
+            others.append(message)
+            other_tokens.append(count)
+
+    last_message = others.pop() if others else None
+    last_tokens = other_tokens.pop() if other_tokens else 0
+
+    available_tokens = max(max_tokens - system_tokens - last_tokens - reserve, 0)
+    start, used = _keep_tail(others, other_tokens, available_tokens)
+    if start:
+        logger.info("Trimmed %s older messages to fit token limit", start)
+
+    result = system_messages + others[start:]
+    if last_message:
+        result.append(last_message)
+    logger.debug("Final estimated tokens: %s", system_tokens + used + last_tokens)
+    return result
+
+
+class ContextTrimmer:
+    """Per-channel HistoryTokenIndexes; build_chat_messages cuts history with them."""
+
+    def __init__(self, max_channels: int = 1000):
+        self.max_channels = max_channels
+        self.indexes: Dict[Hashable, HistoryTokenIndex] = {}
+
+    def index_for(self, key: Hashable, count_tokens: Callable[[str], int]) -> HistoryTokenIndex:
+        index = self.indexes.get(key)
+        if index is None:
+            if len(self.indexes) >= self.max_channels:
+                # Drop the oldest channel's index; it is rebuilt on its next message
+                self.indexes.pop(next(iter(self.indexes)))
+            index = self.indexes[key] = HistoryTokenIndex(count_tokens)
+        return index
+
+    def forget(self, key: Hashable) -> None:
+        self.indexes.pop(key, None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "channels": len(self.indexes),
+            "indexed_messages": sum(len(index) for index in list(self.indexes.values())),
+            "rebuilds": sum(index.rebuilds for index in list(self.indexes.values()))
+        }
@@ -1,17 +1,36 @@
 """Discord bot with OpenAI integration and preset support."""
 import discord
 from discord.ext import commands
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, Callable, Awaitable, Any
+from contextlib import asynccontextmanager, aclosing
 import re
 import aiohttp
 import asyncio
 import os
+import time
+from bot_logging import bot_logging, get_logger, SUBSYSTEMS, LEVELS
 from config_manager import ConfigManager
 from preset_manager import PresetManager
 from character_manager import CharacterManager
 from user_characters_manager import UserCharactersManager
 from lorebook_manager import LorebookManager
-from openai_client import OpenAIClient
+from openai_client import OpenAIClient, OpenAIClientRegistry
+from generation_metrics import GenerationMetrics, PrefixStabilityTracker
+from generation_scheduler import GenerationScheduler, PRIORITY_CHAT, PRIORITY_SWIPE, PRIORITY_BACKGROUND
+from api_resilience import ResilientCaller, CircuitBreaker, classify_error
+from request_hedging import RequestHedger
+from rate_limiter import RateLimiter
+from prompt_context_cache import PromptContextCache, CompiledPromptContext
+from tokenizer import TokenizerRegistry, TokenCounter
+from context_trimmer import ContextTrimmer, HistoryWindow, trim_to_fit
+from history_summarizer import HistorySummarizer, build_summary_request
+from token_budget import BudgetPlanner, ContextWindowRegistry, DEFAULT_COMPONENTS, truncate_text, keep_leading
+
+chat_logger = get_logger("chat")
+lorebook_logger = get_logger("lorebook")
+context_logger = get_logger("context")
+generation_logger = get_logger("generation")
+webhook_logger = get_logger("webhook")
 
 
 def smart_split_text(text: str, max_length: int = 4096, prefer_length: int = 3900) -> List[str]:
@@ -140,7 +159,7 @@ class PersistentTyping:
                 break
             except Exception as e:
                 # If there's an error, stop the loop
-                print(f"Error maintaining typing indicator: {e}")
+                chat_logger.warning("Error maintaining typing indicator: %s", e)
                 break
     
     async def __aenter__(self):
@@ -192,7 +211,7 @@ class SwipeButtonView(discord.ui.View):
         response = self.bot.response_alternatives[self.channel_id][-1][current_idx]
         
         # Apply thinking filter to the stored response
-        full_response, filtered_response = self.bot.filter_thinking_tags(response)
+        full_response, filtered_response = self.bot.filter_thinking_tags(response, self.channel_id)
         
         # Recalculate CP for this swipe
         self.bot.recalculate_cp_for_swipe(filtered_response, self.channel_id)
@@ -242,11 +261,10 @@ class SwipeButtonView(discord.ui.View):
         # Get the last user message
         last_user_msg = None
         last_user_character = None
-        for msg in reversed(self.bot.conversations[self.channel_id]):
-            if msg["role"] == "user":
-                last_user_msg = msg["content"]
-                last_user_character, _ = self.bot.parse_character_message(last_user_msg)
-                break
+        turn = self.bot.last_user_message(self.channel_id)
+        if turn:
+            last_user_msg = turn["content"]
+            last_user_character, _ = self.bot.parse_character_message(last_user_msg)
         
         if not last_user_msg:
             await interaction.followup.send("No user message found to regenerate.", ephemeral=True)
@@ -267,19 +285,19 @@ class SwipeButtonView(discord.ui.View):
         
         try:
             # Generate alternative response
-            response = await self.bot.openai_client.chat_completion(
-                messages=messages,
-                temperature=preset.get("temperature", 0.7),
-                max_tokens=preset.get("max_response_length", preset.get("max_tokens", 2000)),
-                top_p=preset.get("top_p", 1.0),
-                frequency_penalty=preset.get("frequency_penalty", 0.0),
-                presence_penalty=preset.get("presence_penalty", 0.0),
-                frequency_penalty_enabled=preset.get("frequency_penalty_enabled", True),
-                presence_penalty_enabled=preset.get("presence_penalty_enabled", True)
+            notify = lambda text: interaction.followup.send(text, ephemeral=True, wait=True)
+            responses = await self.bot.generate_swipe_alternatives(
+                self.channel_id, interaction.guild_id, messages, preset, notify
             )
+            response = responses[0]
+            
+            if self.bot.last_user_message(self.channel_id) is not turn:
+                # A new message was answered while this was generating - don't overwrite its reply
+                await interaction.followup.send("The conversation moved on while this alternative was generating, so it was discarded.", ephemeral=True)
+                return
             
             # Apply thinking filter
-            full_response, filtered_response = self.bot.filter_thinking_tags(response)
+            full_response, filtered_response = self.bot.filter_thinking_tags(response, self.channel_id)
             
             # Recalculate CP for this swipe (it's a new alternative)
             # Don't increment count since it's not a new user message
@@ -291,18 +309,11 @@ class SwipeButtonView(discord.ui.View):
             # Store the response with CP info
             self.bot.last_response_text[self.channel_id] = filtered_response_with_cp
             
-            # Log full response to console if filtering is active
-            thinking_config = self.bot.config_manager.get("thinking_filter", {})
+            # Log the full response (debug level) if filtering is active
+            thinking_config = self.bot.get_thinking_config(self.channel_id)
             if thinking_config.get("enabled", False) and full_response != filtered_response:
-                print(f"\n{'='*60}")
-                print(f"FULL RESPONSE (before filtering):")
-                print(f"{'='*60}")
-                print(full_response)
-                print(f"{'='*60}")
-                print(f"FILTERED RESPONSE (sent to Discord):")
-                print(f"{'='*60}")
-                print(filtered_response_with_cp)
-                print(f"{'='*60}\n")
+                chat_logger.debug("Full response (before filtering):\n%s\nFiltered response (sent to Discord):\n%s",
+                                  full_response, filtered_response_with_cp)
             
             # Add to alternatives (store full response)
             if self.channel_id in self.bot.response_alternatives and len(self.bot.response_alternatives[self.channel_id]) > 0:
@@ -314,6 +325,9 @@ class SwipeButtonView(discord.ui.View):
                 self.bot.response_alternatives[self.channel_id].append([full_response])
                 self.bot.current_alternative_index[self.channel_id] = 0
             
+            # Extra alternatives from the same round trip can be browsed with ◀ ▶ instantly
+            self.bot.response_alternatives[self.channel_id][-1].extend(responses[1:])
+            
             # Update conversation history (with full response)
             self.bot.conversations[self.channel_id][-1] = {"role": "assistant", "content": full_response}
             
@@ -336,7 +350,7 @@ class SwipeButtonView(discord.ui.View):
                     # Update message IDs for next swipe
                     self.message_ids = new_ids
                 
-                await interaction.followup.send(f"*Alternative {current_idx + 1}/{alt_count}*", ephemeral=True)
+                await interaction.followup.send(f"*Alternative {current_idx + 1}/{alt_count}*{self.bot.format_extra_alternatives(len(responses) - 1)}", ephemeral=True)
             except Exception as e:
                 await interaction.followup.send(f"Error updating message: {str(e)}", ephemeral=True)
         
@@ -365,7 +379,7 @@ class SwipeButtonView(discord.ui.View):
         response = self.bot.response_alternatives[self.channel_id][-1][current_idx]
         
         # Apply thinking filter to the stored response
-        full_response, filtered_response = self.bot.filter_thinking_tags(response)
+        full_response, filtered_response = self.bot.filter_thinking_tags(response, self.channel_id)
         
         # Recalculate CP for this swipe
         self.bot.recalculate_cp_for_swipe(filtered_response, self.channel_id)
@@ -584,6 +598,121 @@ async def replace_multi_page_message(channel, old_message_ids: List[int], conten
     return new_message_ids
 
 
+class StreamingMessageRenderer:
+    """Progressively render a streaming AI reply into Discord embeds.
+    
+    The first embed is posted as soon as any visible text arrives. After that
+    the text is re-rendered at most once per edit_interval seconds so edits
+    stay within Discord's rate limits. Text that outgrows one embed rolls onto
+    new pages at smart_split_text boundaries; pages that are already complete
+    are not edited again until the final render.
+    """
+    
+    def __init__(self, channel, webhook: Optional[discord.Webhook] = None,
+                 webhook_params: Optional[Dict[str, any]] = None, edit_interval: float = 1.5):
+        self.channel = channel
+        self.webhook = webhook
+        self.webhook_params = webhook_params or {}
+        self.edit_interval = edit_interval
+        self.messages = []  # One sent message per page
+        self.rendered = []  # (description, footer, has_view) currently shown on each page
+        self.first_visible_at: Optional[float] = None
+        self.last_render_at = 0.0
+    
+    def due(self) -> bool:
+        """Whether enough time has passed since the last render to render again."""
+        if not self.messages:
+            return True
+        return time.monotonic() - self.last_render_at >= self.edit_interval
+    
+    async def update(self, text: str) -> None:
+        """Show partial text if a render is due (throttled)."""
+        if not text.strip() or not self.due():
+            return
+        await self._render(text, final=False)
+    
+    async def finalize(self, text: str, view: discord.ui.View = None):
+        """Render the complete text and attach the view to the last page.
+        
+        Returns:
+            Tuple of (last_message, list of all message IDs)
+        """
+        await self._render(text, final=True, view=view)
+        last_message = self.messages[-1] if self.messages else None
+        return last_message, [msg.id for msg in self.messages]
+    
+    async def discard(self) -> None:
+        """Delete every page sent so far (used when generation fails midway)."""
+        for message in self.messages:
+            try:
+                if self.webhook:
+                    await self.webhook.delete_message(message.id)
+                else:
+                    await message.delete()
+            except:
+                pass  # Message might already be deleted
+        self.messages = []
+        self.rendered = []
+    
+    async def _render(self, text: str, final: bool, view: discord.ui.View = None) -> None:
+        chunks = smart_split_text(text, max_length=4096, prefer_length=3900) if text else [""]
+        for i, chunk in enumerate(chunks):
+            is_last = i == len(chunks) - 1
+            if final:
+                footer = f"Page {i+1}/{len(chunks)}" if len(chunks) > 1 else None
+            else:
+                footer = "✍️ Generating..." if is_last else None
+            page_view = view if (final and is_last) else None
+            state = (chunk, footer, page_view is not None)
+            
+            # Skip pages whose visible state hasn't changed
+            if i < len(self.rendered) and self.rendered[i] == state:
+                continue
+            
+            embed = discord.Embed(description=chunk, color=0x2b2d31)
+            if footer:
+                embed.set_footer(text=footer)
+            
+            if i < len(self.messages):
+                await self._edit(self.messages[i], embed, page_view)
+                self.rendered[i] = state
+            else:
+                self.messages.append(await self._send(embed, page_view))
+                self.rendered.append(state)
+                if self.first_visible_at is None:
+                    self.first_visible_at = time.monotonic()
+        
+        # The final text can be shorter than what was streamed (e.g. thinking filter)
+        if final and len(self.messages) > len(chunks):
+            extra = self.messages[len(chunks):]
+            self.messages = self.messages[:len(chunks)]
+            self.rendered = self.rendered[:len(chunks)]
+            for message in extra:
+                try:
+                    if self.webhook:
+                        await self.webhook.delete_message(message.id)
+                    else:
+                        await message.delete()
+                except:
+                    pass
+        
+        self.last_render_at = time.monotonic()
+    
+    async def _send(self, embed: discord.Embed, view: discord.ui.View = None):
+        kwargs = {'embed': embed}
+        if view is not None:
+            kwargs['view'] = view
+        if self.webhook:
+            return await self.webhook.send(**kwargs, **self.webhook_params)
+        return await self.channel.send(**kwargs)
+    
+    async def _edit(self, message, embed: discord.Embed, view: discord.ui.View = None) -> None:
+        if self.webhook:
+            await self.webhook.edit_message(message.id, embed=embed, view=view)
+        else:
+            await message.edit(embed=embed, view=view)
+
+
 class DiscordBot(commands.Bot):
     def __init__(self, config: ConfigManager):
         intents = discord.Intents.default()
@@ -591,10 +720,14 @@ class DiscordBot(commands.Bot):
         super().__init__(command_prefix="!", intents=intents)
         
         self.config_manager = config
+        # Leveled, queued logging for the hot paths (see bot_logging.py)
+        self.configure_logging()
         self.preset_manager = PresetManager()
         self.character_manager = CharacterManager()
         self.user_characters_manager = UserCharactersManager()
-        self.lorebook_manager = LorebookManager()
+        self.lorebook_manager = LorebookManager(
+            storage=config.get("lorebook_storage", {}).get("backend", "json")
+        )
         
         # Initialize OpenAI client
         openai_config = config.get("openai_config", {})
@@ -604,6 +737,9 @@ class DiscordBot(commands.Bot):
             model=openai_config.get("model", "gpt-3.5-turbo")
         )
         
+        # Pooled clients for saved API configs used by channels and servers
+        self.client_registry = OpenAIClientRegistry()
+        
         # Load default preset
         default_preset = config.get("default_preset", {})
         if default_preset:
@@ -615,6 +751,10 @@ class DiscordBot(commands.Bot):
         # Store alternative responses for swipe functionality
         self.response_alternatives: Dict[int, List[List[str]]] = {}
         self.current_alternative_index: Dict[int, int] = {}
+        # Whether each endpoint (base URL) honors the n parameter for multi-candidate swipes
+        self.n_parameter_support: Dict[str, bool] = {}
+        # Speculatively pre-generated swipe alternative per channel (see start_speculative_swipe)
+        self.speculative_swipes: Dict[int, Dict[str, any]] = {}
         
         # Track character names per channel for context
         self.character_names: Dict[int, List[str]] = {}
@@ -636,6 +776,43 @@ class DiscordBot(commands.Bot):
         # Store last response's raw text for CP extraction on swipe
         self.last_response_text: Dict[int, str] = {}
         
+        # Latency metrics (time to first visible token, total generation time)
+        self.generation_metrics = GenerationMetrics()
+        
+        # Admission control in front of every generation (per-endpoint limits, fair queuing)
+        self.scheduler = GenerationScheduler(metrics=self.generation_metrics)
+        self.configure_scheduler()
+        
+        # Retries, circuit breakers and failover between saved API configs
+        self.resilience = ResilientCaller()
+        self.configure_resilience()
+        
+        # Rate-limit buckets per endpoint, synced from the provider's rate-limit headers
+        self.rate_limiter = RateLimiter()
+        # How much of each channel's prompt repeats the previous one (prompt cache friendliness)
+        self.prefix_stability = PrefixStabilityTracker()
+        # Compiled character cards / preset sections and prompt file change detection
+        self.prompt_context_cache = PromptContextCache()
+        # Running token totals per channel history for incremental trimming
+        self.context_trimmer = ContextTrimmer()
+        # Token budgets per prompt component and model context windows
+        self.last_budget_allocations: Dict[int, Dict[str, Any]] = {}
+        self.configure_token_budget()
+        # Running summaries of history that no longer fits in the prompt
+        self.history_summarizer = HistorySummarizer(self.summarize_history)
+        self.configure_history_summary()
+        # Semantic activation of "vectorized" lorebook entries
+        self.configure_lorebook_vectors()
+        # Entries activated by the content of other active entries
+        self.configure_lorebook_recursion()
+        # Token counting with local BPE vocabularies, memoized per message
+        self.configure_tokenizer()
+        self.configure_rate_limits()
+        
+        # Opt-in hedging of slow requests to a second API config
+        self.hedger = RequestHedger()
+        self.configure_hedging()
+        
         # Add commands
         self.add_bot_commands()
     
@@ -682,10 +859,10 @@ class DiscordBot(commands.Bot):
                     self.channel_webhooks[channel_id] = webhook
                     return webhook
         except discord.Forbidden:
-            print(f"No permission to manage webhooks in channel {channel.name}")
+            webhook_logger.warning("No permission to manage webhooks in channel %s", channel.name)
             return None
         except Exception as e:
-            print(f"Error fetching webhooks: {e}")
+            webhook_logger.error("Error fetching webhooks: %s", e)
             return None
         
         # Create new webhook
@@ -697,12 +874,38 @@ class DiscordBot(commands.Bot):
             self.channel_webhooks[channel_id] = webhook
             return webhook
         except discord.Forbidden:
-            print(f"No permission to create webhook in channel {channel.name}")
+            webhook_logger.warning("No permission to create webhook in channel %s", channel.name)
             return None
         except Exception as e:
-            print(f"Error creating webhook: {e}")
+            webhook_logger.error("Error creating webhook: %s", e)
             return None
     
+    def get_webhook_params(self, character_data: Dict[str, any]) -> Dict[str, any]:
+        """Build the webhook send parameters that make a message appear as a character.
+        
+        Args:
+            character_data: Character data including name and avatar_url
+            
+        Returns:
+            Dict of keyword arguments for webhook.send
+        """
+        # Get character name and avatar
+        character_name = character_data.get('name', 'Character')
+        avatar_url = character_data.get('avatar_url')
+        
+        # Build webhook parameters
+        webhook_params = {
+            'username': character_name,
+            'wait': True
+        }
+        
+        # Only include avatar_url if it's a valid HTTP/HTTPS URL
+        # Discord webhooks don't support base64 data URLs
+        if avatar_url and avatar_url.strip() and (avatar_url.startswith('http://') or avatar_url.startswith('https://')):
+            webhook_params['avatar_url'] = avatar_url
+        
+        return webhook_params
+    
     async def send_as_character(
         self, 
         channel: discord.TextChannel, 
@@ -730,20 +933,7 @@ class DiscordBot(commands.Bot):
             return None, []
         
         try:
-            # Get character name and avatar
-            character_name = character_data.get('name', 'Character')
-            avatar_url = character_data.get('avatar_url')
-            
-            # Build webhook parameters
-            webhook_params = {
-                'username': character_name,
-                'wait': True
-            }
-            
-            # Only include avatar_url if it's a valid HTTP/HTTPS URL
-            # Discord webhooks don't support base64 data URLs
-            if avatar_url and avatar_url.strip() and (avatar_url.startswith('http://') or avatar_url.startswith('https://')):
-                webhook_params['avatar_url'] = avatar_url
+            webhook_params = self.get_webhook_params(character_data)
             
             # Use embeds for better formatting and higher character limit (4096 vs 2000)
             # Split intelligently if content exceeds embed description limit
@@ -782,9 +972,7 @@ class DiscordBot(commands.Bot):
                 message_ids.append(last_message.id)
             return last_message, message_ids
         except Exception as e:
-            print(f"[WEBHOOK] Error sending webhook message: {e}")
-            import traceback
-            traceback.print_exc()
+            webhook_logger.exception("Error sending webhook message: %s", e)
             return None, []
     
     async def edit_as_character(
@@ -833,7 +1021,7 @@ class DiscordBot(commands.Bot):
             )
             return edited_message
         except Exception as e:
-            print(f"Error editing webhook message: {e}")
+            webhook_logger.error("Error editing webhook message: %s", e)
             return None
     
     async def replace_as_character(
@@ -902,110 +1090,683 @@ class DiscordBot(commands.Bot):
             base_url=base_url,
             model=model
         )
-        print(f"Updated OpenAI configuration - Model: {model}, Base URL: {base_url}")
+        generation_logger.info("Updated OpenAI configuration - Model: %s, Base URL: %s", model, base_url)
 
+    def invalidate_api_config(self, name: str = None) -> None:
+        """Drop the pooled client for a saved API config after it was edited or deleted.
+        
+        Args:
+            name: Name of the saved API config, or None to drop all pooled clients
+        """
+        self.client_registry.invalidate(name)
+    
     def get_openai_client_for_channel(self, channel_id: int, server_id: int = None):
         """Get the appropriate OpenAI client for a channel (with channel or server-specific config if set)."""
-        # Priority: channel config > server config > default
+        # Priority: channel config > server config > default (already applied when resolved)
+        resolved = self.config_manager.resolve_channel(channel_id, server_id)
+        if resolved.api_config:
+            # Reuse the pooled client (and its keep-alive connections) for this config
+            return self.client_registry.get(resolved.api_config_name, resolved.api_config)
         
-        # Check for channel-specific API config first
-        api_config_name = self.config_manager.get(f'channel_configs.{channel_id}.api_config', '')
-        
-        # If no channel config and server_id provided, check server config
-        if not api_config_name and server_id:
-            api_config_name = self.config_manager.get(f'server_configs.{server_id}.api_config', '')
+        # Return default client
+        return self.openai_client
+    
+    def get_api_candidates(self, channel_id: int, server_id: int = None) -> List[Tuple[str, OpenAIClient]]:
+        """Get the clients to try for a channel, in order: its usual client, then its failover list.
         
-        if api_config_name:
-            # Load the API config
-            api_config = self.config_manager.get_api_config(api_config_name)
+        The failover list is "failover_api_configs" (saved API config names) in the
+        channel's config, or in the server's config if the channel has none.
+        """
+        primary = self.get_openai_client_for_channel(channel_id, server_id)
+        resolved = self.config_manager.resolve_channel(channel_id, server_id)
+        primary_name = resolved.api_config_name
+        candidates = [(primary_name or 'default', primary)]
+        
+        for name in resolved.failover_api_configs:
+            if name == primary_name or any(name == existing for existing, _ in candidates):
+                continue
+            api_config = self.config_manager.get_api_config(name)
             if api_config:
-                # Create a temporary client with channel-specific config
-                from openai_client import OpenAIClient
-                return OpenAIClient(
-                    api_key=api_config.get('api_key', ''),
-                    base_url=api_config.get('base_url', 'https://api.openai.com/v1'),
-                    model=api_config.get('model', 'gpt-3.5-turbo')
-                )
+                candidates.append((name, self.client_registry.get(name, api_config)))
+            else:
+                generation_logger.warning("Failover API config '%s' not found, skipping", name)
         
-        # Return default client
-        return self.openai_client
+        for _, client in candidates:
+            self.rate_limiter.attach(client)
+        return candidates
     
-    def estimate_tokens(self, text: str) -> int:
-        """Estimate token count for text using a simple approximation.
+    def get_rate_limit_config(self) -> Dict[str, any]:
+        """Get client-side rate limiting settings (on by default; only acts on endpoints that send rate-limit headers)."""
+        rate_limit_config = self.config_manager.get("rate_limits", {}) or {}
+        return {
+            "enabled": rate_limit_config.get("enabled", True),
+            "max_wait": float(rate_limit_config.get("max_wait", 30.0)),
+            "reroute_after": float(rate_limit_config.get("reroute_after", 2.0))
+        }
+    
+    def configure_rate_limits(self) -> None:
+        """Apply the "rate_limits" config section to the rate limiter."""
+        self.rate_limiter.max_wait = self.get_rate_limit_config()["max_wait"]
+    
+    def estimate_request_tokens(self, messages: List[Dict[str, str]], preset: Dict[str, any], completions: int = 1) -> int:
+        """Estimate what a request counts against a provider's token rate limit.
         
-        This uses a rough estimate: 1 token ≈ 4 characters.
-        For more accurate counts, you could use tiktoken library.
+        Providers count the prompt plus max_tokens for every requested completion.
+        The preset's max_tokens is its context size; the reply length sent as
+        max_tokens comes from get_generation_params.
         """
-        # Simple estimation: average 4 characters per token
-        return len(text) // 4
+        prompt_tokens = sum(self.estimate_tokens(message.get("content", "") or "") for message in messages)
+        return prompt_tokens + completions * int(self.get_generation_params(preset)["max_tokens"])
     
-    def trim_messages_to_fit(self, messages: List[Dict[str, str]], max_tokens: int) -> List[Dict[str, str]]:
-        """Trim oldest messages to fit within token limit.
+    def configure_resilience(self) -> None:
+        """Apply the "resilience" config section (retries and circuit breakers)."""
+        resilience_config = self.config_manager.get("resilience", {}) or {}
+        self.resilience.configure(
+            max_retries=resilience_config.get("max_retries", 2),
+            base_delay=resilience_config.get("base_delay", 1.0),
+            max_delay=resilience_config.get("max_delay", 20.0),
+            failure_threshold=resilience_config.get("circuit_failure_threshold", 5),
+            reset_timeout=resilience_config.get("circuit_reset_seconds", 30.0)
+        )
+    
+    def get_hedging_config(self) -> Dict[str, any]:
+        """Get hedging settings (disabled unless configured)."""
+        hedging_config = self.config_manager.get("hedging", {}) or {}
+        return {
+            "enabled": hedging_config.get("enabled", False),
+            "percentile": hedging_config.get("percentile", 95),
+            "min_samples": hedging_config.get("min_samples", 20),
+            "default_delay": hedging_config.get("default_delay", 8.0),
+            "min_delay": hedging_config.get("min_delay", 1.0),
+            "max_delay": hedging_config.get("max_delay", 30.0)
+        }
+    
+    def configure_hedging(self) -> None:
+        """Apply the "hedging" config section to the request hedger."""
+        hedging_config = self.get_hedging_config()
+        self.hedger.configure(
+            percentile=hedging_config["percentile"],
+            min_samples=hedging_config["min_samples"],
+            default_delay=hedging_config["default_delay"],
+            min_delay=hedging_config["min_delay"],
+            max_delay=hedging_config["max_delay"]
+        )
+    
+    async def generate_response(
+        self,
+        channel_id: int,
+        server_id: int,
+        messages: List[Dict[str, str]],
+        preset: Dict[str, any],
+        priority: int = PRIORITY_CHAT,
+        notify: Optional[Callable[[str], Awaitable[Any]]] = None,
+        renderer: "StreamingMessageRenderer" = None
+    ) -> str:
+        """Generate a reply for a channel with scheduling, retries and failover.
         
         Args:
-            messages: List of message dicts with 'role' and 'content'
-            max_tokens: Maximum token limit for context
-            
+            channel_id: Channel the reply is for (selects the API config and failover list)
+            server_id: Server the channel belongs to
+            messages: Chat messages to send
+            preset: Preset with the sampling parameters
+            priority: Scheduler priority (PRIORITY_CHAT or PRIORITY_SWIPE)
+            notify: Sends "queued" notices to the user (see generation_slot)
+            renderer: If given, the reply is streamed into it
+        
         Returns:
-            Trimmed list of messages that fits within the limit
+            The complete response text
+        """
+        async def request(openai_client: OpenAIClient, claim: Callable[[], bool]) -> str:
+            if renderer:
+                return await self.stream_reply(openai_client, messages, preset, renderer, claim, channel_id)
+            response = await openai_client.chat_completion(
+                messages=messages,
+                **self.get_generation_params(preset)
+            )
+            if not claim():
+                raise asyncio.CancelledError()
+            return response
+        
+        # Once part of a streamed reply is visible, retrying would show a different reply
+        can_retry = lambda: renderer is None or renderer.first_visible_at is None
+        return await self.run_generation(
+            channel_id, server_id, request, priority, notify, can_retry,
+            self.estimate_request_tokens(messages, preset), streaming=renderer is not None
+        )
+    
+    def get_swipe_candidates_config(self) -> Dict[str, any]:
+        """Get how many alternatives each swipe generates (1 unless configured)."""
+        swipe_config = self.config_manager.get("swipe_candidates", {}) or {}
+        return {
+            "count": max(1, min(8, int(swipe_config.get("count", 1)))),
+            "use_n_parameter": swipe_config.get("use_n_parameter", True)
+        }
+    
+    def get_history_summary_config(self) -> Dict[str, any]:
+        """Get rolling history summary settings (disabled unless configured)."""
+        summary_config = self.config_manager.get("history_summary", {}) or {}
+        return {
+            "enabled": summary_config.get("enabled", False),
+            "batch_size": max(1, int(summary_config.get("batch_size", 20))),
+            "min_pending": max(1, int(summary_config.get("min_pending", 6))),
+            "max_summary_tokens": max(50, int(summary_config.get("max_summary_tokens", 400)))
+        }
+    
+    def configure_history_summary(self) -> None:
+        """Apply the "history_summary" config section to the summarizer."""
+        summary_config = self.get_history_summary_config()
+        self.history_summarizer.batch_size = summary_config["batch_size"]
+        self.history_summarizer.min_pending = summary_config["min_pending"]
+    
+    def get_lorebook_vector_config(self) -> Dict[str, any]:
+        """Get how many vectorized lorebook entries activate by similarity, and how similar they must be."""
+        vector_config = self.config_manager.get("lorebook_vectors", {}) or {}
+        return {
+            "top_k": max(0, int(vector_config.get("top_k", 3))),
+            "threshold": float(vector_config.get("threshold", 0.1))
+        }
+    
+    def configure_lorebook_vectors(self) -> None:
+        """Apply the "lorebook_vectors" config section to the lorebook manager."""
+        vector_config = self.get_lorebook_vector_config()
+        self.lorebook_manager.vector_top_k = vector_config["top_k"]
+        self.lorebook_manager.vector_threshold = vector_config["threshold"]
+    
+    def get_lorebook_recursion_config(self) -> Dict[str, any]:
+        """Get how many steps deep active lorebook entries can activate further entries."""
+        recursion_config = self.config_manager.get("lorebook_recursion", {}) or {}
+        return {
+            "max_depth": max(0, int(recursion_config.get("max_depth", 2)))
+        }
+    
+    def configure_lorebook_recursion(self) -> None:
+        """Apply the "lorebook_recursion" config section to the lorebook manager."""
+        self.lorebook_manager.recursion_depth = self.get_lorebook_recursion_config()["max_depth"]
+    
+    def get_logging_config(self) -> Dict[str, any]:
+        """Get the default log level, per-subsystem levels and lorebook entry sampling."""
+        logging_config = self.config_manager.get("logging", {}) or {}
+        
+        def level_name(value, default=None):
+            value = str(value).upper() if value else ""
+            return value if value in LEVELS else default
+        
+        levels = logging_config.get("levels", {}) or {}
+        return {
+            "level": level_name(logging_config.get("level"), "INFO"),
+            "levels": {
+                subsystem: level_name(levels.get(subsystem))
+                for subsystem in SUBSYSTEMS
+                if level_name(levels.get(subsystem))
+            },
+            "lorebook_entry_sample_rate": min(1.0, max(0.0, float(logging_config.get("lorebook_entry_sample_rate", 1.0)))),
+            "queue_size": max(100, int(logging_config.get("queue_size", 10000)))
+        }
+    
+    def configure_logging(self) -> None:
+        """Apply the "logging" config section (levels are process-wide)."""
+        bot_logging.configure(self.get_logging_config())
+    
+    async def summarize_history(
+        self,
+        channel_id: int,
+        server_id: Optional[int],
+        summary: str,
+        messages: List[Dict[str, str]]
+    ) -> str:
+        """Fold messages into a channel's running summary (called by the history summarizer).
+        
+        Runs at background priority so it never holds up a !chat or swipe.
+        """
+        max_summary_tokens = self.get_history_summary_config()["max_summary_tokens"]
+        request_messages = build_summary_request(summary, messages, max_words=max_summary_tokens * 3 // 4)
+        params = self.get_generation_params(self.get_preset_for_channel(channel_id, server_id))
+        params["temperature"] = 0.3
+        params["max_tokens"] = max_summary_tokens
+        
+        async def request(openai_client: OpenAIClient, claim: Callable[[], bool]) -> str:
+            response = await openai_client.chat_completion(messages=request_messages, **params)
+            if not claim():
+                raise asyncio.CancelledError()
+            return response
+        
+        response = await self.run_generation(
+            channel_id, server_id, request, PRIORITY_BACKGROUND,
+            estimated_tokens=self.estimate_request_tokens(request_messages, {"max_tokens": max_summary_tokens})
+        )
+        return self.filter_thinking_tags(response, channel_id)[1]
+    
+    def get_speculative_swipe_config(self) -> Dict[str, any]:
+        """Get speculative swipe settings (disabled unless configured)."""
+        speculative_config = self.config_manager.get("speculative_swipe", {}) or {}
+        return {"enabled": speculative_config.get("enabled", False)}
+    
+    def start_speculative_swipe(
+        self,
+        channel_id: int,
+        server_id: int,
+        messages: List[Dict[str, str]],
+        preset: Dict[str, any]
+    ) -> None:
+        """Quietly pre-generate one swipe alternative for the reply that was just sent.
+        
+        Runs at background priority with the exact message list of the turn, so
+        a swipe can be answered instantly. Cancelled when a new !chat arrives.
         """
-        # Calculate total tokens
-        total_tokens = sum(self.estimate_tokens(msg['content']) for msg in messages)
+        if not self.get_speculative_swipe_config()["enabled"]:
+            return
+        self.cancel_speculative_swipe(channel_id)
+        
+        state = {"in_flight": False, "usage": {}}
+        params = self.get_generation_params(preset)
+        
+        async def request(openai_client: OpenAIClient, claim: Callable[[], bool]) -> str:
+            state["in_flight"] = True
+            response, usage = await openai_client.chat_completion_with_usage(messages=messages, **params)
+            if not claim():
+                raise asyncio.CancelledError()
+            # Fall back to an estimate for providers that don't report usage
+            state["usage"] = usage or {
+                "prompt_tokens": sum(self.estimate_tokens(m.get("content", "")) for m in messages),
+                "completion_tokens": self.estimate_tokens(response)
+            }
+            return response
+        
+        async def speculate() -> Optional[str]:
+            try:
+                response = await self.run_generation(
+                    channel_id, server_id, request, PRIORITY_BACKGROUND,
+                    estimated_tokens=self.estimate_request_tokens(messages, preset)
+                )
+            except asyncio.CancelledError:
+                self.generation_metrics.increment("speculative_swipes_cancelled")
+                raise
+            except Exception as e:
+                generation_logger.warning("Pre-generating swipe for channel %s failed: %s", channel_id, e)
+                self.generation_metrics.increment("speculative_swipes_failed")
+                return None
+            self.generation_metrics.increment("speculative_prompt_tokens", state["usage"].get("prompt_tokens", 0))
+            self.generation_metrics.increment("speculative_completion_tokens", state["usage"].get("completion_tokens", 0))
+            generation_logger.debug("Speculative swipe alternative ready for channel %s", channel_id)
+            return response
         
-        print(f"[CONTEXT] Total estimated tokens: {total_tokens}, Max: {max_tokens}")
+        self.generation_metrics.increment("speculative_swipes_started")
+        state["task"] = asyncio.create_task(speculate())
+        self.speculative_swipes[channel_id] = state
+    
+    def cancel_speculative_swipe(self, channel_id: int) -> None:
+        """Drop the pending speculative swipe for a channel (the turn it was for is over)."""
+        state = self.speculative_swipes.pop(channel_id, None)
+        if not state:
+            return
+        task = state["task"]
+        if not task.done():
+            task.cancel()
+            generation_logger.debug("Cancelled speculative swipe for channel %s", channel_id)
+        elif not task.cancelled() and task.result() is not None:
+            # Generated but never shown
+            self.generation_metrics.increment("speculative_swipes_wasted")
+    
+    async def take_speculative_swipe(self, channel_id: int) -> Optional[str]:
+        """Get the pre-generated swipe alternative for a channel, if there is one.
         
-        # If we're under the limit, return as-is
-        if total_tokens <= max_tokens:
-            return messages
+        A request that is already generating is awaited; one still waiting in the
+        scheduler queue is cancelled so the swipe can be generated at swipe priority.
+        """
+        state = self.speculative_swipes.pop(channel_id, None)
+        if not state:
+            return None
+        task = state["task"]
+        if not task.done():
+            if not state["in_flight"]:
+                task.cancel()
+                return None
+            try:
+                await asyncio.shield(task)
+            except Exception:
+                return None
+        if task.cancelled() or task.result() is None:
+            return None
+        self.generation_metrics.increment("speculative_swipes_used")
+        return task.result()
+    
+    async def generate_swipe_alternatives(
+        self,
+        channel_id: int,
+        server_id: int,
+        messages: List[Dict[str, str]],
+        preset: Dict[str, any],
+        notify: Optional[Callable[[str], Awaitable[Any]]] = None
+    ) -> List[str]:
+        """Get the alternatives for a swipe, starting with the speculative one if it is ready."""
+        count = self.get_swipe_candidates_config()["count"]
+        speculative = await self.take_speculative_swipe(channel_id)
+        if speculative is None:
+            return await self.generate_alternatives(channel_id, server_id, messages, preset, count, PRIORITY_SWIPE, notify)
+        generation_logger.info("Using pre-generated swipe for channel %s", channel_id)
+        if count > 1:
+            return [speculative] + await self.generate_alternatives(
+                channel_id, server_id, messages, preset, count - 1, PRIORITY_SWIPE, notify
+            )
+        return [speculative]
+    
+    def format_extra_alternatives(self, extra: int) -> str:
+        """Suffix for the "Alternative i/N" notice when a swipe generated more than one."""
+        if extra <= 0:
+            return ""
+        return f" ({extra} more ready - swipe left/right to browse)"
+    
+    async def generate_alternatives(
+        self,
+        channel_id: int,
+        server_id: int,
+        messages: List[Dict[str, str]],
+        preset: Dict[str, any],
+        count: int,
+        priority: int = PRIORITY_SWIPE,
+        notify: Optional[Callable[[str], Awaitable[Any]]] = None
+    ) -> List[str]:
+        """Generate several alternative replies to the same messages in one round trip.
+        
+        Uses the provider's `n` parameter when it is supported, and concurrent
+        requests for whatever it doesn't return. Endpoints that ignore or reject
+        `n` are remembered and get concurrent requests straight away next time.
         
-        # We need to trim. Keep system messages and the last user message, trim from middle
-        system_messages = [msg for msg in messages if msg.get('role') == 'system']
-        non_system_messages = [msg for msg in messages if msg.get('role') != 'system']
+        Returns:
+            Between 1 and count responses
         
-        # Calculate tokens in system messages (these are kept)
-        system_tokens = sum(self.estimate_tokens(msg['content']) for msg in system_messages)
+        Raises:
+            The first error if no alternative could be generated
+        """
+        if count <= 1:
+            return [await self.generate_response(channel_id, server_id, messages, preset, priority, notify)]
         
-        # Always keep the last message (current user message)
-        if non_system_messages:
-            last_message = non_system_messages[-1]
-            last_message_tokens = self.estimate_tokens(last_message['content'])
-            other_messages = non_system_messages[:-1]
-        else:
-            last_message = None
-            last_message_tokens = 0
-            other_messages = []
+        params = self.get_generation_params(preset)
+        results: List[str] = []
+        errors: List[Exception] = []
         
-        # Available tokens for other messages
-        available_tokens = max_tokens - system_tokens - last_message_tokens
+        if self.get_swipe_candidates_config()["use_n_parameter"]:
+            async def request(openai_client: OpenAIClient, claim: Callable[[], bool]) -> List[str]:
+                if self.n_parameter_support.get(openai_client.base_url, True):
+                    try:
+                        choices = await openai_client.chat_completion_candidates(messages, count, **params)
+                    except Exception as e:
+                        if classify_error(e)[0]:
+                            raise
+                        # Some proxies reject unknown parameters - remember and ask for one
+                        generation_logger.info("Endpoint rejected n=%s, using concurrent requests: %s", count, str(e.__cause__ or e)[:120])
+                        self.n_parameter_support[openai_client.base_url] = False
+                        choices = [await openai_client.chat_completion(messages=messages, **params)]
+                    else:
+                        self.n_parameter_support[openai_client.base_url] = len(choices) >= count
+                else:
+                    choices = [await openai_client.chat_completion(messages=messages, **params)]
+                if not claim():
+                    raise asyncio.CancelledError()
+                return choices
+            
+            try:
+                results.extend(await self.run_generation(
+                    channel_id, server_id, request, priority, notify,
+                    estimated_tokens=self.estimate_request_tokens(messages, preset, count)
+                ))
+            except Exception as e:
+                errors.append(e)
+        
+        # Fill in what the n parameter didn't provide with concurrent requests
+        missing = count - len(results)
+        if missing > 0 and not errors:
+            extra = await asyncio.gather(*(
+                self.generate_response(channel_id, server_id, messages, preset, priority, notify if i == 0 and not results else None)
+                for i in range(missing)
+            ), return_exceptions=True)
+            for item in extra:
+                if isinstance(item, Exception):
+                    errors.append(item)
+                elif isinstance(item, BaseException):
+                    raise item
+                else:
+                    results.append(item)
         
-        # Reserve some tokens for the final response
-        available_tokens = max(available_tokens - 500, 0)  # Reserve 500 tokens for response
+        if not results:
+            raise errors[0]
+        if errors:
+            generation_logger.warning("Generated %s/%s swipe alternatives, %s failed: %s", len(results), count, len(errors), errors[0])
+        return results[:count]
+    
+    async def run_generation(
+        self,
+        channel_id: int,
+        server_id: int,
+        request: Callable[[OpenAIClient, Callable[[], bool]], Awaitable[Any]],
+        priority: int = PRIORITY_CHAT,
+        notify: Optional[Callable[[str], Awaitable[Any]]] = None,
+        can_retry: Optional[Callable[[], bool]] = None,
+        estimated_tokens: int = 0,
+        streaming: bool = False
+    ) -> Any:
+        """Run a provider request for a channel through the scheduler, hedging, retries and failover.
         
-        # Add messages from the end (most recent) until we hit the limit
-        trimmed_messages = []
-        current_tokens = 0
+        Args:
+            channel_id: Channel the request is for (selects the API config and failover list)
+            server_id: Server the channel belongs to
+            request: Coroutine function called as request(client, claim); it must call
+                claim() once it has its first token or result and stop if it returns False
+            priority: Scheduler priority
+            notify: Sends "queued" notices to the user (see generation_slot)
+            can_retry: Return False once retrying is no longer safe
+            estimated_tokens: Tokens the request will count against the provider's rate limit
+            streaming: Whether request claims on its first token (streamed) or its full reply
         
-        for msg in reversed(other_messages):
-            msg_tokens = self.estimate_tokens(msg['content'])
-            if current_tokens + msg_tokens <= available_tokens:
-                trimmed_messages.insert(0, msg)
-                current_tokens += msg_tokens
-            else:
-                # We've hit the limit, stop adding messages
-                break
+        Returns:
+            The result of the successful request
+        """
+        can_retry = can_retry or (lambda: True)
+        # Close the clients of edited or deleted API configs whose requests have finished
+        await self.client_registry.close_idle()
+        candidates = self.get_api_candidates(channel_id, server_id)
+        names = {id(client): name for name, client in candidates}
+        
+        rate_limit_config = self.get_rate_limit_config()
+        if rate_limit_config["enabled"] and len(candidates) > 1:
+            # Prefer an API config that isn't about to hit its rate limit
+            waits = {id(client): self.rate_limiter.wait_time(client.base_url, estimated_tokens) for _, client in candidates}
+            primary = candidates[0]
+            if waits[id(primary[1])] > rate_limit_config["reroute_after"]:
+                candidates.sort(key=lambda candidate: waits[id(candidate[1])])
+                if candidates[0] is not primary:
+                    generation_logger.info("Rerouting to '%s' - '%s' is rate limited", candidates[0][0], primary[0])
+        
+        async def attempt(openai_client: OpenAIClient, claim: Callable[[], bool] = None) -> Any:
+            if claim is None:
+                started_at = time.monotonic()
+                
+                def claim() -> bool:
+                    # Not hedged - still feed the latencies used for hedge delays
+                    self.hedger.record_claim(names.get(id(openai_client), 'default'),
+                                             time.monotonic() - started_at, streaming)
+                    return True
+            
+            if rate_limit_config["enabled"]:
+                # Wait for the rate limit before taking a slot, so a throttled
+                # request doesn't hold one that other channels could use
+                await self.rate_limiter.acquire(openai_client.base_url, estimated_tokens)
+            async with self.generation_slot(openai_client, server_id, priority, notify):
+                return await request(openai_client, claim)
+        
+        # Hedging needs a second API config whose circuit isn't open
+        healthy = [
+            candidate for candidate in candidates
+            if self.resilience.breaker(candidate[1].base_url).state == CircuitBreaker.CLOSED
+        ]
+        if self.get_hedging_config()["enabled"] and len(healthy) >= 2:
+            async def hedged_attempt(openai_client: OpenAIClient, claim: Callable[[], bool]) -> Any:
+                breaker = self.resilience.breaker(openai_client.base_url)
+                try:
+                    result = await attempt(openai_client, claim)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    if classify_error(e)[0]:
+                        breaker.record_failure()
+                    raise
+                breaker.record_success()
+                return result
+            
+            try:
+                return await self.hedger.run(healthy[0], healthy[1], hedged_attempt, streaming)
+            except Exception as e:
+                # Both hedged requests failed - fall back to the usual retries and failover
+                if not (classify_error(e)[0] and can_retry()):
+                    raise
+                generation_logger.warning("Both hedged requests failed, retrying: %s",
+                                          str(e).splitlines()[0][:120] if str(e) else type(e).__name__)
+        
+        return await self.resilience.call(candidates, attempt, can_retry)
+    
+    def get_generation_params(self, preset: Dict[str, any]) -> Dict[str, any]:
+        """Get the sampling parameters for chat_completion from a preset."""
+        return {
+            "temperature": preset.get("temperature", 0.7),
+            "max_tokens": preset.get("max_response_length", preset.get("max_tokens", 2000)),
+            "top_p": preset.get("top_p", 1.0),
+            "frequency_penalty": preset.get("frequency_penalty", 0.0),
+            "presence_penalty": preset.get("presence_penalty", 0.0),
+            "frequency_penalty_enabled": preset.get("frequency_penalty_enabled", True),
+            "presence_penalty_enabled": preset.get("presence_penalty_enabled", True)
+        }
+    
+    def get_streaming_config(self) -> Dict[str, any]:
+        """Get streaming settings (disabled unless configured)."""
+        streaming_config = self.config_manager.get("streaming", {}) or {}
+        return {
+            "enabled": streaming_config.get("enabled", False),
+            # Discord allows roughly 5 edits per 5 seconds per channel
+            "edit_interval": max(1.0, float(streaming_config.get("edit_interval", 1.5)))
+        }
+    
+    def visible_stream_text(self, text: str, channel_id: Optional[int] = None) -> str:
+        """Get the part of a partially streamed reply that is safe to show.
+        
+        Completed thinking blocks are removed as usual, and anything after an
+        unclosed start tag is held back until the block is closed.
+        """
+        _, filtered_text = self.filter_thinking_tags(text, channel_id)
+        thinking_config = self.get_thinking_config(channel_id)
+        if thinking_config.get("enabled", False):
+            start_tag = thinking_config.get("start_tag", "<think>")
+            if start_tag and start_tag in filtered_text:
+                filtered_text = filtered_text[:filtered_text.index(start_tag)].strip()
+        return filtered_text
+    
+    def configure_scheduler(self) -> None:
+        """Apply the "scheduler" config section to the generation scheduler."""
+        scheduler_config = self.config_manager.get("scheduler", {}) or {}
+        self.scheduler.configure(
+            default_limit=scheduler_config.get("max_concurrent_per_endpoint", 4),
+            endpoint_limits=scheduler_config.get("endpoint_limits", {}) or {},
+            guild_weights=scheduler_config.get("guild_weights", {}) or {}
+        )
+    
+    @asynccontextmanager
+    async def generation_slot(
+        self,
+        openai_client: OpenAIClient,
+        server_id: int = None,
+        priority: int = PRIORITY_CHAT,
+        notify: Optional[Callable[[str], Awaitable[Any]]] = None
+    ):
+        """Wait for the scheduler to admit a generation, telling the user if it is queued.
+        
+        Args:
+            openai_client: Client the generation will use (its base URL is the endpoint)
+            server_id: Guild the request comes from, for fair queuing between guilds
+            priority: PRIORITY_CHAT for new messages, PRIORITY_SWIPE for regenerations
+            notify: Coroutine that sends a text notice and returns the sent message
+        """
+        notice = None
         
-        if len(other_messages) > len(trimmed_messages):
-            print(f"[CONTEXT] Trimmed {len(other_messages) - len(trimmed_messages)} older messages to fit token limit")
+        async def on_queued(position: int):
+            nonlocal notice
+            generation_logger.info("Request queued at position %s for %s", position, openai_client.base_url)
+            if notify:
+                notice = await notify(f"⏳ Queued (position {position}) - the AI provider is busy, your reply will start shortly.")
         
-        # Combine: system messages + trimmed history + last message
-        result = system_messages + trimmed_messages
-        if last_message:
-            result.append(last_message)
+        async with self.scheduler.slot(openai_client.base_url, server_id, priority, on_queued):
+            if notice:
+                try:
+                    await notice.delete()
+                except Exception:
+                    pass
+            yield
+    
+    async def stream_reply(
+        self,
+        openai_client: OpenAIClient,
+        messages: List[Dict[str, str]],
+        preset: Dict[str, any],
+        renderer: StreamingMessageRenderer,
+        claim: Optional[Callable[[], bool]] = None,
+        channel_id: Optional[int] = None
+    ) -> str:
+        """Stream a reply into the renderer and return the complete response text.
+        
+        If given, claim() is called on the first token; when it returns False
+        (a hedged request to another API config got there first) streaming
+        stops before anything is rendered. channel_id selects the thinking filter.
+        """
+        parts = []
+        # Close the stream right away when stopping early, not when it is garbage collected
+        async with aclosing(openai_client.stream_chat_completion(
+            messages=messages,
+            **self.get_generation_params(preset)
+        )) as deltas:
+            async for delta in deltas:
+                if not parts and claim and not claim():
+                    raise asyncio.CancelledError()
+                parts.append(delta)
+                # Only join the text when the renderer will actually use it
+                if renderer.due():
+                    await renderer.update(self.visible_stream_text("".join(parts), channel_id))
+        return "".join(parts)
+    
+    def estimate_tokens(self, text: str, model: Optional[str] = None) -> int:
+        """Count tokens in text.
         
-        final_tokens = sum(self.estimate_tokens(msg['content']) for msg in result)
-        print(f"[CONTEXT] Final estimated tokens: {final_tokens}")
+        Uses the model family's local BPE vocabulary when available (see
+        tokenizer.py), otherwise an estimate of about 4 characters per token
+        for English. Counts are memoized per message content.
+        
+        Args:
+            text: Text to count
+            model: Model name (defaults to the default API config's model)
+        """
+        return self.token_counter.count(text, model or self.openai_client.model)
+    
+    def configure_tokenizer(self) -> None:
+        """Apply the "tokenizer" config section (vocabulary directory and model families)."""
+        tokenizer_config = self.config_manager.get("tokenizer", {}) or {}
+        registry = TokenizerRegistry(
+            vocab_dir=tokenizer_config.get("vocab_dir", "tokenizers"),
+            model_families=tokenizer_config.get("model_families", {})
+        )
+        self.token_counter = TokenCounter(registry, cache_size=int(tokenizer_config.get("cache_size", 20000)))
+        # Indexed history counts came from the old tokenizer
+        self.context_trimmer.indexes.clear()
+    
+    def trim_messages_to_fit(self, messages: List[Dict[str, str]], max_tokens: int, model: Optional[str] = None) -> List[Dict[str, str]]:
+        """Trim oldest messages to fit within token limit.
         
-        return result
+        Args:
+            messages: List of message dicts with 'role' and 'content'
+            max_tokens: Maximum token limit for context
+            model: Model the messages are for (selects the tokenizer)
+            
+        Returns:
+            Trimmed list of messages that fits within the limit
+        """
+        # Each message is counted once and the kept tail is found in one pass (see context_trimmer.py)
+        return trim_to_fit(messages, max_tokens, lambda text: self.estimate_tokens(text, model))
     
     def get_preset_for_channel(self, channel_id: int, server_id: int = None):
         """Get the preset for a channel - always uses global default preset."""
@@ -1015,15 +1776,19 @@ class DiscordBot(commands.Bot):
     def get_character_for_channel(self, channel_id: int, server_id: int = None):
         """Get the appropriate character for a channel (with channel or server-specific config if set)."""
         # Priority: channel config > server config > default (None)
+        return self.config_manager.resolve_channel(channel_id, server_id).character
+    
+    def last_user_message(self, channel_id: int) -> Optional[Dict[str, str]]:
+        """The user message of the channel's current turn (the one swipes answer), or None.
         
-        # Check for channel-specific character first
-        character_name = self.config_manager.get(f'channel_configs.{channel_id}.character', '')
-        
-        # If no channel config and server_id provided, check server config
-        if not character_name and server_id:
-            character_name = self.config_manager.get(f'server_configs.{server_id}.character', '')
-        
-        return character_name if character_name else None
+        Messages are replaced rather than edited, so a swipe can check after
+        generating that this is still the same dict - i.e. that no new turn
+        was added in the meantime.
+        """
+        for message in reversed(self.conversations.get(channel_id, [])):
+            if message["role"] == "user":
+                return message
+        return None
     
     def parse_character_message(self, message: str) -> Tuple[Optional[str], str]:
         """Parse a message for character name format: 'CharacterName:message'.
@@ -1040,15 +1805,25 @@ class DiscordBot(commands.Bot):
             return character_name, actual_message
         return None, message
     
-    def filter_thinking_tags(self, text: str) -> Tuple[str, str]:
+    def get_thinking_config(self, channel_id: Optional[int] = None) -> Dict[str, Any]:
+        """Get the thinking filter config for a channel (the global one without a channel)."""
+        if channel_id is None:
+            return self.config_manager.get("thinking_filter", {})
+        return self.config_manager.resolve_channel(channel_id).thinking_filter
+    
+    def filter_thinking_tags(self, text: str, channel_id: Optional[int] = None) -> Tuple[str, str]:
         """Filter out thinking tags from response based on configuration.
         
+        Args:
+            text: Response text
+            channel_id: Channel the response is for (selects its resolved config)
+        
         Returns:
             Tuple of (full_response, filtered_response). If filtering is disabled,
             both will be the same.
         """
         # Get thinking filter config
-        thinking_config = self.config_manager.get("thinking_filter", {})
+        thinking_config = self.get_thinking_config(channel_id)
         enabled = thinking_config.get("enabled", False)
         
         if not enabled:
@@ -1104,7 +1879,7 @@ class DiscordBot(commands.Bot):
         Returns:
             Response with CP tracking appended
         """
-        cp_config = self.config_manager.get("cp_tracking", {})
+        cp_config = self.config_manager.resolve_channel(channel_id).cp_tracking
         if not cp_config.get("enabled", False):
             return response
         
@@ -1123,7 +1898,7 @@ class DiscordBot(commands.Bot):
             channel_id: The Discord channel ID
             is_new_response: Whether this is a new response (vs a swipe)
         """
-        cp_config = self.config_manager.get("cp_tracking", {})
+        cp_config = self.config_manager.resolve_channel(channel_id).cp_tracking
         if not cp_config.get("enabled", False):
             return
         
@@ -1160,7 +1935,7 @@ class DiscordBot(commands.Bot):
             response: The swiped response text
             channel_id: The Discord channel ID
         """
-        cp_config = self.config_manager.get("cp_tracking", {})
+        cp_config = self.config_manager.resolve_channel(channel_id).cp_tracking
         if not cp_config.get("enabled", False):
             return
         
@@ -1182,13 +1957,16 @@ class DiscordBot(commands.Bot):
                     # Set current to base + new CP
                     self.cp_totals[channel_id] = base_cp + cp_from_response
     
-    def get_cp_tracking_prompt(self) -> str:
+    def get_cp_tracking_prompt(self, channel_id: int) -> str:
         """Get the system prompt for CP tracking if enabled.
         
+        Args:
+            channel_id: Channel the prompt is for (selects its resolved config)
+        
         Returns:
             The CP tracking prompt or empty string if disabled
         """
-        cp_config = self.config_manager.get("cp_tracking", {})
+        cp_config = self.config_manager.resolve_channel(channel_id).cp_tracking
         if not cp_config.get("enabled", False):
             return ""
         
@@ -1262,7 +2040,7 @@ class DiscordBot(commands.Bot):
                     })
             
         except Exception as e:
-            print(f"Error loading channel history: {e}")
+            chat_logger.warning("Error loading channel history: %s", e)
         
         return conversation, character_names_found
     
@@ -1272,14 +2050,20 @@ class DiscordBot(commands.Bot):
         @self.command(name="chat", help="Chat with the AI")
         async def chat(ctx, *, message: str):
             """Chat with the AI using current preset and character."""
+            received_at = time.monotonic()
             channel_id = ctx.channel.id
             server_id = ctx.guild.id if ctx.guild else None
             
-            print(f"\n[CHAT] Received message in channel {channel_id}: {message[:50]}...")
+            chat_logger.info("Received message in channel %s: %s...", channel_id, message[:50])
+            
+            # A new turn makes the pre-generated swipe for the previous reply useless
+            self.cancel_speculative_swipe(channel_id)
+            
+            # Channel settings with server and default fallbacks applied
+            channel_config = self.config_manager.resolve_channel(channel_id, server_id)
             
             # Check if manual send mode is enabled
-            manual_send_enabled = self.config_manager.get('manual_send_enabled', False)
-            if manual_send_enabled:
+            if channel_config.manual_send_enabled:
                 await ctx.send("⚠️ Manual Send Mode is enabled. API calls are disabled. Use the Manual Send tab in the web interface to send messages.")
                 return
             
@@ -1305,7 +2089,7 @@ class DiscordBot(commands.Bot):
             # Parse character name from message
             character_name, actual_message = self.parse_character_message(message)
             
-            print(f"[CHAT] Parsed - Character: {character_name}, Message: {actual_message[:50]}...")
+            chat_logger.debug("Parsed - Character: %s, Message: %s...", character_name, actual_message[:50])
             
             # Track character name if provided
             if character_name:
@@ -1316,32 +2100,38 @@ class DiscordBot(commands.Bot):
             # SillyTavern-style presets with proper role separation
             messages = self.build_chat_messages(channel_id, actual_message, character_name, server_id)
             
-            print(f"[CHAT] Built {len(messages)} messages for API call")
+            chat_logger.debug("Built %s messages for API call", len(messages))
             
             # Get preset parameters (check channel-specific first, then server-specific, then default)
             preset = self.get_preset_for_channel(channel_id, server_id)
             
-            # Get appropriate OpenAI client (channel-specific, server-specific, or default)
-            openai_client = self.get_openai_client_for_channel(channel_id, server_id)
+            # In streaming mode the reply is shown while it is being generated
+            streaming_config = self.get_streaming_config()
+            renderer = None
+            if streaming_config["enabled"]:
+                webhook = None
+                webhook_params = None
+                if channel_id in self.channel_characters:
+                    webhook = await self.get_or_create_webhook(ctx.channel)
+                    if webhook:
+                        webhook_params = self.get_webhook_params(self.channel_characters[channel_id])
+                renderer = StreamingMessageRenderer(
+                    ctx.channel, webhook, webhook_params,
+                    edit_interval=streaming_config["edit_interval"]
+                )
             
             try:
                 async with PersistentTyping(ctx.channel):
                     # Generate response
-                    print(f"[CHAT] Calling OpenAI API...")
-                    response = await openai_client.chat_completion(
-                        messages=messages,
-                        temperature=preset.get("temperature", 0.7),
-                        max_tokens=preset.get("max_response_length", preset.get("max_tokens", 2000)),
-                        top_p=preset.get("top_p", 1.0),
-                        frequency_penalty=preset.get("frequency_penalty", 0.0),
-                        presence_penalty=preset.get("presence_penalty", 0.0),
-                        frequency_penalty_enabled=preset.get("frequency_penalty_enabled", True),
-                        presence_penalty_enabled=preset.get("presence_penalty_enabled", True)
+                    chat_logger.debug("Calling OpenAI API%s...", " (streaming)" if renderer else "")
+                    response = await self.generate_response(
+                        channel_id, server_id, messages, preset,
+                        PRIORITY_CHAT, ctx.send, renderer
                     )
-                    print(f"[CHAT] Received response: {response[:100] if response else 'None'}...")
+                    chat_logger.debug("Received response: %s...", response[:100] if response else None)
                 
                 # Apply thinking filter
-                full_response, filtered_response = self.filter_thinking_tags(response)
+                full_response, filtered_response = self.filter_thinking_tags(response, channel_id)
                 
                 # Update CP tracking (this is a new response, not a swipe)
                 self.update_cp_tracking(filtered_response, channel_id, is_new_response=True)
@@ -1352,18 +2142,10 @@ class DiscordBot(commands.Bot):
                 # Store the response with CP info for future reference
                 self.last_response_text[channel_id] = filtered_response_with_cp
                 
-                # Log full response to console if filtering is active
-                thinking_config = self.config_manager.get("thinking_filter", {})
-                if thinking_config.get("enabled", False) and full_response != filtered_response:
-                    print(f"\n{'='*60}")
-                    print(f"FULL RESPONSE (before filtering):")
-                    print(f"{'='*60}")
-                    print(full_response)
-                    print(f"{'='*60}")
-                    print(f"FILTERED RESPONSE (sent to Discord):")
-                    print(f"{'='*60}")
-                    print(filtered_response_with_cp)
-                    print(f"{'='*60}\n")
+                # Log the full response (debug level) if filtering is active
+                if channel_config.thinking_filter.get("enabled", False) and full_response != filtered_response:
+                    chat_logger.debug("Full response (before filtering):\n%s\nFiltered response (sent to Discord):\n%s",
+                                      full_response, filtered_response_with_cp)
                 
                 # Update conversation history with full response (unfiltered)
                 # This ensures context is preserved even if thinking tags are filtered
@@ -1380,7 +2162,17 @@ class DiscordBot(commands.Bot):
                 self.current_alternative_index[channel_id] = 0
                 
                 # Limit conversation history
-                if len(self.conversations[channel_id]) > 20:
+                history_limit = 20
+                layout_config = self.get_prompt_layout_config()
+                if layout_config["mode"] == "cache_friendly":
+                    # Evict in chunks so the start of the history (part of the cached
+                    # prompt prefix) only moves every few turns instead of every turn
+                    history_limit += layout_config["history_trim_chunk"]
+                summary_enabled = self.get_history_summary_config()["enabled"]
+                if len(self.conversations[channel_id]) > history_limit:
+                    if summary_enabled:
+                        # Keep the gist of the evicted turns in the channel's running summary
+                        self.history_summarizer.note_evicted(channel_id, self.conversations[channel_id][:-20])
                     self.conversations[channel_id] = self.conversations[channel_id][-20:]
                     # Also limit response alternatives history
                     if len(self.response_alternatives[channel_id]) > 10:
@@ -1388,10 +2180,17 @@ class DiscordBot(commands.Bot):
                 
                 # Send response - use webhook if character is loaded for this channel
                 # Use filtered_response_with_cp for what's actually sent to Discord
-                if channel_id in self.channel_characters:
+                if renderer:
+                    # Streaming already posted the reply; render the final text and buttons
+                    view = SwipeButtonView(self, channel_id)
+                    last_msg, msg_ids = await renderer.finalize(filtered_response_with_cp, view=view)
+                    if msg_ids:
+                        view.message_ids = msg_ids
+                    chat_logger.debug("Streamed message finalized, IDs: %s", msg_ids)
+                elif channel_id in self.channel_characters:
                     # Try to send via webhook with character's avatar
                     character_data = self.channel_characters[channel_id]
-                    print(f"[CHAT] Sending via webhook as character: {character_data.get('name')}")
+                    chat_logger.debug("Sending via webhook as character: %s", character_data.get('name'))
                     # Create view first (will update message_ids after sending)
                     view = SwipeButtonView(self, channel_id)
                     last_msg, msg_ids = await self.send_as_character(
@@ -1402,32 +2201,49 @@ class DiscordBot(commands.Bot):
                     )
                     # If webhook send failed, fall back to regular message
                     if not last_msg or not msg_ids:
-                        print(f"[CHAT] Webhook send failed for channel {channel_id}, falling back to regular message")
+                        webhook_logger.warning("Webhook send failed for channel %s, falling back to regular message", channel_id)
                         last_msg, msg_ids = await send_long_message_with_view(ctx.channel, filtered_response_with_cp, view=view)
                     # Update view with message IDs for multi-page swipe support
                     if msg_ids:
                         view.message_ids = msg_ids
-                    print(f"[CHAT] Message sent successfully, IDs: {msg_ids}")
+                    chat_logger.debug("Message sent successfully, IDs: %s", msg_ids)
                 else:
                     # No character loaded, send normal message - use embeds
-                    print(f"[CHAT] Sending via regular embed (no character loaded)")
+                    chat_logger.debug("Sending via regular embed (no character loaded)")
                     view = SwipeButtonView(self, channel_id)
                     last_msg, msg_ids = await send_long_message_with_view(ctx.channel, filtered_response_with_cp, view=view)
                     # Update view with message IDs for multi-page swipe support
                     if msg_ids:
                         view.message_ids = msg_ids
-                    print(f"[CHAT] Message sent successfully, IDs: {msg_ids}")
+                    chat_logger.debug("Message sent successfully, IDs: %s", msg_ids)
+                
+                # Time to first visible token is the headline latency metric
+                finished_at = time.monotonic()
+                first_visible_at = renderer.first_visible_at if renderer and renderer.first_visible_at else finished_at
+                self.generation_metrics.record("time_to_first_visible", first_visible_at - received_at)
+                self.generation_metrics.record("total_response", finished_at - received_at)
+                chat_logger.info("Time to first visible token: %.2fs (total %.2fs)",
+                                 first_visible_at - received_at, finished_at - received_at)
+                
+                # Users often swipe right away - have an alternative ready
+                self.start_speculative_swipe(channel_id, server_id, messages, preset)
+                if summary_enabled:
+                    self.history_summarizer.schedule(channel_id, server_id)
             
             except Exception as e:
-                print(f"[CHAT] Error occurred: {str(e)}")
-                import traceback
-                traceback.print_exc()
+                chat_logger.exception("Error occurred: %s", e)
+                if renderer:
+                    # Don't leave a half-written reply behind
+                    await renderer.discard()
                 await ctx.send(f"Error: {str(e)}")
         
         @self.command(name="clear", help="Clear conversation history")
         async def clear(ctx):
             """Clear conversation history for this channel."""
             channel_id = ctx.channel.id
+            self.cancel_speculative_swipe(channel_id)
+            self.history_summarizer.reset(channel_id)
+            self.lorebook_manager.activations.reset(channel_id)
             if channel_id in self.conversations:
                 self.conversations[channel_id] = []
             if channel_id in self.response_alternatives:
@@ -1458,6 +2274,8 @@ class DiscordBot(commands.Bot):
             async with PersistentTyping(ctx.channel):
                 # Clear current conversation
                 self.conversations[channel_id] = []
+                self.history_summarizer.reset(channel_id)
+                self.lorebook_manager.activations.reset(channel_id)
                 self.character_names[channel_id] = []
                 
                 # Load history
@@ -1470,6 +2288,7 @@ class DiscordBot(commands.Bot):
                 self.character_names[channel_id] = history_character_names
                 
                 # Clear response alternatives as they're no longer valid
+                self.cancel_speculative_swipe(channel_id)
                 if channel_id in self.response_alternatives:
                     self.response_alternatives[channel_id] = []
                 if channel_id in self.current_alternative_index:
@@ -1579,6 +2398,8 @@ class DiscordBot(commands.Bot):
                 # Clear conversation when switching characters
                 if channel_id in self.conversations:
                     self.conversations[channel_id] = []
+                self.history_summarizer.reset(channel_id)
+                self.lorebook_manager.activations.reset(channel_id)
                     
             except FileNotFoundError:
                 await ctx.send(f"❌ Character not found: {character_name}\nUse `!characters` to see available characters.")
@@ -1982,12 +2803,11 @@ Visit http://localhost:5000 to configure the bot via web interface.
             # Get the last user message (should be second to last in history)
             last_user_msg = None
             last_user_character = None
-            for msg in reversed(self.conversations[channel_id]):
-                if msg["role"] == "user":
-                    last_user_msg = msg["content"]
-                    # Try to parse character name from the message
-                    last_user_character, _ = self.parse_character_message(last_user_msg)
-                    break
+            turn = self.last_user_message(channel_id)
+            if turn:
+                last_user_msg = turn["content"]
+                # Try to parse character name from the message
+                last_user_character, _ = self.parse_character_message(last_user_msg)
             
             if not last_user_msg:
                 await ctx.send("No user message found to regenerate.")
@@ -2007,38 +2827,27 @@ Visit http://localhost:5000 to configure the bot via web interface.
             # Get preset parameters (check channel-specific first, then server-specific, then default)
             preset = self.get_preset_for_channel(channel_id, server_id)
             
-            # Get appropriate OpenAI client (channel-specific, server-specific, or default)
-            openai_client = self.get_openai_client_for_channel(channel_id, server_id)
-            
             try:
                 async with PersistentTyping(ctx.channel):
-                    # Generate alternative response
-                    response = await openai_client.chat_completion(
-                        messages=messages,
-                        temperature=preset.get("temperature", 0.7),
-                        max_tokens=preset.get("max_response_length", preset.get("max_tokens", 2000)),
-                        top_p=preset.get("top_p", 1.0),
-                        frequency_penalty=preset.get("frequency_penalty", 0.0),
-                        presence_penalty=preset.get("presence_penalty", 0.0),
-                        frequency_penalty_enabled=preset.get("frequency_penalty_enabled", True),
-                        presence_penalty_enabled=preset.get("presence_penalty_enabled", True)
+                    # Generate alternative response(s) (channel-specific, server-specific, or default API config)
+                    responses = await self.generate_swipe_alternatives(
+                        channel_id, server_id, messages, preset, ctx.send
                     )
+                    response = responses[0]
+                
+                if self.last_user_message(channel_id) is not turn:
+                    # A new message was answered while this was generating - don't overwrite its reply
+                    await ctx.send("The conversation moved on while this alternative was generating, so it was discarded.")
+                    return
                 
                 # Apply thinking filter
-                full_response, filtered_response = self.filter_thinking_tags(response)
+                full_response, filtered_response = self.filter_thinking_tags(response, channel_id)
                 
-                # Log full response to console if filtering is active
-                thinking_config = self.config_manager.get("thinking_filter", {})
+                # Log the full response (debug level) if filtering is active
+                thinking_config = self.get_thinking_config(channel_id)
                 if thinking_config.get("enabled", False) and full_response != filtered_response:
-                    print(f"\n{'='*60}")
-                    print(f"FULL RESPONSE (before filtering):")
-                    print(f"{'='*60}")
-                    print(full_response)
-                    print(f"{'='*60}")
-                    print(f"FILTERED RESPONSE (sent to Discord):")
-                    print(f"{'='*60}")
-                    print(filtered_response)
-                    print(f"{'='*60}\n")
+                    chat_logger.debug("Full response (before filtering):\n%s\nFiltered response (sent to Discord):\n%s",
+                                      full_response, filtered_response)
                 
                 # Add to alternatives (store full response)
                 if channel_id in self.response_alternatives and len(self.response_alternatives[channel_id]) > 0:
@@ -2051,6 +2860,9 @@ Visit http://localhost:5000 to configure the bot via web interface.
                     self.response_alternatives[channel_id].append([full_response])
                     self.current_alternative_index[channel_id] = 0
                 
+                # Extra alternatives from the same round trip can be browsed with !swipe_left / !swipe_right
+                self.response_alternatives[channel_id][-1].extend(responses[1:])
+                
                 # Update the last assistant message in history (with full response)
                 self.conversations[channel_id][-1] = {"role": "assistant", "content": full_response}
                 
@@ -2071,7 +2883,7 @@ Visit http://localhost:5000 to configure the bot via web interface.
                     )
                     # If webhook send failed, fall back to regular message
                     if not last_msg or not msg_ids:
-                        print(f"Webhook send failed for channel {channel_id}, falling back to regular message")
+                        webhook_logger.warning("Webhook send failed for channel %s, falling back to regular message", channel_id)
                         last_msg, msg_ids = await send_long_message_with_view(ctx.channel, filtered_response, view=view)
                     # Update view with message IDs for multi-page swipe support
                     if msg_ids:
@@ -2084,7 +2896,7 @@ Visit http://localhost:5000 to configure the bot via web interface.
                     if msg_ids:
                         view.message_ids = msg_ids
                 
-                await ctx.send(f"*Alternative {current_idx + 1}/{alt_count}*")
+                await ctx.send(f"*Alternative {current_idx + 1}/{alt_count}*{self.format_extra_alternatives(len(responses) - 1)}")
             
             except Exception as e:
                 await ctx.send(f"Error generating alternative: {str(e)}")
@@ -2128,7 +2940,7 @@ Visit http://localhost:5000 to configure the bot via web interface.
                 )
                 # If webhook send failed, fall back to regular message
                 if not last_msg or not msg_ids:
-                    print(f"Webhook send failed for channel {channel_id}, falling back to regular message")
+                    webhook_logger.warning("Webhook send failed for channel %s, falling back to regular message", channel_id)
                     last_msg, msg_ids = await send_long_message_with_view(ctx.channel, response, view=view)
                 # Update view with message IDs for multi-page swipe support
                 if msg_ids:
@@ -2184,7 +2996,7 @@ Visit http://localhost:5000 to configure the bot via web interface.
                 )
                 # If webhook send failed, fall back to regular message
                 if not last_msg or not msg_ids:
-                    print(f"Webhook send failed for channel {channel_id}, falling back to regular message")
+                    webhook_logger.warning("Webhook send failed for channel %s, falling back to regular message", channel_id)
                     last_msg, msg_ids = await send_long_message_with_view(ctx.channel, response, view=view)
                 # Update view with message IDs for multi-page swipe support
                 if msg_ids:
@@ -2234,177 +3046,281 @@ Visit http://localhost:5000 to configure the bot via web interface.
         # Get preset (check channel-specific first, then server-specific, then default)
         preset = self.get_preset_for_channel(channel_id, server_id)
         
-        # Get character data if loaded for this channel
-        character_data = None
+        # Character card and preset sections, compiled once and rebuilt when their files change
         if channel_id in self.channel_characters:
-            # Reload character data from disk to ensure we have latest changes
             character_name = self.channel_characters[channel_id].get('name')
-            if character_name:
+        context = self.get_compiled_prompt_context(channel_id, preset)
+        character_data = context.character_data
+        
+        # Context that changes between turns (user characters, matched lore, CP prompt)
+        volatile_blocks = self.get_volatile_prompt_blocks(channel_id, user_message, character_data)
+        layout_config = self.get_prompt_layout_config()
+        cache_friendly = layout_config["mode"] == "cache_friendly"
+        
+        # Current user message
+        if character_name:
+            formatted_message = f"{character_name}: {user_message}"
+            last_message = {"role": "user", "content": formatted_message}
+        else:
+            last_message = {"role": "user", "content": user_message}
+        
+        # Conversation history - not copied; its token totals are kept per channel
+        history = self.conversations.get(channel_id, [])
+        
+        # Split the token budget between the prompt's components
+        model = self.get_openai_client_for_channel(channel_id, server_id).model
+        count_tokens = lambda text: self.estimate_tokens(text, model)
+        history_index = self.context_trimmer.index_for((channel_id, model), count_tokens)
+        history_index.sync(history)
+        
+        # Classic layout: character list, lorebook entries and CP prompt go in every system section
+        copies = 1 if cache_friendly else max(1, sum(1 for section in context.sections if section["role"] == "system"))
+        block_tokens = [count_tokens(text) for _, text in volatile_blocks]
+        requested = {name: 0 for name in DEFAULT_COMPONENTS}
+        requested["system"] = sum(count_tokens(section["content"]) for section in context.sections)
+        for (component, _), tokens in zip(volatile_blocks, block_tokens):
+            requested[component] += tokens * copies
+        requested["examples"] = sum(count_tokens(message["content"]) for message in context.example_dialogues)
+        requested["history"] = history_index.total()
+        summary_enabled = self.get_history_summary_config()["enabled"]
+        summary_text = self.history_summarizer.summary_for(channel_id) if summary_enabled else ""
+        summary_content = f"[Summary of the story so far]\n{summary_text}" if summary_text else ""
+        requested["summary"] = count_tokens(summary_content)
+        requested["user_message"] = count_tokens(last_message["content"])
+        
+        budget_config = self.get_token_budget_config()
+        limit = self.get_prompt_token_limit(preset, model)
+        allocation = self.budget_planner.plan(limit, requested, budget_config["response_reserve"])
+        
+        # Truncate each component to what it was granted
+        kept_blocks = []
+        if allocation.trimmed:
+            remaining = {name: allocation.granted[name] // copies for name in allocation.granted}
+            for (component, text), tokens in zip(volatile_blocks, block_tokens):
+                if component != "system":
+                    text, tokens = truncate_text(text, remaining[component], count_tokens)
+                    remaining[component] -= tokens
+                if text.strip():
+                    kept_blocks.append(text)
+            for name in ("user_characters", "lorebook"):
+                allocation.used[name] = (allocation.granted[name] // copies - remaining[name]) * copies
+            examples, allocation.used["examples"] = keep_leading(
+                context.example_dialogues, allocation.granted["examples"], count_tokens
+            )
+            summary_content, allocation.used["summary"] = truncate_text(
+                summary_content, allocation.granted["summary"], count_tokens
+            )
+            history_start = history_index.fitting_start(allocation.granted["history"])
+            allocation.used["history"] = history_index.tokens_from(history_start)
+            if summary_enabled:
+                # Turns that no longer fit are folded into the summary in the background
+                self.history_summarizer.note_dropped(channel_id, HistoryWindow(history, 0, history_start))
+            context_logger.info("Prompt trimmed to fit %s", allocation.summary())
+        else:
+            kept_blocks = [text for _, text in volatile_blocks]
+            examples = context.example_dialogues
+            history_start = 0
+        self.last_budget_allocations[channel_id] = allocation.report()
+        
+        # 1. Add preset sections / system prompt
+        for section in context.sections:
+            content = section["content"]
+            if section["role"] == "system" and not cache_friendly:
+                content += "".join(kept_blocks)
+            if context.legacy and not content:
+                continue
+            messages.append({"role": section["role"], "content": content})
+        
+        # 2. Add example dialogues from character card (if configured in preset)
+        messages.extend(examples)
+        
+        # Pinned summary of the conversation before the history that fits
+        if summary_content.strip():
+            messages.append({"role": "system", "content": summary_content})
+        
+        # 3. Add conversation history (oldest messages past the budget are left out)
+        messages.extend(HistoryWindow(history, history_start))
+        
+        # 4. Add current user message
+        messages.append(last_message)
+        
+        if cache_friendly and kept_blocks:
+            # Cache-friendly layout: everything above stays byte-identical between
+            # turns, so the volatile context goes in its own message near the end
+            volatile_content = "\n\n".join(block.strip() for block in kept_blocks)
+            insert_at = max(0, len(messages) - layout_config["volatile_depth"])
+            messages.insert(insert_at, {"role": "system", "content": volatile_content})
+        
+        self.prefix_stability.record(channel_id, messages)
+        return messages
+    
+    def get_compiled_prompt_context(self, channel_id: int, preset: Dict[str, Any]) -> CompiledPromptContext:
+        """Get the channel's compiled character card and preset sections.
+        
+        The channel's character card is re-read only when its file changes
+        (or the web UI invalidates the cache), instead of on every message.
+        """
+        character_name = None
+        fallback = None
+        if channel_id in self.channel_characters:
+            character_name = self.channel_characters[channel_id].get('name')
+            if not character_name:
+                fallback = self.channel_characters[channel_id]
+        else:
+            fallback = self.character_manager.current_character
+        
+        character_path = None
+        if character_name:
+            character_path = os.path.join(self.character_manager.characters_dir, f"{character_name}.json")
+        
+        def build() -> CompiledPromptContext:
+            character_data = fallback
+            loaded_from_disk = False
+            if character_path:
                 try:
                     character_data = self.character_manager.load_character(character_name)
-                    # Update the cache with fresh data
-                    self.channel_characters[channel_id] = character_data
+                    loaded_from_disk = True
                 except FileNotFoundError:
                     # Character was deleted, use cached data
                     character_data = self.channel_characters[channel_id]
-            else:
-                character_data = self.channel_characters[channel_id]
-        elif self.character_manager.current_character:
-            character_data = self.character_manager.current_character
-        
-        # Format character card according to preset rules
-        char_format = self.preset_manager.format_character_for_prompt(
-            character_data, 
-            preset
+            # Format character card according to preset rules
+            char_format = self.preset_manager.format_character_for_prompt(character_data, preset)
+            return CompiledPromptContext(preset, character_data, char_format, loaded_from_disk)
+        
+        def is_current(context: CompiledPromptContext) -> bool:
+            # Presets and unsaved characters live in memory - compare them instead of file times
+            if context.preset is not preset and context.preset != preset:
+                return False
+            return character_path is not None or context.character_data is fallback
+        
+        context = self.prompt_context_cache.get(
+            (channel_id, character_name),
+            [character_path] if character_path else [],
+            build,
+            is_current
         )
         
-        # Check if preset uses new prompt_sections format
-        if 'prompt_sections' in preset and preset['prompt_sections']:
-            # Use new multi-section format
-            sections = preset['prompt_sections']
-            # Sort by order
-            sections = sorted(sections, key=lambda x: x.get('order', 0))
-            
-            for section in sections:
-                if not section.get('enabled', True):
-                    continue
-                
-                role = section.get('role', 'system')
-                content = section.get('content', '')
-                
-                # Process placeholders and add context for system messages
-                if role == 'system':
-                    # Build enhanced system prompt with character context
-                    enhanced_content = content
-                    
-                    # Add character system info if present
-                    char_system = char_format.get('character_system', '')
-                    if char_system:
-                        enhanced_content += '\n\n' + char_system
-                    
-                    # Add user character tracking info if needed
-                    if self.character_names.get(channel_id):
-                        character_list = ", ".join(self.character_names[channel_id])
-                        enhanced_content += f"""
-
-IMPORTANT: In this conversation, users will identify themselves as characters by prefixing their messages with 'CharacterName:'. The following character names are being used by users: {character_list}. You should NEVER pretend to be these characters or respond as if you are them. You are a separate entity having a conversation with these characters.
-
-FORMAT GUIDELINES:
-- Text in "quotes" represents spoken dialogue by the character
-- Text in *asterisks* represents actions performed by the character
-- Text without quotes or asterisks is descriptive text or additional context"""
-                        
-                        # Add user character descriptions
-                        # Reload to ensure we have the latest data
-                        self.user_characters_manager.load_all_user_characters()
-                        user_char_section = self.user_characters_manager.get_system_prompt_section(
-                            self.character_names[channel_id]
-                        )
-                        if user_char_section:
-                            enhanced_content += user_char_section
-                    
-                    # Add lorebook entries
-                    # Reload to ensure we have the latest data
-                    self.lorebook_manager.load_all_lorebooks()
-                    current_character_name = character_data.get("name") if character_data else None
-                    print(f"[LOREBOOK] Requesting lorebook for character: {current_character_name}")
-                    print(f"[LOREBOOK] Character data: {character_data.get('name') if character_data else 'None'}")
-                    lorebook_section = self.lorebook_manager.get_system_prompt_section(user_message, current_character_name)
-                    if lorebook_section:
-                        enhanced_content += "\n\n" + lorebook_section
-                        print(f"[LOREBOOK] Added lorebook section ({len(lorebook_section)} chars)")
-                    else:
-                        print(f"[LOREBOOK] No lorebook content returned")
-                    
-                    # Add CP tracking prompt if enabled
-                    cp_prompt = self.get_cp_tracking_prompt()
-                    if cp_prompt:
-                        enhanced_content += cp_prompt
-                    
-                    messages.append({"role": role, "content": enhanced_content})
-                else:
-                    # User or assistant messages
-                    messages.append({"role": role, "content": content})
-        else:
-            # Backward compatibility: use old system_prompt format
-            # 1. Add main system prompt
-            system_prompt = char_format.get('system_prompt', '')
-            if not system_prompt:
-                system_prompt = preset.get('system_prompt', 'You are a helpful AI assistant.')
-            
-            # Build enhanced system prompt with character context
-            enhanced_system_prompt = system_prompt
-            
-            # Add character system info if present
-            char_system = char_format.get('character_system', '')
-            if char_system:
-                enhanced_system_prompt += '\n\n' + char_system
-            
-            # Add user character tracking info if needed
-            if self.character_names.get(channel_id):
-                character_list = ", ".join(self.character_names[channel_id])
-                enhanced_system_prompt += f"""
+        if context.loaded_from_disk:
+            # Same effect as loading the card: the channel and the manager see the latest data
+            self.channel_characters[channel_id] = context.character_data
+            self.character_manager.current_character = context.character_data
+        return context
+    
+    def invalidate_prompt_context(self) -> None:
+        """Rebuild compiled prompt contexts and reload prompt files on the next message."""
+        self.prompt_context_cache.invalidate()
+    
+    def get_token_budget_config(self) -> Dict[str, any]:
+        """Get token budget settings (reply reserve, context windows, component priorities/shares)."""
+        budget_config = self.config_manager.get("token_budget", {}) or {}
+        return {
+            "response_reserve": max(0, int(budget_config.get("response_reserve", 500))),
+            "context_windows": budget_config.get("context_windows", {}) or {},
+            "components": budget_config.get("components", {}) or {}
+        }
+    
+    def configure_token_budget(self) -> None:
+        """Apply the "token_budget" config section."""
+        budget_config = self.get_token_budget_config()
+        self.context_windows = ContextWindowRegistry(budget_config["context_windows"])
+        self.budget_planner = BudgetPlanner(budget_config["components"])
+    
+    def get_prompt_token_limit(self, preset: Dict[str, Any], model: Optional[str]) -> int:
+        """Token limit for a prompt: the preset's max_tokens, capped so the
+        prompt plus the reply fit in the model's context window (if known)."""
+        limit = int(preset.get('max_tokens', 2000))
+        window = self.context_windows.window_for(model)
+        if window:
+            limit = min(limit, window - int(self.get_generation_params(preset)["max_tokens"]))
+        return max(limit, 0)
+    
+    def get_prompt_layout_config(self) -> Dict[str, any]:
+        """Get prompt layout settings.
+        
+        "classic" folds every context block into the system prompt;
+        "cache_friendly" keeps the start of the prompt stable so providers'
+        prompt caches can hit, places volatile blocks volatile_depth messages
+        from the end, and evicts old history history_trim_chunk messages at a time.
+        """
+        layout_config = self.config_manager.get("prompt_layout", {}) or {}
+        mode = layout_config.get("mode", "classic")
+        return {
+            "mode": mode if mode in ("classic", "cache_friendly") else "classic",
+            "volatile_depth": max(0, int(layout_config.get("volatile_depth", 1))),
+            "history_trim_chunk": max(0, int(layout_config.get("history_trim_chunk", 10)))
+        }
+    
+    def get_volatile_prompt_blocks(
+        self,
+        channel_id: int,
+        user_message: str,
+        character_data: Optional[Dict[str, Any]]
+    ) -> List[Tuple[str, str]]:
+        """Build the prompt blocks that change from turn to turn.
+        
+        Returns:
+            (budget component, text) pairs for the user character list and
+            descriptions, matched lorebook entries and CP tracking prompt; each
+            text starts with its own separator
+        """
+        blocks = []
+        
+        # Add user character tracking info if needed
+        if self.character_names.get(channel_id):
+            character_list = ", ".join(self.character_names[channel_id])
+            blocks.append(("system", f"""
 
 IMPORTANT: In this conversation, users will identify themselves as characters by prefixing their messages with 'CharacterName:'. The following character names are being used by users: {character_list}. You should NEVER pretend to be these characters or respond as if you are them. You are a separate entity having a conversation with these characters.
 
 FORMAT GUIDELINES:
 - Text in "quotes" represents spoken dialogue by the character
 - Text in *asterisks* represents actions performed by the character
-- Text without quotes or asterisks is descriptive text or additional context"""
-                
-                # Add user character descriptions
-                # Reload to ensure we have the latest data
-                self.user_characters_manager.load_all_user_characters()
-                user_char_section = self.user_characters_manager.get_system_prompt_section(
-                    self.character_names[channel_id]
-                )
-                if user_char_section:
-                    enhanced_system_prompt += user_char_section
-            
-            # Add lorebook entries
-            # Reload to ensure we have the latest data
-            self.lorebook_manager.load_all_lorebooks()
-            # Pass current character name to filter character-linked lorebooks
-            current_character_name = character_data.get("name") if character_data else None
-            print(f"[LOREBOOK] Requesting lorebook for character: {current_character_name}")
-            print(f"[LOREBOOK] Character data: {character_data.get('name') if character_data else 'None'}")
-            lorebook_section = self.lorebook_manager.get_system_prompt_section(user_message, current_character_name)
-            if lorebook_section:
-                enhanced_system_prompt += "\n\n" + lorebook_section
-                print(f"[LOREBOOK] Added lorebook section ({len(lorebook_section)} chars)")
-            else:
-                print(f"[LOREBOOK] No lorebook content returned")
-            
-            # Add CP tracking prompt if enabled
-            cp_prompt = self.get_cp_tracking_prompt()
-            if cp_prompt:
-                enhanced_system_prompt += cp_prompt
-            
-            # Add the system message
-            if enhanced_system_prompt:
-                messages.append({"role": "system", "content": enhanced_system_prompt})
-        
-        # 2. Add example dialogues from character card (if configured in preset)
-        example_dialogues = char_format.get('example_dialogues', [])
-        if example_dialogues:
-            messages.extend(example_dialogues)
-        
-        # 3. Add conversation history
-        if channel_id in self.conversations:
-            messages.extend(self.conversations[channel_id])
-        
-        # 4. Add current user message
-        if character_name:
-            formatted_message = f"{character_name}: {user_message}"
-            messages.append({"role": "user", "content": formatted_message})
+- Text without quotes or asterisks is descriptive text or additional context"""))
+            
+            # Add user character descriptions
+            # Reload if the web UI changed them since the last message
+            self.prompt_context_cache.reload_if_changed(
+                "user_characters",
+                [os.path.join(self.user_characters_manager.user_chars_dir, "user_characters.json")],
+                self.user_characters_manager.load_all_user_characters
+            )
+            user_char_section = self.user_characters_manager.get_system_prompt_section(
+                self.character_names[channel_id]
+            )
+            if user_char_section:
+                blocks.append(("user_characters", user_char_section))
+        
+        # Add lorebook entries
+        # Reload if the lorebook files changed since the last message
+        self.prompt_context_cache.reload_if_changed(
+            "lorebooks",
+            self.lorebook_manager.get_storage_paths(),
+            self.lorebook_manager.load_all_lorebooks
+        )
+        # Pass current character name to filter character-linked lorebooks
+        current_character_name = character_data.get("name") if character_data else None
+        lorebook_logger.debug("Requesting lorebook for character: %s", current_character_name)
+        # Recent history is matched too, up to each lorebook's scan depth
+        lorebook_section = self.lorebook_manager.get_system_prompt_section(
+            user_message, current_character_name, channel_id, self.conversations.get(channel_id, [])
+        )
+        if lorebook_section:
+            blocks.append(("lorebook", "\n\n" + lorebook_section))
+            lorebook_logger.debug("Added lorebook section (%s chars)", len(lorebook_section))
         else:
-            messages.append({"role": "user", "content": user_message})
+            lorebook_logger.debug("No lorebook content returned")
         
-        # 5. Trim messages to fit within max_tokens limit
-        max_tokens = preset.get('max_tokens', 2000)
-        messages = self.trim_messages_to_fit(messages, max_tokens)
+        # Add CP tracking prompt if enabled
+        cp_prompt = self.get_cp_tracking_prompt(channel_id)
+        if cp_prompt:
+            blocks.append(("system", cp_prompt))
         
-        return messages
+        return blocks
+    
+    async def close(self):
+        """Log out, then close the pooled API clients."""
+        await super().close()
+        await self.client_registry.close()
     
     async def on_ready(self):
         """Called when bot is ready."""
@@ -0,0 +1,124 @@
+"""Fake OpenAI-compatible provider for the tests.
+
+Each test passes its own respond(handler, request) function, which answers
+one chat completion request (request is the decoded JSON body). The server
+keeps every request in server.requests; extra keyword arguments to
+fake_provider become attributes of the server, so respond can read and
+change per-test state through handler.server.
+
+    with fake_provider(respond, delay=0.1) as server, tempfile.TemporaryDirectory() as tmp:
+        bot = make_bot(tmp, openai_config=api_config(server))
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, Optional
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    """Records each request and hands it to server.respond."""
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        self.server.requests.append(request)
+        try:
+            self.server.respond(self, request)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped waiting (e.g. a cancelled hedge leg)
+            pass
+
+    def send_json(self, body: Dict[str, Any], status: int = 200, headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def start_events(self) -> None:
+        """Start a server-sent events response; follow with send_event calls."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+    def send_event(self, data: Any) -> None:
+        self.wfile.write(f"data: {data if isinstance(data, str) else json.dumps(data)}\n\n".encode())
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def completion(*contents: str, usage: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """A chat.completion body with one choice per content."""
+    body = {
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "test-model",
+        "choices": [{
+            "index": i,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        } for i, content in enumerate(contents)]
+    }
+    if usage:
+        body["usage"] = usage
+    return body
+
+
+def completion_chunk(content: str) -> Dict[str, Any]:
+    """A streamed chat.completion.chunk carrying one delta."""
+    return {
+        "id": "chatcmpl-test",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": "test-model",
+        "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}]
+    }
+
+
+def error(message: str, error_type: str = "server_error") -> Dict[str, Any]:
+    return {"error": {"message": message, "type": error_type}}
+
+
+@contextmanager
+def fake_provider(respond: Callable[[FakeProviderHandler, Dict[str, Any]], None], **state) -> Iterator[ThreadingHTTPServer]:
+    """Run a fake provider on a random local port for the duration of the block."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeProviderHandler)
+    server.respond = respond
+    server.requests = []
+    for name, value in state.items():
+        setattr(server, name, value)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def base_url(server: ThreadingHTTPServer) -> str:
+    return f"http://127.0.0.1:{server.server_port}/v1"
+
+
+def api_config(server: ThreadingHTTPServer, model: str = "m") -> Dict[str, str]:
+    """A saved API config (or openai_config) pointing at the fake provider."""
+    return {"api_key": "sk-test", "base_url": base_url(server), "model": model}
+
+
+def make_bot(tmp: str, **config):
+    """A DiscordBot whose config.json in tmp holds config."""
+    from config_manager import ConfigManager
+    from discord_bot import DiscordBot
+
+    config_path = os.path.join(tmp, "config.json")
+    with open(config_path, "w") as f:
+        json.dump(config, f)
+    return DiscordBot(ConfigManager(config_path))
@@ -0,0 +1,146 @@
+"""Rolling latency metrics for AI generations."""
+import time
+from collections import deque
+from typing import Dict, Any, Optional, List
+
+
+class LatencyTracker:
+    """Keep a rolling window of latency samples and summarize them."""
+
+    def __init__(self, window: int = 200):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.last: Optional[float] = None
+
+    def record(self, seconds: float) -> None:
+        """Record one latency sample in seconds."""
+        self.samples.append(seconds)
+        self.count += 1
+        self.last = seconds
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """Get a percentile (0-100) of the current window, or None if empty."""
+        # Copy first - the web server reads this from another thread
+        ordered = sorted(list(self.samples))
+        if not ordered:
+            return None
+        index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def summary(self) -> Dict[str, Any]:
+        """Get a JSON-friendly summary of the tracked latencies."""
+        samples = list(self.samples)
+        return {
+            "count": self.count,
+            "last": self.last,
+            "avg": sum(samples) / len(samples) if samples else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99)
+        }
+
+
+class GenerationMetrics:
+    """Named latency trackers shared by the bot and exposed by the web server.
+
+    The headline metric is "time_to_first_visible": the time from receiving
+    a !chat command until the first piece of the reply is visible in Discord.
+    """
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self.trackers: Dict[str, LatencyTracker] = {}
+        self.counters: Dict[str, int] = {}
+        self.started_at = time.time()
+
+    def tracker(self, name: str) -> LatencyTracker:
+        """Get (or create) the tracker with the given name."""
+        if name not in self.trackers:
+            self.trackers[name] = LatencyTracker(self.window)
+        return self.trackers[name]
+
+    def record(self, name: str, seconds: float) -> None:
+        """Record a latency sample for the named metric."""
+        self.tracker(name).record(seconds)
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        """Add to a named counter (e.g. requests or tokens spent)."""
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Get summaries of all tracked metrics."""
+        return {
+            "uptime_seconds": time.time() - self.started_at,
+            "latency": {name: tracker.summary() for name, tracker in list(self.trackers.items())},
+            "counters": dict(self.counters)
+        }
+
+
+def common_prefix_length(a: str, b: str) -> int:
+    """Length of the longest common prefix of two strings."""
+    n = min(len(a), len(b))
+    if a[:n] == b[:n]:
+        return n
+    # Binary search on slice comparisons - much faster than a per-character loop
+    low, high = 0, n
+    while high - low > 1:
+        middle = (low + high) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+class PrefixStabilityTracker:
+    """Measure how much of each prompt repeats the channel's previous prompt byte for byte.
+
+    Providers cache prompts by prefix, so the share of a prompt that matches
+    the start of the previous one is roughly the share that can be served
+    from the provider's prompt cache.
+    """
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self.last_prompts: Dict[Any, str] = {}
+        self.ratios: Dict[Any, deque] = {}
+        self.stats: Dict[Any, Dict[str, Any]] = {}
+
+    @staticmethod
+    def serialize(messages: List[Dict[str, str]]) -> str:
+        return "".join(f"{message.get('role', '')}\x00{message.get('content', '') or ''}\x01" for message in messages)
+
+    def record(self, channel_id: Any, messages: List[Dict[str, str]]) -> float:
+        """Record a prompt sent for a channel.
+
+        Returns:
+            The fraction (0-1) of the prompt shared with the channel's previous prompt
+        """
+        prompt = self.serialize(messages)
+        previous = self.last_prompts.get(channel_id)
+        self.last_prompts[channel_id] = prompt
+        if previous is None:
+            return 0.0
+
+        shared = common_prefix_length(previous, prompt)
+        ratio = shared / len(prompt) if prompt else 1.0
+        if channel_id not in self.ratios:
+            self.ratios[channel_id] = deque(maxlen=self.window)
+        self.ratios[channel_id].append(ratio)
+        stats = self.stats.setdefault(channel_id, {"prompts": 0})
+        stats["prompts"] += 1
+        stats["last_ratio"] = ratio
+        stats["last_shared_chars"] = shared
+        stats["last_prompt_chars"] = len(prompt)
+        return ratio
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Per-channel prefix stability, keyed by channel ID."""
+        result = {}
+        for channel_id, stats in list(self.stats.items()):
+            ratios = list(self.ratios.get(channel_id, ()))
+            result[str(channel_id)] = dict(
+                stats,
+                avg_ratio=sum(ratios) / len(ratios) if ratios else None
+            )
+        return result
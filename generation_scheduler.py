@@ -0,0 +1,214 @@
+"""Admission control for AI generations.
+
+Every generation goes through the scheduler before it reaches the provider:
+- Each endpoint (base URL) has a cap on concurrent requests
+- Waiting requests are ordered by priority first (fresh !chat before swipes),
+  then by weighted fair queuing between guilds, so one busy guild can't
+  starve the others
+- Queue depth and wait times are tracked for the web interface
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional, Callable, Awaitable, List
+
+from bot_logging import get_logger
+
+logger = get_logger("generation")
+
+# Lower value = served first
+PRIORITY_CHAT = 0
+PRIORITY_SWIPE = 1
+PRIORITY_BACKGROUND = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_CHAT: "chat",
+    PRIORITY_SWIPE: "swipe",
+    PRIORITY_BACKGROUND: "background"
+}
+
+
+class _EndpointQueue:
+    """Concurrency slots and waiting requests for one endpoint."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        # Heap of [priority, virtual_finish, sequence, future, virtual_start]
+        self.waiting: List[list] = []
+        # Weighted fair queuing state: the virtual clock advances to the start
+        # tag of each dispatched request; each guild's next request starts
+        # where its previous one finished.
+        self.virtual_time = 0.0
+        self.guild_finish: Dict[Any, float] = {}
+        self.dispatched = 0
+
+    def pending(self) -> List[list]:
+        return [entry for entry in self.waiting if not entry[3].done()]
+
+
+class GenerationScheduler:
+    """Per-endpoint concurrency limits with prioritized, guild-fair queuing.
+
+    All methods except configure() and snapshot() must be called from the
+    bot's event loop.
+    """
+
+    def __init__(self, default_limit: int = 4, endpoint_limits: Optional[Dict[str, int]] = None,
+                 guild_weights: Optional[Dict[str, float]] = None, metrics=None):
+        """
+        Args:
+            default_limit: Concurrent requests allowed per endpoint
+            endpoint_limits: Per-base-URL overrides of default_limit
+            guild_weights: Relative share of each guild (by id) when queued; default 1
+            metrics: Optional GenerationMetrics to record queue wait times into
+        """
+        self.default_limit = max(1, int(default_limit))
+        self.endpoint_limits = {self.normalize_endpoint(k): max(1, int(v)) for k, v in (endpoint_limits or {}).items()}
+        self.guild_weights = {str(k): float(v) for k, v in (guild_weights or {}).items() if float(v) > 0}
+        self.metrics = metrics
+        self._queues: Dict[str, _EndpointQueue] = {}
+        self._sequence = itertools.count()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @staticmethod
+    def normalize_endpoint(endpoint: str) -> str:
+        return (endpoint or "").strip().rstrip("/")
+
+    def configure(self, default_limit: int = None, endpoint_limits: Optional[Dict[str, int]] = None,
+                  guild_weights: Optional[Dict[str, float]] = None) -> None:
+        """Apply new limits and weights. Queued requests are kept."""
+        if default_limit is not None:
+            self.default_limit = max(1, int(default_limit))
+        if endpoint_limits is not None:
+            self.endpoint_limits = {self.normalize_endpoint(k): max(1, int(v)) for k, v in endpoint_limits.items()}
+        if guild_weights is not None:
+            self.guild_weights = {str(k): float(v) for k, v in guild_weights.items() if float(v) > 0}
+        for endpoint, queue in list(self._queues.items()):
+            queue.limit = self.endpoint_limits.get(endpoint, self.default_limit)
+
+        # Raised limits may let queued requests start. The web server calls this
+        # from its own thread, so hand the dispatch to the bot's event loop.
+        if self._loop and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._dispatch_all)
+
+    def _dispatch_all(self) -> None:
+        for queue in list(self._queues.values()):
+            self._dispatch(queue)
+
+    def _queue(self, endpoint: str) -> _EndpointQueue:
+        if endpoint not in self._queues:
+            self._queues[endpoint] = _EndpointQueue(self.endpoint_limits.get(endpoint, self.default_limit))
+        return self._queues[endpoint]
+
+    def _dispatch(self, queue: _EndpointQueue) -> None:
+        while queue.active < queue.limit and queue.waiting:
+            entry = heapq.heappop(queue.waiting)
+            future = entry[3]
+            if future.done():
+                # Cancelled while waiting
+                continue
+            queue.virtual_time = max(queue.virtual_time, entry[4])
+            queue.active += 1
+            queue.dispatched += 1
+            future.set_result(True)
+
+    async def acquire(self, endpoint: str, guild_id=None, priority: int = PRIORITY_CHAT,
+                      on_queued: Optional[Callable[[int], Awaitable[None]]] = None) -> None:
+        """Wait for a generation slot on an endpoint.
+
+        Args:
+            endpoint: Base URL of the provider
+            guild_id: Guild the request comes from (None for DMs)
+            priority: PRIORITY_CHAT, PRIORITY_SWIPE or PRIORITY_BACKGROUND
+            on_queued: Awaited with the 1-based queue position if the request has to wait
+        """
+        endpoint = self.normalize_endpoint(endpoint)
+        queue = self._queue(endpoint)
+        self._loop = asyncio.get_running_loop()
+        queued_at = time.monotonic()
+
+        if queue.active < queue.limit and not queue.pending():
+            queue.active += 1
+            queue.dispatched += 1
+            self._record_wait(priority, 0.0)
+            return
+
+        guild_key = str(guild_id) if guild_id is not None else "dm"
+        weight = self.guild_weights.get(guild_key, 1.0)
+        start = max(queue.virtual_time, queue.guild_finish.get(guild_key, 0.0))
+        finish = start + 1.0 / weight
+        queue.guild_finish[guild_key] = finish
+
+        future = self._loop.create_future()
+        entry = [priority, finish, next(self._sequence), future, start]
+        heapq.heappush(queue.waiting, entry)
+
+        try:
+            if on_queued:
+                position = sum(1 for other in queue.pending() if other[:3] < entry[:3]) + 1
+                try:
+                    await on_queued(position)
+                except Exception as e:
+                    logger.warning("Could not send queue notice: %s", e)
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just as we were cancelled - hand it on
+                self.release(endpoint)
+            else:
+                future.cancel()
+            raise
+
+        self._record_wait(priority, time.monotonic() - queued_at)
+
+    def release(self, endpoint: str) -> None:
+        """Return a generation slot and start the next queued request."""
+        queue = self._queue(self.normalize_endpoint(endpoint))
+        queue.active = max(0, queue.active - 1)
+        self._dispatch(queue)
+
+    @asynccontextmanager
+    async def slot(self, endpoint: str, guild_id=None, priority: int = PRIORITY_CHAT,
+                   on_queued: Optional[Callable[[int], Awaitable[None]]] = None):
+        """Hold a generation slot for the duration of the block."""
+        await self.acquire(endpoint, guild_id, priority, on_queued)
+        try:
+            yield
+        finally:
+            self.release(endpoint)
+
+    def _record_wait(self, priority: int, seconds: float) -> None:
+        if self.metrics:
+            self.metrics.record("queue_wait", seconds)
+            self.metrics.record(f"queue_wait_{PRIORITY_NAMES.get(priority, priority)}", seconds)
+
+    def queue_depth(self, endpoint: str = None) -> int:
+        """Number of requests waiting for a slot (on one endpoint, or in total)."""
+        if endpoint is not None:
+            queue = self._queues.get(self.normalize_endpoint(endpoint))
+            return len(queue.pending()) if queue else 0
+        return sum(len(queue.pending()) for queue in self._queues.values())
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Get a JSON-friendly view of every endpoint's slots and queue."""
+        endpoints = {}
+        for endpoint, queue in list(self._queues.items()):
+            pending = queue.pending()
+            endpoints[endpoint] = {
+                "limit": queue.limit,
+                "active": queue.active,
+                "queued": len(pending),
+                "queued_by_priority": {
+                    name: sum(1 for entry in pending if entry[0] == priority)
+                    for priority, name in PRIORITY_NAMES.items()
+                },
+                "dispatched": queue.dispatched
+            }
+        return {
+            "default_limit": self.default_limit,
+            "queue_depth": sum(item["queued"] for item in endpoints.values()),
+            "endpoints": endpoints
+        }
@@ -0,0 +1,194 @@
+"""Rolling summaries of conversation history that no longer fits in the prompt.
+
+Turns that are trimmed out of the prompt (by the token budget) or cut from the
+channel's history (by the 20-message cap) used to be lost. HistorySummarizer
+queues them per channel and, off the hot path, folds them into a running
+summary that the bot pins above the history. Prompt size stays roughly
+constant however long a campaign runs, without raising !setcontext.
+
+Summarizing runs as a background task, one per channel at a time, and the
+bot sends it through the scheduler at background priority so it never delays
+a !chat.
+"""
+import asyncio
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Sequence
+
+from bot_logging import get_logger
+
+logger = get_logger("context")
+
+Message = Dict[str, Any]
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a roleplay conversation. Merge the new "
+    "conversation into the current summary. Keep names, relationships, places, "
+    "items, promises, unresolved plot threads and how each character feels. "
+    "Drop small talk and exact wording. Write in past tense, in {max_words} "
+    "words or fewer, and reply with the updated summary only."
+)
+
+
+def format_transcript(messages: Sequence[Message]) -> str:
+    """Render messages as "Role: content" lines for the summarization prompt."""
+    lines = []
+    for message in messages:
+        role = "Assistant" if message.get("role") == "assistant" else "User"
+        lines.append(f"{role}: {message.get('content') or ''}")
+    return "\n".join(lines)
+
+
+def build_summary_request(summary: str, messages: Sequence[Message], max_words: int = 300) -> List[Message]:
+    """Messages asking the model to fold messages into summary."""
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS.format(max_words=max_words)},
+        {
+            "role": "user",
+            "content": f"Current summary:\n{summary or '(none yet)'}\n\nNew conversation:\n{format_transcript(messages)}"
+        }
+    ]
+
+
+class ChannelSummary:
+    """Summary state for one channel."""
+
+    def __init__(self):
+        self.text = ""
+        # Messages waiting to be folded into the summary
+        self.pending: List[Message] = []
+        # Messages already queued or summarized that may still be in the history,
+        # by identity (the references keep ids from being reused)
+        self.covered: Dict[int, Message] = {}
+        self.summarized = 0
+        self.task: Optional[asyncio.Task] = None
+
+
+class HistorySummarizer:
+    """Queues messages that left the prompt and summarizes them in the background."""
+
+    def __init__(
+        self,
+        summarize: Callable[[int, Optional[int], str, List[Message]], Awaitable[str]],
+        batch_size: int = 20,
+        min_pending: int = 6
+    ):
+        """
+        Args:
+            summarize: summarize(channel_id, server_id, summary, messages) returns
+                the updated summary
+            batch_size: Most messages folded in per summarization request
+            min_pending: Messages to collect before a summarization is started
+        """
+        self.summarize = summarize
+        self.batch_size = batch_size
+        self.min_pending = min_pending
+        self.channels: Dict[int, ChannelSummary] = {}
+        self.runs = 0
+        self.failures = 0
+
+    def _channel(self, channel_id: int) -> ChannelSummary:
+        if channel_id not in self.channels:
+            self.channels[channel_id] = ChannelSummary()
+        return self.channels[channel_id]
+
+    def _queue_new(self, state: ChannelSummary, messages: Sequence[Message]) -> int:
+        # Dropped messages always form the start of the history and covered ones
+        # the start of those, so scanning back to the first covered message finds
+        # every new one without walking the whole history each turn
+        new = []
+        for message in reversed(messages):
+            if id(message) in state.covered:
+                break
+            new.append(message)
+        new.reverse()
+        for message in new:
+            state.covered[id(message)] = message
+        state.pending.extend(new)
+        return len(new)
+
+    def note_dropped(self, channel_id: int, dropped: Sequence[Message]) -> int:
+        """Queue history messages that were trimmed out of the prompt.
+
+        Args:
+            dropped: The start of the channel's history that didn't fit
+
+        Returns:
+            Number of newly queued messages
+        """
+        if not dropped:
+            return 0
+        return self._queue_new(self._channel(channel_id), dropped)
+
+    def note_evicted(self, channel_id: int, evicted: Sequence[Message]) -> int:
+        """Queue messages that are being removed from the start of the history."""
+        if not evicted:
+            return 0
+        state = self._channel(channel_id)
+        queued = self._queue_new(state, evicted)
+        for message in evicted:
+            state.covered.pop(id(message), None)
+        return queued
+
+    def summary_for(self, channel_id: int) -> str:
+        state = self.channels.get(channel_id)
+        return state.text if state else ""
+
+    def reset(self, channel_id: int) -> None:
+        """Forget a channel's summary (its history was cleared or reloaded)."""
+        state = self.channels.pop(channel_id, None)
+        if state and state.task and not state.task.done():
+            state.task.cancel()
+
+    def schedule(self, channel_id: int, server_id: Optional[int] = None, force: bool = False) -> Optional[asyncio.Task]:
+        """Start summarizing the channel's pending messages in the background.
+
+        Does nothing if too few messages are pending (unless force) or a
+        summarization for the channel is already running.
+        """
+        state = self.channels.get(channel_id)
+        if not state or not state.pending:
+            return None
+        if state.task and not state.task.done():
+            return None
+        if len(state.pending) < self.min_pending and not force:
+            return None
+        state.task = asyncio.create_task(self._run(channel_id, server_id, state))
+        return state.task
+
+    async def _run(self, channel_id: int, server_id: Optional[int], state: ChannelSummary) -> None:
+        while state.pending and self.channels.get(channel_id) is state:
+            batch = state.pending[:self.batch_size]
+            try:
+                summary = await self.summarize(channel_id, server_id, state.text, batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Keep the batch queued; the next turn tries again
+                self.failures += 1
+                logger.warning("Summarizing history for channel %s failed: %s", channel_id, e)
+                return
+            summary = (summary or "").strip()
+            if not summary:
+                self.failures += 1
+                logger.warning("Empty summary for channel %s, will retry", channel_id)
+                return
+            state.text = summary
+            del state.pending[:len(batch)]
+            state.summarized += len(batch)
+            self.runs += 1
+            logger.info("Folded %s messages into the summary for channel %s (%s pending)",
+                        len(batch), channel_id, len(state.pending))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "failures": self.failures,
+            "channels": {
+                str(channel_id): {
+                    "summary_chars": len(state.text),
+                    "summarized_messages": state.summarized,
+                    "pending_messages": len(state.pending),
+                    "running": bool(state.task and not state.task.done())
+                }
+                for channel_id, state in list(self.channels.items())
+            }
+        }
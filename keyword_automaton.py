@@ -0,0 +1,125 @@
+"""Multi-keyword matching for lorebook activation.
+
+Matching used to test every keyword of every entry against the message, which
+is O(entries x keywords x text) per !chat and per swipe. KeywordAutomaton
+compiles all keywords into one Aho-Corasick automaton, so a single pass over
+the text finds every keyword that occurs in it, however many entries there are.
+
+Keywords match case-insensitively anywhere in the text by default, like the
+old substring check. Each keyword can be made case-sensitive or restricted to
+whole words.
+"""
+from collections import deque
+from typing import Any, Dict, Iterator, List, Set, Tuple
+
+
+def fold_case(text: str) -> str:
+    """Lowercase text without changing its length, so match positions line up with the original."""
+    folded = text.lower()
+    if len(folded) == len(text):
+        return folded
+    # A few characters lowercase to two (e.g. "İ") - keep those as they are
+    return "".join(char.lower() if len(char.lower()) == 1 else char for char in text)
+
+
+def is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton mapping keywords to values (e.g. lorebook entries).
+
+    Add keywords, call build(), then search(). Adding after build() requires
+    another build().
+    """
+
+    def __init__(self):
+        # Trie over case-folded keywords: transitions, failure links, the keywords
+        # ending at each node, and those plus the ones reached via failure links
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.ends: List[List[int]] = [[]]
+        self.outputs: List[List[int]] = [[]]
+        # Per keyword: (original keyword, value, case_sensitive, whole_word)
+        self.keywords: List[Tuple[str, Any, bool, bool]] = []
+        # Values of empty keywords, which match any text (as "" in text does)
+        self.match_any: List[Any] = []
+        self.built = False
+
+    def __len__(self) -> int:
+        return len(self.keywords) + len(self.match_any)
+
+    def add(self, keyword: str, value: Any, case_sensitive: bool = False, whole_word: bool = False) -> None:
+        """Register a keyword that triggers value."""
+        if not keyword:
+            self.match_any.append(value)
+            return
+        node = 0
+        for char in fold_case(keyword):
+            next_node = self.goto[node].get(char)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][char] = next_node
+                self.goto.append({})
+                self.fail.append(0)
+                self.ends.append([])
+            node = next_node
+        self.ends[node].append(len(self.keywords))
+        self.keywords.append((keyword, value, case_sensitive, whole_word))
+        self.built = False
+
+    def build(self) -> "KeywordAutomaton":
+        """Compute failure links (breadth-first over the trie)."""
+        self.outputs = [list(ends) for ends in self.ends]
+        queue = deque()
+        for child in self.goto[0].values():
+            self.fail[child] = 0
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.outputs[child] += self.outputs[self.fail[child]]
+        self.built = True
+        return self
+
+    def _accepts(self, text: str, start: int, end: int, keyword: str, case_sensitive: bool, whole_word: bool) -> bool:
+        if case_sensitive and text[start:end] != keyword:
+            return False
+        if whole_word:
+            if is_word_char(keyword[0]) and start > 0 and is_word_char(text[start - 1]):
+                return False
+            if is_word_char(keyword[-1]) and end < len(text) and is_word_char(text[end]):
+                return False
+        return True
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, Any]]:
+        """Yield (start, end, value) for every keyword occurrence in text."""
+        if not self.built:
+            self.build()
+        goto = self.goto
+        fail = self.fail
+        outputs = self.outputs
+        keywords = self.keywords
+        node = 0
+        for position, char in enumerate(fold_case(text)):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for index in outputs[node]:
+                keyword, value, case_sensitive, whole_word = keywords[index]
+                start = position + 1 - len(keyword)
+                if (not case_sensitive and not whole_word) or self._accepts(
+                        text, start, position + 1, keyword, case_sensitive, whole_word):
+                    yield start, position + 1, value
+
+    def search(self, text: str) -> Set[Any]:
+        """Values of all keywords found in text."""
+        found = set(self.match_any)
+        for _, _, value in self.iter_matches(text):
+            found.add(value)
+        return found
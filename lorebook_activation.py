@@ -0,0 +1,178 @@
+"""Lorebook activation across turns: scan depth, sticky entries and cooldowns.
+
+Keyword activation used to look at the current message only, so lore
+mentioned one turn ago dropped out of the prompt on the next turn. Each
+lorebook can now set a scan depth: entries also activate when they were
+triggered by one of the last N messages of the channel's history.
+LorebookActivationTracker remembers which entries each history message
+triggered, so a turn only scans messages it hasn't seen before instead of
+all N again.
+
+Entries can also set timed effects, counted in turns (assistant replies):
+
+- sticky: an activated entry stays active for this many more turns, even if
+  nothing triggers it again
+- cooldown: after an entry's activation (and sticky turns) end, it can't be
+  triggered again for this many turns
+"""
+from typing import Dict, Any, Callable, FrozenSet, Optional, Sequence, Set, Tuple
+
+Message = Dict[str, Any]
+
+
+class ChannelActivations:
+    """Activation state for one channel."""
+
+    def __init__(self):
+        # Compiled lorebook index the records were made with; positions are only valid for it
+        self.index: Optional[Dict[str, Any]] = None
+        # id(message) -> (message, content it was scanned with, positions it triggered)
+        self.records: Dict[int, Tuple[Message, str, FrozenSet[int]]] = {}
+        self.turn = 0
+        self.last_reply: Optional[Message] = None
+        # Entry id -> last turn it stays active / last turn it can't be triggered
+        self.sticky_until: Dict[str, int] = {}
+        self.cooldown_until: Dict[str, int] = {}
+
+
+class LorebookActivationTracker:
+    """Per-channel records of triggered entries and timed effects."""
+
+    def __init__(self):
+        self.channels: Dict[int, ChannelActivations] = {}
+        self.messages_scanned = 0
+        self.record_hits = 0
+
+    def _channel(self, channel_id: int) -> ChannelActivations:
+        if channel_id not in self.channels:
+            self.channels[channel_id] = ChannelActivations()
+        return self.channels[channel_id]
+
+    def reset(self, channel_id: int) -> None:
+        """Forget a channel's records and timed effects (its history was cleared)."""
+        self.channels.pop(channel_id, None)
+
+    def scan_history(
+        self,
+        channel_id: int,
+        index: Dict[str, Any],
+        history: Sequence[Message],
+        match: Callable[[str], Set[int]]
+    ) -> Set[int]:
+        """Entries triggered by recent history messages, within their lorebook's scan depth.
+
+        Args:
+            index: Compiled lorebook index with "scan_depths" per entry position
+                and "max_scan_depth"
+            history: The channel's history (without the current message)
+            match: Positions of the entries a text triggers
+
+        Returns:
+            Entry positions
+        """
+        depth = index["max_scan_depth"]
+        state = self._channel(channel_id)
+        if state.index is not index:
+            # Lorebooks changed: earlier records may miss new keywords
+            state.index = index
+            state.records = {}
+        if depth <= 0 or not history:
+            state.records = {}
+            return set()
+
+        scan_depths = index["scan_depths"]
+        records = {}
+        triggered = set()
+        for distance, message in enumerate(reversed(history[-depth:]), 1):
+            content = message.get("content") or ""
+            record = state.records.get(id(message))
+            if record is None or record[0] is not message or record[1] != content:
+                record = (message, content, frozenset(match(content)))
+                self.messages_scanned += 1
+            else:
+                self.record_hits += 1
+            records[id(message)] = record
+            for position in record[2]:
+                if scan_depths[position] >= distance:
+                    triggered.add(position)
+        # Messages that left the window are forgotten
+        state.records = records
+        return triggered
+
+    def apply_timed_effects(
+        self,
+        channel_id: int,
+        index: Dict[str, Any],
+        history: Sequence[Message],
+        triggered: Set[int]
+    ) -> Set[int]:
+        """Drop entries on cooldown and add entries that are still sticky.
+
+        A new turn starts when the history ends with a reply that wasn't seen
+        before, so rebuilding a prompt for a swipe doesn't count as a turn.
+
+        Args:
+            index: Compiled lorebook index with "ids" and "positions_by_id"
+            triggered: Entry positions triggered this turn
+
+        Returns:
+            Entry positions active this turn
+        """
+        state = self._channel(channel_id)
+        if history and history[-1].get("role") == "assistant" and history[-1] is not state.last_reply:
+            state.last_reply = history[-1]
+            state.turn += 1
+        turn = state.turn
+
+        active = set()
+        for entry_id, until in state.sticky_until.items():
+            position = index["positions_by_id"].get(entry_id)
+            if until >= turn and position is not None:
+                active.add(position)
+
+        for position in sorted(triggered):
+            if position in active:
+                continue
+            entry_id = index["ids"][position]
+            if state.cooldown_until.get(entry_id, -1) >= turn:
+                continue
+            active.add(position)
+            entry = index["entries"][position][2]
+            sticky = int(entry.get("sticky") or 0)
+            cooldown = int(entry.get("cooldown") or 0)
+            if sticky or cooldown:
+                # Also marks the entry active for the rest of this turn (e.g. swipes)
+                state.sticky_until[entry_id] = turn + sticky
+                if cooldown:
+                    state.cooldown_until[entry_id] = turn + sticky + cooldown
+
+        state.sticky_until = {entry_id: until for entry_id, until in state.sticky_until.items() if until >= turn}
+        state.cooldown_until = {entry_id: until for entry_id, until in state.cooldown_until.items() if until >= turn}
+        return active
+
+    def cooling_down(self, channel_id: int, index: Dict[str, Any]) -> Set[int]:
+        """Positions of the entries that can't be triggered in the channel's current turn."""
+        state = self.channels.get(channel_id)
+        if state is None:
+            return set()
+        positions_by_id = index["positions_by_id"]
+        return {
+            positions_by_id[entry_id]
+            for entry_id, until in state.cooldown_until.items()
+            if until >= state.turn and entry_id in positions_by_id
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "messages_scanned": self.messages_scanned,
+            "record_hits": self.record_hits,
+            "channels": {
+                str(channel_id): {
+                    "turn": state.turn,
+                    "recorded_messages": len(state.records),
+                    "sticky_entries": len(state.sticky_until),
+                    "cooling_down": len(state.cooldown_until)
+                }
+                for channel_id, state in list(self.channels.items())
+            }
+        }
@@ -0,0 +1,393 @@
+"""Streaming import of large lorebook files, including SillyTavern world info.
+
+The regular import (/api/lorebook/import) receives the whole file as one JSON
+string, parses it all and then saves every lorebook. For community world info
+files of tens of megabytes that holds the file several times in memory and
+blocks the request until everything is written.
+
+LorebookImporter reads the file in chunks and decodes one entry at a time.
+SillyTavern fields are mapped onto the entry schema as entries arrive:
+
+- key / keys -> keywords, keysecondary / secondary_keys -> secondary_keywords
+- comment (or name, or the first key) -> entry key
+- constant -> "constant" activation, vectorized -> "vectorized"
+- order / insertion_order -> order
+- disable (or enabled: false) -> the entry is skipped
+- caseSensitive, matchWholeWords, sticky, cooldown -> the same options here
+- preventRecursion -> no_recurse
+
+order and secondary_keywords are kept with the entry for exporting back, but
+activation doesn't use them yet.
+
+Files in this bot's own lorebook format are imported as they are. Entries are
+collected in a lorebook private to the import, which replaces (or is merged
+into) the manager's one under its lock after the last entry, so requests
+never see a half-imported lorebook. With the SQLite store, entries are
+committed in batches as they arrive; with JSON storage the file is written
+once at the end. The keyword and vector indexes are rebuilt once, at the end.
+"""
+import json
+import re
+import time
+from typing import Dict, Any, Iterator, List, Optional, TextIO
+
+from bot_logging import get_logger
+
+logger = get_logger("lorebook")
+
+CHUNK_SIZE = 64 * 1024
+# How long a finished import's progress stays available
+FINISHED_IMPORT_TTL = 600
+
+STRING_PATTERN = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+# Runs of characters that can't start or end a nested value
+PLAIN_PATTERN = re.compile(r'[^"{}\[\]]+')
+
+
+class JsonStream:
+    """Reads the values of a JSON document one at a time from a text file."""
+
+    def __init__(self, f: TextIO, chunk_size: int = CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> None:
+        # Drop what was consumed; read at least as much as is buffered so long values don't re-parse too often
+        chunk = self.f.read(max(self.chunk_size, len(self.buffer) - self.pos))
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        if not chunk:
+            self.eof = True
+
+    def peek(self) -> str:
+        """Next non-whitespace character ("" at the end of the file)."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                return ""
+            self._fill()
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Invalid JSON: expected '{char}' but found '{found or 'end of file'}'")
+        self.pos += 1
+
+    def read_value(self) -> Any:
+        """Decode the next complete value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self._fill()
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and not self.eof:
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+    def skip_value(self) -> None:
+        """Skip the next value without decoding it."""
+        if self.peek() not in "{[":
+            self.read_value()
+            return
+        depth = 0
+        while True:
+            if self.pos >= len(self.buffer):
+                if self.eof:
+                    raise ValueError("Invalid JSON: unexpected end of file")
+                self._fill()
+                continue
+            char = self.buffer[self.pos]
+            if char == '"':
+                match = STRING_PATTERN.match(self.buffer, self.pos)
+                if match is None:
+                    if self.eof:
+                        raise ValueError("Invalid JSON: unterminated string")
+                    self._fill()
+                    continue
+                self.pos = match.end()
+            elif char in "{[":
+                depth += 1
+                self.pos += 1
+            elif char in "}]":
+                depth -= 1
+                self.pos += 1
+                if depth == 0:
+                    return
+            else:
+                self.pos = PLAIN_PATTERN.match(self.buffer, self.pos).end()
+
+    def _iter_container(self, opening: str, closing: str, keyed: bool) -> Iterator[Any]:
+        self.expect(opening)
+        if self.peek() == closing:
+            self.pos += 1
+            return
+        index = 0
+        while True:
+            if keyed:
+                key = self.read_value()
+                self.expect(":")
+                yield key
+            else:
+                yield index
+                index += 1
+            char = self.peek()
+            self.pos += 1
+            if char == closing:
+                return
+            if char != ",":
+                raise ValueError(f"Invalid JSON: expected ',' or '{closing}' but found '{char or 'end of file'}'")
+
+    def iter_object(self) -> Iterator[str]:
+        """Yield the keys of the next object; read or skip each value before resuming."""
+        return self._iter_container("{", "}", True)
+
+    def iter_array(self) -> Iterator[int]:
+        """Yield the indexes of the next array; read or skip each item before resuming."""
+        return self._iter_container("[", "]", False)
+
+
+def map_sillytavern_entry(entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Convert a SillyTavern world info (or character book) entry to this bot's entry schema.
+
+    Returns:
+        The entry, or None if it is disabled
+    """
+    if entry.get("disable") or entry.get("enabled") is False:
+        return None
+    keywords = entry.get("key", entry.get("keys")) or []
+    secondary = entry.get("keysecondary", entry.get("secondary_keys")) or []
+    if isinstance(keywords, str):
+        keywords = [keyword.strip() for keyword in keywords.split(",") if keyword.strip()]
+    if isinstance(secondary, str):
+        secondary = [keyword.strip() for keyword in secondary.split(",") if keyword.strip()]
+    key = (entry.get("comment") or entry.get("name") or (keywords[0] if keywords else "")).strip()
+    if not key:
+        key = f"Entry {entry.get('uid', entry.get('id', ''))}".strip()
+
+    if entry.get("constant"):
+        activation_type = "constant"
+    elif entry.get("vectorized"):
+        activation_type = "vectorized"
+    else:
+        activation_type = "normal"
+    mapped = {
+        "key": key,
+        "content": entry.get("content") or "",
+        "keywords": [str(keyword) for keyword in keywords],
+        "activation_type": activation_type
+    }
+    if secondary:
+        mapped["secondary_keywords"] = [str(keyword) for keyword in secondary]
+    order = entry.get("order", entry.get("insertion_order"))
+    if order is not None:
+        mapped["order"] = order
+    if entry.get("caseSensitive", entry.get("case_sensitive")):
+        mapped["case_sensitive"] = True
+    if entry.get("matchWholeWords"):
+        mapped["match_whole_words"] = True
+    for option in ("sticky", "cooldown"):
+        if entry.get(option):
+            mapped[option] = int(entry[option])
+    if entry.get("preventRecursion"):
+        mapped["no_recurse"] = True
+    return mapped
+
+
+def is_sillytavern_entry(entry: Dict[str, Any]) -> bool:
+    # This bot's entries have a string "key" and "keywords"; SillyTavern's have a list of keys
+    return isinstance(entry.get("key"), list) or "keys" in entry or "keysecondary" in entry or "uid" in entry
+
+
+class LorebookImporter:
+    """Imports one lorebook file into a LorebookManager, entry by entry."""
+
+    def __init__(self, manager, batch_size: int = 500):
+        self.manager = manager
+        self.batch_size = batch_size
+        self.lorebook_name: Optional[str] = None
+        self.entries = 0
+        self.skipped = 0
+        self.batches = 0
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    def expired(self, ttl: float = FINISHED_IMPORT_TTL) -> bool:
+        """Whether the import finished more than ttl seconds ago."""
+        return self.finished is not None and time.perf_counter() - self.finished > ttl
+
+    @property
+    def entries_per_second(self) -> float:
+        elapsed = self.elapsed
+        return self.entries / elapsed if elapsed > 0 else 0.0
+
+    def run(self, f: TextIO, name: Optional[str] = None, merge: bool = True) -> Dict[str, Any]:
+        """Import a lorebook from an open text file.
+
+        Args:
+            f: File with a SillyTavern world info file or a lorebook exported by this bot
+            name: Lorebook to import into; defaults to the file's "name" or "Imported Lorebook"
+            merge: If True, add to an existing lorebook of that name; if False, replace it
+
+        Returns:
+            Progress snapshot (see snapshot)
+        """
+        self.started = time.perf_counter()
+        try:
+            self._import(JsonStream(f), name, merge)
+        except Exception as e:
+            self.error = str(e)
+            raise
+        finally:
+            self.finished = time.perf_counter()
+        logger.info("Imported %s entries into '%s' in %.2fs (%.0f entries/s, %s disabled entries skipped)",
+                    self.entries, self.lorebook_name, self.elapsed, self.entries_per_second, self.skipped)
+        return self.snapshot()
+
+    def import_path(self, path: str, name: Optional[str] = None, merge: bool = True) -> Dict[str, Any]:
+        with open(path, "r", encoding="utf-8") as f:
+            return self.run(f, name, merge)
+
+    def _import(self, stream: JsonStream, name: Optional[str], merge: bool) -> None:
+        metadata: Dict[str, Any] = {}
+        lorebook = None
+        for field in stream.iter_object():
+            if field == "entries":
+                lorebook = self._open_lorebook(name or metadata.get("name") or "Imported Lorebook", metadata, merge)
+                self._import_entries(stream, lorebook)
+            elif field in ("name", "description", "linked_characters", "scan_depth") and lorebook is None:
+                metadata[field] = stream.read_value()
+            else:
+                # Everything else (e.g. SillyTavern's originalData copy) is skipped unparsed
+                stream.skip_value()
+        if stream.peek():
+            raise ValueError("Invalid JSON: data after the lorebook object")
+        if lorebook is None:
+            raise ValueError("The file has no \"entries\"")
+
+        self._swap_in(lorebook, merge)
+
+    def _open_lorebook(self, name: str, metadata: Dict[str, Any], merge: bool) -> Dict[str, Any]:
+        """Start the lorebook the entries are imported into.
+
+        It is private to the import; the manager's lorebooks only change in _swap_in.
+        """
+        self.lorebook_name = name
+        with self.manager.lock:
+            existing = self.manager.lorebooks.get(name) if merge else None
+            if existing is not None:
+                lorebook = {field: value for field, value in existing.items() if field != "entries"}
+                lorebook["entries"] = {}
+                if metadata.get("description"):
+                    lorebook["description"] = metadata["description"]
+                return lorebook
+        lorebook = {
+            "name": name,
+            "description": metadata.get("description", ""),
+            "enabled": True,
+            "linked_characters": metadata.get("linked_characters") or None,
+            "entries": {}
+        }
+        if metadata.get("scan_depth"):
+            lorebook["scan_depth"] = int(metadata["scan_depth"])
+        return lorebook
+
+    def _swap_in(self, lorebook: Dict[str, Any], merge: bool) -> None:
+        """Put the imported lorebook in the manager and save it."""
+        manager = self.manager
+        name = lorebook["name"]
+        with manager.lock:
+            existing = manager.lorebooks.get(name)
+            if merge and existing is not None:
+                existing["entries"].update(lorebook["entries"])
+                if lorebook.get("description"):
+                    existing["description"] = lorebook["description"]
+            else:
+                manager.lorebooks[name] = lorebook
+                if existing is not None and manager.store is not None:
+                    # Drops the stored entries of the lorebook being replaced
+                    stale = [key for key in existing.get("entries", {}) if key not in lorebook["entries"]]
+                    manager.store.delete_entries(name, stale)
+
+            if manager.store is None:
+                # JSON storage is written once, for the whole import
+                manager.save_all_lorebooks()
+            else:
+                # The entries are already stored; this writes the lorebook's metadata and rebuilds the indexes
+                manager.save_lorebook(name)
+
+    def _import_entries(self, stream: JsonStream, lorebook: Dict[str, Any]) -> None:
+        entries = lorebook["entries"]
+        imported_keys = set()
+        batch: List[str] = []
+        items = stream.iter_object() if stream.peek() == "{" else stream.iter_array()
+        for item_key in items:
+            entry = stream.read_value()
+            if not isinstance(entry, dict):
+                continue
+            if is_sillytavern_entry(entry):
+                entry = map_sillytavern_entry(entry)
+                if entry is None:
+                    self.skipped += 1
+                    continue
+                key = entry["key"]
+            else:
+                key = item_key if isinstance(item_key, str) else entry.get("key") or f"Entry {item_key}"
+                if "activation_type" not in entry:
+                    entry["activation_type"] = "constant" if entry.get("always_active") else "normal"
+
+            # Several SillyTavern entries can share a title; keep them all
+            unique_key = key
+            copy = 2
+            while unique_key in imported_keys:
+                unique_key = f"{key} ({copy})"
+                copy += 1
+            entry["key"] = unique_key
+            imported_keys.add(unique_key)
+            entries[unique_key] = entry
+            self.entries += 1
+
+            batch.append(unique_key)
+            if len(batch) >= self.batch_size:
+                self._commit(lorebook, batch)
+                batch = []
+        self._commit(lorebook, batch)
+
+    def _commit(self, lorebook: Dict[str, Any], keys: List[str]) -> None:
+        if not keys:
+            return
+        if self.manager.store is not None:
+            self.manager.store.save_lorebook(lorebook["name"], lorebook, keys)
+        self.batches += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "lorebook": self.lorebook_name,
+            "entries": self.entries,
+            "skipped": self.skipped,
+            "batches": self.batches,
+            "elapsed": round(self.elapsed, 3),
+            "entries_per_second": round(self.entries_per_second, 1),
+            "done": self.finished is not None,
+            "error": self.error
+        }
@@ -1,15 +1,60 @@
 """Lorebook manager for handling world-building and lore information."""
+import hashlib
 import json
+import logging
 import os
-from typing import Dict, Any, List, Optional
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Set, Tuple
+from keyword_automaton import KeywordAutomaton
+from lorebook_vector_index import LorebookVectorIndex
+from lorebook_activation import LorebookActivationTracker
+from lorebook_trigger_graph import LorebookTriggerGraph
+from lorebook_sqlite_store import LorebookSqliteStore
+from bot_logging import get_logger
+
+logger = get_logger("lorebook")
+# Per-entry activation lines, sampled (see "lorebook_entry_sample_rate")
+entry_logger = get_logger("lorebook.entries")
+
 
 class LorebookManager:
-    def __init__(self, lorebook_dir: str = "lorebook"):
+    def __init__(self, lorebook_dir: str = "lorebook", embedder: Optional[Any] = None, storage: str = "json"):
+        """
+        Args:
+            lorebook_dir: Directory the lorebooks are stored in
+            embedder: Embedder for vectorized entries (see lorebook_vector_index.py)
+            storage: "json" (lorebooks.json) or "sqlite" (lorebooks.db with row-level writes)
+        """
         self.lorebook_dir = lorebook_dir
-        self.debug_logging = True  # Always enabled for diagnostics
         self.ensure_lorebook_dir()
+        self.store: Optional[LorebookSqliteStore] = None
+        if storage == "sqlite":
+            self.store = LorebookSqliteStore(os.path.join(lorebook_dir, "lorebooks.db"))
+        # Embeddings of "vectorized" entries for semantic activation, stored next to lorebooks.json
+        self.vector_index = LorebookVectorIndex(os.path.join(lorebook_dir, "lorebook_vectors"), embedder)
+        self.vector_top_k = 3
+        self.vector_threshold = 0.1
+        # Per-channel records of triggered entries for scan depth, sticky and cooldown
+        self.activations = LorebookActivationTracker()
+        # Entry -> entry triggers for recursive activation (0 = no recursion)
+        self.trigger_graph = LorebookTriggerGraph()
+        self.recursion_depth = 2
         self.lorebooks: Dict[str, Dict[str, Any]] = {}
         self.entries: Dict[str, Dict[str, Any]] = {}  # Legacy flat entries for backward compatibility
+        # Compiled keyword matching, rebuilt after lorebooks are loaded or saved
+        self._keyword_index: Optional[Dict[str, Dict[str, Any]]] = None
+        # Increases whenever the lorebooks are loaded or changed
+        self.version = 0
+        # Rendered prompt sections by (text hash, character, version, ...), so swipes don't redo activation
+        self.section_cache: "OrderedDict[Tuple, Tuple[str, Any]]" = OrderedDict()
+        self.section_cache_size = 256
+        self.section_cache_hits = 0
+        self.section_cache_misses = 0
+        self._section_cache_lock = threading.Lock()
+        # Guards the lorebook dicts while they are changed, saved or exported
+        # (web requests and background imports run in their own threads)
+        self.lock = threading.RLock()
         self.load_all_lorebooks()
     
     def ensure_lorebook_dir(self) -> None:
@@ -19,37 +64,50 @@ class LorebookManager:
     
     def load_all_lorebooks(self) -> None:
         """Load all lorebooks from storage."""
-        # Load new multi-lorebook format
+        self._keyword_index = None
+        self.vector_index.load()
+        
         lorebooks_path = os.path.join(self.lorebook_dir, "lorebooks.json")
-        if os.path.exists(lorebooks_path):
+        legacy_path = os.path.join(self.lorebook_dir, "lorebook.json")
+        if self.store is not None and not self.store.is_empty():
+            self.lorebooks = self.store.load()
+        elif os.path.exists(lorebooks_path):
+            # Load new multi-lorebook format
             with open(lorebooks_path, "r") as f:
                 self.lorebooks = json.load(f)
+            if self.store is not None:
+                # One-shot migration into the SQLite store; lorebooks.json is left as it is
+                self.store.replace_all(self.lorebooks)
+                logger.info("Migrated %s lorebooks from %s to %s", len(self.lorebooks), lorebooks_path, self.store.path)
         else:
             self.lorebooks = {}
-        
-        # Load legacy single lorebook for backward compatibility
-        legacy_path = os.path.join(self.lorebook_dir, "lorebook.json")
-        if os.path.exists(legacy_path):
-            with open(legacy_path, "r") as f:
-                self.entries = json.load(f)
-                
-            # If we have legacy entries but no "Default" lorebook, migrate them
-            if self.entries and "Default" not in self.lorebooks:
-                self.lorebooks["Default"] = {
-                    "name": "Default",
-                    "description": "Default lorebook (migrated from legacy format)",
-                    "enabled": True,
-                    "entries": self.entries
-                }
-                self.save_all_lorebooks()
-        else:
-            self.entries = {}
+            # Migrate a legacy single lorebook into "Default"
+            if os.path.exists(legacy_path):
+                with open(legacy_path, "r") as f:
+                    legacy_entries = json.load(f)
+                if legacy_entries:
+                    self.lorebooks["Default"] = {
+                        "name": "Default",
+                        "description": "Default lorebook (migrated from legacy format)",
+                        "enabled": True,
+                        "entries": legacy_entries
+                    }
+                    self.save_all_lorebooks()
         
         # Migrate always_active to activation_type in all lorebooks
         self._migrate_always_active_to_activation_type()
         
         # Migrate linked_character to linked_characters
         self._migrate_linked_character_to_list()
+        
+        # Embed vectorized entries that were added or changed since the index was saved
+        self.rebuild_indexes()
+    
+    def get_storage_paths(self) -> List[str]:
+        """Files that change when the lorebooks are saved (to notice edits made by another process)."""
+        if self.store is not None:
+            return self.store.watched_paths
+        return [os.path.join(self.lorebook_dir, "lorebooks.json")]
     
     def _migrate_always_active_to_activation_type(self) -> None:
         """Migrate old always_active boolean to new activation_type field."""
@@ -101,20 +159,64 @@ class LorebookManager:
     
     def save_all_lorebooks(self) -> None:
         """Save all lorebooks to storage."""
-        lorebooks_path = os.path.join(self.lorebook_dir, "lorebooks.json")
-        with open(lorebooks_path, "w") as f:
-            json.dump(self.lorebooks, f, indent=2)
+        with self.lock:
+            if self.store is not None:
+                self.store.replace_all(self.lorebooks)
+            else:
+                lorebooks_path = os.path.join(self.lorebook_dir, "lorebooks.json")
+                with open(lorebooks_path, "w") as f:
+                    json.dump(self.lorebooks, f, indent=2)
+            self.rebuild_indexes()
+    
+    def save_lorebook(self, name: str, entry_keys: Optional[List[str]] = None, replace: bool = False) -> None:
+        """Save one lorebook's metadata and the given entries.
         
-        # Also update legacy format for backward compatibility
+        The SQLite store only writes those rows; with JSON storage all lorebooks are written.
+        
+        Args:
+            name: Lorebook to save
+            entry_keys: Keys of the entries that were added or changed
+            replace: Write all of the lorebook's entries and drop stored ones it no longer has
+        """
+        with self.lock:
+            if self.store is None:
+                self.save_all_lorebooks()
+                return
+            if replace:
+                self.store.replace_lorebook(name, self.lorebooks[name])
+            else:
+                self.store.save_lorebook(name, self.lorebooks[name], entry_keys or [])
+            self.rebuild_indexes()
+    
+    def save_deleted_entries(self, name: str, keys: List[str]) -> None:
+        """Save the deletion of entries from a lorebook."""
+        with self.lock:
+            if self.store is None:
+                self.save_all_lorebooks()
+                return
+            self.store.delete_entries(name, keys)
+            self.rebuild_indexes()
+    
+    def save_deleted_lorebook(self, name: str) -> None:
+        """Save the deletion of a lorebook and its entries."""
+        with self.lock:
+            if self.store is None:
+                self.save_all_lorebooks()
+                return
+            self.store.delete_lorebook(name)
+            self.rebuild_indexes()
+    
+    def rebuild_indexes(self) -> None:
+        """Rebuild everything derived from the lorebooks after they were loaded or changed."""
         # Merge all enabled lorebooks into flat entries (regardless of linked_character for legacy support)
         self.entries = {}
         for lorebook_name, lorebook in self.lorebooks.items():
             if lorebook.get("enabled", True):
                 self.entries.update(lorebook.get("entries", {}))
         
-        legacy_path = os.path.join(self.lorebook_dir, "lorebook.json")
-        with open(legacy_path, "w") as f:
-            json.dump(self.entries, f, indent=2)
+        self.sync_vector_index()
+        self._keyword_index = None
+        self.version += 1
     
     def save_all_entries(self) -> None:
         """Save all lorebook entries to storage (legacy method for backward compatibility)."""
@@ -122,7 +224,9 @@ class LorebookManager:
     
     def add_or_update_entry(self, key: str, content: str, keywords: Optional[List[str]] = None, 
                            always_active: bool = False, activation_type: Optional[str] = None,
-                           lorebook_name: str = "Default") -> None:
+                           lorebook_name: str = "Default", case_sensitive: bool = False,
+                           match_whole_words: bool = False, sticky: int = 0, cooldown: int = 0,
+                           no_recurse: bool = False) -> None:
         """Add or update a lorebook entry.
         
         Args:
@@ -132,38 +236,51 @@ class LorebookManager:
             always_active: DEPRECATED - use activation_type instead. If True, sets activation_type to "constant"
             activation_type: Type of activation - "constant" (always active), "normal" (keyword-based), or "vectorized" (semantic search)
             lorebook_name: Name of the lorebook to add the entry to (default: "Default")
+            case_sensitive: Match keywords with exact case
+            match_whole_words: Only match keywords as whole words
+            sticky: Turns the entry stays active after being triggered
+            cooldown: Turns after its activation ends before the entry can be triggered again
+            no_recurse: The entry's content doesn't activate other entries
         """
-        if keywords is None:
-            keywords = []
-        
-        # Ensure the lorebook exists
-        if lorebook_name not in self.lorebooks:
-            self.lorebooks[lorebook_name] = {
-                "name": lorebook_name,
-                "description": "",
-                "enabled": True,
-                "entries": {}
-            }
-        
-        # Handle activation_type - convert from always_active if needed
-        if activation_type is None:
-            # Use always_active for backward compatibility
-            activation_type = "constant" if always_active else "normal"
-        
-        # Add/update the entry
-        entry = {
-            "key": key,
-            "content": content,
-            "keywords": keywords,
-            "activation_type": activation_type
-        }
-        self.lorebooks[lorebook_name]["entries"][key] = entry
-        
-        # Update flat entries for backward compatibility
-        if self.lorebooks[lorebook_name].get("enabled", True):
-            self.entries[key] = entry
+        with self.lock:
+            if keywords is None:
+                keywords = []
+        
+            # Ensure the lorebook exists
+            if lorebook_name not in self.lorebooks:
+                self.lorebooks[lorebook_name] = {
+                    "name": lorebook_name,
+                    "description": "",
+                    "enabled": True,
+                    "entries": {}
+                }
         
-        self.save_all_lorebooks()
+            # Handle activation_type - convert from always_active if needed
+            if activation_type is None:
+                # Use always_active for backward compatibility
+                activation_type = "constant" if always_active else "normal"
+        
+            # Add/update the entry
+            entry = {
+                "key": key,
+                "content": content,
+                "keywords": keywords,
+                "activation_type": activation_type
+            }
+            # Matching options are only stored when set, so existing entries stay unchanged
+            if case_sensitive:
+                entry["case_sensitive"] = True
+            if match_whole_words:
+                entry["match_whole_words"] = True
+            if sticky:
+                entry["sticky"] = int(sticky)
+            if cooldown:
+                entry["cooldown"] = int(cooldown)
+            if no_recurse:
+                entry["no_recurse"] = True
+            self.lorebooks[lorebook_name]["entries"][key] = entry
+        
+            self.save_lorebook(lorebook_name, [key])
     
     def get_entry(self, key: str, lorebook_name: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """Get a lorebook entry by key.
@@ -194,27 +311,28 @@ class LorebookManager:
         Returns:
             True if entry was deleted, False otherwise
         """
-        deleted = False
+        with self.lock:
+            deleted_from = []
+        
+            if lorebook_name:
+                # Delete from specific lorebook
+                if lorebook_name in self.lorebooks:
+                    entries = self.lorebooks[lorebook_name].get("entries", {})
+                    if key in entries:
+                        del entries[key]
+                        deleted_from.append(lorebook_name)
+            else:
+                # Delete from all lorebooks
+                for name, lorebook in self.lorebooks.items():
+                    entries = lorebook.get("entries", {})
+                    if key in entries:
+                        del entries[key]
+                        deleted_from.append(name)
         
-        if lorebook_name:
-            # Delete from specific lorebook
-            if lorebook_name in self.lorebooks:
-                entries = self.lorebooks[lorebook_name].get("entries", {})
-                if key in entries:
-                    del entries[key]
-                    deleted = True
-        else:
-            # Delete from all lorebooks
-            for lorebook in self.lorebooks.values():
-                entries = lorebook.get("entries", {})
-                if key in entries:
-                    del entries[key]
-                    deleted = True
-        
-        if deleted:
-            self.save_all_lorebooks()
+            for name in deleted_from:
+                self.save_deleted_entries(name, [key])
         
-        return deleted
+            return bool(deleted_from)
     
     def list_entries(self) -> List[str]:
         """List all lorebook entry keys."""
@@ -226,7 +344,8 @@ class LorebookManager:
     
     def export_lorebook(self) -> str:
         """Export all lorebook entries as JSON string."""
-        return json.dumps(self.entries, indent=2)
+        with self.lock:
+            return json.dumps(self.entries, indent=2)
     
     def import_lorebook(self, lorebook_json: str, merge: bool = True) -> None:
         """Import lorebook entries from JSON string.
@@ -235,12 +354,138 @@ class LorebookManager:
             lorebook_json: JSON string containing lorebook entries
             merge: If True, merge with existing entries; if False, replace all
         """
-        imported = json.loads(lorebook_json)
-        if merge:
-            self.entries.update(imported)
-        else:
-            self.entries = imported
-        self.save_all_entries()
+        with self.lock:
+            imported = json.loads(lorebook_json)
+            if merge:
+                self.entries.update(imported)
+            else:
+                self.entries = imported
+            self.save_all_entries()
+    
+    @staticmethod
+    def get_activation_type(entry: Dict[str, Any]) -> str:
+        """Get an entry's activation type (with backward compatibility)."""
+        activation_type = entry.get("activation_type")
+        if activation_type is None:
+            # Fall back to always_active for old entries
+            activation_type = "constant" if entry.get("always_active", False) else "normal"
+        return activation_type
+    
+    @staticmethod
+    def entry_id(lorebook_name: str, key: str) -> str:
+        """Id of an entry across lorebooks (used by the vector index and timed effects)."""
+        return json.dumps([lorebook_name, key])
+    
+    @staticmethod
+    def get_scan_depth(lorebook: Dict[str, Any]) -> int:
+        """How many recent history messages a lorebook's entries are matched against."""
+        return max(0, int(lorebook.get("scan_depth") or 0))
+    
+    @staticmethod
+    def vector_text(key: str, entry: Dict[str, Any]) -> str:
+        """Text embedded for a vectorized entry."""
+        return "\n".join([key, ", ".join(entry.get("keywords") or []), entry.get("content", "")])
+    
+    def sync_vector_index(self) -> int:
+        """Update the vector index to the current vectorized entries.
+        
+        Entries in disabled lorebooks are kept too, so enabling a lorebook
+        doesn't require embedding it again. Only new or changed entries are
+        embedded.
+        
+        Returns:
+            Number of entries added, updated or removed
+        """
+        texts = {
+            self.entry_id(lorebook_name, key): self.vector_text(key, entry)
+            for lorebook_name, lorebook in self.lorebooks.items()
+            for key, entry in lorebook.get("entries", {}).items()
+            if self.get_activation_type(entry) == "vectorized"
+        }
+        changed = self.vector_index.sync(texts)
+        if changed:
+            logger.info("Updated %s entries in the vector index", changed)
+        return changed
+    
+    def _compile_entries(self, entries: List[Any], get_entry, get_vector_id) -> Dict[str, Any]:
+        """Split entries into constant ones and a keyword automaton over the rest.
+        
+        Matches are reported by position in entries, so results keep their order.
+        Vectorized entries are also looked up in the vector index.
+        """
+        constant = []
+        automaton = KeywordAutomaton()
+        vector_positions = {}
+        for position, item in enumerate(entries):
+            entry = get_entry(item)
+            activation_type = self.get_activation_type(entry)
+            if activation_type == "constant":
+                constant.append(position)
+            # Vectorized entries activate on their keywords or on similar text
+            elif activation_type in ("normal", "vectorized"):
+                for keyword in entry.get("keywords") or []:
+                    automaton.add(
+                        keyword, position,
+                        case_sensitive=entry.get("case_sensitive", False),
+                        whole_word=entry.get("match_whole_words", False)
+                    )
+                vector_id = get_vector_id(item) if activation_type == "vectorized" else None
+                if vector_id is not None:
+                    vector_positions[vector_id] = position
+        return {
+            "entries": entries,
+            "constant": constant,
+            "automaton": automaton.build(),
+            "vector_positions": vector_positions,
+            "vector_rows": self.vector_index.rows_for(list(vector_positions))
+        }
+    
+    def get_keyword_index(self) -> Dict[str, Dict[str, Any]]:
+        """Get the compiled keyword matching for enabled lorebooks.
+        
+        Built on first use after the lorebooks are loaded or saved, instead of
+        checking every keyword of every entry on each message.
+        """
+        if self._keyword_index is None:
+            lorebook_entries = []
+            # Lorebook each flat entry came from (the last enabled one with its key)
+            owners = {}
+            for lorebook_name, lorebook in self.lorebooks.items():
+                if lorebook.get("enabled", True):
+                    for key, entry in lorebook.get("entries", {}).items():
+                        lorebook_entries.append((lorebook_name, key, entry))
+                        owners[key] = lorebook_name
+            lorebook_index = self._compile_entries(
+                lorebook_entries,
+                lambda item: item[2],
+                lambda item: self.entry_id(item[0], item[1])
+            )
+            # Entry ids and scan depths by position, for activation across turns
+            lorebook_index["ids"] = [self.entry_id(lorebook_name, key) for lorebook_name, key, _ in lorebook_entries]
+            lorebook_index["positions_by_id"] = {entry_id: position for position, entry_id in enumerate(lorebook_index["ids"])}
+            scan_depths = {
+                lorebook_name: self.get_scan_depth(lorebook)
+                for lorebook_name, lorebook in self.lorebooks.items()
+                if lorebook.get("enabled", True)
+            }
+            lorebook_index["scan_depths"] = [scan_depths[lorebook_name] for lorebook_name, _, _ in lorebook_entries]
+            lorebook_index["max_scan_depth"] = max(scan_depths.values(), default=0)
+            self._keyword_index = {
+                "lorebooks": lorebook_index,
+                "flat": self._compile_entries(
+                    list(self.entries.items()),
+                    lambda item: item[1],
+                    lambda item: self.entry_id(owners[item[0]], item[0]) if item[0] in owners else None
+                )
+            }
+        return self._keyword_index
+    
+    def _semantic_matches(self, index: Dict[str, Any], text: str) -> Dict[int, float]:
+        """Positions of vectorized entries similar to text, with their similarity."""
+        if not text or not index["vector_positions"]:
+            return {}
+        matches = self.vector_index.search(text, self.vector_top_k, self.vector_threshold, index["vector_rows"])
+        return {index["vector_positions"][entry_id]: similarity for entry_id, similarity in matches}
     
     def get_relevant_entries(self, text: str, include_always_active: bool = True) -> List[Dict[str, Any]]:
         """Get lorebook entries relevant to the given text.
@@ -252,100 +497,180 @@ class LorebookManager:
         Returns:
             List of relevant lorebook entries
         """
-        relevant = []
-        text_lower = text.lower()
-        
-        for entry in self.entries.values():
-            # Get activation type (with backward compatibility)
-            activation_type = entry.get("activation_type")
-            if activation_type is None:
-                # Fall back to always_active for old entries
-                activation_type = "constant" if entry.get("always_active", False) else "normal"
-            
-            # Include if it's constant (always active)
-            if include_always_active and activation_type == "constant":
-                relevant.append(entry)
-                continue
-            
-            # For normal entries, include if any keyword is found in the text
-            if activation_type == "normal":
-                keywords = entry.get("keywords", [])
-                if any(keyword.lower() in text_lower for keyword in keywords):
-                    relevant.append(entry)
-            
-            # TODO: Implement vectorized/semantic search activation in the future
-            # For now, treat "vectorized" the same as "normal"
-            if activation_type == "vectorized":
-                keywords = entry.get("keywords", [])
-                if any(keyword.lower() in text_lower for keyword in keywords):
-                    relevant.append(entry)
+        index = self.get_keyword_index()["flat"]
+        positions = index["automaton"].search(text)
+        positions.update(self._semantic_matches(index, text))
+        if include_always_active:
+            positions.update(index["constant"])
+        return [index["entries"][position][1] for position in sorted(positions)]
+    
+    def _match_text(self, index: Dict[str, Any], text: str) -> Set[int]:
+        """Positions of the entries triggered by text (keywords and similarity)."""
+        positions = index["automaton"].search(text)
+        positions.update(self._semantic_matches(index, text))
+        return positions
+    
+    @staticmethod
+    def _history_before(relevant_text: str, history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """The history before relevant_text.
         
-        return relevant
+        !chat builds the prompt before the user's message is stored, a swipe
+        after; a trailing user message holding relevant_text (possibly as
+        "Name: text") is dropped so both see the same history.
+        """
+        if history and history[-1].get("role") == "user":
+            content = (history[-1].get("content") or "").strip()
+            text = relevant_text.strip()
+            if text and (content == text or content.endswith(": " + text)):
+                return history[:-1]
+        return history
     
-    def get_system_prompt_section(self, relevant_text: str = "", character_name: Optional[str] = None) -> str:
+    def _section_cache_key(self, relevant_text: str, character_name: Optional[str],
+                           channel_id: Optional[int], history: List[Dict[str, Any]]) -> Tuple:
+        text_hash = hashlib.blake2b(relevant_text.strip().encode("utf-8"), digest_size=16).digest()
+        key = (text_hash, character_name, self.version, self.vector_top_k, self.vector_threshold,
+               self.recursion_depth, channel_id)
+        if channel_id is None:
+            return key
+        # The recent messages within scan depth; the last one also tells which turn it is
+        depth = max(1, self.get_keyword_index()["lorebooks"]["max_scan_depth"])
+        recent = tuple((id(message), message.get("role"), hash(message.get("content") or ""))
+                       for message in history[-depth:])
+        return key + (recent,)
+    
+    def get_system_prompt_section(self, relevant_text: str = "", character_name: Optional[str] = None,
+                                  channel_id: Optional[int] = None,
+                                  history: Optional[List[Dict[str, Any]]] = None) -> str:
         """Generate system prompt section with lorebook entries.
         
+        Rebuilding the prompt for the same message (e.g. a swipe) reuses the
+        section rendered the first time, as long as the lorebooks, the
+        settings and the channel's recent history are unchanged.
+        
         Args:
             relevant_text: Text to match against keywords for relevance
             character_name: Optional character name (kept for backward compatibility but not used for filtering)
+            channel_id: Channel the prompt is for; enables scan depth, sticky and cooldown
+            history: The channel's conversation history (a trailing user message
+                holding relevant_text is ignored)
             
         Returns:
             Formatted system prompt section with lorebook entries
         """
+        history = self._history_before(relevant_text, history or [])
+        key = self._section_cache_key(relevant_text, character_name, channel_id, history)
+        # Timed effects are per channel; a cleared channel (new activation state) must not reuse sections
+        channel_state = self.activations.channels.get(channel_id) if channel_id is not None else None
+        with self._section_cache_lock:
+            cached = self.section_cache.get(key)
+            if cached is not None and cached[1] is channel_state:
+                self.section_cache.move_to_end(key)
+                self.section_cache_hits += 1
+                logger.debug("Reusing lorebook section (version %s)", self.version)
+                return cached[0]
+            self.section_cache_misses += 1
+        
+        section = self._render_system_prompt_section(relevant_text, channel_id, history)
+        
+        channel_state = self.activations.channels.get(channel_id) if channel_id is not None else None
+        with self._section_cache_lock:
+            self.section_cache[key] = (section, channel_state)
+            self.section_cache.move_to_end(key)
+            while len(self.section_cache) > self.section_cache_size:
+                self.section_cache.popitem(last=False)
+        return section
+    
+    def section_cache_snapshot(self) -> Dict[str, Any]:
+        with self._section_cache_lock:
+            return {
+                "version": self.version,
+                "entries": len(self.section_cache),
+                "hits": self.section_cache_hits,
+                "misses": self.section_cache_misses
+            }
+    
+    def _render_system_prompt_section(self, relevant_text: str, channel_id: Optional[int],
+                                      history: Optional[List[Dict[str, Any]]]) -> str:
+        """Activate entries for the text (and the channel's history) and format them."""
         # Get entries from enabled lorebooks only (no character linking)
         entries = []
         
-        # Debug logging
-        if self.debug_logging:
-            print(f"[LOREBOOK] Getting lorebook entries (no character filtering)")
-            print(f"[LOREBOOK] Total lorebooks: {len(self.lorebooks)}")
+        debug = logger.isEnabledFor(logging.DEBUG)
+        entry_debug = entry_logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug("Getting lorebook entries from %s lorebooks (no character filtering)", len(self.lorebooks))
+        
+        # Constant entries plus everything whose keywords occur in the text, in one pass,
+        # plus vectorized entries similar to the text
+        index = self.get_keyword_index()["lorebooks"]
+        positions = set(index["constant"])
+        keyword_matches = set()
+        semantic_matches = {}
+        if relevant_text:
+            keyword_matches = index["automaton"].search(relevant_text)
+            semantic_matches = self._semantic_matches(index, relevant_text)
+        triggered = keyword_matches | set(semantic_matches)
+        history_matches = set()
+        if channel_id is not None:
+            # Entries triggered by recent messages, within their lorebook's scan depth
+            history_matches = self.activations.scan_history(
+                channel_id, index, history or [], lambda text: self._match_text(index, text)
+            ) - triggered
+            triggered = self.activations.apply_timed_effects(channel_id, index, history or [], triggered | history_matches)
+        positions.update(triggered)
+        # Entries mentioned in the content of active entries, from the precomputed trigger graph
+        recursive_matches = self.trigger_graph.walk(
+            index, positions, self.recursion_depth, index["automaton"].search,
+            blocked=self.activations.cooling_down(channel_id, index) if channel_id is not None else ()
+        )
+        if recursive_matches and channel_id is not None:
+            # Recursively activated entries start their sticky turns and cooldowns too
+            self.activations.apply_timed_effects(channel_id, index, history or [], set(recursive_matches))
+        positions.update(recursive_matches)
+        constant = set(index["constant"])
+        matched_by_lorebook: Dict[str, List[int]] = {}
+        for position in sorted(positions):
+            matched_by_lorebook.setdefault(index["entries"][position][0], []).append(position)
         
         for lorebook_name, lorebook in self.lorebooks.items():
             # Skip disabled lorebooks
             if not lorebook.get("enabled", True):
-                if self.debug_logging:
-                    print(f"[LOREBOOK] Skipping disabled lorebook: {lorebook_name}")
+                if debug:
+                    logger.debug("Skipping disabled lorebook: %s", lorebook_name)
                 continue
             
             # Include all enabled lorebooks (ignore character linking)
-            if self.debug_logging:
-                print(f"[LOREBOOK] Including enabled lorebook '{lorebook_name}'")
+            if debug:
+                logger.debug("Including enabled lorebook '%s'", lorebook_name)
             
-            lorebook_entries = lorebook.get("entries", {})
+            lorebook_positions = matched_by_lorebook.get(lorebook_name, [])
+            for position in lorebook_positions:
+                entry = index["entries"][position][2]
+                entries.append(entry)
+                if entry_debug:
+                    if position in constant:
+                        entry_logger.debug("Added constant entry: %s", entry['key'])
+                    elif position in keyword_matches:
+                        entry_logger.debug("Added keyword-matched entry: %s", entry['key'])
+                    elif position in history_matches:
+                        entry_logger.debug("Added entry matched in recent messages: %s", entry['key'])
+                    elif position in recursive_matches:
+                        entry_logger.debug("Added recursively activated entry: %s (depth %s)",
+                                           entry['key'], recursive_matches[position])
+                    elif position not in semantic_matches:
+                        entry_logger.debug("Added sticky entry: %s", entry['key'])
+                    else:
+                        entry_logger.debug("Added vector-matched entry: %s (similarity %.2f)",
+                                           entry['key'], semantic_matches[position])
             
-            entry_count = 0
-            for entry in lorebook_entries.values():
-                # Get activation type (with backward compatibility)
-                activation_type = entry.get("activation_type")
-                if activation_type is None:
-                    # Fall back to always_active for old entries
-                    activation_type = "constant" if entry.get("always_active", False) else "normal"
-                
-                # Include if it's constant (always active)
-                if activation_type == "constant":
-                    entries.append(entry)
-                    entry_count += 1
-                    if self.debug_logging:
-                        print(f"[LOREBOOK]   Added constant entry: {entry['key']}")
-                # For normal/vectorized entries, include if relevant text contains keywords
-                elif relevant_text and activation_type in ["normal", "vectorized"]:
-                    keywords = entry.get("keywords", [])
-                    if any(keyword.lower() in relevant_text.lower() for keyword in keywords):
-                        entries.append(entry)
-                        entry_count += 1
-                        if self.debug_logging:
-                            print(f"[LOREBOOK]   Added keyword-matched entry: {entry['key']}")
-            
-            if self.debug_logging:
-                print(f"[LOREBOOK]   Total entries from '{lorebook_name}': {entry_count}")
+            if debug:
+                logger.debug("Total entries from '%s': %s", lorebook_name, len(lorebook_positions))
         
         if not entries:
-            if self.debug_logging:
-                print(f"[LOREBOOK] No entries found, returning empty string")
+            logger.debug("No entries found, returning empty string")
             return ""
         
-        if self.debug_logging:
-            print(f"[LOREBOOK] Total entries to include: {len(entries)}")
+        logger.debug("Total entries to include: %s", len(entries))
         
         sections = []
         sections.append("[Lorebook - World Information]")
@@ -373,28 +698,29 @@ class LorebookManager:
             linked_character: DEPRECATED - use linked_characters instead. Optional character name to link this lorebook to (None = global)
             linked_characters: Optional list of character names to link this lorebook to (None or empty list = global)
         """
-        if name in self.lorebooks:
-            raise ValueError(f"Lorebook '{name}' already exists")
-        
-        # Handle backward compatibility: if linked_character is provided, convert to list
-        if linked_characters is None:
-            if linked_character:
-                linked_characters = [linked_character]
+        with self.lock:
+            if name in self.lorebooks:
+                raise ValueError(f"Lorebook '{name}' already exists")
+        
+            # Handle backward compatibility: if linked_character is provided, convert to list
+            if linked_characters is None:
+                if linked_character:
+                    linked_characters = [linked_character]
+                else:
+                    linked_characters = None
             else:
-                linked_characters = None
-        else:
-            # Empty list should be treated as None (global)
-            if not linked_characters:
-                linked_characters = None
-        
-        self.lorebooks[name] = {
-            "name": name,
-            "description": description,
-            "enabled": enabled,
-            "linked_characters": linked_characters,
-            "entries": {}
-        }
-        self.save_all_lorebooks()
+                # Empty list should be treated as None (global)
+                if not linked_characters:
+                    linked_characters = None
+        
+            self.lorebooks[name] = {
+                "name": name,
+                "description": description,
+                "enabled": enabled,
+                "linked_characters": linked_characters,
+                "entries": {}
+            }
+            self.save_lorebook(name)
     
     def delete_lorebook(self, name: str) -> bool:
         """Delete a lorebook.
@@ -405,11 +731,12 @@ class LorebookManager:
         Returns:
             True if deleted, False if not found
         """
-        if name in self.lorebooks:
-            del self.lorebooks[name]
-            self.save_all_lorebooks()
-            return True
-        return False
+        with self.lock:
+            if name in self.lorebooks:
+                del self.lorebooks[name]
+                self.save_deleted_lorebook(name)
+                return True
+            return False
     
     def list_lorebooks(self) -> List[Dict[str, Any]]:
         """List all lorebooks with their metadata.
@@ -425,6 +752,7 @@ class LorebookManager:
                 "description": lorebook.get("description", ""),
                 "enabled": lorebook.get("enabled", True),
                 "linked_characters": linked_chars,
+                "scan_depth": self.get_scan_depth(lorebook),
                 "entry_count": len(lorebook.get("entries", {}))
             }
             # Backward compatibility: also provide linked_character (first in list or None)
@@ -453,7 +781,8 @@ class LorebookManager:
     
     def update_lorebook_metadata(self, name: str, description: Optional[str] = None, 
                                  enabled: Optional[bool] = None, linked_character: Optional[str] = None,
-                                 linked_characters: Optional[List[str]] = None) -> bool:
+                                 linked_characters: Optional[List[str]] = None,
+                                 scan_depth: Optional[int] = None) -> bool:
         """Update lorebook metadata.
         
         Args:
@@ -462,33 +791,38 @@ class LorebookManager:
             enabled: Optional new enabled status
             linked_character: DEPRECATED - use linked_characters instead. Optional character name to link this lorebook to (None = global, empty string to unlink)
             linked_characters: Optional list of character names to link this lorebook to (None or empty list = global)
+            scan_depth: Optional number of recent history messages to match entries against (0 = current message only)
         
         Returns:
             True if updated, False if lorebook not found
         """
-        if name not in self.lorebooks:
-            return False
+        with self.lock:
+            if name not in self.lorebooks:
+                return False
         
-        if description is not None:
-            self.lorebooks[name]["description"] = description
-        
-        if enabled is not None:
-            self.lorebooks[name]["enabled"] = enabled
-        
-        # Handle linked_characters (new preferred method)
-        if linked_characters is not None:
-            # Empty list means unlink (set to None for global)
-            self.lorebooks[name]["linked_characters"] = linked_characters if linked_characters else None
-        # Handle backward compatibility with linked_character (deprecated)
-        elif linked_character is not None:
-            # Empty string means unlink (set to None)
-            if linked_character:
-                self.lorebooks[name]["linked_characters"] = [linked_character]
-            else:
-                self.lorebooks[name]["linked_characters"] = None
+            if description is not None:
+                self.lorebooks[name]["description"] = description
         
-        self.save_all_lorebooks()
-        return True
+            if enabled is not None:
+                self.lorebooks[name]["enabled"] = enabled
+        
+            # Handle linked_characters (new preferred method)
+            if linked_characters is not None:
+                # Empty list means unlink (set to None for global)
+                self.lorebooks[name]["linked_characters"] = linked_characters if linked_characters else None
+            # Handle backward compatibility with linked_character (deprecated)
+            elif linked_character is not None:
+                # Empty string means unlink (set to None)
+                if linked_character:
+                    self.lorebooks[name]["linked_characters"] = [linked_character]
+                else:
+                    self.lorebooks[name]["linked_characters"] = None
+        
+            if scan_depth is not None:
+                self.lorebooks[name]["scan_depth"] = max(0, int(scan_depth))
+        
+            self.save_lorebook(name)
+            return True
     
     def enable_lorebook(self, name: str) -> bool:
         """Enable a lorebook.
@@ -499,7 +833,8 @@ class LorebookManager:
         Returns:
             True if enabled, False if not found
         """
-        return self.update_lorebook_metadata(name, enabled=True)
+        with self.lock:
+            return self.update_lorebook_metadata(name, enabled=True)
     
     def disable_lorebook(self, name: str) -> bool:
         """Disable a lorebook.
@@ -510,7 +845,8 @@ class LorebookManager:
         Returns:
             True if disabled, False if not found
         """
-        return self.update_lorebook_metadata(name, enabled=False)
+        with self.lock:
+            return self.update_lorebook_metadata(name, enabled=False)
     
     def import_lorebook_file(self, lorebook_data: Dict[str, Any], merge: bool = True) -> str:
         """Import a lorebook from a structured lorebook file.
@@ -522,48 +858,50 @@ class LorebookManager:
         Returns:
             Name of the imported lorebook
         """
-        name = lorebook_data.get("name", "Imported Lorebook")
-        description = lorebook_data.get("description", "")
-        enabled = lorebook_data.get("enabled", True)
-        
-        # Handle both old and new format for character linking
-        linked_characters = lorebook_data.get("linked_characters")
-        if linked_characters is None and "linked_character" in lorebook_data:
-            # Migrate old format
-            linked_char = lorebook_data.get("linked_character")
-            if linked_char:
-                linked_characters = [linked_char]
-        
-        entries = lorebook_data.get("entries", {})
-        
-        # Migrate always_active to activation_type in imported entries
-        for key, entry in entries.items():
-            if "always_active" in entry and "activation_type" not in entry:
-                always_active = entry.get("always_active", False)
-                entry["activation_type"] = "constant" if always_active else "normal"
-            elif "activation_type" not in entry:
-                entry["activation_type"] = "normal"
-        
-        if merge and name in self.lorebooks:
-            # Merge entries into existing lorebook
-            self.lorebooks[name]["entries"].update(entries)
-            if description:
-                self.lorebooks[name]["description"] = description
-            # Update linked_characters if provided in import
-            if "linked_characters" in lorebook_data or "linked_character" in lorebook_data:
-                self.lorebooks[name]["linked_characters"] = linked_characters
-        else:
-            # Create new or replace existing lorebook
-            self.lorebooks[name] = {
-                "name": name,
-                "description": description,
-                "enabled": enabled,
-                "linked_characters": linked_characters,
-                "entries": entries
-            }
+        with self.lock:
+            name = lorebook_data.get("name", "Imported Lorebook")
+            description = lorebook_data.get("description", "")
+            enabled = lorebook_data.get("enabled", True)
+        
+            # Handle both old and new format for character linking
+            linked_characters = lorebook_data.get("linked_characters")
+            if linked_characters is None and "linked_character" in lorebook_data:
+                # Migrate old format
+                linked_char = lorebook_data.get("linked_character")
+                if linked_char:
+                    linked_characters = [linked_char]
         
-        self.save_all_lorebooks()
-        return name
+            entries = lorebook_data.get("entries", {})
+        
+            # Migrate always_active to activation_type in imported entries
+            for key, entry in entries.items():
+                if "always_active" in entry and "activation_type" not in entry:
+                    always_active = entry.get("always_active", False)
+                    entry["activation_type"] = "constant" if always_active else "normal"
+                elif "activation_type" not in entry:
+                    entry["activation_type"] = "normal"
+        
+            if merge and name in self.lorebooks:
+                # Merge entries into existing lorebook
+                self.lorebooks[name]["entries"].update(entries)
+                if description:
+                    self.lorebooks[name]["description"] = description
+                # Update linked_characters if provided in import
+                if "linked_characters" in lorebook_data or "linked_character" in lorebook_data:
+                    self.lorebooks[name]["linked_characters"] = linked_characters
+                self.save_lorebook(name, list(entries))
+            else:
+                # Create new or replace existing lorebook
+                self.lorebooks[name] = {
+                    "name": name,
+                    "description": description,
+                    "enabled": enabled,
+                    "linked_characters": linked_characters,
+                    "entries": entries
+                }
+                self.save_lorebook(name, replace=True)
+        
+            return name
     
     def export_lorebook_file(self, name: str) -> str:
         """Export a specific lorebook as JSON string.
@@ -574,13 +912,46 @@ class LorebookManager:
         Returns:
             JSON string of the lorebook
         """
-        if name not in self.lorebooks:
-            raise ValueError(f"Lorebook '{name}' not found")
+        with self.lock:
+            if name not in self.lorebooks:
+                raise ValueError(f"Lorebook '{name}' not found")
         
-        lorebook = self.lorebooks[name].copy()
-        # Backward compatibility: also include linked_character for old systems
-        linked_chars = lorebook.get("linked_characters")
-        lorebook["linked_character"] = linked_chars[0] if linked_chars else None
+            lorebook = self.lorebooks[name].copy()
+            # Backward compatibility: also include linked_character for old systems
+            linked_chars = lorebook.get("linked_characters")
+            lorebook["linked_character"] = linked_chars[0] if linked_chars else None
         
-        return json.dumps(lorebook, indent=2)
+            return json.dumps(lorebook, indent=2)
 
+    
+    def search_entries(self, query: str, lorebook_name: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """Search entry keys, keywords and content (for the web UI's lorebook browser).
+        
+        Uses the SQLite store's full-text index when there is one, otherwise a
+        case-insensitive substring search over all entries.
+        
+        Args:
+            query: Words to search for
+            lorebook_name: Only search this lorebook
+            limit: Most results returned
+        
+        Returns:
+            Dicts with lorebook, key and a snippet of the entry's content
+        """
+        if self.store is not None:
+            return self.store.search(query, lorebook_name, limit)
+        
+        words = query.lower().split()
+        if not words:
+            return []
+        results = []
+        for name, lorebook in self.lorebooks.items():
+            if lorebook_name is not None and name != lorebook_name:
+                continue
+            for key, entry in lorebook.get("entries", {}).items():
+                text = " ".join([key, " ".join(entry.get("keywords") or []), entry.get("content", "")]).lower()
+                if all(word in text for word in words):
+                    results.append({"lorebook": name, "key": key, "snippet": entry.get("content", "")[:80]})
+                    if len(results) >= limit:
+                        return results
+        return results
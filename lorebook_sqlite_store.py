@@ -0,0 +1,265 @@
+"""SQLite storage for lorebooks.
+
+With the JSON backend every edit rewrites the whole lorebooks.json, which
+for books with thousands of entries means megabytes of serialization for a
+one-entry change. LorebookSqliteStore keeps one row per lorebook and per
+entry in lorebook/lorebooks.db (stdlib sqlite3, WAL mode), so an edit writes
+only the rows that changed. Entries are also indexed with FTS5 for the web
+UI's lorebook search.
+
+LorebookManager still works on its in-memory dicts; the store only replaces
+how they are persisted. Enable it with "lorebook_storage": {"backend":
+"sqlite"}. The first load copies the existing JSON files into the database
+(the JSON files are left as they are). To migrate by hand:
+
+    python lorebook_sqlite_store.py [lorebook_dir]
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+from bot_logging import get_logger
+
+logger = get_logger("lorebook")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lorebooks (
+    name TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    lorebook TEXT NOT NULL REFERENCES lorebooks(name) ON DELETE CASCADE,
+    key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    UNIQUE (lorebook, key)
+);
+-- Appending an entry looks up the lorebook's last position
+CREATE INDEX IF NOT EXISTS entries_position ON entries (lorebook, position);
+"""
+
+# Full-text index over entries; rowid is entries.id
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+    key, keywords, content, tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+
+def fts_query(text: str) -> str:
+    """Turn user input into an FTS5 query: every word must match, the last one as a prefix."""
+    words = [word.replace('"', '""') for word in text.split()]
+    if not words:
+        return ""
+    terms = [f'"{word}"' for word in words[:-1]] + [f'"{words[-1]}"*']
+    return " ".join(terms)
+
+
+class LorebookSqliteStore:
+    """Row-level lorebook persistence in SQLite."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        # The web server handles requests on several threads; the lock serializes them
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+        try:
+            self.conn.executescript(FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5: search falls back to LIKE
+            logger.warning("SQLite has no FTS5 support, lorebook search uses LIKE")
+            self.has_fts = False
+        self.rows_written = 0
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+    @property
+    def watched_paths(self) -> List[str]:
+        """Files that change when the store is written (WAL mode writes go to the -wal file first)."""
+        return [self.path, self.path + "-wal"]
+
+    def is_empty(self) -> bool:
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM lorebooks LIMIT 1").fetchone() is None
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """All lorebooks with their entries, in their saved order."""
+        with self.lock:
+            lorebooks = {}
+            for name, data in self.conn.execute("SELECT name, data FROM lorebooks ORDER BY position"):
+                lorebook = json.loads(data)
+                lorebook["entries"] = {}
+                lorebooks[name] = lorebook
+            for lorebook_name, key, data in self.conn.execute(
+                    "SELECT lorebook, key, data FROM entries ORDER BY lorebook, position"):
+                if lorebook_name in lorebooks:
+                    lorebooks[lorebook_name]["entries"][key] = json.loads(data)
+            return lorebooks
+
+    @staticmethod
+    def _lorebook_data(lorebook: Dict[str, Any]) -> str:
+        return json.dumps({field: value for field, value in lorebook.items() if field != "entries"})
+
+    def _write_lorebook(self, name: str, lorebook: Dict[str, Any]) -> None:
+        updated = self.conn.execute(
+            "UPDATE lorebooks SET data = ? WHERE name = ?", (self._lorebook_data(lorebook), name)
+        ).rowcount
+        if not updated:
+            self.conn.execute(
+                "INSERT INTO lorebooks (name, position, data) "
+                "VALUES (?, (SELECT COALESCE(MAX(position), -1) + 1 FROM lorebooks), ?)",
+                (name, self._lorebook_data(lorebook))
+            )
+        self.rows_written += 1
+
+    def _fts_delete(self, entry_ids: Iterable[int]) -> None:
+        if self.has_fts:
+            self.conn.executemany("DELETE FROM entries_fts WHERE rowid = ?", [(entry_id,) for entry_id in entry_ids])
+
+    def _write_entry(self, lorebook_name: str, key: str, entry: Dict[str, Any]) -> None:
+        data = json.dumps(entry)
+        row = self.conn.execute(
+            "SELECT id FROM entries WHERE lorebook = ? AND key = ?", (lorebook_name, key)
+        ).fetchone()
+        if row:
+            entry_id = row[0]
+            self.conn.execute("UPDATE entries SET data = ? WHERE id = ?", (data, entry_id))
+            self._fts_delete([entry_id])
+        else:
+            entry_id = self.conn.execute(
+                "INSERT INTO entries (lorebook, key, position, data) "
+                "VALUES (?, ?, (SELECT COALESCE(MAX(position), -1) + 1 FROM entries WHERE lorebook = ?), ?)",
+                (lorebook_name, key, lorebook_name, data)
+            ).lastrowid
+        if self.has_fts:
+            self.conn.execute(
+                "INSERT INTO entries_fts (rowid, key, keywords, content) VALUES (?, ?, ?, ?)",
+                (entry_id, key, " ".join(entry.get("keywords") or []), entry.get("content", ""))
+            )
+        self.rows_written += 1
+
+    def save_lorebook(self, name: str, lorebook: Dict[str, Any], entry_keys: Iterable[str] = ()) -> None:
+        """Write a lorebook's metadata and the given entries in one transaction."""
+        with self.lock, self.conn:
+            self._write_lorebook(name, lorebook)
+            entries = lorebook.get("entries", {})
+            for key in entry_keys:
+                self._write_entry(name, key, entries[key])
+
+    def delete_entries(self, lorebook_name: str, keys: Iterable[str]) -> None:
+        with self.lock, self.conn:
+            for key in keys:
+                row = self.conn.execute(
+                    "SELECT id FROM entries WHERE lorebook = ? AND key = ?", (lorebook_name, key)
+                ).fetchone()
+                if row:
+                    self.conn.execute("DELETE FROM entries WHERE id = ?", row)
+                    self._fts_delete(row)
+                    self.rows_written += 1
+
+    def delete_lorebook(self, name: str) -> None:
+        with self.lock, self.conn:
+            entry_ids = [row[0] for row in self.conn.execute("SELECT id FROM entries WHERE lorebook = ?", (name,))]
+            self._fts_delete(entry_ids)
+            self.conn.execute("DELETE FROM lorebooks WHERE name = ?", (name,))
+            self.rows_written += 1 + len(entry_ids)
+
+    def replace_lorebook(self, name: str, lorebook: Dict[str, Any]) -> None:
+        """Write a lorebook and all its entries, dropping entries it no longer has."""
+        with self.lock, self.conn:
+            entries = lorebook.get("entries", {})
+            stale = [
+                (entry_id, key) for entry_id, key in
+                self.conn.execute("SELECT id, key FROM entries WHERE lorebook = ?", (name,))
+                if key not in entries
+            ]
+            self._fts_delete([entry_id for entry_id, _ in stale])
+            self.conn.executemany("DELETE FROM entries WHERE id = ?", [(entry_id,) for entry_id, _ in stale])
+            self._write_lorebook(name, lorebook)
+            for key, entry in entries.items():
+                self._write_entry(name, key, entry)
+
+    def replace_all(self, lorebooks: Dict[str, Dict[str, Any]]) -> None:
+        """Make the store hold exactly these lorebooks (migration and bulk changes)."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM entries")
+            self.conn.execute("DELETE FROM lorebooks")
+            if self.has_fts:
+                self.conn.execute("DELETE FROM entries_fts")
+            for name, lorebook in lorebooks.items():
+                self._write_lorebook(name, lorebook)
+                for key, entry in lorebook.get("entries", {}).items():
+                    self._write_entry(name, key, entry)
+
+    def search(self, text: str, lorebook_name: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """Entries matching text, best matches first.
+
+        Returns:
+            Dicts with lorebook, key and a snippet of the matching text
+        """
+        query = fts_query(text)
+        if not query:
+            return []
+        with self.lock:
+            if self.has_fts:
+                sql = (
+                    "SELECT e.lorebook, e.key, snippet(entries_fts, 2, '[', ']', '...', 12) "
+                    "FROM entries_fts JOIN entries e ON e.id = entries_fts.rowid "
+                    "WHERE entries_fts MATCH ?"
+                )
+                params: Tuple[Any, ...] = (query,)
+            else:
+                pattern = f"%{text.strip()}%"
+                sql = (
+                    "SELECT e.lorebook, e.key, substr(json_extract(e.data, '$.content'), 1, 80) "
+                    "FROM entries e WHERE (e.key LIKE ? OR e.data LIKE ?)"
+                )
+                params = (pattern, pattern)
+            if lorebook_name is not None:
+                sql += " AND e.lorebook = ?"
+                params += (lorebook_name,)
+            sql += " ORDER BY entries_fts.rank LIMIT ?" if self.has_fts else " ORDER BY e.lorebook, e.position LIMIT ?"
+            params += (limit,)
+            return [
+                {"lorebook": lorebook, "key": key, "snippet": snippet}
+                for lorebook, key, snippet in self.conn.execute(sql, params)
+            ]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"path": self.path, "fts": self.has_fts, "rows_written": self.rows_written}
+
+
+def migrate(lorebook_dir: str = "lorebook") -> int:
+    """Copy the JSON lorebooks of lorebook_dir into lorebooks.db (replacing its contents).
+
+    Returns:
+        Number of entries migrated
+    """
+    from lorebook_manager import LorebookManager
+
+    lorebooks = LorebookManager(lorebook_dir).lorebooks
+    store = LorebookSqliteStore(os.path.join(lorebook_dir, "lorebooks.db"))
+    try:
+        store.replace_all(lorebooks)
+    finally:
+        store.close()
+    return sum(len(lorebook.get("entries", {})) for lorebook in lorebooks.values())
+
+
+if __name__ == "__main__":
+    directory = sys.argv[1] if len(sys.argv) > 1 else "lorebook"
+    count = migrate(directory)
+    print(f"Migrated {count} lorebook entries to {os.path.join(directory, 'lorebooks.db')}")
+    print('Set "lorebook_storage": {"backend": "sqlite"} in config.json to use it.')
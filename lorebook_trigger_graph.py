@@ -0,0 +1,97 @@
+"""Recursive lorebook activation.
+
+An activated entry's content can mention keywords of other entries, which
+then activate too (recursion, as in SillyTavern). Scanning the content of
+every active entry again on each message would repeat the same work every
+turn, since entry contents only change when the lorebooks do.
+
+LorebookTriggerGraph therefore precomputes, once per compiled lorebook index,
+which entries each entry's content triggers. At message time recursion is a
+walk over that graph from the directly activated entries, up to a maximum
+depth. Entries with "no_recurse" set don't trigger other entries.
+"""
+from typing import Dict, Any, Callable, Iterable, List, Optional, Set, Tuple
+
+
+class LorebookTriggerGraph:
+    """Entry -> entry trigger edges of a compiled lorebook index."""
+
+    def __init__(self):
+        # Compiled lorebook index the edges were built for; positions are only valid for it
+        self.index: Optional[Dict[str, Any]] = None
+        self.edges: List[Tuple[int, ...]] = []
+        self.builds = 0
+        self.walks = 0
+        self.recursive_activations = 0
+
+    def build(self, index: Dict[str, Any], match: Callable[[str], Set[int]]) -> None:
+        """Precompute which entries each entry's content triggers.
+
+        Args:
+            index: Compiled lorebook index with (lorebook name, key, entry) items
+            match: Positions of the entries a text triggers by keyword
+        """
+        edges = []
+        for position, (_, _, entry) in enumerate(index["entries"]):
+            if entry.get("no_recurse"):
+                edges.append(())
+                continue
+            targets = match(entry.get("content") or "")
+            targets.discard(position)
+            edges.append(tuple(sorted(targets)))
+        self.index = index
+        self.edges = edges
+        self.builds += 1
+
+    def walk(
+        self,
+        index: Dict[str, Any],
+        active: Iterable[int],
+        max_depth: int,
+        match: Callable[[str], Set[int]],
+        blocked: Iterable[int] = ()
+    ) -> Dict[int, int]:
+        """Entries activated through the content of active entries.
+
+        Args:
+            index: Compiled lorebook index (the graph is rebuilt if it changed)
+            active: Positions of the entries activated directly
+            max_depth: Most steps of recursion (0 = none)
+            match: Used to build the graph, see build
+            blocked: Positions that can't be activated (e.g. on cooldown)
+
+        Returns:
+            Position -> recursion depth it was activated at
+        """
+        if max_depth <= 0:
+            return {}
+        if self.index is not index:
+            self.build(index, match)
+        self.walks += 1
+
+        frontier = sorted(set(active))
+        seen = set(frontier)
+        seen.update(blocked)
+        activated = {}
+        for depth in range(1, max_depth + 1):
+            next_frontier = []
+            for position in frontier:
+                for target in self.edges[position]:
+                    if target not in seen:
+                        seen.add(target)
+                        activated[target] = depth
+                        next_frontier.append(target)
+            if not next_frontier:
+                break
+            frontier = next_frontier
+        self.recursive_activations += len(activated)
+        return activated
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.edges),
+            "edges": sum(len(targets) for targets in self.edges),
+            "builds": self.builds,
+            "walks": self.walks,
+            "recursive_activations": self.recursive_activations
+        }
@@ -0,0 +1,296 @@
+"""Semantic activation for "vectorized" lorebook entries.
+
+Vectorized entries used to be matched by their keywords only. They are now
+also embedded into a local vector index, and an entry activates when the
+message is similar enough to it, even if none of its keywords occur. Nothing
+is sent over the network.
+
+The default embedder hashes words and word pairs into a fixed number of
+dimensions (the "hashing trick"). LorebookVectorIndex keeps the entry vectors
+in one contiguous float32 matrix, weights dimensions by inverse document
+frequency (TF-IDF) and ranks entries by cosine similarity. Any object with a
+name, dimensions and embed(texts) can be used as the embedder instead.
+
+The index is stored next to lorebooks.json. When an entry changes only its
+row is re-embedded and rewritten; unchanged entries are recognized by a
+fingerprint of their text.
+"""
+import hashlib
+import json
+import os
+import re
+import zlib
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from bot_logging import get_logger
+
+logger = get_logger("lorebook")
+
+WORD_PATTERN = re.compile(r"\w+")
+
+# Words too common to say anything about which entry a message is about
+STOP_WORDS = frozenset(
+    "a an and are as at be but by do for from had has have he her him his i if in into is it its me my "
+    "no not of on or our she so than that the their them then there they this to was we were what when "
+    "where which who will with you your".split()
+)
+
+
+def fingerprint(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class HashingEmbedder:
+    """Embeds text as hashed counts of its words and adjacent word pairs."""
+
+    def __init__(self, dimensions: int = 1024, ngrams: int = 2):
+        self.dimensions = dimensions
+        self.ngrams = ngrams
+
+    @property
+    def name(self) -> str:
+        # Stored with the index: vectors from a differently configured embedder aren't comparable
+        return f"hashing-{self.dimensions}-{self.ngrams}"
+
+    def features(self, text: str) -> List[str]:
+        words = [word for word in WORD_PATTERN.findall(text.lower()) if word not in STOP_WORDS]
+        features = list(words)
+        for n in range(2, self.ngrams + 1):
+            features.extend(" ".join(words[i:i + n]) for i in range(len(words) - n + 1))
+        return features
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """One L2-normalized row of log-scaled term counts per text."""
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self.features(text):
+                vectors[row, zlib.crc32(feature.encode("utf-8")) % self.dimensions] += 1.0
+        np.log1p(vectors, out=vectors)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+
+class LorebookVectorIndex:
+    """Entry vectors in a contiguous float32 matrix with top-k cosine search."""
+
+    def __init__(self, path: Optional[str] = None, embedder: Optional[Any] = None):
+        """
+        Args:
+            path: File path without extension; the matrix is stored in
+                path + ".f32" and entry ids in path + ".json". None keeps the
+                index in memory only.
+            embedder: Defaults to HashingEmbedder()
+        """
+        self.path = path
+        self.embedder = embedder or HashingEmbedder()
+        self.clear()
+        self.embedded = 0
+        self.searches = 0
+
+    def clear(self) -> None:
+        dimensions = self.embedder.dimensions
+        self.ids: List[str] = []
+        self.fingerprints: List[str] = []
+        self.rows: Dict[str, int] = {}
+        # Rows past count are spare capacity, so appends don't copy the matrix every time
+        self.matrix = np.zeros((0, dimensions), dtype=np.float32)
+        self.count = 0
+        # How many entries have a non-zero value in each dimension (for IDF weights)
+        self.doc_freq = np.zeros(dimensions, dtype=np.int64)
+        self._weights: Optional[np.ndarray] = None
+        self._norms: Optional[np.ndarray] = None
+        self._dirty_rows = set()
+        self._rewrite = True
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def matrix_path(self) -> str:
+        return self.path + ".f32"
+
+    @property
+    def meta_path(self) -> str:
+        return self.path + ".json"
+
+    def load(self) -> None:
+        """Load the stored index; if it is missing or unusable, start empty (and rewrite it on the next save)."""
+        self.clear()
+        if not self.path or not os.path.exists(self.meta_path) or not os.path.exists(self.matrix_path):
+            return
+        try:
+            with open(self.meta_path, "r") as f:
+                meta = json.load(f)
+            if meta.get("embedder") != self.embedder.name:
+                logger.info("Vector index was built with %s, re-embedding entries", meta.get('embedder'))
+                return
+            matrix = np.fromfile(self.matrix_path, dtype=np.float32)
+            if matrix.size != len(meta["ids"]) * self.embedder.dimensions:
+                logger.warning("Vector index is incomplete, re-embedding entries")
+                return
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Could not load vector index, re-embedding entries: %s", e)
+            return
+        self.ids = list(meta["ids"])
+        self.fingerprints = list(meta["fingerprints"])
+        self.rows = {entry_id: row for row, entry_id in enumerate(self.ids)}
+        self.matrix = matrix.reshape(-1, self.embedder.dimensions)
+        self.count = len(self.ids)
+        self.doc_freq = np.count_nonzero(self.matrix, axis=0).astype(np.int64)
+        self._rewrite = False
+
+    def save(self) -> None:
+        """Write changed rows (or the whole matrix if the file isn't usable) and the entry ids."""
+        if not self.path:
+            return
+        row_bytes = self.embedder.dimensions * 4
+        if self._rewrite or not os.path.exists(self.matrix_path):
+            self.matrix[:self.count].tofile(self.matrix_path)
+        else:
+            with open(self.matrix_path, "r+b") as f:
+                for row in sorted(self._dirty_rows):
+                    f.seek(row * row_bytes)
+                    f.write(self.matrix[row].tobytes())
+                f.truncate(self.count * row_bytes)
+        with open(self.meta_path, "w") as f:
+            json.dump({"embedder": self.embedder.name, "ids": self.ids, "fingerprints": self.fingerprints}, f)
+        self._dirty_rows.clear()
+        self._rewrite = False
+
+    def _set_row(self, row: int, vector: np.ndarray) -> None:
+        if row < self.count:
+            self.doc_freq -= self.matrix[row] != 0
+        self.matrix[row] = vector
+        self.doc_freq += vector != 0
+        self._dirty_rows.add(row)
+
+    def _append_row(self, entry_id: str, entry_fingerprint: str, vector: np.ndarray) -> None:
+        if self.count == len(self.matrix):
+            grown = np.zeros((max(16, self.count * 2), self.embedder.dimensions), dtype=np.float32)
+            grown[:self.count] = self.matrix[:self.count]
+            self.matrix = grown
+        row = self.count
+        self._set_row(row, vector)
+        self.count += 1
+        self.ids.append(entry_id)
+        self.fingerprints.append(entry_fingerprint)
+        self.rows[entry_id] = row
+
+    def remove(self, entry_id: str) -> bool:
+        """Remove an entry, moving the last row into its place."""
+        row = self.rows.pop(entry_id, None)
+        if row is None:
+            return False
+        self.doc_freq -= self.matrix[row] != 0
+        last = self.count - 1
+        if row != last:
+            self.matrix[row] = self.matrix[last]
+            self.ids[row] = self.ids[last]
+            self.fingerprints[row] = self.fingerprints[last]
+            self.rows[self.ids[row]] = row
+            self._dirty_rows.add(row)
+        self._dirty_rows.discard(last)
+        self.ids.pop()
+        self.fingerprints.pop()
+        self.count -= 1
+        self._weights = None
+        return True
+
+    def sync(self, texts: Dict[str, str], save: bool = True) -> int:
+        """Make the index hold exactly the given entries.
+
+        Only new or changed texts are embedded (in one batch); entries not in
+        texts are removed.
+
+        Args:
+            texts: Entry id -> text to embed
+
+        Returns:
+            Number of entries added, updated or removed
+        """
+        removed = [entry_id for entry_id in self.ids if entry_id not in texts]
+        for entry_id in removed:
+            self.remove(entry_id)
+
+        changed = []
+        for entry_id, text in texts.items():
+            entry_fingerprint = fingerprint(text)
+            row = self.rows.get(entry_id)
+            if row is None or self.fingerprints[row] != entry_fingerprint:
+                changed.append((entry_id, text, entry_fingerprint))
+        if changed:
+            vectors = self.embedder.embed([text for _, text, _ in changed])
+            self.embedded += len(changed)
+            for (entry_id, _, entry_fingerprint), vector in zip(changed, vectors):
+                row = self.rows.get(entry_id)
+                if row is None:
+                    self._append_row(entry_id, entry_fingerprint, vector)
+                else:
+                    self._set_row(row, vector)
+                    self.fingerprints[row] = entry_fingerprint
+            self._weights = None
+
+        if save and (changed or removed or self._rewrite):
+            self.save()
+        return len(changed) + len(removed)
+
+    def rows_for(self, entry_ids: Sequence[str]) -> np.ndarray:
+        """Rows of the given entries (for restricting a search), skipping unknown ids."""
+        return np.array([self.rows[entry_id] for entry_id in entry_ids if entry_id in self.rows], dtype=np.int64)
+
+    def _prepare(self) -> None:
+        # Squared IDF weights and each row's weighted norm, recomputed only after changes
+        if self._weights is None:
+            idf = np.log((1.0 + self.count) / (1.0 + self.doc_freq)) + 1.0
+            self._weights = (idf * idf).astype(np.float32)
+            matrix = self.matrix[:self.count]
+            self._norms = np.sqrt((matrix * matrix) @ self._weights)
+
+    def search(self, text: str, top_k: int = 5, threshold: float = 0.2,
+               rows: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
+        """Entries most similar to text.
+
+        Args:
+            text: Query text
+            top_k: Most entries returned
+            threshold: Minimum cosine similarity (TF-IDF weighted)
+            rows: Only consider these rows (see rows_for)
+
+        Returns:
+            (entry id, similarity) pairs, most similar first
+        """
+        if not self.count or top_k <= 0 or (rows is not None and not len(rows)):
+            return []
+        self.searches += 1
+        self._prepare()
+        vector = self.embedder.embed([text])[0]
+        query = vector * self._weights
+        query_norm = float(np.sqrt(vector @ query))
+        if query_norm == 0:
+            return []
+        scores = self.matrix[:self.count] @ query
+        norms = self._norms
+        if rows is not None:
+            scores = scores[rows]
+            norms = norms[rows]
+        else:
+            rows = np.arange(self.count)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores = np.where(norms > 0, scores / (norms * query_norm), 0.0)
+
+        candidates = np.flatnonzero(scores >= threshold)
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(self.ids[rows[i]], float(scores[i])) for i in candidates]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "embedder": self.embedder.name,
+            "entries": self.count,
+            "embedded": self.embedded,
+            "searches": self.searches
+        }
@@ -144,6 +144,8 @@ def main():
     except KeyboardInterrupt:
         print("\n\n👋 Shutting down...")
     finally:
+        # Write out config changes still waiting for the writer thread
+        config_manager.flush()
         # Ensure bot is properly closed
         if bot_instance and not bot_instance.is_closed():
             try:
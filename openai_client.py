@@ -1,6 +1,11 @@
 """OpenAI-compatible API client."""
-from openai import OpenAI
-from typing import Dict, Any, List, Optional
+import threading
+from openai import OpenAI, AsyncOpenAI, APIStatusError
+from typing import Dict, Any, List, Optional, AsyncIterator, Tuple, Callable, Mapping
+
+from bot_logging import get_logger
+
+logger = get_logger("generation")
 
 class OpenAIClient:
     @staticmethod
@@ -47,16 +52,34 @@ class OpenAIClient:
         # Only create the client if we have a valid API key
         # Otherwise, defer client creation until a valid key is provided
         if self.api_key and self.api_key not in ["YOUR_API_KEY", "", "none"]:
-            self.client = OpenAI(
-                api_key=api_key,
-                base_url=base_url
-            )
+            client_kwargs = {"api_key": api_key, "base_url": base_url}
         else:
             # Create a dummy client - will be replaced when config is updated
-            self.client = OpenAI(
-                api_key="none",  # Placeholder to prevent errors
-                base_url=base_url or "https://api.openai.com/v1"
-            )
+            client_kwargs = {
+                "api_key": "none",  # Placeholder to prevent errors
+                "base_url": base_url or "https://api.openai.com/v1"
+            }
+        
+        # The sync client serves the web interface (model listing), which runs
+        # in Flask's worker threads. Chat completions run on the Discord event
+        # loop and must use the async client so one slow request doesn't freeze
+        # heartbeats, typing indicators and every other channel's generation.
+        self.client = OpenAI(**client_kwargs)
+        # Retries for chat completions are handled by the bot (see api_resilience),
+        # which can also fail over to another endpoint
+        self.async_client = AsyncOpenAI(max_retries=0, **client_kwargs)
+        self.base_url = client_kwargs["base_url"]
+        
+        # Called as listener(base_url, headers) after every chat completion response,
+        # e.g. so rate-limit headers can be tracked (see rate_limiter.RateLimiter)
+        self.header_listeners: List[Callable[[str, Mapping[str, str]], None]] = []
+        # Requests (and open streams) using this client; it is only closed when none are left
+        self.in_flight = 0
+    
+    async def close(self) -> None:
+        """Close the HTTP connection pools of both clients."""
+        self.client.close()
+        await self.async_client.close()
     
     def update_config(self, api_key: Optional[str] = None, base_url: Optional[str] = None, model: Optional[str] = None):
         """Update client configuration.
@@ -74,11 +97,14 @@ class OpenAIClient:
                     "API key is not configured. Please set a valid API key in the configuration."
                 )
             self.client.api_key = api_key
+            self.async_client.api_key = api_key
             self.api_key = api_key
         if base_url:
             # Strip whitespace for proxy compatibility
             base_url = base_url.strip()
             self.client.base_url = base_url
+            self.async_client.base_url = base_url
+            self.base_url = base_url
         if model:
             self.model = model
     
@@ -107,6 +133,124 @@ class OpenAIClient:
                 )
             raise Exception(f"Error fetching models from API: {error_msg}")
     
+    def _notify_headers(self, headers: Optional[Mapping[str, str]]) -> None:
+        """Pass response headers to the registered listeners."""
+        if headers is None:
+            return
+        for listener in self.header_listeners:
+            try:
+                listener(self.base_url, headers)
+            except Exception as e:
+                logger.warning("Response header listener failed: %s", e)
+    
+    async def _create_completion(self, **request_params):
+        """Create a chat completion, reporting the response headers to listeners."""
+        self.in_flight += 1
+        try:
+            raw_response = await self.async_client.chat.completions.with_raw_response.create(**request_params)
+        except APIStatusError as e:
+            # Rate-limited and failed responses carry the most useful headers
+            self._notify_headers(e.response.headers)
+            raise
+        finally:
+            self.in_flight -= 1
+        self._notify_headers(raw_response.headers)
+        return raw_response.parse()
+    
+    def _check_api_key(self) -> None:
+        """Raise a helpful error if no usable API key is configured."""
+        if not self.api_key or self.api_key in ["YOUR_API_KEY", "", "none"]:
+            raise ValueError(
+                "API key is not configured. Please set a valid API key in the configuration. "
+                "You can configure it via the web interface at http://localhost:5000 or by editing config.json"
+            )
+    
+    def _build_request_params(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        top_p: float,
+        frequency_penalty: float,
+        presence_penalty: float,
+        frequency_penalty_enabled: bool,
+        presence_penalty_enabled: bool
+    ) -> Dict[str, Any]:
+        """Build the chat completion request parameters."""
+        request_params = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "top_p": top_p
+        }
+        
+        # Only include penalties if they are enabled
+        if frequency_penalty_enabled:
+            request_params["frequency_penalty"] = frequency_penalty
+        if presence_penalty_enabled:
+            request_params["presence_penalty"] = presence_penalty
+        
+        return request_params
+    
+    async def chat_completion_with_usage(
+        self, 
+        messages: List[Dict[str, str]], 
+        temperature: float = 0.7,
+        max_tokens: int = 2000,
+        top_p: float = 1.0,
+        frequency_penalty: float = 0.0,
+        presence_penalty: float = 0.0,
+        frequency_penalty_enabled: bool = True,
+        presence_penalty_enabled: bool = True
+    ) -> Tuple[str, Dict[str, int]]:
+        """
+        Generate a chat completion and report the tokens it used.
+        
+        Takes the same arguments as chat_completion.
+        
+        Returns:
+            (generated text, usage) where usage has prompt_tokens and
+            completion_tokens; it is empty if the provider didn't report usage
+        """
+        # Check if API key is configured
+        self._check_api_key()
+        
+        try:
+            request_params = self._build_request_params(
+                messages, temperature, max_tokens, top_p,
+                frequency_penalty, presence_penalty,
+                frequency_penalty_enabled, presence_penalty_enabled
+            )
+            
+            response = await self._create_completion(**request_params)
+            
+            # Safely access response choices with validation
+            if not hasattr(response, 'choices') or not response.choices:
+                raise Exception(
+                    "API returned an invalid response structure (missing 'choices'). "
+                    "This may indicate a proxy or API configuration issue. "
+                    "Please check your API endpoint and model settings."
+                )
+            
+            if not hasattr(response.choices[0], 'message') or not hasattr(response.choices[0].message, 'content'):
+                raise Exception(
+                    "API returned an invalid response structure (missing message content). "
+                    "This may indicate a proxy or API configuration issue. "
+                    "Please check your API endpoint and model settings."
+                )
+            
+            usage = {}
+            if getattr(response, 'usage', None) is not None:
+                usage = {
+                    "prompt_tokens": getattr(response.usage, 'prompt_tokens', 0) or 0,
+                    "completion_tokens": getattr(response.usage, 'completion_tokens', 0) or 0
+                }
+            return response.choices[0].message.content, usage
+        except Exception as e:
+            # Keep the provider error as __cause__ so callers can tell transient failures apart
+            raise self._friendly_error(e) from e
+    
     async def chat_completion(
         self, 
         messages: List[Dict[str, str]], 
@@ -133,33 +277,54 @@ class OpenAIClient:
         
         Returns:
             Generated text response
+        
+        The request is awaited on the async client, so the event loop keeps
+        serving other channels, heartbeats and button interactions while the
+        provider is generating.
+        """
+        response, _ = await self.chat_completion_with_usage(
+            messages, temperature, max_tokens, top_p,
+            frequency_penalty, presence_penalty,
+            frequency_penalty_enabled, presence_penalty_enabled
+        )
+        return response
+    
+    async def chat_completion_candidates(
+        self, 
+        messages: List[Dict[str, str]], 
+        n: int,
+        temperature: float = 0.7,
+        max_tokens: int = 2000,
+        top_p: float = 1.0,
+        frequency_penalty: float = 0.0,
+        presence_penalty: float = 0.0,
+        frequency_penalty_enabled: bool = True,
+        presence_penalty_enabled: bool = True
+    ) -> List[str]:
+        """
+        Generate several alternative completions in one request using the `n` parameter.
+        
+        Takes the same arguments as chat_completion plus n. Providers and proxies
+        that don't support `n` usually ignore it and return a single choice, so
+        the result may contain fewer than n responses.
+        
+        Returns:
+            Generated text of each returned choice
         """
         # Check if API key is configured
-        if not self.api_key or self.api_key in ["YOUR_API_KEY", "", "none"]:
-            raise ValueError(
-                "API key is not configured. Please set a valid API key in the configuration. "
-                "You can configure it via the web interface at http://localhost:5000 or by editing config.json"
-            )
+        self._check_api_key()
         
         try:
-            # Build request parameters
-            request_params = {
-                "model": self.model,
-                "messages": messages,
-                "temperature": temperature,
-                "max_tokens": max_tokens,
-                "top_p": top_p
-            }
-            
-            # Only include penalties if they are enabled
-            if frequency_penalty_enabled:
-                request_params["frequency_penalty"] = frequency_penalty
-            if presence_penalty_enabled:
-                request_params["presence_penalty"] = presence_penalty
+            request_params = self._build_request_params(
+                messages, temperature, max_tokens, top_p,
+                frequency_penalty, presence_penalty,
+                frequency_penalty_enabled, presence_penalty_enabled
+            )
+            if n > 1:
+                request_params["n"] = n
             
-            response = self.client.chat.completions.create(**request_params)
+            response = await self._create_completion(**request_params)
             
-            # Safely access response choices with validation
             if not hasattr(response, 'choices') or not response.choices:
                 raise Exception(
                     "API returned an invalid response structure (missing 'choices'). "
@@ -167,69 +332,218 @@ class OpenAIClient:
                     "Please check your API endpoint and model settings."
                 )
             
-            if not hasattr(response.choices[0], 'message') or not hasattr(response.choices[0].message, 'content'):
-                raise Exception(
-                    "API returned an invalid response structure (missing message content). "
-                    "This may indicate a proxy or API configuration issue. "
-                    "Please check your API endpoint and model settings."
-                )
+            return [
+                choice.message.content for choice in response.choices
+                if getattr(choice, 'message', None) is not None and choice.message.content is not None
+            ]
+        except Exception as e:
+            raise self._friendly_error(e) from e
+    
+    async def stream_chat_completion(
+        self, 
+        messages: List[Dict[str, str]], 
+        temperature: float = 0.7,
+        max_tokens: int = 2000,
+        top_p: float = 1.0,
+        frequency_penalty: float = 0.0,
+        presence_penalty: float = 0.0,
+        frequency_penalty_enabled: bool = True,
+        presence_penalty_enabled: bool = True
+    ) -> AsyncIterator[str]:
+        """
+        Stream a chat completion as text deltas.
+        
+        Takes the same arguments as chat_completion, but yields each piece of
+        generated text as soon as the provider sends it so the caller can show
+        the reply while it is still being written.
+        
+        Yields:
+            Text deltas in generation order
+        """
+        # Check if API key is configured
+        self._check_api_key()
+        
+        try:
+            request_params = self._build_request_params(
+                messages, temperature, max_tokens, top_p,
+                frequency_penalty, presence_penalty,
+                frequency_penalty_enabled, presence_penalty_enabled
+            )
             
-            return response.choices[0].message.content
+            stream = await self._create_completion(stream=True, **request_params)
+            self.in_flight += 1
+            try:
+                # Closing the stream ends the HTTP response, so the provider stops
+                # generating when the caller stops early (e.g. a hedge leg that lost)
+                async with stream:
+                    async for chunk in stream:
+                        # Some proxies send keep-alive chunks without choices
+                        if not chunk.choices:
+                            continue
+                        delta = getattr(chunk.choices[0], 'delta', None)
+                        content = getattr(delta, 'content', None) if delta else None
+                        if content:
+                            yield content
+            finally:
+                self.in_flight -= 1
         except Exception as e:
-            # Provide more helpful error message for API key issues
-            error_msg = str(e)
-            # Check for authentication/token errors with broader pattern matching
-            if any(pattern in error_msg.lower() for pattern in [
-                "401", "invalid_api_key", "incorrect api key", "invalid api key", "invalid token", 
-                "invalid_request_error", "authentication", "unauthorized"
-            ]):
-                raise Exception(
-                    f"API authentication failed. Please verify your API key/token is correct. "
-                    f"You can update it via the web interface at http://localhost:5000. "
-                    f"Note: If using a proxy (like anas-proxy.xyz), ensure:\n"
-                    f"1. Your API key/token is valid for that specific proxy\n"
-                    f"2. The proxy URL is correct (should end with /v1)\n"
-                    f"3. The proxy service is currently accessible\n"
-                    f"Original error: {error_msg}"
-                )
-            # Provide helpful message for context length/token limit errors
-            elif any(pattern in error_msg.lower() for pattern in [
-                "context_length_exceeded", "maximum context length", "context window",
-                "too many tokens", "token limit", "reduce the length"
-            ]):
-                raise Exception(
-                    f"Message too long - exceeded context window limit. "
-                    f"The combined length of your message, conversation history, and system prompts exceeded the model's token limit. "
-                    f"Please try:\n"
-                    f"1. Sending a shorter message\n"
-                    f"2. Using !clear to clear conversation history\n"
-                    f"3. Reducing the auto context limit with !setcontext (current messages loaded from history)\n"
-                    f"Original error: {error_msg}"
-                )
-            # Provide helpful message for Google AI proxy errors (specific pattern)
-            elif "googleAIBlockingResponseHandler" in error_msg or "Cannot read properties of undefined" in error_msg:
-                raise Exception(
-                    f"Google AI proxy error - likely content filtering or response parsing issue. "
-                    f"This often happens when:\n"
-                    f"1. Your message contains content that triggers safety filters\n"
-                    f"2. The message format (e.g., with newlines or special characters) causes parsing issues\n"
-                    f"3. The proxy cannot parse the API response correctly\n"
-                    f"Try:\n"
-                    f"- Rewording your message\n"
-                    f"- Removing extra line breaks or special formatting\n"
-                    f"- Using a different API endpoint/proxy if available\n"
-                    f"Original error: {error_msg}"
-                )
-            # Provide helpful message for server errors
-            elif "500" in error_msg or "Internal server error" in error_msg:
-                raise Exception(
-                    f"API server error (500). This is typically a problem with the API provider or proxy. "
-                    f"Possible causes:\n"
-                    f"1. Your API endpoint is not accessible or incorrect\n"
-                    f"2. The model name is invalid for your API provider\n"
-                    f"3. Your proxy (if using one) has a configuration issue\n"
-                    f"4. Your message may be too long (try a shorter message or use !clear to reset history)\n"
-                    f"5. Content filtering - your message may contain blocked content (try rewording)\n"
-                    f"Original error: {error_msg}"
-                )
-            raise Exception(f"Error calling OpenAI-compatible API: {error_msg}")
+            raise self._friendly_error(e) from e
+    
+    def _friendly_error(self, e: Exception) -> Exception:
+        """Translate a provider error into an exception with troubleshooting hints."""
+        # Provide more helpful error message for API key issues
+        error_msg = str(e)
+        # Check for authentication/token errors with broader pattern matching
+        if any(pattern in error_msg.lower() for pattern in [
+            "401", "invalid_api_key", "incorrect api key", "invalid api key", "invalid token", 
+            "invalid_request_error", "authentication", "unauthorized"
+        ]):
+            return Exception(
+                f"API authentication failed. Please verify your API key/token is correct. "
+                f"You can update it via the web interface at http://localhost:5000. "
+                f"Note: If using a proxy (like anas-proxy.xyz), ensure:\n"
+                f"1. Your API key/token is valid for that specific proxy\n"
+                f"2. The proxy URL is correct (should end with /v1)\n"
+                f"3. The proxy service is currently accessible\n"
+                f"Original error: {error_msg}"
+            )
+        # Provide helpful message for context length/token limit errors
+        elif any(pattern in error_msg.lower() for pattern in [
+            "context_length_exceeded", "maximum context length", "context window",
+            "too many tokens", "token limit", "reduce the length"
+        ]):
+            return Exception(
+                f"Message too long - exceeded context window limit. "
+                f"The combined length of your message, conversation history, and system prompts exceeded the model's token limit. "
+                f"Please try:\n"
+                f"1. Sending a shorter message\n"
+                f"2. Using !clear to clear conversation history\n"
+                f"3. Reducing the auto context limit with !setcontext (current messages loaded from history)\n"
+                f"Original error: {error_msg}"
+            )
+        # Provide helpful message for Google AI proxy errors (specific pattern)
+        elif "googleAIBlockingResponseHandler" in error_msg or "Cannot read properties of undefined" in error_msg:
+            return Exception(
+                f"Google AI proxy error - likely content filtering or response parsing issue. "
+                f"This often happens when:\n"
+                f"1. Your message contains content that triggers safety filters\n"
+                f"2. The message format (e.g., with newlines or special characters) causes parsing issues\n"
+                f"3. The proxy cannot parse the API response correctly\n"
+                f"Try:\n"
+                f"- Rewording your message\n"
+                f"- Removing extra line breaks or special formatting\n"
+                f"- Using a different API endpoint/proxy if available\n"
+                f"Original error: {error_msg}"
+            )
+        # Provide helpful message for server errors
+        elif "500" in error_msg or "Internal server error" in error_msg:
+            return Exception(
+                f"API server error (500). This is typically a problem with the API provider or proxy. "
+                f"Possible causes:\n"
+                f"1. Your API endpoint is not accessible or incorrect\n"
+                f"2. The model name is invalid for your API provider\n"
+                f"3. Your proxy (if using one) has a configuration issue\n"
+                f"4. Your message may be too long (try a shorter message or use !clear to reset history)\n"
+                f"5. Content filtering - your message may contain blocked content (try rewording)\n"
+                f"Original error: {error_msg}"
+            )
+        return Exception(f"Error calling OpenAI-compatible API: {error_msg}")
+
+
+class OpenAIClientRegistry:
+    """Reuse one OpenAIClient per saved API configuration.
+    
+    Every OpenAIClient owns its own HTTP connection pool, so creating one per
+    message costs a fresh TCP + TLS handshake with the provider each time.
+    The registry keeps a client per saved_api_configs name and hands the same
+    instance back as long as the config's key, URL and model are unchanged.
+    Replaced and invalidated clients are closed by close_idle once their
+    requests have finished, and by close on shutdown.
+    """
+    
+    def __init__(self):
+        # name -> ((api_key, base_url, model), client)
+        self._clients: Dict[str, Tuple[Tuple[str, str, str], OpenAIClient]] = {}
+        # Clients no longer handed out, waiting to be closed
+        self._retired: List[OpenAIClient] = []
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _fingerprint(api_config: Dict[str, Any]) -> Tuple[str, str, str]:
+        return (
+            api_config.get('api_key', ''),
+            api_config.get('base_url', 'https://api.openai.com/v1'),
+            api_config.get('model', 'gpt-3.5-turbo')
+        )
+    
+    def get(self, name: str, api_config: Dict[str, Any]) -> OpenAIClient:
+        """Get the pooled client for a saved API config, creating it if needed.
+        
+        Args:
+            name: Name of the saved API config
+            api_config: The saved config dict with api_key, base_url and model
+        
+        Returns:
+            A client that is reused for every request using this config
+        """
+        fingerprint = self._fingerprint(api_config)
+        with self._lock:
+            cached = self._clients.get(name)
+            if cached and cached[0] == fingerprint:
+                return cached[1]
+            
+            # New config, or it was edited without an explicit invalidation
+            if cached:
+                self._retired.append(cached[1])
+            api_key, base_url, model = fingerprint
+            client = OpenAIClient(api_key=api_key, base_url=base_url, model=model)
+            self._clients[name] = (fingerprint, client)
+            return client
+    
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """Drop the cached client for a config (or all clients if name is None).
+        
+        Requests already in flight keep their client; it is closed by close_idle once they finish.
+        """
+        with self._lock:
+            if name is None:
+                self._retired.extend(client for _, client in self._clients.values())
+                self._clients.clear()
+            else:
+                cached = self._clients.pop(name, None)
+                if cached:
+                    self._retired.append(cached[1])
+    
+    async def close_idle(self) -> int:
+        """Close the replaced and invalidated clients that no request is using anymore.
+        
+        Returns:
+            Number of clients closed
+        """
+        with self._lock:
+            idle = [client for client in self._retired if client.in_flight == 0]
+            self._retired = [client for client in self._retired if client.in_flight > 0]
+        for client in idle:
+            await self._close(client)
+        return len(idle)
+    
+    async def close(self) -> None:
+        """Close every client, pooled or retired (on shutdown)."""
+        with self._lock:
+            clients = [client for _, client in self._clients.values()] + self._retired
+            self._clients.clear()
+            self._retired = []
+        for client in clients:
+            await self._close(client)
+    
+    @staticmethod
+    async def _close(client: OpenAIClient) -> None:
+        try:
+            await client.close()
+        except Exception as e:
+            logger.warning("Closing the client for %s failed: %s", client.base_url, e)
+    
+    def cached_names(self) -> List[str]:
+        """Names of the configs that currently have a pooled client."""
+        with self._lock:
+            return list(self._clients.keys())
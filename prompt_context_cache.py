@@ -0,0 +1,157 @@
+"""Compiled prompt context, rebuilt only when its source files change.
+
+Building a prompt used to re-read the character card, the user characters and
+the lorebooks from disk, re-sort the preset's prompt sections and re-format the
+character card on every !chat. The web UI edits those files through its own
+manager instances, so the bot can't simply trust its in-memory copies either.
+
+PromptContextCache keeps the compiled, turn-independent part of the prompt per
+channel and character (for the preset in use) and reuses it until a source
+file's mtime or size changes, or the web API invalidates it explicitly.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple, Callable, Hashable
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int]]:
+    """(mtime_ns, size) of a file, or None if it doesn't exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def compile_prompt_sections(preset: Dict[str, Any], char_format: Dict[str, Any]) -> Tuple[List[Dict[str, str]], bool]:
+    """Turn a preset and formatted character card into the leading prompt messages.
+
+    System messages get the character's system info appended; per-turn context
+    (lorebook entries, user characters, CP prompt) is added later by the bot.
+
+    Returns:
+        (messages, legacy) - legacy is True for presets without prompt_sections,
+        whose single system message is dropped if it ends up empty
+    """
+    char_system = char_format.get('character_system', '')
+
+    if 'prompt_sections' in preset and preset['prompt_sections']:
+        messages = []
+        for section in sorted(preset['prompt_sections'], key=lambda x: x.get('order', 0)):
+            if not section.get('enabled', True):
+                continue
+            role = section.get('role', 'system')
+            content = section.get('content', '')
+            if role == 'system' and char_system:
+                content += '\n\n' + char_system
+            messages.append({"role": role, "content": content})
+        return messages, False
+
+    # Backward compatibility: old system_prompt format
+    system_prompt = char_format.get('system_prompt', '')
+    if not system_prompt:
+        system_prompt = preset.get('system_prompt', 'You are a helpful AI assistant.')
+    if char_system:
+        system_prompt += '\n\n' + char_system
+    return [{"role": "system", "content": system_prompt}], True
+
+
+class CompiledPromptContext:
+    """The turn-independent part of a channel's prompt."""
+
+    def __init__(self, preset: Dict[str, Any], character_data: Optional[Dict[str, Any]],
+                 char_format: Dict[str, Any], loaded_from_disk: bool = False):
+        self.preset = preset
+        self.character_data = character_data
+        self.char_format = char_format
+        self.loaded_from_disk = loaded_from_disk
+        self.sections, self.legacy = compile_prompt_sections(preset, char_format)
+        self.example_dialogues = char_format.get('example_dialogues', [])
+
+
+class PromptContextCache:
+    """LRU of compiled prompt contexts plus change detection for reloadable files.
+
+    Used from the bot's event loop; invalidate() may be called from the web
+    server thread.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.contexts: "OrderedDict[Hashable, Tuple[Tuple, int, Any]]" = OrderedDict()
+        self.file_signatures: Dict[str, Tuple] = {}
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.reloads_skipped = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, paths: List[str], build: Callable[[], Any],
+            is_current: Optional[Callable[[Any], bool]] = None) -> Any:
+        """Get the compiled value for key, rebuilding it if any of paths changed.
+
+        Args:
+            key: Cache key (e.g. channel and character)
+            paths: Files the value is built from
+            build: Builds the value; exceptions propagate and nothing is cached
+            is_current: Extra check of a cached value (e.g. that its preset is still in use)
+        """
+        signature = tuple(file_signature(path) for path in paths)
+        with self._lock:
+            generation = self.generation
+            entry = self.contexts.get(key)
+            if (entry is not None and entry[0] == signature and entry[1] == generation
+                    and (is_current is None or is_current(entry[2]))):
+                self.contexts.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        value = build()
+        with self._lock:
+            self.contexts[key] = (signature, generation, value)
+            self.contexts.move_to_end(key)
+            while len(self.contexts) > self.max_entries:
+                self.contexts.popitem(last=False)
+        return value
+
+    def reload_if_changed(self, name: str, paths: List[str], loader: Callable[[], None]) -> bool:
+        """Call loader only if the files behind name changed since it last ran.
+
+        Returns:
+            True if loader was called
+        """
+        signature = tuple(file_signature(path) for path in paths)
+        with self._lock:
+            if self.file_signatures.get(name) == signature:
+                self.reloads_skipped += 1
+                return False
+
+        loader()
+        # Loading may rewrite the files (e.g. lorebook migrations) - remember what's on disk now
+        with self._lock:
+            self.file_signatures[name] = tuple(file_signature(path) for path in paths)
+            self.reloads += 1
+        return True
+
+    def invalidate(self) -> None:
+        """Drop everything so the next prompt rebuilds from disk."""
+        with self._lock:
+            self.generation += 1
+            self.contexts.clear()
+            self.file_signatures.clear()
+            self.invalidations += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self.contexts),
+                "hits": self.hits,
+                "misses": self.misses,
+                "file_reloads": self.reloads,
+                "file_reloads_skipped": self.reloads_skipped,
+                "invalidations": self.invalidations
+            }
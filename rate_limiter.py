@@ -0,0 +1,271 @@
+"""Client-side rate limiting driven by provider rate-limit headers.
+
+OpenAI-compatible APIs (and most proxies in front of them) report their limits
+on every response:
+
+    x-ratelimit-limit-requests / x-ratelimit-remaining-requests / x-ratelimit-reset-requests
+    x-ratelimit-limit-tokens   / x-ratelimit-remaining-tokens   / x-ratelimit-reset-tokens
+    retry-after / retry-after-ms
+
+Each endpoint gets a request bucket and a token bucket that are re-synced from
+those headers and refill linearly until the reported reset time. Before a
+request is sent its estimated token cost is reserved, waiting first if the
+buckets are empty, so requests are delayed (or rerouted to another API config)
+before the provider starts rejecting them. Endpoints that never send the
+headers are not throttled.
+"""
+import asyncio
+import re
+import threading
+import time
+from typing import Dict, Any, Optional, Mapping
+
+from bot_logging import get_logger
+
+logger = get_logger("generation")
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse a reset duration such as "1s", "6m0s", "20ms" or "0.5" into seconds.
+
+    Plain numbers larger than a billion are treated as a Unix timestamp.
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value:
+        return None
+    try:
+        number = float(value)
+        return max(0.0, number - time.time()) if number > 1e9 else max(0.0, number)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def _header_int(headers: Mapping[str, str], name: str) -> Optional[int]:
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """A bucket synced from provider headers that refills linearly between updates."""
+
+    def __init__(self):
+        self.capacity: Optional[float] = None
+        self.level: Optional[float] = None
+        self.refill_rate: Optional[float] = None  # units per second
+        self.updated_at = time.monotonic()
+
+    @property
+    def known(self) -> bool:
+        return self.level is not None
+
+    def observe(self, limit: Optional[int], remaining: Optional[int], reset_seconds: Optional[float]) -> None:
+        """Sync the bucket with the limit, remaining amount and reset time the provider reported."""
+        if remaining is None:
+            return
+        now = time.monotonic()
+        if limit:
+            self.capacity = float(limit)
+        else:
+            self.capacity = max(self.capacity or 0.0, float(remaining))
+        self.level = float(remaining)
+        self.updated_at = now
+        if reset_seconds:
+            # The provider refills to the limit by the reset time
+            missing = self.capacity - self.level
+            if missing > 0:
+                self.refill_rate = missing / reset_seconds
+        if self.refill_rate is None and self.capacity:
+            # No reset information: assume a per-minute window
+            self.refill_rate = self.capacity / 60.0
+
+    def _refill(self, now: float) -> None:
+        if self.level is None:
+            return
+        if self.refill_rate:
+            self.level = min(self.capacity, self.level + self.refill_rate * (now - self.updated_at))
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float = None) -> float:
+        """Seconds until amount can be taken from the bucket (0 if unknown)."""
+        if self.level is None:
+            return 0.0
+        now = now if now is not None else time.monotonic()
+        self._refill(now)
+        # A request bigger than the whole bucket can go once the bucket is full
+        amount = min(amount, self.capacity) if self.capacity else amount
+        if self.level >= amount:
+            return 0.0
+        if not self.refill_rate:
+            return float("inf")
+        return (amount - self.level) / self.refill_rate
+
+    def reserve(self, amount: float, now: float = None) -> float:
+        """Take amount from the bucket now and return the seconds until it has refilled (0 if unknown).
+
+        Reserving before waiting makes concurrent callers queue: each one
+        sees the level the earlier ones left behind.
+        """
+        if self.level is None:
+            return 0.0
+        now = now if now is not None else time.monotonic()
+        self._refill(now)
+        self.level -= amount
+        # A request bigger than the whole bucket can go once the bucket was full
+        floor = min(0.0, self.capacity - amount) if self.capacity else 0.0
+        if self.level >= floor:
+            return 0.0
+        if not self.refill_rate:
+            return float("inf")
+        return (floor - self.level) / self.refill_rate
+
+    def snapshot(self) -> Dict[str, Any]:
+        if self.level is not None:
+            self._refill(time.monotonic())
+        return {
+            "capacity": self.capacity,
+            "available": round(self.level, 1) if self.level is not None else None,
+            "refill_per_second": round(self.refill_rate, 3) if self.refill_rate else None
+        }
+
+
+class EndpointRateLimit:
+    """Request and token buckets for one endpoint."""
+
+    def __init__(self):
+        self.requests = TokenBucket()
+        self.tokens = TokenBucket()
+        self.blocked_until = 0.0
+        self.last_update: Optional[float] = None
+        self.throttled = 0
+        self.total_wait = 0.0
+        self._lock = threading.Lock()
+
+    def wait_time(self, tokens: int) -> float:
+        now = time.monotonic()
+        return max(
+            self.blocked_until - now,
+            self.requests.wait_time(1, now),
+            self.tokens.wait_time(tokens, now),
+            0.0
+        )
+
+    def reserve(self, tokens: int) -> float:
+        """Reserve one request and tokens; returns the seconds to wait before sending it."""
+        with self._lock:
+            now = time.monotonic()
+            return max(
+                self.blocked_until - now,
+                self.requests.reserve(1, now),
+                self.tokens.reserve(tokens, now),
+                0.0
+            )
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests.snapshot(),
+            "tokens": self.tokens.snapshot(),
+            "blocked_for_seconds": round(max(0.0, self.blocked_until - time.monotonic()), 2),
+            "seconds_since_update": round(time.time() - self.last_update, 1) if self.last_update else None,
+            "throttled_requests": self.throttled,
+            "total_wait_seconds": round(self.total_wait, 2)
+        }
+
+
+class RateLimiter:
+    """Per-endpoint rate-limit state shared by every client the bot uses."""
+
+    def __init__(self, max_wait: float = 30.0):
+        self.max_wait = max_wait
+        self.endpoints: Dict[str, EndpointRateLimit] = {}
+
+    @staticmethod
+    def normalize_endpoint(endpoint: str) -> str:
+        return (endpoint or "").strip().rstrip("/")
+
+    def state(self, endpoint: str) -> EndpointRateLimit:
+        endpoint = self.normalize_endpoint(endpoint)
+        if endpoint not in self.endpoints:
+            self.endpoints[endpoint] = EndpointRateLimit()
+        return self.endpoints[endpoint]
+
+    def observe(self, endpoint: str, headers: Mapping[str, str]) -> None:
+        """Update an endpoint's buckets from a provider response's headers."""
+        if headers is None:
+            return
+        headers = {str(key).lower(): value for key, value in headers.items()}
+        state = self.state(endpoint)
+        updated = False
+
+        for kind, bucket in (("requests", state.requests), ("tokens", state.tokens)):
+            remaining = _header_int(headers, f"x-ratelimit-remaining-{kind}")
+            if remaining is not None:
+                bucket.observe(
+                    _header_int(headers, f"x-ratelimit-limit-{kind}"),
+                    remaining,
+                    parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                )
+                updated = True
+
+        retry_after = None
+        if headers.get("retry-after-ms"):
+            retry_after = parse_duration(headers["retry-after-ms"])
+            retry_after = retry_after / 1000 if retry_after is not None else None
+        elif headers.get("retry-after"):
+            retry_after = parse_duration(headers["retry-after"])
+        if retry_after:
+            state.blocked_until = max(state.blocked_until, time.monotonic() + retry_after)
+            updated = True
+
+        if updated:
+            state.last_update = time.time()
+
+    def observer(self, endpoint: str, headers: Mapping[str, str]) -> None:
+        """Header listener for OpenAIClient (see attach)."""
+        self.observe(endpoint, headers)
+
+    def attach(self, openai_client) -> None:
+        """Make an OpenAIClient report its response headers to this limiter."""
+        if self.observer not in openai_client.header_listeners:
+            openai_client.header_listeners.append(self.observer)
+
+    def wait_time(self, endpoint: str, tokens: int = 0) -> float:
+        """Predicted seconds before a request of this size may be sent."""
+        return self.state(endpoint).wait_time(tokens)
+
+    async def acquire(self, endpoint: str, tokens: int = 0) -> float:
+        """Reserve a request in the endpoint's buckets, then wait until they allow it.
+
+        The reservation is taken before waiting, so concurrent requests queue
+        one behind another instead of all going out once the first one may.
+        Waits at most max_wait seconds; after that the request is sent anyway
+        and the provider's own limit (and the retry logic) takes over.
+
+        Returns:
+            Seconds waited
+        """
+        state = self.state(endpoint)
+        wait = min(state.reserve(tokens), self.max_wait)
+        if wait > 0:
+            state.throttled += 1
+            state.total_wait += wait
+            logger.info("Rate limit: waiting %.1fs for %s (~%s tokens)",
+                        wait, self.normalize_endpoint(endpoint), tokens)
+            await asyncio.sleep(wait)
+        return wait
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {endpoint: state.snapshot() for endpoint, state in list(self.endpoints.items())}
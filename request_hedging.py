@@ -0,0 +1,206 @@
+"""Hedged requests across two API configs.
+
+Most replies start quickly, but now and then a proxy request gets stuck and
+dominates the worst-case latency. With hedging, if the primary API config
+hasn't produced its first token after a delay derived from its own p95
+first-token latency, the same request is also sent to a secondary config.
+Whichever produces the first token (or full reply, when not streaming) first
+wins and the other request is cancelled. Non-streaming requests can only be
+claimed once the whole reply is in, so their delay comes from full-response
+latencies, which are tracked separately.
+"""
+import asyncio
+import time
+from typing import Dict, Any, Optional, Tuple, List, Callable, Awaitable
+
+from bot_logging import get_logger
+from generation_metrics import LatencyTracker
+
+logger = get_logger("generation")
+
+
+class HedgeStats:
+    """Win and latency statistics for one API config."""
+
+    def __init__(self, window: int = 200):
+        self.first_token = LatencyTracker(window)
+        self.full_response = LatencyTracker(window)
+        self.requests = 0
+        self.wins = 0
+        self.hedges_fired = 0
+        self.hedge_wins = 0
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "wins": self.wins,
+            "hedges_fired": self.hedges_fired,
+            "hedge_wins": self.hedge_wins,
+            "first_token_latency": self.first_token.summary(),
+            "full_response_latency": self.full_response.summary()
+        }
+
+
+class RequestHedger:
+    """Race a primary request against a delayed secondary one."""
+
+    def __init__(self, percentile: float = 95, min_samples: int = 20, default_delay: float = 8.0,
+                 min_delay: float = 1.0, max_delay: float = 30.0):
+        """
+        Args:
+            percentile: Primary's first-token latency percentile used as the hedge delay
+            min_samples: Samples needed before the percentile is trusted
+            default_delay: Hedge delay until enough samples are collected
+            min_delay: Lower bound of the hedge delay (avoids doubling normal traffic)
+            max_delay: Upper bound of the hedge delay
+        """
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.stats: Dict[str, HedgeStats] = {}
+
+    def configure(self, percentile: float = 95, min_samples: int = 20, default_delay: float = 8.0,
+                  min_delay: float = 1.0, max_delay: float = 30.0) -> None:
+        """Apply new settings; collected statistics are kept."""
+        self.percentile = float(percentile)
+        self.min_samples = max(1, int(min_samples))
+        self.default_delay = float(default_delay)
+        self.min_delay = float(min_delay)
+        self.max_delay = max(self.min_delay, float(max_delay))
+
+    def stats_for(self, name: str) -> HedgeStats:
+        if name not in self.stats:
+            self.stats[name] = HedgeStats()
+        return self.stats[name]
+
+    def record_first_token(self, name: str, seconds: float) -> None:
+        """Record how long a config took to produce its first token."""
+        self.stats_for(name).first_token.record(seconds)
+
+    def record_full_response(self, name: str, seconds: float) -> None:
+        """Record how long a config took to produce a whole (non-streamed) reply."""
+        self.stats_for(name).full_response.record(seconds)
+
+    def record_claim(self, name: str, seconds: float, streaming: bool) -> None:
+        """Record the latency a claim() measured: first token when streaming, else the full reply."""
+        if streaming:
+            self.record_first_token(name, seconds)
+        else:
+            self.record_full_response(name, seconds)
+
+    def hedge_delay(self, name: str, streaming: bool = True) -> float:
+        """Seconds to wait for the primary's first token (or full reply) before hedging."""
+        stats = self.stats_for(name)
+        tracker = stats.first_token if streaming else stats.full_response
+        delay = self.default_delay
+        if len(tracker.samples) >= self.min_samples:
+            delay = tracker.percentile(self.percentile)
+        return max(self.min_delay, min(self.max_delay, delay))
+
+    async def run(
+        self,
+        primary: Tuple[str, Any],
+        secondary: Tuple[str, Any],
+        attempt: Callable[[Any, Callable[[], bool]], Awaitable[Any]],
+        streaming: bool = True
+    ) -> Any:
+        """Run attempt on the primary, hedging to the secondary if it is slow.
+
+        Args:
+            primary: (config name, client) tried first
+            secondary: (config name, client) used as the hedge
+            attempt: Coroutine function called as attempt(client, claim). It
+                must call claim() when it has its first token (or its full
+                reply); claim returns False if the other request already won,
+                in which case the attempt should stop.
+            streaming: Whether claim() comes with the first token (True) or
+                only with the full reply
+
+        Returns:
+            The winning attempt's result
+
+        Raises:
+            The primary's error if both requests fail
+        """
+        legs: List[Tuple[str, asyncio.Task]] = []
+        claimed = asyncio.Event()
+        winner: Dict[str, Optional[str]] = {"name": None}
+        started_at: Dict[str, float] = {}
+
+        def make_claim(name: str) -> Callable[[], bool]:
+            def claim() -> bool:
+                if winner["name"] is None:
+                    winner["name"] = name
+                    self.record_claim(name, time.monotonic() - started_at[name], streaming)
+                    claimed.set()
+                    # Cancel the other request right away
+                    for other_name, task in legs:
+                        if other_name != name and not task.done():
+                            task.cancel()
+                return winner["name"] == name
+            return claim
+
+        def launch(leg: Tuple[str, Any]) -> asyncio.Task:
+            name, client = leg
+            self.stats_for(name).requests += 1
+            started_at[name] = time.monotonic()
+            task = asyncio.create_task(attempt(client, make_claim(name)))
+            legs.append((name, task))
+            return task
+
+        primary_task = launch(primary)
+        claim_waiter = asyncio.create_task(claimed.wait())
+        try:
+            # Give the primary its p95 head start; a fast failure hedges immediately
+            await asyncio.wait(
+                [primary_task, claim_waiter],
+                timeout=self.hedge_delay(primary[0], streaming),
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if not claimed.is_set():
+                if primary_task.done():
+                    logger.warning("Hedge: '%s' failed, sending to '%s'", primary[0], secondary[0])
+                else:
+                    logger.info("Hedge: no first token from '%s' yet, also sending to '%s'", primary[0], secondary[0])
+                self.stats_for(primary[0]).hedges_fired += 1
+                launch(secondary)
+
+            # Wait for a winner, or for every request to fail
+            while not claimed.is_set():
+                pending = [task for _, task in legs if not task.done()]
+                if not pending:
+                    break
+                await asyncio.wait(pending + [claim_waiter], return_when=asyncio.FIRST_COMPLETED)
+
+            if winner["name"] is not None:
+                winning_task = dict(legs)[winner["name"]]
+                result = await winning_task
+                self.stats_for(winner["name"]).wins += 1
+                if winner["name"] != primary[0]:
+                    self.stats_for(secondary[0]).hedge_wins += 1
+                return result
+
+            # Nobody claimed: every request failed (or finished without claiming)
+            errors = []
+            for _, task in legs:
+                if task.cancelled():
+                    continue
+                if task.exception() is None:
+                    return task.result()
+                errors.append(task.exception())
+            if not errors:
+                raise asyncio.CancelledError()
+            # The primary's error, unless it was cancelled
+            raise errors[0]
+        finally:
+            claim_waiter.cancel()
+            for _, task in legs:
+                if not task.done():
+                    task.cancel()
+            # Let cancelled requests release their scheduler slots
+            await asyncio.gather(*(task for _, task in legs), return_exceptions=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {name: stats.summary() for name, stats in list(self.stats.items())}
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""Test retries, circuit breakers and failover between saved API configs."""
+import sys
+import os
+import time
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from openai_client import OpenAIClient
+from api_resilience import ResilientCaller, RetryPolicy, CircuitBreaker, CircuitOpenError, classify_error
+from fake_provider import fake_provider, completion, error, base_url, make_bot
+
+
+def scripted(script):
+    """Fake provider that answers with the next status code from script.
+
+    The last entry repeats once the script runs out.
+    """
+    def respond(handler, request):
+        status = script[min(len(handler.server.requests), len(script)) - 1]
+        if status == 200:
+            handler.send_json(completion(f"Hello from port {handler.server.server_port}"))
+        else:
+            headers = {"retry-after-ms": "10"} if status == 429 else None
+            handler.send_json(error(f"status {status}"), status, headers)
+
+    return fake_provider(respond)
+
+
+def client_for(server):
+    return OpenAIClient(api_key="sk-test", base_url=base_url(server), model="test-model")
+
+
+async def complete(client):
+    return await client.chat_completion(messages=[{"role": "user", "content": "Hi"}])
+
+
+FAST_POLICY = RetryPolicy(max_retries=2, base_delay=0.01, max_delay=0.05)
+
+
+def test_retries_transient_errors():
+    """429 and 5xx responses are retried on the same endpoint."""
+    with scripted([429, 503, 200]) as server:
+        caller = ResilientCaller(FAST_POLICY)
+        result = asyncio.run(caller.call([("primary", client_for(server))], complete))
+        assert result.startswith("Hello from port")
+        assert len(server.requests) == 3
+        assert caller.retries == 2
+        assert caller.snapshot()["circuit_breakers"][base_url(server)]["state"] == "closed"
+    print("✓ Transient errors are retried")
+
+
+def test_non_transient_errors_are_not_retried():
+    """Authentication errors are raised immediately with the friendly message."""
+    with scripted([401]) as server:
+        caller = ResilientCaller(FAST_POLICY)
+        try:
+            asyncio.run(caller.call([("primary", client_for(server))], complete))
+            assert False, "Expected an authentication error"
+        except Exception as e:
+            assert "API authentication failed" in str(e)
+            assert classify_error(e) == (False, None)
+        assert len(server.requests) == 1
+    print("✓ Non-transient errors are not retried")
+
+
+def test_failover_to_next_config():
+    """When the primary keeps failing, the next config in the list answers."""
+    with scripted([500]) as broken, scripted([200]) as healthy:
+        caller = ResilientCaller(FAST_POLICY)
+        result = asyncio.run(caller.call(
+            [("primary", client_for(broken)), ("backup", client_for(healthy))],
+            complete
+        ))
+        assert result == f"Hello from port {healthy.server_port}"
+        assert len(broken.requests) == 3
+        assert caller.failovers == 1
+    print("✓ Requests fail over to the next API config")
+
+
+def test_circuit_opens_and_skips_endpoint():
+    """After repeated failures the endpoint is skipped until the cool-down ends."""
+    with scripted([500]) as broken, scripted([200]) as healthy:
+        caller = ResilientCaller(RetryPolicy(max_retries=0), failure_threshold=2, reset_timeout=60)
+        candidates = [("primary", client_for(broken)), ("backup", client_for(healthy))]
+
+        async def run():
+            for _ in range(4):
+                await caller.call(candidates, complete)
+
+        asyncio.run(run())
+        # Two failures open the circuit; later requests go straight to the backup
+        assert len(broken.requests) == 2
+        breaker = caller.breaker(candidates[0][1].base_url)
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.times_opened == 1
+
+        try:
+            asyncio.run(caller.call(candidates[:1], complete))
+            assert False, "Expected CircuitOpenError"
+        except CircuitOpenError:
+            pass
+        assert len(broken.requests) == 2
+    print("✓ Circuit breaker stops traffic to a failing endpoint")
+
+
+def test_circuit_half_open_probe():
+    """After the cool-down one probe is allowed; success closes the circuit."""
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.02)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow(), "Only one probe at a time"
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+    print("✓ Half-open circuit lets a single probe through")
+
+
+def test_backoff_respects_retry_after():
+    """Backoff is jittered, capped, and never shorter than the provider asks."""
+    policy = RetryPolicy(max_retries=3, base_delay=1.0, max_delay=5.0)
+    for attempt in range(6):
+        assert 0 <= policy.delay(attempt) <= 5.0
+    assert policy.delay(0, retry_after=3.0) >= 3.0
+    assert policy.delay(0, retry_after=60.0) == 5.0
+    print("✓ Backoff respects retry-after and max_delay")
+
+
+def test_bot_failover_candidates():
+    """Channel failover lists take precedence over server lists; unknown names are skipped."""
+    with tempfile.TemporaryDirectory() as tmp:
+        api = {"api_key": "sk-test", "base_url": "http://127.0.0.1:1/v1", "model": "m"}
+        bot = make_bot(
+            tmp,
+            saved_api_configs={"a": api, "b": dict(api, base_url="http://127.0.0.1:2/v1"), "c": api},
+            channel_configs={"111": {"api_config": "a", "failover_api_configs": ["a", "b", "missing"]}},
+            server_configs={"999": {"api_config": "", "failover_api_configs": ["c"]}}
+        )
+
+        assert [name for name, _ in bot.get_api_candidates(111, 999)] == ["a", "b"]
+        assert [name for name, _ in bot.get_api_candidates(222, 999)] == ["default", "c"]
+        assert [name for name, _ in bot.get_api_candidates(333)] == ["default"]
+        assert bot.get_api_candidates(333)[0][1] is bot.openai_client
+        assert bot.resilience.policy.max_retries == 2
+    print("✓ Bot builds failover candidates from channel and server configs")
+
+
+if __name__ == "__main__":
+    try:
+        test_retries_transient_errors()
+        test_non_transient_errors_are_not_retried()
+        test_failover_to_next_config()
+        test_circuit_opens_and_skips_endpoint()
+        test_circuit_half_open_probe()
+        test_backoff_respects_retry_after()
+        test_bot_failover_candidates()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Test that OpenAIClient.chat_completion does not block the event loop."""
+import sys
+import os
+import time
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from openai_client import OpenAIClient
+from fake_provider import fake_provider, completion, base_url
+
+# How long the fake provider takes to answer each request
+PROVIDER_DELAY = 0.5
+
+
+def slow_completion(handler, request):
+    """Fake OpenAI-compatible endpoint that answers after a fixed delay."""
+    time.sleep(PROVIDER_DELAY)
+    handler.send_json(completion(
+        "Hello from the slow proxy", usage={"prompt_tokens": 5, "completion_tokens": 5, "total_tokens": 10}
+    ))
+
+
+async def measure_loop_lag(stop_event: asyncio.Event, interval: float = 0.01) -> float:
+    """Return the worst observed delay of a periodic tick on the event loop."""
+    worst = 0.0
+    while not stop_event.is_set():
+        before = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - before - interval)
+    return worst
+
+
+async def run_concurrent_generations(client: OpenAIClient, count: int):
+    stop_event = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(stop_event))
+    
+    start = time.perf_counter()
+    responses = await asyncio.gather(*[
+        client.chat_completion(messages=[{"role": "user", "content": f"Hello {i}"}])
+        for i in range(count)
+    ])
+    elapsed = time.perf_counter() - start
+    
+    stop_event.set()
+    worst_lag = await lag_task
+    return responses, elapsed, worst_lag
+
+
+def test_chat_completion_is_non_blocking():
+    """Concurrent generations should overlap and keep the event loop responsive."""
+    print("\n=== Testing non-blocking chat_completion ===\n")
+    
+    with fake_provider(slow_completion) as server:
+        client = OpenAIClient(api_key="sk-test", base_url=base_url(server), model="test-model")
+        
+        count = 4
+        responses, elapsed, worst_lag = asyncio.run(run_concurrent_generations(client, count))
+        
+        print(f"  Generations:        {count} x {PROVIDER_DELAY}s")
+        print(f"  Total wall time:    {elapsed:.2f}s (serial would be {count * PROVIDER_DELAY:.2f}s)")
+        print(f"  Worst event-loop lag: {worst_lag * 1000:.1f}ms")
+        
+        assert responses == ["Hello from the slow proxy"] * count
+        # Requests must overlap instead of running one after another
+        assert elapsed < count * PROVIDER_DELAY * 0.75, f"Generations ran serially ({elapsed:.2f}s)"
+        # The loop must never be frozen for the duration of a provider call
+        assert worst_lag < PROVIDER_DELAY / 2, f"Event loop blocked for {worst_lag:.2f}s"
+        
+        print("\n✓ chat_completion keeps the event loop responsive")
+
+
+def test_update_config_applies_to_async_client():
+    """update_config must keep the sync and async clients in step."""
+    client = OpenAIClient(api_key="sk-initial", base_url="https://api.openai.com/v1")
+    client.update_config(api_key="Bearer sk-updated", base_url=" http://localhost:1234/v1 ")
+    
+    assert client.async_client.api_key == "sk-updated"
+    assert "localhost:1234" in str(client.async_client.base_url)
+    assert "localhost:1234" in str(client.client.base_url)
+    print("✓ update_config applies to both clients")
+
+
+if __name__ == "__main__":
+    try:
+        test_chat_completion_is_non_blocking()
+        test_update_config_applies_to_async_client()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
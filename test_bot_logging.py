@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""Test the queued, leveled logging of the bot's hot paths."""
+import sys
+import os
+import io
+import json
+import queue
+import logging
+import tempfile
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bot_logging import bot_logging, get_logger, SamplingFilter, DroppingQueueHandler
+
+
+def flush_logs():
+    """Wait until the listener has written everything queued so far."""
+    if bot_logging.listener is not None:
+        bot_logging.handler.queue.join()
+
+
+def make_bot(tmp, logging_config):
+    from config_manager import ConfigManager
+    from discord_bot import DiscordBot
+    from lorebook_manager import LorebookManager
+
+    config_path = os.path.join(tmp, "config.json")
+    with open(config_path, "w") as f:
+        json.dump({"logging": logging_config}, f)
+    bot = DiscordBot(ConfigManager(config_path))
+    bot.lorebook_manager = LorebookManager(os.path.join(tmp, "lorebook"))
+    return bot
+
+
+def test_sampling_filter():
+    sampler = SamplingFilter(0.25)
+    record = logging.LogRecord("bot.lorebook.entries", logging.DEBUG, __file__, 1, "x", None, None)
+    passed = [sampler.filter(record) for _ in range(20)]
+    assert sum(passed) == 5
+    assert sampler.sampled_out == 15
+    sampler.rate = 1.0
+    assert all(sampler.filter(record) for _ in range(5))
+    sampler.rate = 0.0
+    assert not any(sampler.filter(record) for _ in range(5))
+    print("✓ Sampling keeps the configured fraction of records")
+
+
+def test_queue_handler_never_blocks():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=2))
+    test_logger = logging.getLogger("test_bot_logging.drop")
+    test_logger.propagate = False
+    test_logger.addHandler(handler)
+    for i in range(5):
+        test_logger.warning("Message %s", i)
+    test_logger.removeHandler(handler)
+    assert handler.queued == 2
+    assert handler.dropped == 3
+    # Arguments are merged on the caller's side, formatting is left to the listener
+    record = handler.queue.get_nowait()
+    assert record.msg == "Message 0" and record.args is None
+    print("✓ A full queue drops records instead of blocking")
+
+
+def test_levels_and_lorebook_sampling():
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = make_bot(tmp, {"level": "warning", "levels": {"lorebook": "DEBUG", "chat": "bogus"},
+                             "lorebook_entry_sample_rate": 0.5})
+        assert bot.get_logging_config()["level"] == "WARNING"
+        assert bot.get_logging_config()["levels"] == {"lorebook": "DEBUG"}
+        assert get_logger("lorebook").isEnabledFor(logging.DEBUG)
+        assert not get_logger("chat").isEnabledFor(logging.INFO)
+        assert not get_logger("context").isEnabledFor(logging.INFO)
+
+        for i in range(4):
+            bot.lorebook_manager.add_or_update_entry(f"Place {i}", f"Lore {i}.", keywords=["aldoria"])
+        output = io.StringIO()
+        with redirect_stdout(output):
+            sampled_out = bot_logging.entry_sampler.sampled_out
+            section = bot.lorebook_manager.get_system_prompt_section("We reach Aldoria.")
+            flush_logs()
+        assert "**Place 3:**" in section
+        lines = output.getvalue().splitlines()
+        assert any("bot.lorebook: Total entries to include: 4" in line for line in lines)
+        # Half of the per-entry lines
+        assert len([line for line in lines if "Added keyword-matched entry" in line]) == 2
+        assert bot_logging.entry_sampler.sampled_out == sampled_out + 2
+        assert not any("bot.chat" in line for line in lines)
+
+        # Levels can be changed through the web config
+        from web_server import WebServer
+        client = WebServer(bot.config_manager, bot).app.test_client()
+        response = client.post('/api/config', json={"logging": {"level": "INFO", "levels": {"lorebook": ""}}})
+        assert response.get_json()["status"] == "success"
+        assert not get_logger("lorebook").isEnabledFor(logging.DEBUG)
+        assert get_logger("chat").isEnabledFor(logging.INFO)
+        metrics = client.get('/api/metrics').get_json()
+        assert metrics["logging"]["levels"]["lorebook"] == "INFO"
+        assert metrics["logging"]["dropped"] == 0
+        assert metrics["logging"]["queued"] > 0
+        bot.config_manager.flush()
+    print("✓ Subsystem levels and lorebook sampling follow the config")
+
+
+def test_thinking_filter_dump_is_debug():
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = make_bot(tmp, {"level": "INFO"})
+        chat_logger = get_logger("chat")
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        chat_logger.addHandler(handler)
+        try:
+            chat_logger.debug("Full response (before filtering):\n%s", "<think>x</think>y")
+            assert records == []
+            bot.config_manager.update_config({"logging": {"levels": {"chat": "DEBUG"}}})
+            bot.configure_logging()
+            chat_logger.debug("Full response (before filtering):\n%s", "<think>x</think>y")
+            assert len(records) == 1
+        finally:
+            chat_logger.removeHandler(handler)
+            bot.config_manager.update_config({"logging": {"levels": {"chat": ""}}})
+            bot.configure_logging()
+            bot.config_manager.flush()
+    print("✓ Full responses are only logged at debug level")
+
+
+if __name__ == "__main__":
+    try:
+        test_sampling_filter()
+        test_queue_handler_never_blocks()
+        test_levels_and_lorebook_sampling()
+        test_thinking_filter_dump_is_debug()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
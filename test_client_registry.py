@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Test that OpenAI clients are pooled per saved API config."""
+import sys
+import os
+import json
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from openai_client import OpenAIClientRegistry
+from config_manager import ConfigManager
+from discord_bot import DiscordBot
+from web_server import WebServer
+
+PROXY_CONFIG = {"api_key": "sk-proxy", "base_url": "http://localhost:5001/v1", "model": "proxy-model"}
+
+
+def test_registry_reuses_client_for_same_config():
+    """The same config name and settings must return the same client."""
+    registry = OpenAIClientRegistry()
+    first = registry.get("proxy", PROXY_CONFIG)
+    second = registry.get("proxy", dict(PROXY_CONFIG))
+    assert first is second
+    assert first.model == "proxy-model"
+    assert registry.cached_names() == ["proxy"]
+    print("✓ Client reused for unchanged config")
+
+
+def test_registry_rebuilds_client_when_config_changes():
+    """Editing a config's key, URL or model must produce a new client."""
+    registry = OpenAIClientRegistry()
+    first = registry.get("proxy", PROXY_CONFIG)
+    changed = dict(PROXY_CONFIG, model="other-model")
+    second = registry.get("proxy", changed)
+    assert first is not second
+    assert second.model == "other-model"
+    assert registry.get("proxy", changed) is second
+    print("✓ Client rebuilt when config changes")
+
+
+def test_registry_invalidate():
+    """Invalidation drops one config or all of them."""
+    registry = OpenAIClientRegistry()
+    first = registry.get("proxy", PROXY_CONFIG)
+    registry.get("other", PROXY_CONFIG)
+
+    registry.invalidate("proxy")
+    assert registry.cached_names() == ["other"]
+    assert registry.get("proxy", PROXY_CONFIG) is not first
+
+    registry.invalidate()
+    assert registry.cached_names() == []
+    print("✓ Invalidation drops cached clients")
+
+
+def test_registry_closes_retired_clients():
+    """Replaced and invalidated clients are closed once no request uses them."""
+    registry = OpenAIClientRegistry()
+    replaced = registry.get("proxy", PROXY_CONFIG)
+    busy = registry.get("other", PROXY_CONFIG)
+    pooled = registry.get("proxy", dict(PROXY_CONFIG, model="other-model"))
+    registry.invalidate("other")
+    busy.in_flight = 1
+
+    assert asyncio.run(registry.close_idle()) == 1
+    assert replaced.async_client.is_closed()
+    assert not busy.async_client.is_closed()
+    busy.in_flight = 0
+    assert asyncio.run(registry.close_idle()) == 1
+    assert busy.async_client.is_closed()
+    assert asyncio.run(registry.close_idle()) == 0
+
+    # Shutdown closes the pooled clients too
+    assert not pooled.async_client.is_closed()
+    asyncio.run(registry.close())
+    assert pooled.async_client.is_closed()
+    assert registry.cached_names() == []
+    print("✓ Retired clients are closed once idle, and every client on shutdown")
+
+
+def test_bot_reuses_client_for_channel_and_server():
+    """Channels and servers sharing a saved config share one client."""
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = os.path.join(tmp, "config.json")
+        with open(config_path, "w") as f:
+            json.dump({
+                "saved_api_configs": {"proxy": PROXY_CONFIG},
+                "channel_configs": {"111": {"api_config": "proxy"}},
+                "server_configs": {"999": {"api_config": "proxy"}}
+            }, f)
+        bot = DiscordBot(ConfigManager(config_path))
+
+        channel_client = bot.get_openai_client_for_channel(111)
+        assert channel_client is bot.get_openai_client_for_channel(111)
+        assert channel_client is bot.get_openai_client_for_channel(222, 999)
+        assert bot.get_openai_client_for_channel(333) is bot.openai_client
+
+        # Saving the config through the web server drops the pooled client
+        web_server = WebServer(bot.config_manager, bot)
+        web_server.app.testing = True
+        response = web_server.app.test_client().post(
+            "/api/api_configs/proxy",
+            json=dict(PROXY_CONFIG, model="new-model")
+        )
+        assert response.status_code == 200
+        new_client = bot.get_openai_client_for_channel(111)
+        assert new_client is not channel_client
+        assert new_client.model == "new-model"
+        bot.config_manager.flush()
+    print("✓ Bot shares pooled clients across channels and servers")
+
+
+if __name__ == "__main__":
+    try:
+        test_registry_reuses_client_for_same_config()
+        test_registry_rebuilds_client_when_config_changes()
+        test_registry_invalidate()
+        test_registry_closes_retired_clients()
+        test_bot_reuses_client_for_channel_and_server()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""Test debounced, atomic, background persistence of config.json."""
+import sys
+import os
+import json
+import time
+import gc
+import weakref
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config_manager import ConfigManager
+
+
+def make_config(tmp, save_delay=0.2):
+    config_path = os.path.join(tmp, "config.json")
+    with open(config_path, "w") as f:
+        json.dump({"channel_configs": {}}, f)
+    return ConfigManager(config_path, save_delay=save_delay)
+
+
+def read(config):
+    with open(config.config_path, "r") as f:
+        return json.load(f)
+
+
+def test_writes_are_coalesced():
+    with tempfile.TemporaryDirectory() as tmp:
+        config = make_config(tmp)
+        for channel_id in range(2000):
+            config.set(f'channel_configs.{channel_id}.character', f'Character {channel_id}')
+        config.save_api_config("main", "key", "https://main.example/v1", "m1")
+        assert config.save_requests == 2001
+        # Nothing written yet; the writer waits for the window to close
+        assert config.writes == 0
+        assert read(config) == {"channel_configs": {}}
+        assert config.persistence_snapshot()["pending"] is True
+
+        for _ in range(100):
+            if config.writes:
+                break
+            time.sleep(0.02)
+        assert config.writes == 1
+        saved = read(config)
+        assert len(saved["channel_configs"]) == 2000
+        assert saved["saved_api_configs"]["main"]["model"] == "m1"
+        assert not config.flush()
+        # No temporary files are left behind
+        assert os.listdir(tmp) == ["config.json"]
+    print("✓ Thousands of changes are written once")
+
+
+def test_flush_and_concurrent_writers():
+    with tempfile.TemporaryDirectory() as tmp:
+        config = make_config(tmp, save_delay=60)
+        os.chmod(config.config_path, 0o644)
+
+        def edit(offset):
+            for i in range(200):
+                config.update_config({"channel_configs": {str(offset + i): {"api_config": "main"}}})
+
+        threads = [threading.Thread(target=edit, args=(offset,)) for offset in (0, 1000, 2000, 3000)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert config.writes == 0
+        # Shutdown doesn't wait for the window
+        assert config.flush()
+        assert len(read(config)["channel_configs"]) == 800
+        assert config.writes == 1
+        assert os.stat(config.config_path).st_mode & 0o777 == 0o644
+
+        # save_config still writes right away
+        config.config["auto_context_limit"] = 100
+        config.save_config()
+        assert read(config)["auto_context_limit"] == 100
+        assert not config.flush()
+
+        # Without a delay every change is written immediately
+        config.save_delay = 0
+        config.set("manual_send_enabled", True)
+        assert read(config)["manual_send_enabled"] is True
+    print("✓ Flush writes pending changes immediately")
+
+
+def test_failed_write_keeps_old_file():
+    with tempfile.TemporaryDirectory() as tmp:
+        config = make_config(tmp, save_delay=60)
+        config.set("channel_configs.1.character", "Luna")
+        config.flush()
+        # Something that can't be serialized fails before config.json is touched
+        config.config["broken"] = object()
+        try:
+            config.save_config()
+            assert False, "Unserializable config should raise"
+        except TypeError:
+            pass
+        assert read(config)["channel_configs"]["1"]["character"] == "Luna"
+        assert os.listdir(tmp) == ["config.json"]
+    print("✓ A failed save leaves config.json intact")
+
+
+def test_failed_write_is_retried():
+    with tempfile.TemporaryDirectory() as tmp:
+        config = make_config(tmp, save_delay=0.05)
+        write_file = config._write_file
+        attempts = []
+
+        def flaky_write(data):
+            attempts.append(time.monotonic())
+            if len(attempts) < 3:
+                raise OSError("disk full")
+            write_file(data)
+
+        config._write_file = flaky_write
+        config.set("channel_configs.1.character", "Luna")
+        writer = config._writer
+        writer.join(timeout=5)
+        assert not writer.is_alive()
+        assert len(attempts) == 3
+        assert config.writes == 1 and config.failed_writes == 0
+        assert not config.persistence_snapshot()["pending"]
+        assert read(config)["channel_configs"]["1"]["character"] == "Luna"
+        # Each retry waits longer than the one before
+        assert attempts[2] - attempts[1] > attempts[1] - attempts[0] >= 0.04
+    print("✓ A failed write stays pending and is retried with a backoff")
+
+
+def test_writer_stops_when_saved():
+    """Once everything is saved the writer thread exits and nothing keeps the manager alive."""
+    import config_manager
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config = make_config(tmp, save_delay=60)
+        config.set("channel_configs.1.character", "Luna")
+        writer = config._writer
+        assert writer.is_alive()
+        assert config in config_manager._writing_managers
+        assert config.flush()
+        writer.join(timeout=5)
+        assert not writer.is_alive()
+        assert config._writer is None
+        assert config not in config_manager._writing_managers
+
+        # The next change starts a new writer
+        config.set("channel_configs.2.character", "Mira")
+        next_writer = config._writer
+        assert next_writer is not None and next_writer is not writer
+        config.flush()
+        next_writer.join(timeout=5)
+        assert read(config)["channel_configs"]["2"]["character"] == "Mira"
+
+        reference = weakref.ref(config)
+        del config
+        gc.collect()
+        assert reference() is None
+    print("✓ The writer thread stops once everything is saved")
+
+
+def test_web_bulk_edits():
+    from web_server import WebServer
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config = make_config(tmp, save_delay=60)
+        client = WebServer(config).app.test_client()
+        for channel_id in range(50):
+            response = client.post(f'/api/channel_config/{channel_id}',
+                                   json={"preset": "", "api_config": "", "character": "Luna"})
+            assert response.get_json()["status"] == "success"
+        assert client.post('/api/cp_total', json={"cp_total": 40}).get_json()["status"] == "success"
+        assert config.writes == 0
+        assert config.save_requests == 50 * 3 + 1
+        config.flush()
+        saved = read(config)
+        assert len(saved["channel_configs"]) == 50
+        assert saved["cp_tracking"]["cp_total"] == 40
+
+        assert config.resolve_channel("7").character == "Luna"
+        assert client.delete('/api/channel_config/7').get_json()["status"] == "success"
+        assert client.delete('/api/channel_config/7').status_code == 404
+        assert config.resolve_channel("7").character is None
+        config.flush()
+        assert "7" not in read(config)["channel_configs"]
+    print("✓ Web UI edits are persisted behind")
+
+
+if __name__ == "__main__":
+    try:
+        test_writes_are_coalesced()
+        test_flush_and_concurrent_writers()
+        test_failed_write_keeps_old_file()
+        test_failed_write_is_retried()
+        test_writer_stops_when_saved()
+        test_web_bulk_edits()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
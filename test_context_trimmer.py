@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""Test incremental context trimming against the previous trimming algorithm."""
+import sys
+import os
+import io
+import json
+import random
+import tempfile
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from context_trimmer import ContextTrimmer, HistoryTokenIndex, HistoryWindow, trim_to_fit
+from token_budget import BudgetPlanner
+from benchmark_context_trimming import previous_trim, budget_trim, make_history
+
+
+def count_tokens(text):
+    return len(text) // 4
+
+
+def quiet(function, *args):
+    with redirect_stdout(io.StringIO()):
+        return function(*args)
+
+
+def test_matches_previous_algorithm():
+    """Same result as the old trimming for any mix of system, example and history messages."""
+    rng = random.Random(7)
+    trimmer = ContextTrimmer()
+    planner = BudgetPlanner()
+    for case in range(300):
+        head = []
+        for _ in range(rng.randint(0, 4)):
+            role = rng.choice(["system", "system", "user", "assistant"])
+            head.append({"role": role, "content": "x" * rng.randint(0, 400)})
+        history = [{"role": rng.choice(["user", "assistant", "system"]), "content": "y" * rng.randint(0, 300)}
+                   for _ in range(rng.randint(0, 40))]
+        last = {"role": "user", "content": "z" * rng.randint(0, 200)}
+        max_tokens = rng.randint(0, 3000)
+
+        expected = quiet(previous_trim, head + history + [last], max_tokens, count_tokens)
+        assert quiet(trim_to_fit, head + history + [last], max_tokens, count_tokens) == expected
+
+        # The indexed budget cut keeps the same history when the head is all system messages
+        head = [message for message in head if message["role"] == "system"]
+        history = [message for message in history if message["role"] != "system"]
+        expected = previous_trim(head + history + [last], max_tokens, count_tokens)
+        assert budget_trim(trimmer, planner, case, head, history, last, max_tokens, count_tokens) == expected, case
+    print("✓ Trimming matches the previous algorithm")
+
+
+def test_index_follows_history_edits():
+    """Appends, swipes ([-1] replacement), pops and the 20-message cap update the index incrementally."""
+    counted = []
+
+    def counting(text):
+        counted.append(text)
+        return count_tokens(text)
+
+    index = HistoryTokenIndex(counting)
+    history = make_history(5000)
+    index.sync(history)
+    assert len(counted) == 5000
+
+    history.append({"role": "user", "content": "new question"})
+    history.append({"role": "assistant", "content": "first answer"})
+    index.sync(history)
+    history[-1] = {"role": "assistant", "content": "swiped answer"}
+    index.sync(history)
+    reply = history.pop()
+    index.sync(history)
+    history.append(reply)
+    index.sync(history)
+    assert len(counted) == 5004
+    assert index.total() == sum(count_tokens(m["content"]) for m in history)
+
+    # Dropping old messages from the front doesn't recount anything
+    history = history[-20:]
+    index.sync(history)
+    assert len(counted) == 5004
+    assert len(index) == 20
+    assert index.total() == sum(count_tokens(m["content"]) for m in history)
+    assert index.rebuilds == 1
+
+    # A different history (e.g. !setcontext reloading the channel) rebuilds
+    index.sync(make_history(10))
+    assert index.rebuilds == 2
+    assert index.total() == sum(count_tokens(m["content"]) for m in make_history(10))
+    print("✓ Index follows history edits without recounting")
+
+
+def test_fitting_start_and_window():
+    history = [{"role": "user", "content": "a" * 40} for _ in range(10)]  # 10 tokens each
+    index = HistoryTokenIndex(count_tokens)
+    index.sync(history)
+    assert index.fitting_start(1000) == 0
+    assert index.fitting_start(35) == 7
+    assert index.tokens_from(7) == 30
+    assert index.fitting_start(0) == 10
+
+    window = HistoryWindow(history, 7)
+    assert len(window) == 3
+    assert list(window) == history[7:]
+    assert window[-1] is history[-1]
+    assert window[1:] == history[8:]
+    print("✓ Cut point found by binary search, kept history is a view")
+
+
+def test_bot_trims_incrementally():
+    """build_chat_messages counts each history message once across turns."""
+    from config_manager import ConfigManager
+    from discord_bot import DiscordBot
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = os.path.join(tmp, "config.json")
+        with open(config_path, "w") as f:
+            json.dump({"openai_config": {"api_key": "sk-test", "base_url": "http://127.0.0.1:1/v1", "model": "m"}}, f)
+        bot = DiscordBot(ConfigManager(config_path))
+        bot.conversations[111] = make_history(5000)
+
+        messages = quiet(bot.build_chat_messages, 111, "What happens next?")
+        assert messages[-1] == {"role": "user", "content": "What happens next?"}
+        assert messages[-2] is bot.conversations[111][-1]
+        assert sum(bot.estimate_tokens(m["content"]) for m in messages) <= 2000
+
+        bot.conversations[111].append({"role": "user", "content": "What happens next?"})
+        bot.conversations[111].append({"role": "assistant", "content": "The door opens."})
+        quiet(bot.build_chat_messages, 111, "And then?")
+        index = bot.context_trimmer.indexes[(111, "m")]
+        assert index.rebuilds == 1
+        assert index.counted == 5002
+    print("✓ Bot trims history incrementally")
+
+
+if __name__ == "__main__":
+    try:
+        test_matches_previous_algorithm()
+        test_index_follows_history_edits()
+        test_fitting_start_and_window()
+        test_bot_trims_incrementally()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""Test the generation scheduler (concurrency caps, priority, fair queuing)."""
+import sys
+import os
+import json
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generation_scheduler import GenerationScheduler, PRIORITY_CHAT, PRIORITY_SWIPE
+from generation_metrics import GenerationMetrics
+
+ENDPOINT = "http://localhost:5001/v1"
+
+
+async def _hold_slot(scheduler, release_event, guild_id=None):
+    """Occupy a slot until release_event is set."""
+    async with scheduler.slot(ENDPOINT, guild_id):
+        await release_event.wait()
+
+
+def _serve_order(scheduler, requests):
+    """Queue requests behind a busy slot and return the order they are served in.
+
+    requests is a list of (label, guild_id, priority).
+    """
+    async def run():
+        order = []
+        release = asyncio.Event()
+        holder = asyncio.create_task(_hold_slot(scheduler, release))
+        await asyncio.sleep(0)
+
+        async def request(label, guild_id, priority):
+            async with scheduler.slot(ENDPOINT, guild_id, priority):
+                order.append(label)
+                await asyncio.sleep(0)
+
+        tasks = []
+        for label, guild_id, priority in requests:
+            tasks.append(asyncio.create_task(request(label, guild_id, priority)))
+            await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(holder, *tasks)
+        return order
+
+    return asyncio.run(run())
+
+
+def test_concurrency_cap_per_endpoint():
+    """No more than the configured number of requests run at once per endpoint."""
+    scheduler = GenerationScheduler(default_limit=2, endpoint_limits={"http://other/v1/": 3})
+
+    async def run():
+        running = {"now": 0, "peak": 0}
+
+        async def request(endpoint):
+            async with scheduler.slot(endpoint):
+                running["now"] += 1
+                running["peak"] = max(running["peak"], running["now"])
+                await asyncio.sleep(0.02)
+                running["now"] -= 1
+
+        await asyncio.gather(*(request(ENDPOINT) for _ in range(6)))
+        main_peak = running["peak"]
+        running["peak"] = 0
+        await asyncio.gather(*(request("http://other/v1") for _ in range(6)))
+        return main_peak, running["peak"]
+
+    main_peak, other_peak = asyncio.run(run())
+    assert main_peak == 2, f"Expected 2 concurrent requests, got {main_peak}"
+    assert other_peak == 3, f"Expected endpoint override of 3, got {other_peak}"
+    assert scheduler.snapshot()["endpoints"][ENDPOINT]["active"] == 0
+    print("✓ Concurrency is capped per endpoint")
+
+
+def test_chat_served_before_swipes():
+    """A fresh !chat jumps ahead of queued swipes."""
+    scheduler = GenerationScheduler(default_limit=1)
+    order = _serve_order(scheduler, [
+        ("swipe1", 1, PRIORITY_SWIPE),
+        ("swipe2", 1, PRIORITY_SWIPE),
+        ("chat", 1, PRIORITY_CHAT),
+    ])
+    assert order == ["chat", "swipe1", "swipe2"], order
+    print("✓ !chat is served before swipes")
+
+
+def test_busy_guild_does_not_starve_others():
+    """Guilds are interleaved instead of served strictly first-come-first-served."""
+    scheduler = GenerationScheduler(default_limit=1)
+    order = _serve_order(scheduler, [
+        ("a1", "A", PRIORITY_CHAT),
+        ("a2", "A", PRIORITY_CHAT),
+        ("a3", "A", PRIORITY_CHAT),
+        ("a4", "A", PRIORITY_CHAT),
+        ("b1", "B", PRIORITY_CHAT),
+    ])
+    assert order.index("b1") <= 1, order
+    assert [label for label in order if label.startswith("a")] == ["a1", "a2", "a3", "a4"]
+    print("✓ A busy guild doesn't starve other guilds")
+
+
+def test_guild_weights():
+    """A guild with weight 2 gets about twice the share of a guild with weight 1."""
+    scheduler = GenerationScheduler(default_limit=1, guild_weights={"A": 2})
+    requests = []
+    for i in range(6):
+        requests.append((f"a{i}", "A", PRIORITY_CHAT))
+        requests.append((f"b{i}", "B", PRIORITY_CHAT))
+    order = _serve_order(scheduler, requests)
+    first_six = order[:6]
+    assert sum(1 for label in first_six if label.startswith("a")) == 4, order
+    print("✓ Guild weights control the share of the queue")
+
+
+def test_queue_position_and_metrics():
+    """Queued requests report their position and wait times are recorded."""
+    metrics = GenerationMetrics()
+    scheduler = GenerationScheduler(default_limit=1, metrics=metrics)
+
+    async def run():
+        positions = []
+        release = asyncio.Event()
+        holder = asyncio.create_task(_hold_slot(scheduler, release))
+        await asyncio.sleep(0)
+
+        async def on_queued(position):
+            positions.append(position)
+
+        async def request(priority):
+            async with scheduler.slot(ENDPOINT, 1, priority, on_queued):
+                pass
+
+        tasks = [asyncio.create_task(request(PRIORITY_SWIPE))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(request(PRIORITY_SWIPE)))
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(request(PRIORITY_CHAT)))
+        await asyncio.sleep(0)
+        depth = scheduler.queue_depth(ENDPOINT)
+        snapshot = scheduler.snapshot()
+        release.set()
+        await asyncio.gather(holder, *tasks)
+        return positions, depth, snapshot
+
+    positions, depth, snapshot = asyncio.run(run())
+    assert positions == [1, 2, 1], positions
+    assert depth == 3
+    assert snapshot["queue_depth"] == 3
+    assert snapshot["endpoints"][ENDPOINT]["queued_by_priority"] == {"chat": 1, "swipe": 2, "background": 0}
+    latency = metrics.snapshot()["latency"]
+    assert latency["queue_wait"]["count"] == 4
+    assert latency["queue_wait_swipe"]["count"] == 2
+    print("✓ Queue position, depth and wait times are reported")
+
+
+def test_cancelled_request_frees_its_place():
+    """Cancelling a queued request neither leaks a slot nor blocks the queue."""
+    scheduler = GenerationScheduler(default_limit=1)
+
+    async def run():
+        release = asyncio.Event()
+        holder = asyncio.create_task(_hold_slot(scheduler, release))
+        await asyncio.sleep(0)
+        cancelled = asyncio.create_task(scheduler.acquire(ENDPOINT))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        assert scheduler.queue_depth() == 0
+        release.set()
+        await holder
+        await asyncio.wait_for(scheduler.acquire(ENDPOINT), timeout=1)
+        scheduler.release(ENDPOINT)
+
+    asyncio.run(run())
+    assert scheduler.snapshot()["endpoints"][ENDPOINT]["active"] == 0
+    print("✓ Cancelled requests leave the queue cleanly")
+
+
+def test_bot_generation_slot_notice():
+    """The bot tells queued users their position and removes the notice once started."""
+    from config_manager import ConfigManager
+    from discord_bot import DiscordBot
+
+    class Notice:
+        def __init__(self, text):
+            self.text = text
+            self.deleted = False
+
+        async def delete(self):
+            self.deleted = True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = os.path.join(tmp, "config.json")
+        with open(config_path, "w") as f:
+            json.dump({"scheduler": {"max_concurrent_per_endpoint": 1}}, f)
+        bot = DiscordBot(ConfigManager(config_path))
+        assert bot.scheduler.default_limit == 1
+
+        async def run():
+            notices = []
+
+            async def notify(text):
+                notices.append(Notice(text))
+                return notices[-1]
+
+            release = asyncio.Event()
+
+            async def first():
+                async with bot.generation_slot(bot.openai_client, 1, PRIORITY_CHAT, notify):
+                    await release.wait()
+
+            async def second():
+                async with bot.generation_slot(bot.openai_client, 2, PRIORITY_CHAT, notify):
+                    pass
+
+            first_task = asyncio.create_task(first())
+            await asyncio.sleep(0)
+            second_task = asyncio.create_task(second())
+            await asyncio.sleep(0.01)
+            release.set()
+            await asyncio.gather(first_task, second_task)
+            return notices
+
+        notices = asyncio.run(run())
+        assert len(notices) == 1
+        assert "Queued (position 1)" in notices[0].text
+        assert notices[0].deleted
+    print("✓ Queued users get a position notice that is removed when generation starts")
+
+
+if __name__ == "__main__":
+    try:
+        test_concurrency_cap_per_endpoint()
+        test_chat_served_before_swipes()
+        test_busy_guild_does_not_starve_others()
+        test_guild_weights()
+        test_queue_position_and_metrics()
+        test_cancelled_request_frees_its_place()
+        test_bot_generation_slot_notice()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""Test background rolling summaries of history that no longer fits in the prompt."""
+import sys
+import os
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from lorebook_manager import LorebookManager
+from history_summarizer import HistorySummarizer, build_summary_request
+from fake_provider import fake_provider, completion, api_config, make_bot
+
+
+def make_turns(start, count):
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"Turn {i}: " + "the story goes on " * 20}
+        for i in range(start, start + count)
+    ]
+
+
+def summarize_story(handler, request):
+    """Fake provider that answers every request with a short summary."""
+    handler.send_json(completion(f"Summary #{len(handler.server.requests)}: the heroes travelled."))
+
+
+def test_dropped_messages_queued_once():
+    """Messages trimmed out of the prompt on several turns are queued only once."""
+    summarizer = HistorySummarizer(None)
+    history = make_turns(0, 30)
+    assert summarizer.note_dropped(1, history[:10]) == 10
+    assert summarizer.note_dropped(1, history[:10]) == 0
+    assert summarizer.note_dropped(1, history[:14]) == 4
+    # Evicting from the history only queues what wasn't queued yet
+    assert summarizer.note_evicted(1, history[:20]) == 6
+    assert summarizer.channels[1].pending == history[:20]
+    assert summarizer.channels[1].covered == {}
+    history = history[20:]
+    assert summarizer.note_dropped(1, history[:2]) == 2
+    print("✓ Dropped messages are queued once")
+
+
+def test_background_summarization():
+    calls = []
+
+    async def summarize(channel_id, server_id, summary, messages):
+        calls.append((summary, len(messages)))
+        await asyncio.sleep(0)
+        if len(calls) == 3:
+            raise RuntimeError("provider down")
+        return f"summary after {len(calls)} runs"
+
+    async def run():
+        summarizer = HistorySummarizer(summarize, batch_size=4, min_pending=3)
+        summarizer.note_dropped(1, make_turns(0, 2))
+        assert summarizer.schedule(1) is None  # Not enough pending yet
+        summarizer.note_dropped(1, make_turns(2, 8))
+        await summarizer.schedule(1)
+
+        # Batches are folded in order; a failure keeps the rest queued
+        assert calls == [("", 4), ("summary after 1 runs", 4), ("summary after 2 runs", 2)]
+        assert summarizer.summary_for(1) == "summary after 2 runs"
+        assert len(summarizer.channels[1].pending) == 2
+        assert summarizer.failures == 1
+
+        await summarizer.schedule(1, force=True)
+        assert summarizer.summary_for(1) == "summary after 4 runs"
+        assert summarizer.snapshot()["channels"]["1"]["summarized_messages"] == 10
+
+        summarizer.reset(1)
+        assert summarizer.summary_for(1) == ""
+
+    asyncio.run(run())
+    print("✓ Pending messages are summarized in background batches")
+
+
+def test_summary_request():
+    request = build_summary_request("Old summary.", [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello"}], 100)
+    assert request[0]["role"] == "system"
+    assert "100 words" in request[0]["content"]
+    assert "Old summary." in request[1]["content"]
+    assert "User: Hi\nAssistant: Hello" in request[1]["content"]
+    print("✓ Summary request includes the current summary and transcript")
+
+
+def test_prompt_size_stays_constant():
+    """Over a long campaign the prompt stays within budget and carries the summary."""
+    with fake_provider(summarize_story) as server, tempfile.TemporaryDirectory() as tmp:
+        bot = make_bot(
+            tmp,
+            openai_config=api_config(server),
+            history_summary={"enabled": True, "batch_size": 10, "min_pending": 4}
+        )
+        bot.lorebook_manager = LorebookManager(os.path.join(tmp, "lorebook"))
+        bot.conversations[111] = make_turns(0, 20)
+
+        async def campaign():
+            sizes = []
+            for turn in range(40):
+                messages = bot.build_chat_messages(111, f"Question {turn}")
+                sizes.append(sum(bot.estimate_tokens(m["content"]) for m in messages))
+                # Same bookkeeping as !chat: append the exchange, cap the history, summarize
+                history = bot.conversations[111]
+                history.extend(make_turns(20 + turn * 2, 2))
+                if len(history) > 20:
+                    bot.history_summarizer.note_evicted(111, history[:-20])
+                    bot.conversations[111] = history[-20:]
+                task = bot.history_summarizer.schedule(111)
+                if task:
+                    await task
+            return sizes, messages
+
+        sizes, messages = asyncio.run(campaign())
+        assert max(sizes) <= 2000
+        assert max(sizes[10:]) - min(sizes[10:]) < 300
+        assert server.requests
+        summary_messages = [m for m in messages if m["content"].startswith("[Summary of the story so far]")]
+        assert len(summary_messages) == 1
+        assert "the heroes travelled" in summary_messages[0]["content"]
+        # The summary sits right before the history
+        position = messages.index(summary_messages[0])
+        assert messages[position + 1]["content"].startswith("Turn ")
+        # Summaries are requested with the summary-sized token limit
+        assert server.requests[0]["max_tokens"] == 400
+        assert bot.history_summarizer.snapshot()["runs"] == len(server.requests)
+    print("✓ Prompt size stays constant with a rolling summary")
+
+
+if __name__ == "__main__":
+    try:
+        test_dropped_messages_queued_once()
+        test_background_summarization()
+        test_summary_request()
+        test_prompt_size_stays_constant()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
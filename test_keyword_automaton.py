@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Test compiled lorebook keyword matching."""
+import sys
+import os
+import random
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from keyword_automaton import KeywordAutomaton
+from lorebook_manager import LorebookManager
+
+
+def test_automaton_finds_all_keywords():
+    automaton = KeywordAutomaton()
+    for value, keyword in enumerate(["he", "she", "his", "hers", "Aldoria", "dor"]):
+        automaton.add(keyword, value)
+    automaton.build()
+    assert automaton.search("ushers") == {0, 1, 3}
+    assert automaton.search("Welcome to ALDORIA") == {4, 5}
+    assert automaton.search("nothing here") == {0}
+    assert automaton.search("") == set()
+    matches = sorted((start, end) for start, end, _ in automaton.iter_matches("ushers"))
+    assert matches == [(1, 4), (2, 4), (2, 6)]
+    print("✓ Automaton finds every keyword in one pass")
+
+
+def test_matching_flags():
+    automaton = KeywordAutomaton()
+    automaton.add("Rose", "case", case_sensitive=True)
+    automaton.add("cat", "word", whole_word=True)
+    automaton.add("Elf", "both", case_sensitive=True, whole_word=True)
+    automaton.add("", "any")
+    assert automaton.search("a rose garden") == {"any"}
+    assert automaton.search("Rosewood") == {"case", "any"}
+    assert automaton.search("concatenate the category") == {"any"}
+    assert automaton.search("The cat, the CAT.") == {"word", "any"}
+    assert automaton.search("Elves and elf") == {"any"}
+    assert automaton.search("An Elf!") == {"both", "any"}
+
+    # Keywords can be added after a build
+    automaton.add("garden", "late")
+    assert automaton.search("a rose garden") == {"late", "any"}
+    print("✓ Case-sensitive and whole-word flags")
+
+
+def test_matches_previous_substring_check():
+    """Without flags, results match the old per-entry substring check."""
+    rng = random.Random(7)
+    alphabet = "abcAB "
+    for _ in range(200):
+        keywords = ["".join(rng.choice(alphabet) for _ in range(rng.randint(0, 4))) for _ in range(8)]
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        automaton = KeywordAutomaton()
+        for value, keyword in enumerate(keywords):
+            automaton.add(keyword, value)
+        expected = {value for value, keyword in enumerate(keywords) if keyword.lower() in text.lower()}
+        assert automaton.search(text) == expected, (keywords, text)
+    print("✓ Automaton agrees with substring matching")
+
+
+def test_lorebook_uses_compiled_index():
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = LorebookManager(os.path.join(tmp, "lorebook"))
+        manager.add_or_update_entry("Kingdom", "A vast kingdom.", keywords=["aldoria", "kingdom"])
+        manager.add_or_update_entry("Rules", "Magic is rare.", activation_type="constant")
+        manager.add_or_update_entry("Cat", "A talking cat.", keywords=["cat"], match_whole_words=True)
+        manager.add_or_update_entry("Ward", "A ward against Fae.", keywords=["Fae"], case_sensitive=True)
+        manager.create_lorebook("Hidden")
+        manager.add_or_update_entry("Secret", "Hidden lore.", keywords=["aldoria"], lorebook_name="Hidden")
+        manager.disable_lorebook("Hidden")
+
+        section = manager.get_system_prompt_section("We reach ALDORIA with a cat")
+        assert "**Kingdom:**" in section
+        assert "**Rules:**" in section
+        assert "**Cat:**" in section
+        assert "**Ward:**" not in section
+        assert "**Secret:**" not in section
+        # Entries keep their lorebook order
+        assert section.index("**Kingdom:**") < section.index("**Rules:**") < section.index("**Cat:**")
+
+        section = manager.get_system_prompt_section("A catapult and the fae")
+        assert "**Cat:**" not in section
+        assert "**Ward:**" not in section
+        assert "**Ward:**" in manager.get_system_prompt_section("The Fae came")
+        # Without text only constant entries are included
+        assert "**Kingdom:**" not in manager.get_system_prompt_section("")
+
+        keys = [entry["key"] for entry in manager.get_relevant_entries("kingdom of Fae")]
+        assert keys == ["Kingdom", "Rules", "Ward"]
+        keys = [entry["key"] for entry in manager.get_relevant_entries("kingdom", include_always_active=False)]
+        assert keys == ["Kingdom"]
+
+        # The index is built once and rebuilt only after a change
+        index = manager.get_keyword_index()
+        manager.get_system_prompt_section("aldoria")
+        assert manager.get_keyword_index() is index
+        manager.add_or_update_entry("Dragon", "A red dragon.", keywords=["dragon"])
+        assert manager.get_keyword_index() is not index
+        assert "**Dragon:**" in manager.get_system_prompt_section("a dragon appears")
+        manager.enable_lorebook("Hidden")
+        assert "**Secret:**" in manager.get_system_prompt_section("aldoria")
+
+        # Flags are saved with the entry
+        reloaded = LorebookManager(os.path.join(tmp, "lorebook"))
+        assert reloaded.get_entry("Cat")["match_whole_words"] is True
+        assert "case_sensitive" not in reloaded.get_entry("Kingdom")
+    print("✓ Lorebook matching uses the compiled index")
+
+
+if __name__ == "__main__":
+    try:
+        test_automaton_finds_all_keywords()
+        test_matching_flags()
+        test_matches_previous_substring_check()
+        test_lorebook_uses_compiled_index()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""Test lorebook scan depth over recent history, sticky entries and cooldowns."""
+import sys
+import os
+import json
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from lorebook_manager import LorebookManager
+
+
+def exchange(history, user, reply):
+    history.append({"role": "user", "content": user})
+    history.append({"role": "assistant", "content": reply})
+
+
+def test_scan_depth():
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = LorebookManager(os.path.join(tmp, "lorebook"))
+        manager.add_or_update_entry("Aldoria", "A vast kingdom.", keywords=["aldoria"])
+        manager.create_lorebook("Shallow")
+        manager.add_or_update_entry("Moon", "The moon is red.", keywords=["moon"], lorebook_name="Shallow")
+        manager.update_lorebook_metadata("Default", scan_depth=3)
+        assert manager.list_lorebooks()[0]["scan_depth"] == 3
+
+        history = []
+        exchange(history, "We ride to Aldoria under the moon.", "The gates open.")
+        section = manager.get_system_prompt_section("Who guards them?", channel_id=1, history=history)
+        # Aldoria was mentioned 2 messages ago; the Shallow lorebook only looks at the current message
+        assert "**Aldoria:**" in section
+        assert "**Moon:**" not in section
+
+        exchange(history, "Who guards them?", "Knights.")
+        section = manager.get_system_prompt_section("And then?", channel_id=1, history=history)
+        assert "**Aldoria:**" not in section
+
+        # Without a channel, only the current message is matched (as before)
+        assert manager.get_system_prompt_section("Who guards them?", history=history[:2]) == ""
+    print("✓ Entries activate from recent messages within the scan depth")
+
+
+def test_only_new_messages_are_scanned():
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = LorebookManager(os.path.join(tmp, "lorebook"))
+        manager.add_or_update_entry("Aldoria", "A vast kingdom.", keywords=["aldoria"])
+        manager.update_lorebook_metadata("Default", scan_depth=10)
+        tracker = manager.activations
+
+        history = []
+        for turn in range(10):
+            exchange(history, f"Turn {turn}", "Reply in Aldoria" if turn == 0 else "Reply")
+        manager.get_system_prompt_section("Next", channel_id=1, history=history)
+        assert tracker.messages_scanned == 10
+
+        exchange(history, "Turn 10", "Reply")
+        section = manager.get_system_prompt_section("Next", channel_id=1, history=history)
+        assert tracker.messages_scanned == 12
+        # The Aldoria reply is now 11 messages back
+        assert "**Aldoria:**" not in section
+
+        # A message edited in place is scanned again
+        history[-1]["content"] = "Back to Aldoria"
+        assert "**Aldoria:**" in manager.get_system_prompt_section("Next", channel_id=1, history=history)
+        assert tracker.messages_scanned == 13
+
+        # Changing the lorebooks rescans the window once
+        manager.add_or_update_entry("Turn", "Turns pass.", keywords=["turn 9"])
+        section = manager.get_system_prompt_section("Next", channel_id=1, history=history)
+        assert "**Turn:**" in section
+        assert tracker.messages_scanned == 23
+        assert tracker.snapshot()["channels"]["1"]["recorded_messages"] == 10
+    print("✓ Only new or changed messages are scanned")
+
+
+def test_sticky_and_cooldown():
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = LorebookManager(os.path.join(tmp, "lorebook"))
+        manager.add_or_update_entry("Storm", "A storm rages.", keywords=["storm"], sticky=2)
+        manager.add_or_update_entry("Bell", "A bell rings.", keywords=["bell"], cooldown=2)
+
+        history = []
+
+        def turn(message):
+            section = manager.get_system_prompt_section(message, channel_id=1, history=history)
+            exchange(history, message, "Reply")
+            return section
+
+        assert "**Storm:**" in turn("A storm!")
+        # Sticky for 2 more turns, then gone
+        assert "**Storm:**" in turn("Hello")
+        assert "**Storm:**" in turn("Hello")
+        assert "**Storm:**" not in turn("Hello")
+
+        assert "**Bell:**" in turn("The bell")
+        # Rebuilding the prompt in the same turn (a swipe) keeps it
+        reply = history.pop()
+        assert "**Bell:**" in manager.get_system_prompt_section("The bell", channel_id=1, history=history)
+        history.append(reply)
+        # Cooling down for 2 turns
+        assert "**Bell:**" not in turn("The bell again")
+        assert "**Bell:**" not in turn("The bell again")
+        assert "**Bell:**" in turn("The bell again")
+
+        manager.activations.reset(1)
+        assert "1" not in manager.activations.snapshot()["channels"]
+
+        reloaded = LorebookManager(os.path.join(tmp, "lorebook"))
+        assert reloaded.get_entry("Storm")["sticky"] == 2
+        assert "cooldown" not in reloaded.get_entry("Storm")
+    print("✓ Sticky entries stay active and cooldowns hold entries back")
+
+
+def test_bot_matches_recent_history():
+    from config_manager import ConfigManager
+    from discord_bot import DiscordBot
+    from web_server import WebServer
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = os.path.join(tmp, "config.json")
+        with open(config_path, "w") as f:
+            json.dump({"openai_config": {"api_key": "sk-test", "base_url": "http://127.0.0.1:1/v1", "model": "m"}}, f)
+        bot = DiscordBot(ConfigManager(config_path))
+        bot.lorebook_manager = LorebookManager(os.path.join(tmp, "lorebook"))
+        bot.lorebook_manager.add_or_update_entry("Aldoria", "A vast kingdom.", keywords=["aldoria"])
+        bot.conversations[111] = [
+            {"role": "user", "content": "We reach Aldoria."},
+            {"role": "assistant", "content": "The gates open."}
+        ]
+        messages = bot.build_chat_messages(111, "Who guards them?")
+        assert not any("A vast kingdom." in m["content"] for m in messages)
+
+        web_server = WebServer(bot.config_manager, bot)
+        client = web_server.app.test_client()
+        web_server.lorebook_manager = bot.lorebook_manager
+        response = client.post('/api/lorebooks/Default', json={"scan_depth": 2})
+        assert response.get_json()["status"] == "success"
+        messages = bot.build_chat_messages(111, "Who guards them?")
+        assert any("A vast kingdom." in m["content"] for m in messages)
+
+        metrics = client.get('/api/metrics').get_json()
+        assert metrics["lorebook_activations"]["channels"]["111"]["recorded_messages"] == 2
+    print("✓ Bot prompts include lore from recent history")
+
+
+if __name__ == "__main__":
+    try:
+        test_scan_depth()
+        test_only_new_messages_are_scanned()
+        test_sticky_and_cooldown()
+        test_bot_matches_recent_history()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
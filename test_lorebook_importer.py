@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""Test streaming import of lorebook and SillyTavern world info files."""
+import sys
+import os
+import io
+import json
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from lorebook_importer import JsonStream, LorebookImporter, map_sillytavern_entry
+from lorebook_manager import LorebookManager
+
+
+def world_info(count, disabled=()):
+    """A SillyTavern world info file with count entries."""
+    return {
+        "entries": {
+            str(uid): {
+                "uid": uid,
+                "key": [f"place{uid}", f"alias{uid}"],
+                "keysecondary": ["night"] if uid % 2 else [],
+                "comment": f"Place {uid}",
+                "content": f"Lore about place {uid}. \"Quoted\" {{braces}} [brackets]",
+                "constant": uid == 0,
+                "selective": True,
+                "order": 100 + uid,
+                "position": 0,
+                "disable": uid in disabled,
+                "caseSensitive": None,
+                "matchWholeWords": uid == 1,
+                "sticky": 2 if uid == 2 else 0,
+                "cooldown": 0
+            }
+            for uid in range(count)
+        },
+        "originalData": {"name": "Original", "entries": [{"keys": ["x"], "content": "[{\"nested\": true}]"}]}
+    }
+
+
+def test_json_stream():
+    text = '{"a": [1, 2.5e3, {"b": "x\\"}]{"}], "entries": {"k": {"v": 1}, "l": [true, null]}, "n": 123456}'
+    stream = JsonStream(io.StringIO(text), chunk_size=4)
+    seen = {}
+    for key in stream.iter_object():
+        if key == "a":
+            stream.skip_value()
+        elif key == "entries":
+            for entry_key in stream.iter_object():
+                seen[entry_key] = stream.read_value()
+        else:
+            seen[key] = stream.read_value()
+    assert seen == {"k": {"v": 1}, "l": [True, None], "n": 123456}
+    assert stream.peek() == ""
+
+    stream = JsonStream(io.StringIO('[{"a": 1}, {"b": 2}]'), chunk_size=3)
+    assert [stream.read_value() for _ in stream.iter_array()] == [{"a": 1}, {"b": 2}]
+
+    try:
+        stream = JsonStream(io.StringIO('{"a": 1 "b": 2}'))
+        for _ in stream.iter_object():
+            stream.read_value()
+        assert False, "Malformed JSON should raise"
+    except ValueError:
+        pass
+    print("✓ JSON values are read incrementally from small chunks")
+
+
+def test_map_sillytavern_entry():
+    entry = map_sillytavern_entry(world_info(3)["entries"]["1"])
+    assert entry == {
+        "key": "Place 1",
+        "content": "Lore about place 1. \"Quoted\" {braces} [brackets]",
+        "keywords": ["place1", "alias1"],
+        "activation_type": "normal",
+        "secondary_keywords": ["night"],
+        "order": 101,
+        "match_whole_words": True
+    }
+    assert map_sillytavern_entry(world_info(1)["entries"]["0"])["activation_type"] == "constant"
+    assert map_sillytavern_entry({"uid": 5, "key": [], "content": "x", "disable": True}) is None
+    assert map_sillytavern_entry({"uid": 6, "key": ["a"], "content": "x", "preventRecursion": True})["no_recurse"] is True
+    # Character book (V2) entries
+    entry = map_sillytavern_entry({"keys": ["sword"], "secondary_keys": [], "content": "A blade.", "enabled": True,
+                                   "insertion_order": 3, "case_sensitive": True, "id": 7})
+    assert entry["key"] == "sword"
+    assert entry["order"] == 3
+    assert entry["case_sensitive"] is True
+    assert map_sillytavern_entry({"keys": [], "content": "x", "id": 7})["key"] == "Entry 7"
+    # Older files store the keys as comma-separated strings
+    entry = map_sillytavern_entry({"key": "river, ford", "keysecondary": "winter, ice ", "content": "x", "uid": 8})
+    assert entry["keywords"] == ["river", "ford"]
+    assert entry["secondary_keywords"] == ["winter", "ice"]
+    print("✓ SillyTavern fields map onto the entry schema")
+
+
+def test_streaming_import_sqlite():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "world.json")
+        with open(path, "w") as f:
+            json.dump(world_info(1200, disabled={5}), f)
+
+        manager = LorebookManager(os.path.join(tmp, "lorebook"), storage="sqlite")
+        importer = LorebookImporter(manager, batch_size=500)
+        result = importer.import_path(path, "World")
+        assert result["entries"] == 1199
+        assert result["skipped"] == 1
+        assert result["batches"] == 3
+        assert result["done"] and result["error"] is None
+        assert result["entries_per_second"] > 0
+
+        assert len(manager.lorebooks["World"]["entries"]) == 1199
+        assert manager.get_entry("Place 7", "World")["keywords"] == ["place7", "alias7"]
+        assert "Place 5" not in manager.lorebooks["World"]["entries"]
+        # Indexes are rebuilt after the import
+        assert "**Place 42:**" in manager.get_system_prompt_section("We reach alias42")
+        assert "**Place 0:**" in manager.get_system_prompt_section("Hello")
+
+        reloaded = LorebookManager(os.path.join(tmp, "lorebook"), storage="sqlite")
+        assert reloaded.lorebooks == manager.lorebooks
+        assert list(reloaded.lorebooks["World"]["entries"])[:3] == ["Place 0", "Place 1", "Place 2"]
+
+        # Replacing drops the old entries; merging keeps them
+        with open(path, "w") as f:
+            json.dump({"entries": [{"keys": ["sword"], "content": "A blade.", "comment": "Sword"}]}, f)
+        LorebookImporter(manager).import_path(path, "World", merge=True)
+        assert len(manager.lorebooks["World"]["entries"]) == 1200
+        LorebookImporter(manager).import_path(path, "World", merge=False)
+        assert list(LorebookManager(os.path.join(tmp, "lorebook"), storage="sqlite").lorebooks["World"]["entries"]) == ["Sword"]
+    print("✓ Streaming import commits batches to SQLite")
+
+
+def test_streaming_import_json_storage():
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = LorebookManager(os.path.join(tmp, "lorebook"))
+        # The bot's own export format, with duplicate SillyTavern titles in another file
+        exported = {"name": "Kingdom", "description": "Lore", "entries": {
+            "Aldoria": {"key": "Aldoria", "content": "A kingdom.", "keywords": ["aldoria"], "always_active": True}
+        }}
+        LorebookImporter(manager).run(io.StringIO(json.dumps(exported)))
+        assert manager.lorebooks["Kingdom"]["description"] == "Lore"
+        assert manager.get_entry("Aldoria", "Kingdom")["activation_type"] == "constant"
+
+        duplicates = {"entries": {"0": {"uid": 0, "key": ["a"], "comment": "Same", "content": "One"},
+                                  "1": {"uid": 1, "key": ["b"], "comment": "Same", "content": "Two"}}}
+        LorebookImporter(manager).run(io.StringIO(json.dumps(duplicates)), "Dupes")
+        assert sorted(manager.lorebooks["Dupes"]["entries"]) == ["Same", "Same (2)"]
+
+        reloaded = LorebookManager(os.path.join(tmp, "lorebook"))
+        assert reloaded.lorebooks == manager.lorebooks
+
+        try:
+            LorebookImporter(manager).run(io.StringIO('{"name": "Broken"}'))
+            assert False, "A file without entries should raise"
+        except ValueError:
+            pass
+    print("✓ Streaming import with JSON storage writes once")
+
+
+def test_import_swaps_lorebook_in_when_done():
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = LorebookManager(os.path.join(tmp, "lorebook"), storage="sqlite")
+        manager.add_or_update_entry("Old", "Old lore.", ["old"], lorebook_name="World")
+        seen = []
+
+        class WatchedFile(io.StringIO):
+            """Records what requests would see of the lorebook while the file is read."""
+            def read(self, size=-1):
+                seen.append(sorted(manager.lorebooks["World"]["entries"]))
+                return super().read(size)
+
+        LorebookImporter(manager, batch_size=10).run(WatchedFile(json.dumps(world_info(50))), "World", merge=False)
+        assert len(seen) > 1
+        assert all(keys == ["Old"] for keys in seen)
+        assert "Old" not in manager.lorebooks["World"]["entries"]
+        assert len(manager.lorebooks["World"]["entries"]) == 50
+        reloaded = LorebookManager(os.path.join(tmp, "lorebook"), storage="sqlite")
+        assert reloaded.lorebooks == manager.lorebooks
+    print("✓ Imported entries appear all at once, after the last one")
+
+
+def test_web_import_file():
+    from config_manager import ConfigManager
+    from web_server import WebServer
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = os.path.join(tmp, "config.json")
+        with open(config_path, "w") as f:
+            json.dump({}, f)
+        web_server = WebServer(ConfigManager(config_path))
+        web_server.lorebook_manager = LorebookManager(os.path.join(tmp, "lorebook"))
+        client = web_server.app.test_client()
+
+        data = {"file": (io.BytesIO(json.dumps(world_info(50)).encode("utf-8")), "Fantasy World.json")}
+        result = client.post('/api/lorebooks/import_file', data=data, content_type='multipart/form-data').get_json()
+        assert result["status"] == "success"
+
+        for _ in range(100):
+            progress = client.get(f'/api/lorebooks/import_file/{result["job_id"]}').get_json()
+            if progress["done"]:
+                break
+            time.sleep(0.05)
+        assert progress["entries"] == 50
+        assert progress["lorebook"] == "Fantasy World"
+        assert len(web_server.lorebook_manager.lorebooks["Fantasy World"]["entries"]) == 50
+
+        assert client.get('/api/lorebooks/import_file/unknown').status_code == 404
+
+        # Finished imports are forgotten a while after they are done
+        web_server.lorebook_imports[result["job_id"]].finished -= 601
+        data = {"file": (io.BytesIO(json.dumps(world_info(1)).encode("utf-8")), "Small.json")}
+        client.post('/api/lorebooks/import_file', data=data, content_type='multipart/form-data')
+        assert client.get(f'/api/lorebooks/import_file/{result["job_id"]}').status_code == 404
+        assert len(web_server.lorebook_imports) == 1
+        for importer in web_server.lorebook_imports.values():
+            for _ in range(100):
+                if importer.finished is not None:
+                    break
+                time.sleep(0.05)
+        assert client.post('/api/lorebooks/import_file', data={}, content_type='multipart/form-data').status_code == 400
+    print("✓ Web upload imports in the background and reports progress")
+
+
+if __name__ == "__main__":
+    try:
+        test_json_stream()
+        test_map_sillytavern_entry()
+        test_streaming_import_sqlite()
+        test_streaming_import_json_storage()
+        test_import_swaps_lorebook_in_when_done()
+        test_web_import_file()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Test recursive lorebook activation over the precomputed trigger graph."""
+import sys
+import os
+import json
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from lorebook_manager import LorebookManager
+
+
+def chain_manager(tmp):
+    manager = LorebookManager(os.path.join(tmp, "lorebook"))
+    manager.add_or_update_entry("Aldoria", "A kingdom ruled by Queen Mira.", keywords=["aldoria"])
+    manager.add_or_update_entry("Mira", "The queen carries the Sunblade.", keywords=["mira"])
+    manager.add_or_update_entry("Sunblade", "A sword forged in the Ember Forge.", keywords=["sunblade"])
+    manager.add_or_update_entry("Forge", "The Ember Forge burns under Aldoria.", keywords=["ember forge"])
+    return manager
+
+
+def test_trigger_graph():
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = chain_manager(tmp)
+        index = manager.get_keyword_index()["lorebooks"]
+        graph = manager.trigger_graph
+        activated = graph.walk(index, {0}, 10, index["automaton"].search)
+        # Aldoria -> Mira -> Sunblade -> Forge; Forge's mention of Aldoria doesn't loop
+        assert activated == {1: 1, 2: 2, 3: 3}
+        assert graph.edges == [(1,), (2,), (3,), (0,)]
+        assert graph.builds == 1
+
+        assert graph.walk(index, {0}, 1, index["automaton"].search) == {1: 1}
+        assert graph.walk(index, {0}, 0, index["automaton"].search) == {}
+        assert graph.walk(index, {0}, 10, index["automaton"].search, blocked={1}) == {}
+        # The graph is only rebuilt when the lorebooks change
+        assert graph.builds == 1
+        manager.add_or_update_entry("Mira", "The queen.", keywords=["mira"])
+        index = manager.get_keyword_index()["lorebooks"]
+        assert graph.walk(index, {0}, 10, index["automaton"].search) == {1: 1}
+        assert graph.builds == 2
+        assert graph.snapshot()["edges"] == 3
+    print("✓ Trigger graph walk is bounded and rebuilt only on changes")
+
+
+def test_recursive_prompt_section():
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = chain_manager(tmp)
+        section = manager.get_system_prompt_section("We travel to Aldoria.")
+        assert "**Mira:**" in section
+        assert "**Sunblade:**" in section
+        assert "**Forge:**" not in section
+
+        manager.recursion_depth = 0
+        section = manager.get_system_prompt_section("We travel to Aldoria.")
+        assert "**Aldoria:**" in section
+        assert "**Mira:**" not in section
+
+        manager.recursion_depth = 5
+        assert "**Forge:**" in manager.get_system_prompt_section("We travel to Aldoria.")
+
+        # Constant entries recurse too
+        manager.recursion_depth = 2
+        manager.add_or_update_entry("World", "The world knows the Sunblade.", activation_type="constant")
+        section = manager.get_system_prompt_section("Hello")
+        assert "**Sunblade:**" in section
+        assert "**Forge:**" in section
+        assert "**Mira:**" not in section
+
+        # An entry with no_recurse doesn't trigger anything
+        manager.add_or_update_entry("World", "The world knows the Sunblade.", activation_type="constant",
+                                    no_recurse=True)
+        assert "**Sunblade:**" not in manager.get_system_prompt_section("Hello")
+        assert LorebookManager(os.path.join(tmp, "lorebook")).get_entry("World")["no_recurse"] is True
+
+        # Disabled lorebooks aren't reached by recursion
+        manager.create_lorebook("Secrets")
+        manager.add_or_update_entry("Hidden", "Hidden lore.", keywords=["queen"], lorebook_name="Secrets")
+        assert "**Hidden:**" in manager.get_system_prompt_section("Aldoria")
+        manager.disable_lorebook("Secrets")
+        assert "**Hidden:**" not in manager.get_system_prompt_section("Aldoria")
+    print("✓ Active entries activate the entries their content mentions")
+
+
+def test_recursion_respects_cooldown():
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = LorebookManager(os.path.join(tmp, "lorebook"))
+        manager.add_or_update_entry("Storm", "The storm wakes the Kraken.", keywords=["storm"])
+        manager.add_or_update_entry("Kraken", "A sea monster.", keywords=["kraken"], cooldown=1)
+        history = []
+
+        def turn(message):
+            section = manager.get_system_prompt_section(message, channel_id=1, history=history)
+            history.append({"role": "user", "content": message})
+            history.append({"role": "assistant", "content": "Reply"})
+            return section
+
+        assert "**Kraken:**" in turn("A storm!")
+        # Recursively activated entries start their cooldown like directly triggered ones
+        assert "**Kraken:**" not in turn("Another storm!")
+        assert "**Kraken:**" in turn("The storm again!")
+    print("✓ Recursion respects cooldowns")
+
+
+def test_bot_recursion_config():
+    from config_manager import ConfigManager
+    from discord_bot import DiscordBot
+    from web_server import WebServer
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = os.path.join(tmp, "config.json")
+        with open(config_path, "w") as f:
+            json.dump({"lorebook_recursion": {"max_depth": 1}}, f)
+        bot = DiscordBot(ConfigManager(config_path))
+        bot.lorebook_manager = chain_manager(tmp)
+        bot.configure_lorebook_recursion()
+        assert bot.lorebook_manager.recursion_depth == 1
+        assert bot.get_lorebook_recursion_config() == {"max_depth": 1}
+
+        messages = bot.build_chat_messages(111, "We travel to Aldoria.")
+        prompt = "\n".join(m["content"] for m in messages)
+        assert "The queen carries the Sunblade." in prompt
+        assert "A sword forged" not in prompt
+
+        web_server = WebServer(bot.config_manager, bot)
+        client = web_server.app.test_client()
+        metrics = client.get('/api/metrics').get_json()
+        assert metrics["lorebook_recursion"]["recursive_activations"] >= 1
+
+        web_server.lorebook_manager = bot.lorebook_manager
+        response = client.post('/api/lorebook/Mira', json={
+            "content": "The queen carries the Sunblade.", "keywords": ["mira"], "no_recurse": True,
+            "lorebook_name": "Default"
+        })
+        assert response.get_json()["status"] == "success"
+        assert bot.lorebook_manager.get_entry("Mira")["no_recurse"] is True
+    print("✓ Bot applies the recursion config")
+
+
+if __name__ == "__main__":
+    try:
+        test_trigger_graph()
+        test_recursive_prompt_section()
+        test_recursion_respects_cooldown()
+        test_bot_recursion_config()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""Test the lorebook version counter and the cache of rendered lorebook sections."""
+import sys
+import os
+import json
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from lorebook_manager import LorebookManager
+
+
+def test_version_and_cache():
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = LorebookManager(os.path.join(tmp, "lorebook"))
+        version = manager.version
+        manager.add_or_update_entry("Aldoria", "A vast kingdom.", keywords=["aldoria"])
+        assert manager.version == version + 1
+
+        section = manager.get_system_prompt_section("We reach Aldoria.", "Luna")
+        assert "**Aldoria:**" in section
+        automaton = manager.get_keyword_index()["lorebooks"]["automaton"]
+        assert manager.get_system_prompt_section("  We reach Aldoria.\n", "Luna") == section
+        assert manager.section_cache_hits == 1
+        assert manager.section_cache_misses == 1
+
+        # Another character, other settings or another version render again
+        manager.get_system_prompt_section("We reach Aldoria.", "Sherlock")
+        manager.recursion_depth = 0
+        manager.get_system_prompt_section("We reach Aldoria.", "Luna")
+        assert manager.section_cache_misses == 3
+
+        manager.add_or_update_entry("Aldoria", "A small kingdom.", keywords=["aldoria"])
+        assert "A small kingdom." in manager.get_system_prompt_section("We reach Aldoria.", "Luna")
+        manager.load_all_lorebooks()
+        assert manager.version > version + 2
+        assert manager.get_keyword_index()["lorebooks"]["automaton"] is not automaton
+
+        manager.section_cache_size = 2
+        for i in range(5):
+            manager.get_system_prompt_section(f"Message {i}")
+        assert len(manager.section_cache) == 2
+        snapshot = manager.section_cache_snapshot()
+        assert snapshot["version"] == manager.version
+        assert snapshot["entries"] == 2
+    print("✓ Sections are cached by text, character, version and settings")
+
+
+def test_channel_cache_follows_history():
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = LorebookManager(os.path.join(tmp, "lorebook"))
+        manager.add_or_update_entry("Aldoria", "A vast kingdom.", keywords=["aldoria"])
+        manager.add_or_update_entry("Storm", "A storm rages.", keywords=["storm"], sticky=1)
+        manager.update_lorebook_metadata("Default", scan_depth=2)
+        history = [{"role": "user", "content": "A storm over Aldoria!"}, {"role": "assistant", "content": "Rain."}]
+
+        first = manager.get_system_prompt_section("Hello", channel_id=1, history=history)
+        assert "**Aldoria:**" in first and "**Storm:**" in first
+        scanned = manager.activations.messages_scanned
+        # A swipe of the same turn is a lookup: no history scan at all
+        assert manager.get_system_prompt_section("Hello", channel_id=1, history=history) == first
+        assert manager.activations.messages_scanned == scanned
+        assert manager.section_cache_hits == 1
+
+        # An edited message or a new reply renders again
+        history[-1]["content"] = "Thunder."
+        manager.get_system_prompt_section("Hello", channel_id=1, history=history)
+        assert manager.section_cache_hits == 1
+        history.extend([{"role": "user", "content": "Hello"}, {"role": "assistant", "content": "Hi."}])
+        section = manager.get_system_prompt_section("Bye", channel_id=1, history=history)
+        # The storm is still sticky for this turn, Aldoria left the scan depth
+        assert "**Storm:**" in section and "**Aldoria:**" not in section
+        history.extend([{"role": "user", "content": "Bye"}, {"role": "assistant", "content": "Bye."}])
+        assert manager.get_system_prompt_section("Bye", channel_id=1, history=history) == ""
+
+        # Clearing the channel doesn't reuse sections from before
+        manager.get_system_prompt_section("Aldoria", channel_id=1, history=history)
+        hits = manager.section_cache_hits
+        manager.activations.reset(1)
+        manager.get_system_prompt_section("Aldoria", channel_id=1, history=history)
+        assert manager.section_cache_hits == hits
+    print("✓ Channel sections are reused only for the same recent history")
+
+
+def test_bot_swipes_reuse_section():
+    from config_manager import ConfigManager
+    from discord_bot import DiscordBot
+    from web_server import WebServer
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = os.path.join(tmp, "config.json")
+        with open(config_path, "w") as f:
+            json.dump({}, f)
+        bot = DiscordBot(ConfigManager(config_path))
+        bot.lorebook_manager = LorebookManager(os.path.join(tmp, "lorebook"))
+        bot.lorebook_manager.add_or_update_entry("Aldoria", "A vast kingdom.", keywords=["aldoria"])
+        bot.conversations[111] = [
+            {"role": "user", "content": "Hello."},
+            {"role": "assistant", "content": "Welcome, traveler."}
+        ]
+        # Like !chat: the prompt is built before the message is stored
+        messages = bot.build_chat_messages(111, "We reach Aldoria.", "Mira")
+        assert any("A vast kingdom." in m["content"] for m in messages)
+        bot.conversations[111].append({"role": "user", "content": "Mira: We reach Aldoria."})
+        bot.conversations[111].append({"role": "assistant", "content": "The gates open."})
+        assert bot.lorebook_manager.section_cache_misses == 1
+
+        # Like swipe_button: the reply is popped while the prompt is rebuilt
+        for _ in range(3):
+            reply = bot.conversations[111].pop()
+            messages = bot.build_chat_messages(111, "We reach Aldoria.", "Mira")
+            bot.conversations[111].append(reply)
+            assert any("A vast kingdom." in m["content"] for m in messages)
+        # The first swipe reuses the section !chat rendered
+        assert bot.lorebook_manager.section_cache_hits == 3
+        assert bot.lorebook_manager.section_cache_misses == 1
+
+        metrics = WebServer(bot.config_manager, bot).app.test_client().get('/api/metrics').get_json()
+        assert metrics["lorebook_section_cache"]["hits"] == 3
+    print("✓ Swipes reuse the rendered lorebook section")
+
+
+if __name__ == "__main__":
+    try:
+        test_version_and_cache()
+        test_channel_cache_follows_history()
+        test_bot_swipes_reuse_section()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""Test the SQLite lorebook store: row-level writes, FTS search and migration from JSON."""
+import sys
+import os
+import json
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from lorebook_sqlite_store import LorebookSqliteStore, fts_query, migrate
+from lorebook_manager import LorebookManager
+
+
+def sample_lorebooks():
+    return {
+        "World": {
+            "name": "World", "description": "The world", "enabled": True, "linked_characters": None,
+            "scan_depth": 2,
+            "entries": {
+                "Aldoria": {"key": "Aldoria", "content": "The royal kingdom of Aldoria.", "keywords": ["aldoria"],
+                            "activation_type": "normal"},
+                "Vermax": {"key": "Vermax", "content": "The dragon sleeps under the mountain.", "keywords": ["dragon"],
+                           "activation_type": "normal"},
+            }
+        },
+        "Rules": {
+            "name": "Rules", "description": "", "enabled": False, "linked_characters": ["Alice"],
+            "entries": {
+                "Magic": {"key": "Magic", "content": "Magic costs a memory.", "keywords": ["magic", "spell"],
+                          "activation_type": "constant"},
+            }
+        }
+    }
+
+
+def test_fts_query():
+    assert fts_query("red dra") == '"red" "dra"*'
+    assert fts_query('say "hi"') == '"say" """hi"""*'
+    assert fts_query("   ") == ""
+    print("✓ Search text becomes an FTS5 prefix query")
+
+
+def test_store_round_trip_and_row_writes():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "lorebooks.db")
+        store = LorebookSqliteStore(path)
+        assert store.is_empty()
+        assert store.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+        lorebooks = sample_lorebooks()
+        store.replace_all(lorebooks)
+        assert not store.is_empty()
+        assert store.load() == lorebooks
+        assert list(store.load()) == ["World", "Rules"]
+
+        # Changing one entry writes the lorebook row and that entry's row only
+        written = store.rows_written
+        lorebooks["World"]["entries"]["Aldoria"]["content"] = "The old kingdom of Aldoria."
+        store.save_lorebook("World", lorebooks["World"], ["Aldoria"])
+        assert store.rows_written == written + 2
+        assert store.load() == lorebooks
+
+        # New entries go after the existing ones
+        lorebooks["World"]["entries"]["Court"] = {"key": "Court", "content": "The queen's court.", "keywords": []}
+        store.save_lorebook("World", lorebooks["World"], ["Court"])
+        assert list(store.load()["World"]["entries"]) == ["Aldoria", "Vermax", "Court"]
+
+        del lorebooks["World"]["entries"]["Vermax"]
+        store.delete_entries("World", ["Vermax", "Unknown"])
+        assert store.load() == lorebooks
+
+        lorebooks["Rules"]["entries"] = {"Time": {"key": "Time", "content": "Time flows backwards.", "keywords": []}}
+        store.replace_lorebook("Rules", lorebooks["Rules"])
+        assert store.load() == lorebooks
+
+        del lorebooks["Rules"]
+        store.delete_lorebook("Rules")
+        assert store.load() == lorebooks
+        assert store.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 2
+        store.close()
+
+        reopened = LorebookSqliteStore(path)
+        assert reopened.load() == lorebooks
+        reopened.close()
+    print("✓ Store writes only changed rows and keeps order")
+
+
+def test_search():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = LorebookSqliteStore(os.path.join(tmp, "lorebooks.db"))
+        assert store.has_fts
+        store.replace_all(sample_lorebooks())
+
+        results = store.search("drag")
+        assert [(r["lorebook"], r["key"]) for r in results] == [("World", "Vermax")]
+        assert [r["key"] for r in store.search("spell")] == ["Magic"]
+        assert "[kingdom]" in store.search("kingdom")[0]["snippet"]
+        assert store.search("kingdom", lorebook_name="Rules") == []
+        assert store.search("the", limit=1)[0]["lorebook"] == "World"
+        assert store.search("") == []
+
+        # Edited and deleted entries leave the index
+        lorebooks = store.load()
+        lorebooks["World"]["entries"]["Vermax"]["content"] = "A wyrm."
+        lorebooks["World"]["entries"]["Vermax"]["keywords"] = []
+        store.save_lorebook("World", lorebooks["World"], ["Vermax"])
+        assert store.search("dragon") == []
+        store.delete_lorebook("Rules")
+        assert store.search("magic") == []
+        store.close()
+    print("✓ Full-text search with prefixes and lorebook filter")
+
+
+def test_manager_with_sqlite_storage():
+    with tempfile.TemporaryDirectory() as tmp:
+        lorebook_dir = os.path.join(tmp, "lorebook")
+        os.makedirs(lorebook_dir)
+        with open(os.path.join(lorebook_dir, "lorebooks.json"), "w") as f:
+            json.dump(sample_lorebooks(), f)
+
+        # The first load migrates lorebooks.json into the database
+        manager = LorebookManager(lorebook_dir, storage="sqlite")
+        assert manager.store.load() == manager.lorebooks
+        assert manager.get_storage_paths() == manager.store.watched_paths
+        json_mtime = os.path.getmtime(os.path.join(lorebook_dir, "lorebooks.json"))
+
+        written = manager.store.rows_written
+        manager.add_or_update_entry("Court", "The queen's court.", keywords=["court"], lorebook_name="World")
+        assert manager.store.rows_written == written + 2
+        assert manager.get_entry("Court")["content"] == "The queen's court."
+        assert "**Court:**" in manager.get_system_prompt_section("To the court!")
+
+        manager.delete_entry("Aldoria")
+        manager.disable_lorebook("World")
+        manager.create_lorebook("Empty")
+        manager.import_lorebook_file({"name": "Rules", "entries": {"Time": {"content": "Time flows.", "keywords": []}}},
+                                     merge=False)
+        manager.delete_lorebook("Empty")
+        assert [r["key"] for r in manager.search_entries("queen")] == ["Court"]
+
+        # lorebooks.json is no longer written, and neither is the legacy flat file
+        assert os.path.getmtime(os.path.join(lorebook_dir, "lorebooks.json")) == json_mtime
+        assert not os.path.exists(os.path.join(lorebook_dir, "lorebook.json"))
+
+        reloaded = LorebookManager(lorebook_dir, storage="sqlite")
+        assert reloaded.lorebooks == manager.lorebooks
+        assert list(reloaded.lorebooks) == ["World", "Rules"]
+        assert not reloaded.lorebooks["World"]["enabled"]
+        assert list(reloaded.lorebooks["Rules"]["entries"]) == ["Time"]
+        assert reloaded.entries == {"Time": reloaded.lorebooks["Rules"]["entries"]["Time"]}
+
+        # The legacy flat format is produced on demand
+        assert list(json.loads(reloaded.export_lorebook())) == ["Time"]
+        manager.store.close()
+        reloaded.store.close()
+    print("✓ Manager saves single rows to SQLite and migrates from JSON")
+
+
+def test_json_storage_and_migrate_cli():
+    with tempfile.TemporaryDirectory() as tmp:
+        lorebook_dir = os.path.join(tmp, "lorebook")
+        manager = LorebookManager(lorebook_dir)
+        assert manager.store is None
+        manager.add_or_update_entry("Aldoria", "The royal kingdom.", keywords=["aldoria"])
+        manager.add_or_update_entry("Vermax", "The dragon sleeps.", keywords=["dragon"])
+        assert not os.path.exists(os.path.join(lorebook_dir, "lorebook.json"))
+        assert [r["key"] for r in manager.search_entries("ROYAL king")] == ["Aldoria"]
+        assert manager.search_entries("royal", lorebook_name="Other") == []
+
+        assert migrate(lorebook_dir) == 2
+        sqlite_manager = LorebookManager(lorebook_dir, storage="sqlite")
+        assert sqlite_manager.lorebooks == LorebookManager(lorebook_dir).lorebooks
+        sqlite_manager.store.close()
+    print("✓ JSON storage skips the legacy file and migrates with the CLI helper")
+
+
+def test_legacy_file_migration():
+    with tempfile.TemporaryDirectory() as tmp:
+        lorebook_dir = os.path.join(tmp, "lorebook")
+        os.makedirs(lorebook_dir)
+        with open(os.path.join(lorebook_dir, "lorebook.json"), "w") as f:
+            json.dump({"Old": {"key": "Old", "content": "Old lore.", "keywords": ["old"]}}, f)
+        manager = LorebookManager(lorebook_dir, storage="sqlite")
+        assert manager.get_entry("Old", "Default")["content"] == "Old lore."
+        assert manager.store.load()["Default"]["entries"]["Old"]["activation_type"] == "normal"
+        manager.store.close()
+    print("✓ Legacy lorebook.json migrates into the Default lorebook")
+
+
+def test_web_search_endpoint():
+    from config_manager import ConfigManager
+    from discord_bot import DiscordBot
+    from web_server import WebServer
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = os.path.join(tmp, "config.json")
+        with open(config_path, "w") as f:
+            json.dump({"lorebook_storage": {"backend": "sqlite"}}, f)
+        bot = DiscordBot(ConfigManager(config_path))
+        assert bot.lorebook_manager.store is not None
+        bot.lorebook_manager = LorebookManager(os.path.join(tmp, "lorebook"), storage="sqlite")
+        bot.lorebook_manager.add_or_update_entry("Vermax", "The dragon sleeps.", keywords=["dragon"])
+
+        web_server = WebServer(bot.config_manager, bot)
+        web_server.lorebook_manager = bot.lorebook_manager
+        client = web_server.app.test_client()
+        results = client.get('/api/lorebooks/search?q=drag').get_json()["results"]
+        assert [r["key"] for r in results] == ["Vermax"]
+        assert client.get('/api/lorebooks/search?q=drag&lorebook=Other').get_json()["results"] == []
+
+        metrics = client.get('/api/metrics').get_json()
+        assert metrics["lorebook_storage"]["fts"] is True
+        bot.lorebook_manager.store.close()
+    print("✓ Web search endpoint and metrics")
+
+
+if __name__ == "__main__":
+    try:
+        test_fts_query()
+        test_store_round_trip_and_row_writes()
+        test_search()
+        test_manager_with_sqlite_storage()
+        test_json_storage_and_migrate_cli()
+        test_legacy_file_migration()
+        test_web_search_endpoint()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
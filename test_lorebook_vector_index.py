@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""Test semantic activation of vectorized lorebook entries."""
+import sys
+import os
+import json
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from lorebook_vector_index import HashingEmbedder, LorebookVectorIndex
+from lorebook_manager import LorebookManager
+
+ENTRIES = {
+    "dragon": "Vermax\nDragon, Vermax\nThe dragon Vermax sleeps under the mountain of fire. His scales are red.",
+    "court": "Court\nAldoria\nThe royal court of Aldoria, ruled by the queen.",
+    "forest": "Forest\nelves\nElven forests full of ancient trees.",
+}
+
+
+class LetterEmbedder:
+    """Minimal custom embedder: letter counts."""
+
+    name = "letters"
+    dimensions = 26
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), 26), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for char in text.lower():
+                if "a" <= char <= "z":
+                    vectors[row, ord(char) - ord("a")] += 1
+        return vectors
+
+
+def test_hashing_embedder():
+    embedder = HashingEmbedder(dimensions=64)
+    vectors = embedder.embed(["The dragon sleeps", "", "dragon sleeps"])
+    assert vectors.shape == (3, 64)
+    assert vectors.dtype == np.float32
+    assert abs(np.linalg.norm(vectors[0]) - 1) < 1e-5
+    assert not vectors[1].any()
+    # Stop words don't count
+    assert np.allclose(vectors[0], vectors[2])
+    assert embedder.features("The red dragon") == ["red", "dragon", "red dragon"]
+    print("✓ Hashing embedder produces normalized float32 rows")
+
+
+def test_search_ranks_similar_entries():
+    index = LorebookVectorIndex()
+    index.sync(ENTRIES)
+    assert index.matrix.dtype == np.float32
+    assert index.matrix.flags["C_CONTIGUOUS"]
+
+    results = index.search("a huge fire breathing dragon attacked", top_k=3, threshold=0.05)
+    assert [entry_id for entry_id, _ in results] == ["dragon"]
+    results = index.search("we walk in the forest", top_k=3, threshold=0.05)
+    assert results[0][0] == "forest"
+    assert index.search("hello there, how are you?", top_k=3, threshold=0.05) == []
+
+    # Threshold 0 returns everything up to top_k, most similar first
+    results = index.search("the queen's court", top_k=2, threshold=0.0)
+    assert len(results) == 2
+    assert results[0][0] == "court"
+    assert results[0][1] >= results[1][1]
+
+    # Searches can be restricted to some rows
+    rows = index.rows_for(["forest", "court", "unknown"])
+    assert len(rows) == 2
+    assert index.search("dragon fire", top_k=3, threshold=0.0, rows=rows)[0][1] == 0.0
+    print("✓ Search ranks entries by similarity with top-k and threshold")
+
+
+def test_incremental_updates_and_persistence():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "vectors")
+        index = LorebookVectorIndex(path)
+        assert index.sync(ENTRIES) == 3
+        assert index.embedded == 3
+        assert os.path.getsize(path + ".f32") == 3 * index.embedder.dimensions * 4
+
+        # Unchanged entries aren't embedded again
+        assert index.sync(ENTRIES) == 0
+        assert index.embedded == 3
+
+        # Changing one entry re-embeds only that entry
+        changed = dict(ENTRIES, court="Court\nAldoria\nThe royal court, where the king rules.")
+        assert index.sync(changed) == 1
+        assert index.embedded == 4
+
+        # Removing an entry moves the last row into its place
+        del changed["dragon"]
+        assert index.sync(changed) == 1
+        assert index.ids == ["forest", "court"]
+        assert os.path.getsize(path + ".f32") == 2 * index.embedder.dimensions * 4
+
+        reloaded = LorebookVectorIndex(path)
+        reloaded.load()
+        assert reloaded.ids == index.ids
+        assert np.array_equal(reloaded.matrix, index.matrix[:index.count])
+        assert np.array_equal(reloaded.doc_freq, index.doc_freq)
+        assert reloaded.sync(changed) == 0
+        assert reloaded.search("the king's court", 1, 0.05)[0][0] == "court"
+
+        # Vectors from another embedder are replaced, not mixed
+        custom = LorebookVectorIndex(path, LetterEmbedder())
+        custom.load()
+        assert len(custom) == 0
+        assert custom.sync(changed) == 2
+        assert json.load(open(path + ".json"))["embedder"] == "letters"
+        assert os.path.getsize(path + ".f32") == 2 * 26 * 4
+    print("✓ Index updates incrementally and persists")
+
+
+def test_vectorized_entries_activate_by_similarity():
+    from config_manager import ConfigManager
+    from discord_bot import DiscordBot
+    from web_server import WebServer
+
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = LorebookManager(os.path.join(tmp, "lorebook"))
+        manager.add_or_update_entry("Vermax", "The dragon Vermax sleeps under the mountain of fire.",
+                                    keywords=["Vermax"], activation_type="vectorized")
+        manager.add_or_update_entry("Forest", "Elven forests full of ancient trees.",
+                                    keywords=["elves"], activation_type="vectorized")
+        manager.add_or_update_entry("Court", "The royal court of Aldoria, ruled by the queen.", keywords=["court"])
+        assert os.path.exists(os.path.join(tmp, "lorebook", "lorebook_vectors.f32"))
+        assert len(manager.vector_index) == 2
+
+        section = manager.get_system_prompt_section("A dragon breathes fire at us!")
+        assert "**Vermax:**" in section
+        assert "**Forest:**" not in section
+        # Keywords still work, and normal entries don't activate by similarity
+        assert "**Forest:**" in manager.get_system_prompt_section("The elves are here")
+        assert "**Court:**" not in manager.get_system_prompt_section("The queen of Aldoria")
+        keys = [entry["key"] for entry in manager.get_relevant_entries("ancient forest trees")]
+        assert keys == ["Forest"]
+
+        manager.vector_top_k = 0
+        assert manager.get_system_prompt_section("A dragon breathes fire at us!") == ""
+        manager.vector_top_k = 3
+
+        # Editing an entry re-embeds just that entry
+        embedded = manager.vector_index.embedded
+        manager.add_or_update_entry("Forest", "Elven forests full of ancient oaks.",
+                                    keywords=["elves"], activation_type="vectorized")
+        assert manager.vector_index.embedded == embedded + 1
+        manager.delete_entry("Vermax")
+        assert manager.vector_index.ids == [LorebookManager.entry_id("Default", "Forest")]
+        assert "**Vermax:**" not in manager.get_system_prompt_section("A dragon breathes fire at us!")
+
+        # Reloading doesn't embed anything again
+        reloaded = LorebookManager(os.path.join(tmp, "lorebook"))
+        assert reloaded.vector_index.embedded == 0
+        assert "**Forest:**" in reloaded.get_system_prompt_section("We walk among ancient oaks")
+
+        config_path = os.path.join(tmp, "config.json")
+        with open(config_path, "w") as f:
+            json.dump({"lorebook_vectors": {"top_k": 1, "threshold": 0.5}}, f)
+        bot = DiscordBot(ConfigManager(config_path))
+        bot.lorebook_manager = reloaded
+        bot.configure_lorebook_vectors()
+        assert reloaded.vector_top_k == 1
+        assert reloaded.vector_threshold == 0.5
+        metrics = WebServer(bot.config_manager, bot).app.test_client().get('/api/metrics').get_json()
+        assert metrics["lorebook_vectors"]["entries"] == 1
+    print("✓ Vectorized entries activate by similarity")
+
+
+if __name__ == "__main__":
+    try:
+        test_hashing_embedder()
+        test_search_ranks_similar_entries()
+        test_incremental_updates_and_persistence()
+        test_vectorized_entries_activate_by_similarity()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""Test the compiled prompt context cache and its file-change invalidation."""
+import sys
+import os
+import json
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config_manager import ConfigManager
+from discord_bot import DiscordBot
+from character_manager import CharacterManager
+from user_characters_manager import UserCharactersManager
+from lorebook_manager import LorebookManager
+from prompt_context_cache import PromptContextCache, compile_prompt_sections
+
+
+def make_bot(tmp):
+    config_path = os.path.join(tmp, "config.json")
+    with open(config_path, "w") as f:
+        json.dump({"openai_config": {"api_key": "sk-test", "base_url": "http://127.0.0.1:1/v1", "model": "m"}}, f)
+    bot = DiscordBot(ConfigManager(config_path))
+    bot.character_manager = CharacterManager(os.path.join(tmp, "character_cards"))
+    bot.user_characters_manager = UserCharactersManager(os.path.join(tmp, "user_characters"))
+    bot.lorebook_manager = LorebookManager(os.path.join(tmp, "lorebook"))
+    bot.character_manager.save_character("Bob", {"name": "Bob", "description": "A grumpy innkeeper."})
+    bot.channel_characters[111] = {"name": "Bob"}
+    return bot
+
+
+def count_calls(obj, name):
+    """Wrap obj.name so calls are counted in the returned list."""
+    calls = []
+    original = getattr(obj, name)
+
+    def wrapper(*args, **kwargs):
+        calls.append(args)
+        return original(*args, **kwargs)
+    setattr(obj, name, wrapper)
+    return calls
+
+
+def test_reload_if_changed():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "data.json")
+        cache = PromptContextCache()
+        loads = []
+        assert cache.reload_if_changed("data", [path], lambda: loads.append(1))
+        assert not cache.reload_if_changed("data", [path], lambda: loads.append(1))
+        with open(path, "w") as f:
+            f.write("{}")
+        assert cache.reload_if_changed("data", [path], lambda: loads.append(1))
+        assert not cache.reload_if_changed("data", [path], lambda: loads.append(1))
+        cache.invalidate()
+        assert cache.reload_if_changed("data", [path], lambda: loads.append(1))
+        assert len(loads) == 3
+    print("✓ Files are reloaded only when they change")
+
+
+def test_compile_prompt_sections():
+    preset = {"prompt_sections": [
+        {"role": "system", "content": "Second", "order": 2},
+        {"role": "system", "content": "Hidden", "order": 1, "enabled": False},
+        {"role": "user", "content": "First", "order": 0}
+    ]}
+    sections, legacy = compile_prompt_sections(preset, {"character_system": "You are Bob."})
+    assert not legacy
+    assert sections == [
+        {"role": "user", "content": "First"},
+        {"role": "system", "content": "Second\n\nYou are Bob."}
+    ]
+    sections, legacy = compile_prompt_sections({"system_prompt": "Be nice."}, {})
+    assert legacy
+    assert sections == [{"role": "system", "content": "Be nice."}]
+    print("✓ Preset sections are compiled in order")
+
+
+def test_character_card_read_once():
+    """The character card is read from disk once, then again only after the file changes."""
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = make_bot(tmp)
+        loads = count_calls(bot.character_manager, "load_character")
+
+        first = bot.build_chat_messages(111, "Hello")
+        bot.build_chat_messages(111, "Hello again")
+        bot.build_chat_messages(111, "Still there?")
+        assert len(loads) == 1
+        assert "A grumpy innkeeper." in first[0]["content"]
+        assert bot.character_manager.current_character["name"] == "Bob"
+
+        # Edited on disk (e.g. by the web UI): picked up on the next message
+        bot.character_manager.save_character("Bob", {"name": "Bob", "description": "A cheerful innkeeper now."})
+        updated = bot.build_chat_messages(111, "Hello")
+        assert len(loads) == 2
+        assert "A cheerful innkeeper now." in updated[0]["content"]
+        assert bot.channel_characters[111]["description"] == "A cheerful innkeeper now."
+        stats = bot.prompt_context_cache.snapshot()
+        assert stats["hits"] == 2
+        assert stats["misses"] == 2
+    print("✓ Character card is read once and rebuilt when its file changes")
+
+
+def test_lorebooks_reloaded_only_on_change():
+    """Lorebooks edited by another manager instance (the web UI) are picked up; otherwise not re-read."""
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = make_bot(tmp)
+        reloads = count_calls(bot.lorebook_manager, "load_all_lorebooks")
+
+        bot.build_chat_messages(111, "Tell me about the dragon")
+        bot.build_chat_messages(111, "Tell me about the dragon")
+        assert len(reloads) == 1
+
+        web_lorebooks = LorebookManager(os.path.join(tmp, "lorebook"))
+        web_lorebooks.add_or_update_entry("dragon", "The dragon sleeps under the inn.", keywords=["dragon"])
+        messages = bot.build_chat_messages(111, "Tell me about the dragon")
+        assert len(reloads) == 2
+        assert "The dragon sleeps under the inn." in messages[0]["content"]
+    print("✓ Lorebooks are reloaded only when their files change")
+
+
+def test_web_edits_invalidate_cache():
+    """Saving content through the web API invalidates the bot's compiled context."""
+    from web_server import WebServer
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = make_bot(tmp)
+        web_server = WebServer(bot.config_manager, bot)
+        web_server.character_manager = CharacterManager(os.path.join(tmp, "character_cards"))
+        client = web_server.app.test_client()
+
+        bot.build_chat_messages(111, "Hello")
+        response = client.post('/api/characters/Bob', json={"name": "Bob", "description": "Retired."})
+        assert response.status_code == 200
+        assert bot.prompt_context_cache.snapshot()["invalidations"] == 1
+        assert bot.prompt_context_cache.snapshot()["entries"] == 0
+        assert "Retired." in bot.build_chat_messages(111, "Hello")[0]["content"]
+
+        # Reads don't invalidate; the explicit endpoint does
+        client.get('/api/characters')
+        assert bot.prompt_context_cache.snapshot()["invalidations"] == 1
+        assert client.post('/api/prompt_cache/invalidate').status_code == 200
+        assert bot.prompt_context_cache.snapshot()["invalidations"] == 2
+        assert "prompt_context_cache" in client.get('/api/metrics').get_json()
+    print("✓ Web edits invalidate the compiled prompt context")
+
+
+if __name__ == "__main__":
+    try:
+        test_reload_if_changed()
+        test_compile_prompt_sections()
+        test_character_card_read_once()
+        test_lorebooks_reloaded_only_on_change()
+        test_web_edits_invalidate_cache()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
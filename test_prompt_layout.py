@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Test the cache-friendly prompt layout and the prefix-stability metric."""
+import sys
+import os
+import json
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config_manager import ConfigManager
+from discord_bot import DiscordBot
+from generation_metrics import PrefixStabilityTracker, common_prefix_length
+from lorebook_manager import LorebookManager
+
+
+def make_bot(tmp, mode):
+    config_path = os.path.join(tmp, "config.json")
+    with open(config_path, "w") as f:
+        json.dump({
+            "openai_config": {"api_key": "sk-test", "base_url": "http://127.0.0.1:1/v1", "model": "m"},
+            "prompt_layout": {"mode": mode}
+        }, f)
+    bot = DiscordBot(ConfigManager(config_path))
+    bot.lorebook_manager = LorebookManager(os.path.join(tmp, "lorebook"))
+    bot.lorebook_manager.add_or_update_entry("dragon", "Dragons breathe fire.", keywords=["dragon"])
+    bot.lorebook_manager.add_or_update_entry("castle", "The castle has three towers.", keywords=["castle"])
+    bot.character_names[111] = ["Aria"]
+    return bot
+
+
+def play_turn(bot, user_message, reply):
+    """Build the prompt for a turn, then record the exchange in history."""
+    messages = bot.build_chat_messages(111, user_message, "Aria")
+    bot.conversations.setdefault(111, []).extend([
+        {"role": "user", "content": f"Aria: {user_message}"},
+        {"role": "assistant", "content": reply}
+    ])
+    return messages
+
+
+def test_common_prefix_length():
+    assert common_prefix_length("", "") == 0
+    assert common_prefix_length("abc", "abc") == 3
+    assert common_prefix_length("abcdef", "abcxyz") == 3
+    assert common_prefix_length("abc", "abcdef") == 3
+    assert common_prefix_length("x" * 10000 + "a", "x" * 10000 + "b") == 10000
+    print("✓ Common prefix length")
+
+
+def test_classic_layout_is_unchanged():
+    """The default layout still folds lore and the character list into the system prompt."""
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = make_bot(tmp, "classic")
+        first = play_turn(bot, "I see a dragon", "It roars.")
+        second = play_turn(bot, "We reach the castle", "The gates open.")
+        assert first[0]["role"] == "system"
+        assert "Dragons breathe fire." in first[0]["content"]
+        assert "Aria" in first[0]["content"]
+        assert "three towers" in second[0]["content"]
+        assert first[0]["content"] != second[0]["content"]
+        assert sum(1 for message in second if message["role"] == "system") == 1
+    print("✓ Classic layout is unchanged")
+
+
+def test_cache_friendly_layout_keeps_prefix_stable():
+    """Volatile blocks move right before the new user message; everything above is byte-stable."""
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = make_bot(tmp, "cache_friendly")
+        first = play_turn(bot, "I see a dragon", "It roars.")
+        second = play_turn(bot, "We reach the castle", "The gates open.")
+
+        # System prompt carries no volatile content and is identical between turns
+        assert first[0] == second[0]
+        assert "Dragons breathe fire." not in first[0]["content"]
+        assert "Aria" not in first[0]["content"]
+
+        # Volatile context sits just before the current user message
+        assert second[-1] == {"role": "user", "content": "Aria: We reach the castle"}
+        assert second[-2]["role"] == "system"
+        assert "three towers" in second[-2]["content"]
+        assert "Aria" in second[-2]["content"]
+        assert not second[-2]["content"].startswith("\n")
+
+        # The earlier prompt, minus its volatile block and user message, prefixes the new one
+        assert second[:len(first) - 2] == first[:-2]
+        assert second[len(first) - 2] == {"role": "user", "content": "Aria: I see a dragon"}
+    print("✓ Cache-friendly layout keeps the prefix stable")
+
+
+def test_prefix_stability_metric():
+    """The cache-friendly layout scores much higher on prefix stability."""
+    results = {}
+    for mode in ("classic", "cache_friendly"):
+        with tempfile.TemporaryDirectory() as tmp:
+            bot = make_bot(tmp, mode)
+            # A long-running roleplay: the history dominates the prompt
+            bot.conversations[111] = [
+                {"role": "user" if i % 2 == 0 else "assistant", "content": f"Earlier message {i}. " + "words " * 40}
+                for i in range(16)
+            ]
+            for i in range(6):
+                keyword = "dragon" if i % 2 else "castle"
+                play_turn(bot, f"Turn {i}: the {keyword} " + "looms " * 10, "Something happens. " * 10)
+            stats = bot.prefix_stability.snapshot()["111"]
+            assert stats["prompts"] == 5
+            results[mode] = stats["avg_ratio"]
+    assert results["cache_friendly"] > 0.8, results
+    assert results["cache_friendly"] > results["classic"] + 0.5, results
+    print(f"✓ Prefix stability: classic {results['classic']:.0%}, cache_friendly {results['cache_friendly']:.0%}")
+
+
+def test_tracker_first_prompt_and_snapshot():
+    tracker = PrefixStabilityTracker()
+    messages = [{"role": "system", "content": "Stable"}, {"role": "user", "content": "Hi"}]
+    assert tracker.record(1, messages) == 0.0
+    assert tracker.snapshot() == {}
+    assert tracker.record(1, messages) == 1.0
+    assert tracker.snapshot()["1"]["avg_ratio"] == 1.0
+    print("✓ Tracker starts scoring from the second prompt")
+
+
+if __name__ == "__main__":
+    try:
+        test_common_prefix_length()
+        test_classic_layout_is_unchanged()
+        test_cache_friendly_layout_keeps_prefix_stable()
+        test_prefix_stability_metric()
+        test_tracker_first_prompt_and_snapshot()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""Test client-side rate limiting driven by provider rate-limit headers."""
+import sys
+import os
+import time
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from rate_limiter import RateLimiter, parse_duration
+from fake_provider import fake_provider, completion, api_config, make_bot
+
+ENDPOINT = "http://provider.test/v1"
+
+
+def test_parse_duration():
+    """Reset headers in Go duration, millisecond and plain-second formats are understood."""
+    assert parse_duration("1s") == 1.0
+    assert parse_duration("6m0s") == 360.0
+    assert abs(parse_duration("20ms") - 0.02) < 1e-9
+    assert parse_duration("1h2m3.5s") == 3723.5
+    assert parse_duration("0.5") == 0.5
+    assert 9 <= parse_duration(str(time.time() + 10)) <= 10
+    assert parse_duration(None) is None
+    assert parse_duration("soon") is None
+    print("✓ Reset durations are parsed")
+
+
+def test_wait_time_from_headers():
+    """An exhausted token budget predicts a wait until enough tokens refill."""
+    limiter = RateLimiter()
+    assert limiter.wait_time(ENDPOINT, 1000) == 0.0
+
+    limiter.observe(ENDPOINT, {
+        "x-ratelimit-limit-requests": "100",
+        "x-ratelimit-remaining-requests": "99",
+        "x-ratelimit-reset-requests": "600ms",
+        "x-ratelimit-limit-tokens": "10000",
+        "x-ratelimit-remaining-tokens": "0",
+        "x-ratelimit-reset-tokens": "10s"
+    })
+    # 10000 tokens refill over 10s: 1000 tokens take about a second
+    assert 0.9 <= limiter.wait_time(ENDPOINT, 1000) <= 1.0
+    assert limiter.wait_time(ENDPOINT, 0) == 0.0
+
+    limiter.observe(ENDPOINT + "/", {"Retry-After": "5"})
+    assert 4.9 <= limiter.wait_time(ENDPOINT, 0) <= 5.0
+    snapshot = limiter.snapshot()[ENDPOINT]
+    assert snapshot["tokens"]["capacity"] == 10000
+    assert snapshot["blocked_for_seconds"] > 4
+    print("✓ Wait time follows the rate-limit headers")
+
+
+def test_acquire_waits_and_reserves():
+    """acquire waits for the budget, reserves the tokens, and never waits past max_wait."""
+    limiter = RateLimiter(max_wait=0.3)
+    limiter.observe(ENDPOINT, {
+        "x-ratelimit-limit-tokens": "1000",
+        "x-ratelimit-remaining-tokens": "100",
+        "x-ratelimit-reset-tokens": "9s"
+    })
+
+    async def run():
+        first = await limiter.acquire(ENDPOINT, 100)
+        second = await limiter.acquire(ENDPOINT, 500)
+        return first, second
+
+    start = time.perf_counter()
+    first, second = asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    assert first == 0.0
+    assert second == 0.3
+    assert 0.25 <= elapsed < 1.0
+    snapshot = limiter.snapshot()[ENDPOINT]
+    assert snapshot["throttled_requests"] == 1
+    assert snapshot["tokens"]["available"] < 0
+    print("✓ acquire waits for the budget, capped at max_wait")
+
+
+def test_concurrent_acquires_queue():
+    """Concurrent requests reserve before waiting, so they are spread out instead of released together."""
+    limiter = RateLimiter(max_wait=5)
+    limiter.observe(ENDPOINT, {
+        "x-ratelimit-limit-requests": "10",
+        "x-ratelimit-remaining-requests": "0",
+        "x-ratelimit-reset-requests": "1s"
+    })
+
+    async def run():
+        return await asyncio.gather(*(limiter.acquire(ENDPOINT) for _ in range(5)))
+
+    waits = sorted(asyncio.run(run()))
+    # 10 requests refill per second: one more every 0.1s
+    for i, wait in enumerate(waits):
+        assert abs(wait - (i + 1) / 10) < 0.02, waits
+    # Nothing was sent before the bucket had room for it
+    assert limiter.snapshot()[ENDPOINT]["requests"]["available"] >= -0.05
+    print("✓ Concurrent requests queue behind each other")
+
+
+def rate_limited_provider(reply, remaining_tokens=10000):
+    """Fake provider that reports server.remaining_tokens in its rate-limit headers."""
+    def respond(handler, request):
+        handler.send_json(completion(handler.server.reply), headers={
+            "x-ratelimit-limit-requests": "60",
+            "x-ratelimit-remaining-requests": "59",
+            "x-ratelimit-reset-requests": "1s",
+            "x-ratelimit-limit-tokens": "10000",
+            "x-ratelimit-remaining-tokens": str(handler.server.remaining_tokens),
+            "x-ratelimit-reset-tokens": "1m0s"
+        })
+
+    return fake_provider(respond, reply=reply, remaining_tokens=remaining_tokens)
+
+
+def make_failover_bot(tmp, primary, backup):
+    return make_bot(
+        tmp,
+        saved_api_configs={"main": api_config(primary), "backup": api_config(backup)},
+        channel_configs={"111": {"api_config": "main", "failover_api_configs": ["backup"]}},
+        rate_limits={"max_wait": 5, "reroute_after": 2.0}
+    )
+
+
+def generate(bot):
+    return asyncio.run(bot.generate_response(
+        111, None, [{"role": "user", "content": "Hi"}], bot.preset_manager.get_current_preset()
+    ))
+
+
+def test_bot_reroutes_when_primary_is_exhausted():
+    """Response headers update the limiter; an exhausted primary sends the next request to the failover."""
+    with rate_limited_provider("from main", remaining_tokens=0) as primary, \
+            rate_limited_provider("from backup") as backup, tempfile.TemporaryDirectory() as tmp:
+        bot = make_failover_bot(tmp, primary, backup)
+        main_url = bot.get_api_candidates(111)[0][1].base_url
+
+        # First request learns the primary's budget from its headers
+        assert generate(bot) == "from main"
+        assert bot.rate_limiter.snapshot()[main_url]["tokens"]["available"] < 100
+        assert bot.rate_limiter.wait_time(main_url, 2000) > 2.0
+
+        # Second request would have to wait, so it goes to the backup without waiting
+        start = time.perf_counter()
+        assert generate(bot) == "from backup"
+        assert time.perf_counter() - start < 2.0
+        assert len(primary.requests) == 1
+        assert len(backup.requests) == 1
+    print("✓ Exhausted primary reroutes to the failover config")
+
+
+def test_request_estimate_reserves_reply_length():
+    """The completion reserve is the reply length, not the preset's context size."""
+    with rate_limited_provider("from main") as primary, rate_limited_provider("from backup") as backup, \
+            tempfile.TemporaryDirectory() as tmp:
+        bot = make_failover_bot(tmp, primary, backup)
+        messages = [{"role": "user", "content": "Hi"}]
+        prompt_tokens = bot.estimate_tokens("Hi")
+        preset = {"max_tokens": 4000, "max_response_length": 300}
+        assert bot.estimate_request_tokens(messages, preset) == prompt_tokens + 300
+        # Every swipe candidate reserves its own reply
+        assert bot.estimate_request_tokens(messages, preset, completions=3) == prompt_tokens + 900
+        # Presets without a reply length still fall back to max_tokens
+        assert bot.estimate_request_tokens(messages, {"max_tokens": 500}) == prompt_tokens + 500
+    print("✓ Request estimates reserve the reply length")
+
+
+def test_rate_limits_endpoint():
+    """GET /api/rate_limits reports the limiter's per-endpoint state."""
+    from web_server import WebServer
+
+    with rate_limited_provider("from main") as primary, rate_limited_provider("from backup") as backup, \
+            tempfile.TemporaryDirectory() as tmp:
+        bot = make_failover_bot(tmp, primary, backup)
+        generate(bot)
+        client = WebServer(bot.config_manager, bot).app.test_client()
+        data = client.get('/api/rate_limits').get_json()
+        assert data["settings"]["max_wait"] == 5
+        main_url = bot.get_api_candidates(111)[0][1].base_url
+        assert data["endpoints"][main_url]["requests"]["capacity"] == 60
+        assert data["endpoints"][main_url]["tokens"]["capacity"] == 10000
+
+        response = client.post('/api/config', json={"rate_limits": {"max_wait": 12}})
+        assert response.status_code == 200
+        assert bot.rate_limiter.max_wait == 12
+
+        assert WebServer(bot.config_manager).app.test_client().get('/api/rate_limits').status_code == 400
+        bot.config_manager.flush()
+    print("✓ /api/rate_limits reports endpoint budgets")
+
+
+if __name__ == "__main__":
+    try:
+        test_parse_duration()
+        test_wait_time_from_headers()
+        test_acquire_waits_and_reserves()
+        test_concurrent_acquires_queue()
+        test_bot_reroutes_when_primary_is_exhausted()
+        test_request_estimate_reserves_reply_length()
+        test_rate_limits_endpoint()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
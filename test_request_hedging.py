@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""Test hedged requests across two API configs."""
+import sys
+import os
+import time
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from request_hedging import RequestHedger
+from fake_provider import fake_provider, completion, api_config, make_bot
+
+
+class FakeClient:
+    """Stands in for an OpenAIClient: answers after a delay, or fails."""
+
+    def __init__(self, name, delay, fail=False):
+        self.name = name
+        self.delay = delay
+        self.fail = fail
+        self.cancelled = False
+
+
+async def fake_attempt(client, claim):
+    try:
+        await asyncio.sleep(client.delay)
+    except asyncio.CancelledError:
+        client.cancelled = True
+        raise
+    if client.fail:
+        raise Exception(f"{client.name} failed")
+    if not claim():
+        raise asyncio.CancelledError()
+    return f"reply from {client.name}"
+
+
+def run_hedged(hedger, primary, secondary):
+    return asyncio.run(hedger.run((primary.name, primary), (secondary.name, secondary), fake_attempt))
+
+
+def test_fast_primary_is_not_hedged():
+    """A primary that answers within the hedge delay never triggers the secondary."""
+    hedger = RequestHedger(default_delay=0.5, min_delay=0.01)
+    primary, secondary = FakeClient("main", 0.01), FakeClient("backup", 0.01)
+    assert run_hedged(hedger, primary, secondary) == "reply from main"
+    stats = hedger.snapshot()
+    assert stats["main"]["wins"] == 1
+    assert stats["main"]["hedges_fired"] == 0
+    assert "backup" not in stats
+    print("✓ Fast primary is not hedged")
+
+
+def test_slow_primary_is_hedged_and_cancelled():
+    """A stuck primary is raced by the secondary, which wins; the primary is cancelled."""
+    hedger = RequestHedger(default_delay=0.05, min_delay=0.01)
+    primary, secondary = FakeClient("main", 5), FakeClient("backup", 0.05)
+    start = time.perf_counter()
+    assert run_hedged(hedger, primary, secondary) == "reply from backup"
+    assert time.perf_counter() - start < 1.0
+    assert primary.cancelled
+    stats = hedger.snapshot()
+    assert stats["main"]["hedges_fired"] == 1
+    assert stats["main"]["wins"] == 0
+    assert stats["backup"]["wins"] == 1
+    assert stats["backup"]["hedge_wins"] == 1
+    assert stats["backup"]["first_token_latency"]["count"] == 1
+    print("✓ Slow primary is hedged and the loser is cancelled")
+
+
+def test_failed_primary_hedges_immediately():
+    """If the primary fails before the hedge delay, the secondary is sent right away."""
+    hedger = RequestHedger(default_delay=5, min_delay=5)
+    primary, secondary = FakeClient("main", 0.01, fail=True), FakeClient("backup", 0.01)
+    start = time.perf_counter()
+    assert run_hedged(hedger, primary, secondary) == "reply from backup"
+    assert time.perf_counter() - start < 1.0
+    print("✓ Failed primary hedges immediately")
+
+
+def test_both_fail_raises_primary_error():
+    """When both requests fail, the primary's error is raised."""
+    hedger = RequestHedger(default_delay=0.01, min_delay=0.01)
+    primary, secondary = FakeClient("main", 0.01, fail=True), FakeClient("backup", 0.01, fail=True)
+    try:
+        run_hedged(hedger, primary, secondary)
+        assert False, "Expected an error"
+    except Exception as e:
+        assert str(e) == "main failed"
+    print("✓ Both failing raises the primary's error")
+
+
+def test_cancelled_legs_and_full_response_latency():
+    """A cancelled leg doesn't hide the other's error; non-streaming claims feed their own metric."""
+    async def cancelled_attempt(client, claim):
+        if client.name == "main":
+            raise asyncio.CancelledError()
+        return await fake_attempt(client, claim)
+
+    async def run_both(primary, secondary):
+        return await hedger.run((primary.name, primary), (secondary.name, secondary), cancelled_attempt)
+
+    hedger = RequestHedger(default_delay=0.01, min_delay=0.01)
+    try:
+        asyncio.run(run_both(FakeClient("main", 0), FakeClient("backup", 0.01, fail=True)))
+        assert False, "Expected an error"
+    except Exception as e:
+        assert str(e) == "backup failed"
+
+    hedger = RequestHedger(default_delay=0.5, min_delay=0.01)
+    primary, secondary = FakeClient("main", 0.01), FakeClient("backup", 0.01)
+    result = asyncio.run(hedger.run(("main", primary), ("backup", secondary), fake_attempt, streaming=False))
+    assert result == "reply from main"
+    stats = hedger.snapshot()["main"]
+    assert stats["first_token_latency"]["count"] == 0
+    assert stats["full_response_latency"]["count"] == 1
+    for _ in range(20):
+        hedger.record_full_response("main", 4.0)
+    assert hedger.hedge_delay("main") == 0.5
+    assert hedger.hedge_delay("main", streaming=False) == 4.0
+    print("✓ Cancelled legs and non-streaming latencies are handled")
+
+
+def test_hedge_delay_tracks_percentile():
+    """The hedge delay follows the primary's p95 once enough samples exist."""
+    hedger = RequestHedger(percentile=95, min_samples=20, default_delay=8.0, min_delay=0.5, max_delay=10.0)
+    assert hedger.hedge_delay("main") == 8.0
+    for i in range(100):
+        hedger.record_first_token("main", (i + 1) / 10)
+    assert 9.0 <= hedger.hedge_delay("main") <= 10.0
+    for _ in range(200):
+        hedger.record_first_token("fast", 0.1)
+    assert hedger.hedge_delay("fast") == 0.5
+    print("✓ Hedge delay follows the p95 first-token latency")
+
+
+def delayed_provider(delay, reply):
+    """Fake provider that answers after delay seconds."""
+    def respond(handler, request):
+        time.sleep(delay)
+        handler.send_json(completion(reply))
+
+    return fake_provider(respond)
+
+
+def test_bot_hedges_between_channel_configs():
+    """With hedging enabled the bot answers from the faster of two API configs."""
+    with delayed_provider(3.0, "slow reply") as slow, delayed_provider(0.05, "fast reply") as fast, \
+            tempfile.TemporaryDirectory() as tmp:
+        bot = make_bot(
+            tmp,
+            saved_api_configs={"slow": api_config(slow), "fast": api_config(fast)},
+            channel_configs={"111": {"api_config": "slow", "failover_api_configs": ["fast"]}},
+            hedging={"enabled": True, "default_delay": 0.2, "min_delay": 0.1}
+        )
+
+        start = time.perf_counter()
+        response = asyncio.run(bot.generate_response(
+            111, None, [{"role": "user", "content": "Hi"}], bot.preset_manager.get_current_preset()
+        ))
+        elapsed = time.perf_counter() - start
+        assert response == "fast reply"
+        assert elapsed < 2.0, f"Hedged reply took {elapsed:.2f}s"
+        stats = bot.hedger.snapshot()
+        assert stats["slow"]["hedges_fired"] == 1
+        assert stats["fast"]["hedge_wins"] == 1
+    print("✓ Bot hedges slow requests to the channel's second API config")
+
+
+if __name__ == "__main__":
+    try:
+        test_fast_primary_is_not_hedged()
+        test_slow_primary_is_hedged_and_cancelled()
+        test_failed_primary_hedges_immediately()
+        test_both_fail_raises_primary_error()
+        test_cancelled_legs_and_full_response_latency()
+        test_hedge_delay_tracks_percentile()
+        test_bot_hedges_between_channel_configs()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
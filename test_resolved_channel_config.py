@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""Test the resolved per-channel config view and its invalidation."""
+import sys
+import os
+import json
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config_manager import ConfigManager
+
+
+CONFIG = {
+    "saved_api_configs": {
+        "main": {"api_key": "k1", "base_url": "https://main.example/v1", "model": "m1"},
+        "backup": {"api_key": "k2", "base_url": "https://backup.example/v1", "model": "m2"}
+    },
+    "server_configs": {"999": {"api_config": "backup", "character": "Luna", "failover_api_configs": ["main"]}},
+    "channel_configs": {
+        "111": {"api_config": "main", "character": ""},
+        "222": {"character": "Sherlock"}
+    },
+    "thinking_filter": {"enabled": True, "start_tag": "<think>", "end_tag": "</think>"},
+    "cp_tracking": {"enabled": False},
+    "manual_send_enabled": False
+}
+
+
+def make_config(tmp):
+    config_path = os.path.join(tmp, "config.json")
+    with open(config_path, "w") as f:
+        json.dump(CONFIG, f)
+    return ConfigManager(config_path)
+
+
+def test_inheritance():
+    with tempfile.TemporaryDirectory() as tmp:
+        config = make_config(tmp)
+        resolved = config.resolve_channel(111, 999)
+        assert resolved.api_config_name == "main"
+        assert resolved.api_config["model"] == "m1"
+        # Empty channel values fall back to the server
+        assert resolved.character == "Luna"
+        assert resolved.failover_api_configs == ["main"]
+        assert resolved.thinking_filter["enabled"] is True
+
+        resolved = config.resolve_channel(222, 999)
+        assert resolved.api_config_name == "backup"
+        assert resolved.character == "Sherlock"
+
+        # No server: no server fallbacks
+        resolved = config.resolve_channel(333)
+        assert resolved.api_config_name == "" and resolved.api_config is None
+        assert resolved.character is None
+        assert resolved.failover_api_configs == []
+    print("✓ Channel > server > default inheritance is applied once")
+
+
+def test_lookups_and_invalidation():
+    with tempfile.TemporaryDirectory() as tmp:
+        config = make_config(tmp)
+        for channel_id in (111, 222, 333):
+            config.resolve_channel(channel_id, 999)
+        config.resolve_channel(444)
+        assert config.resolve_builds == 4
+        # Repeated lookups are dict lookups; a lookup without server_id reuses the entry
+        assert config.resolve_channel(111, 999) is config.resolve_channel(111)
+        assert config.resolve_builds == 4
+
+        # A channel write rebuilds only that channel
+        config.set('channel_configs.222.character', 'Watson')
+        assert config.resolve_channel(222, 999).character == "Watson"
+        assert config.resolve_builds == 5
+        config.resolve_channel(111, 999)
+        assert config.resolve_builds == 5
+
+        # A server write rebuilds only that server's channels
+        config.set('server_configs.999.character', 'Mira')
+        for channel_id in (111, 222, 333, 444):
+            config.resolve_channel(channel_id, 999 if channel_id != 444 else None)
+        assert config.resolve_builds == 8
+        assert config.resolve_channel(333).character == "Mira"
+
+        # update_config with channel and server sections only touches those ids
+        config.update_config({"channel_configs": {"111": {"api_config": "backup"}}})
+        assert config.resolve_channel(111, 999).api_config_name == "backup"
+        config.resolve_channel(222, 999)
+        assert config.resolve_builds == 9
+
+        # Settings every channel shares rebuild everything
+        config.update_config({"manual_send_enabled": True})
+        assert config.resolve_channel(222, 999).manual_send_enabled is True
+        config.delete_api_config("backup")
+        assert config.resolve_channel(111, 999).api_config is None
+        # In-place edits of shared dicts are seen without a rebuild
+        config.config["thinking_filter"]["enabled"] = False
+        assert config.resolve_channel(111).thinking_filter["enabled"] is False
+        config.flush()
+    print("✓ Writes rebuild only the affected channels")
+
+
+def test_bot_and_web_routes():
+    from discord_bot import DiscordBot
+    from web_server import WebServer
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config = make_config(tmp)
+        bot = DiscordBot(config)
+        assert bot.get_openai_client_for_channel(111, 999).base_url == "https://main.example/v1"
+        assert [name for name, _ in bot.get_api_candidates(222, 999)] == ["backup", "main"]
+        assert bot.get_character_for_channel(222, 999) == "Sherlock"
+
+        client = WebServer(config, bot).app.test_client()
+        response = client.post('/api/channel_config/222', json={"preset": "", "api_config": "main", "character": ""})
+        assert response.get_json()["status"] == "success"
+        assert bot.get_character_for_channel(222, 999) == "Luna"
+        assert bot.get_openai_client_for_channel(222, 999).base_url == "https://main.example/v1"
+
+        response = client.post('/api/server_config/999', json={"preset": "", "api_config": "", "character": "Mira"})
+        assert response.get_json()["status"] == "success"
+        assert bot.get_character_for_channel(111, 999) == "Mira"
+
+        assert client.delete('/api/channel_config/111').get_json()["status"] == "success"
+        assert bot.get_openai_client_for_channel(111, 999) is bot.openai_client
+
+        client.post('/api/config', json={"cp_tracking": {"enabled": True}})
+        assert bot.append_cp_tracking("Reply", 111).endswith("[Count: 0/10]")
+        assert "Creation Points" in bot.get_cp_tracking_prompt(111)
+
+        # Reply filtering goes through the resolved view too
+        client.post('/api/config', json={"thinking_filter": {"enabled": True, "start_tag": "<think>", "end_tag": "</think>"}})
+        assert bot.filter_thinking_tags("<think>hm</think>Hi", 111)[1] == "Hi"
+        builds = config.resolve_builds
+        assert bot.visible_stream_text("Hi <think>hm", 111) == "Hi"
+        assert config.resolve_builds == builds
+        config.flush()
+    print("✓ The bot reads the resolved view and web writes refresh it")
+
+
+if __name__ == "__main__":
+    try:
+        test_inheritance()
+        test_lookups_and_invalidation()
+        test_bot_and_web_routes()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
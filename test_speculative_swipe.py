@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""Test speculative background pre-generation of swipe alternatives."""
+import sys
+import os
+import time
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_provider import fake_provider, completion, api_config, make_bot
+
+MESSAGES = [{"role": "system", "content": "You are a narrator."}, {"role": "user", "content": "Open the door"}]
+
+
+def usage_provider(delay=0.01):
+    """Fake provider that reports token usage and answers after delay seconds."""
+    def respond(handler, request):
+        count = len(handler.server.requests)
+        time.sleep(delay)
+        handler.send_json(completion(
+            f"The door creaks open ({count})", usage={"prompt_tokens": 42, "completion_tokens": 7, "total_tokens": 49}
+        ))
+
+    return fake_provider(respond)
+
+
+def make_speculating_bot(tmp, server, enabled=True, concurrency=4):
+    return make_bot(
+        tmp,
+        openai_config=api_config(server),
+        speculative_swipe={"enabled": enabled},
+        scheduler={"max_concurrent_per_endpoint": concurrency}
+    )
+
+
+def test_disabled_by_default():
+    """Nothing is pre-generated unless speculative swipes are enabled."""
+    with usage_provider() as server, tempfile.TemporaryDirectory() as tmp:
+        bot = make_speculating_bot(tmp, server, enabled=False)
+
+        async def run():
+            bot.start_speculative_swipe(111, None, MESSAGES, bot.preset_manager.get_current_preset())
+            return await bot.take_speculative_swipe(111)
+
+        assert asyncio.run(run()) is None
+        assert len(server.requests) == 0
+    print("✓ Speculative swipes are off by default")
+
+
+def test_swipe_uses_pregenerated_alternative():
+    """A ready speculative alternative answers the swipe without a new request."""
+    with usage_provider() as server, tempfile.TemporaryDirectory() as tmp:
+        bot = make_speculating_bot(tmp, server)
+        preset = bot.preset_manager.get_current_preset()
+
+        async def run():
+            bot.start_speculative_swipe(111, None, MESSAGES, preset)
+            await bot.speculative_swipes[111]["task"]
+            requests_before = len(server.requests)
+            responses = await bot.generate_swipe_alternatives(111, None, MESSAGES, preset)
+            return responses, len(server.requests) - requests_before
+
+        responses, new_requests = asyncio.run(run())
+        assert responses == ["The door creaks open (1)"]
+        assert new_requests == 0
+        counters = bot.generation_metrics.snapshot()["counters"]
+        assert counters["speculative_swipes_started"] == 1
+        assert counters["speculative_swipes_used"] == 1
+        assert counters["speculative_prompt_tokens"] == 42
+        assert counters["speculative_completion_tokens"] == 7
+    print("✓ Swipe uses the pre-generated alternative and tokens are reported")
+
+
+def test_new_chat_cancels_speculation():
+    """Starting a new turn cancels an in-flight speculative request."""
+    with usage_provider(delay=2.0) as server, tempfile.TemporaryDirectory() as tmp:
+        bot = make_speculating_bot(tmp, server)
+
+        async def run():
+            bot.start_speculative_swipe(111, None, MESSAGES, bot.preset_manager.get_current_preset())
+            task = bot.speculative_swipes[111]["task"]
+            await asyncio.sleep(0.1)
+            bot.cancel_speculative_swipe(111)
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            return task
+
+        start = time.perf_counter()
+        task = asyncio.run(run())
+        assert task.cancelled()
+        assert time.perf_counter() - start < 1.5
+        assert 111 not in bot.speculative_swipes
+        assert bot.generation_metrics.snapshot()["counters"]["speculative_swipes_cancelled"] == 1
+        assert bot.scheduler.snapshot()["endpoints"][bot.openai_client.base_url]["active"] == 0
+    print("✓ A new !chat cancels the speculative request")
+
+
+def test_queued_speculation_yields_to_real_swipe():
+    """A speculation still waiting for a slot is dropped so the swipe isn't stuck behind it."""
+    with usage_provider() as server, tempfile.TemporaryDirectory() as tmp:
+        bot = make_speculating_bot(tmp, server, concurrency=1)
+        preset = bot.preset_manager.get_current_preset()
+
+        async def run():
+            release = asyncio.Event()
+
+            async def busy():
+                async with bot.generation_slot(bot.openai_client, 1):
+                    await release.wait()
+
+            holder = asyncio.create_task(busy())
+            await asyncio.sleep(0)
+            bot.start_speculative_swipe(111, None, MESSAGES, preset)
+            await asyncio.sleep(0.05)
+            task = bot.speculative_swipes[111]["task"]
+            assert bot.scheduler.queue_depth() == 1
+            taken = await bot.take_speculative_swipe(111)
+            release.set()
+            await holder
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            return taken, task
+
+        taken, task = asyncio.run(run())
+        assert taken is None
+        assert task.cancelled()
+        assert len(server.requests) == 0
+    print("✓ Queued speculation yields to the real swipe")
+
+
+if __name__ == "__main__":
+    try:
+        test_disabled_by_default()
+        test_swipe_uses_pregenerated_alternative()
+        test_new_chat_cancels_speculation()
+        test_queued_speculation_yields_to_real_swipe()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""Test streaming generation and progressive Discord rendering."""
+import sys
+import os
+import json
+import time
+import asyncio
+import tempfile
+import threading
+from contextlib import aclosing
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from openai_client import OpenAIClient
+from config_manager import ConfigManager
+from discord_bot import DiscordBot, StreamingMessageRenderer
+from fake_provider import fake_provider, completion_chunk, base_url
+
+STREAMED_WORDS = ["Once ", "upon ", "a ", "time", "..."]
+
+
+def stream_story(handler, request):
+    """Fake OpenAI-compatible endpoint that streams server-sent events."""
+    assert request.get("stream") is True
+    handler.start_events()
+    for word in STREAMED_WORDS:
+        handler.send_event(completion_chunk(word))
+        time.sleep(0.02)
+    handler.send_event("[DONE]")
+
+
+def stream_until_hangup(handler, request):
+    """Streams until the client hangs up, then records that it did."""
+    handler.start_events()
+    try:
+        for i in range(500):
+            handler.send_event(completion_chunk(f"word{i} "))
+            time.sleep(0.01)
+    except (BrokenPipeError, ConnectionResetError):
+        handler.server.disconnected.set()
+
+
+class MockMessage:
+    _next_id = 1000
+    
+    def __init__(self, channel, embed, view):
+        MockMessage._next_id += 1
+        self.id = MockMessage._next_id
+        self.channel = channel
+        self.embed = embed
+        self.view = view
+        self.edits = 0
+        self.deleted = False
+    
+    async def edit(self, embed=None, view=None):
+        self.embed = embed
+        self.view = view
+        self.edits += 1
+    
+    async def delete(self):
+        self.deleted = True
+
+
+class MockChannel:
+    def __init__(self):
+        self.sent = []
+    
+    async def send(self, embed=None, view=None):
+        message = MockMessage(self, embed, view)
+        self.sent.append(message)
+        return message
+
+
+def test_stream_chat_completion_yields_deltas():
+    """stream_chat_completion should yield each delta as it arrives."""
+    print("\n=== Testing stream_chat_completion ===\n")
+    with fake_provider(stream_story) as server:
+        client = OpenAIClient(api_key="sk-test", base_url=base_url(server), model="test-model")
+        
+        async def collect():
+            return [delta async for delta in client.stream_chat_completion(
+                messages=[{"role": "user", "content": "Tell me a story"}]
+            )]
+        
+        deltas = asyncio.run(collect())
+        print(f"  Received deltas: {deltas}")
+        assert deltas == STREAMED_WORDS
+        print("✓ Deltas streamed in order")
+
+
+def test_stopping_early_closes_the_stream():
+    """A consumer that stops early closes the HTTP response instead of leaving it open."""
+    with fake_provider(stream_until_hangup, disconnected=threading.Event()) as server:
+        client = OpenAIClient(api_key="sk-test", base_url=base_url(server), model="test-model")
+        
+        async def first_delta():
+            async with aclosing(client.stream_chat_completion(
+                messages=[{"role": "user", "content": "Go on forever"}]
+            )) as deltas:
+                async for delta in deltas:
+                    break
+            # The connection is closed while the client is still in use
+            disconnected = await asyncio.to_thread(server.disconnected.wait, 3)
+            return delta, disconnected
+        
+        delta, disconnected = asyncio.run(first_delta())
+        assert delta == "word0 "
+        assert disconnected, "The provider kept streaming"
+        print("✓ Stopping early closes the stream")
+
+
+def test_renderer_posts_first_page_immediately_and_throttles_edits():
+    """The first text is posted at once; later updates respect the edit interval."""
+    async def run():
+        channel = MockChannel()
+        renderer = StreamingMessageRenderer(channel, edit_interval=60)
+        
+        await renderer.update("Hello")
+        assert len(channel.sent) == 1, "First text should be posted immediately"
+        assert renderer.first_visible_at is not None
+        
+        # Within the edit interval nothing is re-rendered
+        await renderer.update("Hello there")
+        assert channel.sent[0].edits == 0
+        assert not renderer.due()
+        
+        last_msg, ids = await renderer.finalize("Hello there, traveller!", view="VIEW")
+        assert ids == [channel.sent[0].id]
+        assert last_msg.embed.description == "Hello there, traveller!"
+        assert last_msg.view == "VIEW"
+    
+    asyncio.run(run())
+    print("✓ First page posted immediately, edits throttled, final render attaches view")
+
+
+def test_renderer_rolls_onto_new_pages():
+    """Text that outgrows one embed continues on a new page."""
+    async def run():
+        channel = MockChannel()
+        renderer = StreamingMessageRenderer(channel, edit_interval=0)
+        
+        paragraph = "The caravan moved slowly across the dunes. " * 40
+        text = paragraph
+        await renderer.update(text)
+        assert len(channel.sent) == 1
+        
+        text = paragraph + "\n\n" + paragraph + "\n\n" + paragraph
+        await renderer.update(text)
+        assert len(channel.sent) == 2, f"Expected 2 pages, got {len(channel.sent)}"
+        # The in-progress marker is only on the last page
+        assert channel.sent[0].embed.footer.text is None
+        assert "Generating" in channel.sent[1].embed.footer.text
+        
+        last_msg, ids = await renderer.finalize(text, view="VIEW")
+        assert ids == [m.id for m in channel.sent]
+        assert channel.sent[0].embed.footer.text == "Page 1/2"
+        assert channel.sent[1].embed.footer.text == "Page 2/2"
+        assert "".join(m.embed.description for m in channel.sent) == text
+        assert channel.sent[0].view is None and last_msg.view == "VIEW"
+    
+    asyncio.run(run())
+    print("✓ Long replies roll onto new pages with smart_split_text boundaries")
+
+
+def test_renderer_shrinks_and_discards():
+    """Pages no longer needed by the final text are deleted; discard removes all."""
+    async def run():
+        channel = MockChannel()
+        renderer = StreamingMessageRenderer(channel, edit_interval=0)
+        await renderer.update("word " * 1000)
+        assert len(channel.sent) == 2
+        
+        _, ids = await renderer.finalize("short final answer")
+        assert len(ids) == 1
+        assert channel.sent[1].deleted
+        
+        await renderer.discard()
+        assert channel.sent[0].deleted
+    
+    asyncio.run(run())
+    print("✓ Extra pages removed on finalize, discard deletes partial reply")
+
+
+def test_visible_stream_text_holds_back_unclosed_thinking():
+    """Thinking content must never be shown while it is still streaming."""
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = os.path.join(tmp, "config.json")
+        with open(config_path, "w") as f:
+            json.dump({
+                "thinking_filter": {"enabled": True, "start_tag": "<think>", "end_tag": "</think>"}
+            }, f)
+        bot = DiscordBot(ConfigManager(config_path))
+        
+        assert bot.visible_stream_text("<think>planning the sce") == ""
+        assert bot.visible_stream_text("<think>plan</think>The door creaks") == "The door creaks"
+        assert bot.visible_stream_text("Hi <think>hm") == "Hi"
+        assert bot.get_streaming_config()["enabled"] is False
+    print("✓ Unclosed thinking blocks are held back while streaming")
+
+
+if __name__ == "__main__":
+    try:
+        test_stream_chat_completion_yields_deltas()
+        test_stopping_early_closes_the_stream()
+        test_renderer_posts_first_page_immediately_and_throttles_edits()
+        test_renderer_rolls_onto_new_pages()
+        test_renderer_shrinks_and_discards()
+        test_visible_stream_text_holds_back_unclosed_thinking()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
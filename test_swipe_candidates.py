@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""Test generating several swipe alternatives in one round trip."""
+import sys
+import os
+import time
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_provider import fake_provider, completion, error, api_config, make_bot
+
+
+def candidate_provider(n_mode):
+    """Fake provider; n_mode is "honor", "ignore" or "reject"."""
+    def respond(handler, request):
+        n = request.get("n", 1)
+        if n > 1 and n_mode == "reject":
+            handler.send_json(error("Unrecognized request argument supplied: n", "invalid_request_error"), 400)
+            return
+        choice_count = n if n_mode == "honor" else 1
+        time.sleep(0.05)
+        request_number = len(handler.server.requests)
+        handler.send_json(completion(*[f"Alternative {request_number}.{i}" for i in range(choice_count)]))
+
+    return fake_provider(respond)
+
+
+def make_swipe_bot(tmp, server, count=3, use_n=True):
+    return make_bot(tmp, openai_config=api_config(server), swipe_candidates={"count": count, "use_n_parameter": use_n})
+
+
+def generate(bot):
+    config = bot.get_swipe_candidates_config()
+    return asyncio.run(bot.generate_alternatives(
+        111, None, [{"role": "user", "content": "Hi"}],
+        bot.preset_manager.get_current_preset(), config["count"]
+    ))
+
+
+def test_n_parameter_in_one_request():
+    """A provider that supports n returns every alternative in one round trip."""
+    with candidate_provider("honor") as server, tempfile.TemporaryDirectory() as tmp:
+        bot = make_swipe_bot(tmp, server)
+        responses = generate(bot)
+        assert len(responses) == 3
+        assert len(set(responses)) == 3
+        assert len(server.requests) == 1
+        assert server.requests[0]["n"] == 3
+        assert bot.n_parameter_support[bot.openai_client.base_url] is True
+    print("✓ n parameter generates all alternatives in one request")
+
+
+def test_ignored_n_falls_back_to_concurrent_requests():
+    """If the provider ignores n, the rest are generated concurrently and n is not sent again."""
+    with candidate_provider("ignore") as server, tempfile.TemporaryDirectory() as tmp:
+        bot = make_swipe_bot(tmp, server)
+        responses = generate(bot)
+        assert len(responses) == 3
+        assert len(server.requests) == 3
+        assert bot.n_parameter_support[bot.openai_client.base_url] is False
+
+        server.requests.clear()
+        assert len(generate(bot)) == 3
+        assert all("n" not in request for request in server.requests)
+    print("✓ Ignored n parameter falls back to concurrent requests")
+
+
+def test_rejected_n_falls_back_to_concurrent_requests():
+    """If the provider rejects n, the swipe still produces every alternative."""
+    with candidate_provider("reject") as server, tempfile.TemporaryDirectory() as tmp:
+        bot = make_swipe_bot(tmp, server)
+        responses = generate(bot)
+        assert len(responses) == 3
+        assert bot.n_parameter_support[bot.openai_client.base_url] is False
+    print("✓ Rejected n parameter falls back to concurrent requests")
+
+
+def test_concurrent_mode_and_default_count():
+    """Without n, requests run concurrently; the default remains one alternative per swipe."""
+    with candidate_provider("honor") as server, tempfile.TemporaryDirectory() as tmp:
+        bot = make_swipe_bot(tmp, server, count=4, use_n=False)
+        start = time.perf_counter()
+        responses = generate(bot)
+        elapsed = time.perf_counter() - start
+        assert len(responses) == 4
+        assert all("n" not in request for request in server.requests)
+        # Four 50ms requests in parallel, not one after another
+        assert elapsed < 0.5, f"Took {elapsed:.2f}s"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        assert make_bot(tmp).get_swipe_candidates_config()["count"] == 1
+    print("✓ Concurrent mode generates alternatives in parallel")
+
+
+def test_extra_alternatives_notice():
+    """The swipe notice mentions how many extra alternatives are ready."""
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = make_bot(tmp)
+        assert bot.format_extra_alternatives(0) == ""
+        assert "2 more ready" in bot.format_extra_alternatives(2)
+    print("✓ Swipe notice mentions extra alternatives")
+
+
+class FakeChannel:
+    id = 111
+
+    async def trigger_typing(self):
+        pass
+
+
+class FakeContext:
+    """Just enough of a commands.Context for !swipe."""
+
+    def __init__(self):
+        self.channel = FakeChannel()
+        self.guild = None
+        self.sent = []
+
+    async def send(self, text, **kwargs):
+        self.sent.append(text)
+
+
+def test_swipe_discarded_when_turn_moves_on():
+    """A swipe that finishes after a new !chat turn doesn't overwrite that turn's reply."""
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = make_bot(tmp)
+        bot.conversations[111] = [
+            {"role": "user", "content": "First question"},
+            {"role": "assistant", "content": "First answer"}
+        ]
+        bot.response_alternatives[111] = [["First answer"]]
+
+        async def new_turn_while_generating(*args, **kwargs):
+            # Another !chat finishes its turn while the swipe is generating
+            bot.conversations[111].append({"role": "user", "content": "Second question"})
+            bot.conversations[111].append({"role": "assistant", "content": "Second answer"})
+            bot.response_alternatives[111].append(["Second answer"])
+            return ["Stale alternative"]
+
+        bot.generate_swipe_alternatives = new_turn_while_generating
+        ctx = FakeContext()
+        asyncio.run(bot.get_command("swipe").callback(ctx))
+        assert bot.conversations[111][-1] == {"role": "assistant", "content": "Second answer"}
+        assert bot.response_alternatives[111] == [["First answer"], ["Second answer"]]
+        assert "discarded" in ctx.sent[-1]
+    print("✓ Swipes for an earlier turn are discarded")
+
+
+if __name__ == "__main__":
+    try:
+        test_n_parameter_in_one_request()
+        test_ignored_n_falls_back_to_concurrent_requests()
+        test_rejected_n_falls_back_to_concurrent_requests()
+        test_concurrent_mode_and_default_count()
+        test_extra_alternatives_notice()
+        test_swipe_discarded_when_turn_moves_on()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Test the prompt token budget planner and context window registry."""
+import sys
+import os
+import json
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from token_budget import BudgetPlanner, ContextWindowRegistry, truncate_text, keep_leading
+
+
+def count_tokens(text):
+    return len(text) // 4
+
+
+def test_context_windows():
+    registry = ContextWindowRegistry({"my-local-model": 32768})
+    assert registry.window_for("gpt-4o-mini") == 128000
+    assert registry.window_for("gpt-4-turbo-preview") == 128000
+    assert registry.window_for("gpt-4-0613") == 8192
+    assert registry.window_for("openai/gpt-3.5-turbo") == 16385
+    assert registry.window_for("My-Local-Model-Q4") == 32768
+    assert registry.window_for("mystery") is None
+    assert registry.window_for(None) is None
+    print("✓ Context windows are looked up by model prefix")
+
+
+def test_everything_fits():
+    planner = BudgetPlanner()
+    requested = {"system": 100, "lorebook": 50, "history": 300, "user_message": 10}
+    allocation = planner.plan(1000, requested)
+    assert allocation.granted == requested
+    assert not allocation.trimmed
+    assert allocation.reserve == 0
+    print("✓ Nothing is trimmed when the prompt fits")
+
+
+def test_lowest_priority_trimmed_first():
+    planner = BudgetPlanner()
+    requested = {"system": 300, "user_characters": 100, "lorebook": 200, "examples": 400, "history": 1000, "user_message": 50}
+    allocation = planner.plan(2000, requested, reserve=500)
+    # Budget is 1500: system, user message, user characters and lorebook fit whole,
+    # history gets what's left and examples get nothing
+    assert allocation.granted["system"] == 300
+    assert allocation.granted["user_message"] == 50
+    assert allocation.granted["user_characters"] == 100
+    assert allocation.granted["lorebook"] == 200
+    assert allocation.granted["history"] == 850
+    assert allocation.granted["examples"] == 0
+    assert allocation.trimmed
+
+    report = allocation.report()
+    assert report["response_reserve"] == 500
+    assert report["components"]["history"] == {"requested": 1000, "granted": 850, "used": 850}
+    print("✓ Lowest-priority components are trimmed first")
+
+
+def test_shares_cap_components():
+    """A component is held to its share while others need the room; leftovers flow back."""
+    planner = BudgetPlanner({"lorebook": {"share": 0.1}, "examples": {"priority": 50}})
+    requested = {"system": 100, "lorebook": 800, "examples": 100, "history": 2000, "user_message": 0}
+    allocation = planner.plan(1500, requested, reserve=500)
+    assert allocation.granted["lorebook"] == 100
+    assert allocation.granted["examples"] == 100
+    assert allocation.granted["history"] == 700
+
+    # Without competition the share doesn't waste space
+    requested = {"system": 100, "lorebook": 800, "examples": 0, "history": 0, "user_message": 0}
+    allocation = planner.plan(800, requested, reserve=0)
+    assert allocation.granted["lorebook"] == 700
+    print("✓ Shares cap components only while others need the room")
+
+
+def test_truncate_helpers():
+    text = "line one....\nline two....\nline three..\n"
+    assert truncate_text(text, 100, count_tokens) == (text, len(text) // 4)
+    kept, used = truncate_text(text, 7, count_tokens)
+    assert kept == "line one....\nline two...."
+    assert used == 6
+    assert truncate_text(text, 0, count_tokens)[0] == ""
+
+    examples = [{"role": "user", "content": "a" * 40}, {"role": "assistant", "content": "b" * 40}, {"role": "user", "content": "c" * 40}]
+    kept, used = keep_leading(examples, 25, count_tokens)
+    assert kept == examples[:2]
+    assert used == 20
+    print("✓ Text and example truncation keep the leading parts")
+
+
+def test_bot_plans_prompt_budget():
+    """Examples are budgeted separately from history and the allocation is reported."""
+    from config_manager import ConfigManager
+    from discord_bot import DiscordBot
+    from web_server import WebServer
+    from lorebook_manager import LorebookManager
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = os.path.join(tmp, "config.json")
+        with open(config_path, "w") as f:
+            json.dump({
+                "openai_config": {"api_key": "sk-test", "base_url": "http://127.0.0.1:1/v1", "model": "gpt-4-0613"},
+                "token_budget": {"response_reserve": 100, "components": {"examples": {"priority": 50}}}
+            }, f)
+        bot = DiscordBot(ConfigManager(config_path))
+        bot.lorebook_manager = LorebookManager(os.path.join(tmp, "lorebook"))
+        bot.lorebook_manager.add_or_update_entry("inn", "The inn is old.\n" * 100, keywords=["hello"])
+        bot.character_manager.current_character = {
+            "name": "Bob",
+            "description": "An innkeeper.",
+            "mes_example": "<START>\n{{user}}: Hi\n{{char}}: Welcome to the inn!"
+        }
+        bot.conversations[111] = [
+            {"role": "user" if i % 2 == 0 else "assistant", "content": f"Turn {i} " + "words " * 50}
+            for i in range(200)
+        ]
+
+        # gpt-4 has an 8192-token window: the preset's 100000 is capped to leave room for the reply
+        preset = {"max_tokens": 100000, "max_response_length": 1000}
+        assert bot.get_prompt_token_limit(preset, "gpt-4-0613") == 7192
+        assert bot.get_prompt_token_limit(preset, "mystery") == 100000
+
+        messages = bot.build_chat_messages(111, "Hello")
+        report = bot.last_budget_allocations[111]
+        assert report["trimmed"]
+        assert report["limit"] == 2000
+        assert report["components"]["history"]["used"] < report["components"]["history"]["requested"]
+        assert report["total"] <= 2000 - 100
+        assert sum(bot.estimate_tokens(m["content"]) for m in messages) <= 2000 - 100
+        # The lorebook outranks history, so old history goes first
+        assert report["components"]["lorebook"]["used"] == report["components"]["lorebook"]["requested"] > 0
+        assert messages[-1] == {"role": "user", "content": "Hello"}
+        # Newest history is kept, oldest dropped
+        assert messages[-2] is bot.conversations[111][-1]
+        assert bot.conversations[111][0] not in messages
+
+        web_server = WebServer(bot.config_manager, bot)
+        metrics = web_server.app.test_client().get('/api/metrics').get_json()
+        assert metrics["token_budget"]["111"]["total"] == report["total"]
+    print("✓ Bot splits the prompt budget and reports the allocation")
+
+
+if __name__ == "__main__":
+    try:
+        test_context_windows()
+        test_everything_fits()
+        test_lowest_priority_trimmed_first()
+        test_shares_cap_components()
+        test_truncate_helpers()
+        test_bot_plans_prompt_budget()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""Test BPE token counting, model family lookup and per-message memoization."""
+import sys
+import os
+import json
+import base64
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from tokenizer import (
+    ApproximateTokenizer, BPETokenizer, TokenizerRegistry, TokenCounter, _bytes_to_unicode
+)
+
+# A tiny vocabulary: every byte, then merges in rank order
+MERGES = [b"he", b"ll", b"hell", b"hello", b" w", b"or", b" wor", b"ld", b" world", b"!!"]
+
+
+def tiny_ranks():
+    ranks = {bytes([i]): i for i in range(256)}
+    for merge in MERGES:
+        ranks[merge] = len(ranks)
+    return ranks
+
+
+def write_tiktoken_file(path):
+    with open(path, "wb") as f:
+        for token, rank in tiny_ranks().items():
+            f.write(base64.b64encode(token) + b" " + str(rank).encode() + b"\n")
+
+
+def write_huggingface_file(path):
+    byte_encoder = _bytes_to_unicode()
+    vocab = {"".join(byte_encoder[b] for b in token): rank for token, rank in tiny_ranks().items()}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"model": {"type": "BPE", "vocab": vocab, "merges": []}}, f)
+
+
+def test_bpe_counts():
+    """Merges are applied in rank order; unknown byte sequences fall back to single bytes."""
+    tokenizer = BPETokenizer("tiny", tiny_ranks())
+    assert tokenizer.count("") == 0
+    assert tokenizer.count("hello world") == 2
+    assert tokenizer.count("hello world!!") == 3
+    assert tokenizer.count("help") == 3  # "he" + "l" + "p"
+    # Each emoji is 4 bytes with no merges
+    assert tokenizer.count("😀😀") == 8
+    print("✓ BPE merges follow rank order")
+
+
+def test_vocabulary_file_formats():
+    with tempfile.TemporaryDirectory() as tmp:
+        tiktoken_path = os.path.join(tmp, "tiny.tiktoken")
+        write_tiktoken_file(tiktoken_path)
+        hf_path = os.path.join(tmp, "tiny.json")
+        write_huggingface_file(hf_path)
+
+        from_tiktoken = BPETokenizer.from_tiktoken_file(tiktoken_path)
+        from_hf = BPETokenizer.from_huggingface_file(hf_path)
+        assert from_tiktoken.name == "tiny"
+        assert from_tiktoken.ranks == from_hf.ranks == tiny_ranks()
+
+        not_bpe = os.path.join(tmp, "unigram.json")
+        with open(not_bpe, "w") as f:
+            json.dump({"model": {"type": "Unigram", "vocab": []}}, f)
+        try:
+            BPETokenizer.from_huggingface_file(not_bpe)
+            assert False, "Expected ValueError"
+        except ValueError:
+            pass
+    print("✓ tiktoken and Hugging Face vocabulary files load")
+
+
+def test_registry_selects_family():
+    """Models map to families by longest prefix; missing vocabularies fall back to estimates."""
+    with tempfile.TemporaryDirectory() as tmp:
+        write_tiktoken_file(os.path.join(tmp, "o200k_base.tiktoken"))
+        registry = TokenizerRegistry(tmp, {"my-roleplay-model": "o200k_base"})
+
+        assert registry.family_for_model("gpt-4o-mini") == "o200k_base"
+        assert registry.family_for_model("openai/gpt-4-turbo") == "cl100k_base"
+        assert registry.family_for_model("My-Roleplay-Model-v2") == "o200k_base"
+        assert registry.family_for_model("mystery-model") is None
+
+        assert isinstance(registry.for_model("gpt-4o"), BPETokenizer)
+        assert registry.for_model("gpt-4o") is registry.for_model("my-roleplay-model")
+        assert isinstance(registry.for_model("gpt-3.5-turbo"), ApproximateTokenizer)
+        assert isinstance(registry.for_model(None), ApproximateTokenizer)
+    print("✓ Registry selects the vocabulary by model family")
+
+
+def test_approximate_counts_non_english():
+    """English keeps the 4-characters-per-token estimate; other scripts count much higher."""
+    approximate = ApproximateTokenizer()
+    assert approximate.count("This is a test message with some content.") == len("This is a test message with some content.") // 4
+    japanese = "こんにちは、世界。今日はいい天気ですね。"
+    assert approximate.count(japanese) >= len(japanese) * 0.9
+    assert approximate.count(japanese) > len(japanese) // 4 * 3
+    print("✓ Approximate counts account for non-English text")
+
+
+def test_counts_are_memoized():
+    """Each distinct message is tokenized once."""
+    calls = []
+
+    class CountingTokenizer(ApproximateTokenizer):
+        name = "counting"
+
+        def count(self, text):
+            calls.append(text)
+            return super().count(text)
+
+    registry = TokenizerRegistry("does-not-exist")
+    registry.register("cl100k_base", CountingTokenizer())
+    counter = TokenCounter(registry, cache_size=2)
+    history = ["first message " * 10, "second message " * 10]
+    for _ in range(5):
+        for message in history:
+            counter.count(message, "gpt-4")
+    assert len(calls) == 2
+    assert counter.snapshot()["hits"] == 8
+
+    # Least recently used entries are evicted
+    counter.count("third", "gpt-4")
+    counter.count(history[0], "gpt-4")
+    assert len(calls) == 4
+    print("✓ Token counts are memoized per message")
+
+
+def test_bot_uses_channel_model_vocabulary():
+    """The bot counts with the vocabulary of the model configured for the channel."""
+    from config_manager import ConfigManager
+    from discord_bot import DiscordBot
+
+    with tempfile.TemporaryDirectory() as tmp:
+        vocab_dir = os.path.join(tmp, "tokenizers")
+        os.makedirs(vocab_dir)
+        write_tiktoken_file(os.path.join(vocab_dir, "o200k_base.tiktoken"))
+        config_path = os.path.join(tmp, "config.json")
+        with open(config_path, "w") as f:
+            json.dump({
+                "openai_config": {"api_key": "sk-test", "base_url": "http://127.0.0.1:1/v1", "model": "gpt-4o"},
+                "tokenizer": {"vocab_dir": vocab_dir}
+            }, f)
+        bot = DiscordBot(ConfigManager(config_path))
+
+        assert bot.estimate_tokens("hello world") == 2
+        assert bot.estimate_tokens("hello world", "some-other-model") == len("hello world") // 4
+
+        messages = [
+            {"role": "system", "content": "hello world"},
+            {"role": "user", "content": "😀" * 200},
+            {"role": "assistant", "content": "hello world"},
+            {"role": "user", "content": "hello"}
+        ]
+        # 800 tokens of emoji don't fit in 600; the 4-chars estimate (50) would have kept them
+        trimmed = bot.trim_messages_to_fit(messages, 600, "gpt-4o")
+        assert [m["content"] for m in trimmed] == ["hello world", "hello world", "hello"]
+    print("✓ Bot counts tokens with the channel model's vocabulary")
+
+
+if __name__ == "__main__":
+    try:
+        test_bpe_counts()
+        test_vocabulary_file_formats()
+        test_registry_selects_family()
+        test_approximate_counts_non_english()
+        test_counts_are_memoized()
+        test_bot_uses_channel_model_vocabulary()
+        print("\n=== All Tests Passed! ===\n")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,203 @@
+"""Token budgets for the parts of a prompt.
+
+Example dialogues, lorebook entries, user character sheets and history used
+to compete for the same space, with example dialogues trimmed as if they were
+old history and a fixed 500 tokens kept free for the reply. BudgetPlanner
+splits the prompt limit between named components instead. Each component has
+a priority and an optional share of the budget. When the prompt doesn't fit,
+the lowest-priority components are truncated or dropped first.
+
+The prompt limit is the preset's max_tokens, capped by the model's context
+window (minus the reply length) when the window is known. Requests are sized
+to fit before they are sent, instead of retrying after the provider answers
+with context_length_exceeded.
+"""
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+# Model name prefix -> context window in tokens. Provider prefixes such as
+# "openai/" are ignored and the longest matching prefix wins.
+DEFAULT_CONTEXT_WINDOWS: Dict[str, int] = {
+    "gpt-5": 400000,
+    "gpt-4.1": 1047576,
+    "gpt-4o": 128000,
+    "chatgpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4-32k": 32768,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+    "o1": 200000,
+    "o3": 200000,
+    "o4": 200000,
+    "claude": 200000,
+    "gemini-1.5": 1048576,
+    "gemini-2": 1048576,
+    "llama-3.1": 131072,
+    "llama-3.3": 131072,
+    "llama-3": 8192,
+    "mistral-large": 131072,
+}
+
+# Prompt components in the order they appear. Higher priority is kept
+# longer; components that can't be trimmed are always sent whole.
+DEFAULT_COMPONENTS: Dict[str, Dict[str, Any]] = {
+    # Preset sections, character card, character list and CP tracking prompt
+    "system": {"priority": 100, "trimmable": False},
+    "user_characters": {"priority": 80},
+    "lorebook": {"priority": 70},
+    "examples": {"priority": 30},
+    # Running summary of history that no longer fits (see history_summarizer.py)
+    "summary": {"priority": 90},
+    "history": {"priority": 40},
+    "user_message": {"priority": 100, "trimmable": False},
+}
+
+
+def match_model_prefix(model: Optional[str], table: Dict[str, Any]) -> Optional[Any]:
+    """Value for the longest prefix of model in table (case-insensitive, provider prefix ignored)."""
+    if not model:
+        return None
+    model = model.lower().rsplit("/", 1)[-1]
+    matches = [prefix for prefix in table if model.startswith(prefix.lower())]
+    if not matches:
+        return None
+    return table[max(matches, key=len)]
+
+
+class ContextWindowRegistry:
+    """Context window sizes by model name."""
+
+    def __init__(self, overrides: Optional[Dict[str, int]] = None):
+        self.windows = dict(DEFAULT_CONTEXT_WINDOWS)
+        self.windows.update({prefix: int(size) for prefix, size in (overrides or {}).items()})
+
+    def window_for(self, model: Optional[str]) -> Optional[int]:
+        """Context window of a model, or None if it isn't known."""
+        return match_model_prefix(model, self.windows)
+
+
+class BudgetAllocation:
+    """How a prompt's token budget was split between its components."""
+
+    def __init__(self, limit: int, reserve: int, requested: Dict[str, int], granted: Dict[str, int]):
+        self.limit = limit
+        self.reserve = reserve
+        self.requested = requested
+        self.granted = granted
+        # What the components actually used after truncation (whole messages/lines only)
+        self.used = dict(granted)
+
+    @property
+    def trimmed(self) -> bool:
+        return any(self.granted[name] < self.requested[name] for name in self.requested)
+
+    def summary(self) -> str:
+        parts = [f"{name} {self.used[name]}/{self.requested[name]}" for name in self.requested]
+        return f"{sum(self.used.values())}/{self.limit} tokens: " + ", ".join(parts)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "response_reserve": self.reserve,
+            "total": sum(self.used.values()),
+            "trimmed": self.trimmed,
+            "components": {
+                name: {"requested": self.requested[name], "granted": self.granted[name], "used": self.used[name]}
+                for name in self.requested
+            }
+        }
+
+
+class BudgetPlanner:
+    """Splits a prompt limit between components by priority and share."""
+
+    def __init__(self, components: Optional[Dict[str, Dict[str, Any]]] = None):
+        """
+        Args:
+            components: Per-component overrides of "priority", "share" (fraction
+                of the budget the component may use when the prompt has to be
+                trimmed) and "trimmable"
+        """
+        self.components = {name: dict(spec) for name, spec in DEFAULT_COMPONENTS.items()}
+        for name, spec in (components or {}).items():
+            self.components.setdefault(name, {"priority": 0}).update(spec)
+
+    def plan(self, limit: int, requested: Dict[str, int], reserve: int = 500) -> BudgetAllocation:
+        """Grant each component up to what it requested.
+
+        If everything fits in limit, everything is granted. Otherwise the
+        budget is limit minus reserve (room for the reply). Components are
+        served highest priority first, each up to its share; whatever is left
+        then goes to components that were held back by their share.
+
+        Args:
+            limit: Prompt token limit
+            requested: Tokens each component needs to be sent whole
+            reserve: Tokens kept free when the prompt has to be trimmed
+        """
+        if sum(requested.values()) <= limit:
+            return BudgetAllocation(limit, 0, dict(requested), dict(requested))
+
+        budget = max(limit - reserve, 0)
+        order = sorted(requested, key=lambda name: -self.components.get(name, {}).get("priority", 0))
+        granted = {}
+        remaining = budget
+        for name in order:
+            spec = self.components.get(name, {})
+            want = requested[name]
+            if spec.get("trimmable", True):
+                share = spec.get("share")
+                if share is not None:
+                    want = min(want, int(budget * float(share)))
+                want = min(want, max(remaining, 0))
+            granted[name] = want
+            remaining -= want
+
+        for name in order:
+            if remaining <= 0:
+                break
+            extra = min(requested[name] - granted[name], remaining)
+            if extra > 0:
+                granted[name] += extra
+                remaining -= extra
+
+        return BudgetAllocation(limit, reserve, dict(requested), {name: granted[name] for name in requested})
+
+
+def truncate_text(text: str, budget: int, count_tokens: Callable[[str], int]) -> Tuple[str, int]:
+    """Keep the leading lines of text that fit in budget.
+
+    Returns:
+        (kept text, its tokens)
+    """
+    tokens = count_tokens(text)
+    if tokens <= budget:
+        return text, tokens
+    kept = []
+    used = 0
+    for line in text.splitlines(keepends=True):
+        line_tokens = count_tokens(line)
+        if used + line_tokens > budget:
+            break
+        kept.append(line)
+        used += line_tokens
+    # Per-line counts can differ slightly from the joined text's
+    text = "".join(kept).rstrip()
+    return text, count_tokens(text)
+
+
+def keep_leading(messages: List[Dict[str, str]], budget: int,
+                 count_tokens: Callable[[str], int]) -> Tuple[List[Dict[str, str]], int]:
+    """Keep whole messages from the start of the list while they fit in budget.
+
+    Returns:
+        (kept messages, their tokens)
+    """
+    kept = []
+    used = 0
+    for message in messages:
+        message_tokens = count_tokens(message['content'])
+        if used + message_tokens > budget:
+            break
+        kept.append(message)
+        used += message_tokens
+    return kept, used
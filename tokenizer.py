@@ -0,0 +1,279 @@
+"""Token counting for context trimming.
+
+The bot used to assume 4 characters per token, which badly undercounts
+non-English text, code and emoji. This module counts tokens with the model's
+real byte-level BPE vocabulary when a copy of it is available locally, and
+falls back to a script-aware estimate otherwise. Nothing is downloaded.
+
+Vocabulary files live in a directory (default "tokenizers/") and are looked up
+by model family:
+
+    tokenizers/cl100k_base.tiktoken   - tiktoken format ("<base64 token> <rank>" per line)
+    tokenizers/o200k_base.tiktoken
+    tokenizers/llama3.json            - Hugging Face tokenizer.json (byte-level BPE)
+    tokenizers/llama3/tokenizer.json
+
+Counts are memoized per message content, so a history message is tokenized
+once for its lifetime instead of on every turn.
+"""
+import base64
+import json
+import os
+import re
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+from bot_logging import get_logger
+from token_budget import match_model_prefix
+
+logger = get_logger("context")
+
+# Model name prefix -> vocabulary family. Provider prefixes such as
+# "openai/" are ignored and the longest matching prefix wins.
+DEFAULT_MODEL_FAMILIES: Dict[str, str] = {
+    "gpt-4o": "o200k_base",
+    "chatgpt-4o": "o200k_base",
+    "gpt-4.1": "o200k_base",
+    "gpt-4.5": "o200k_base",
+    "gpt-5": "o200k_base",
+    "o1": "o200k_base",
+    "o3": "o200k_base",
+    "o4": "o200k_base",
+    "gpt-4": "cl100k_base",
+    "gpt-3.5": "cl100k_base",
+    "llama-3": "llama3",
+    "llama3": "llama3",
+}
+
+# Pre-tokenization split used by cl100k-style vocabularies, written for the
+# standard re module: [^\W\d_] stands in for \p{L} and \d for \p{N}
+_PRETOKENIZE = re.compile(
+    r"""(?i:'s|'t|'re|'ve|'m|'ll|'d)|(?:[^\r\n\w]|_)?[^\W\d_]+|\d{1,3}| ?(?:[^\s\w]|_)+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"""
+)
+
+# Pieces longer than this are counted in chunks to keep merging cheap
+_MAX_PIECE_BYTES = 256
+
+
+class Tokenizer(ABC):
+    """Counts tokens in text."""
+
+    name = "tokenizer"
+
+    @abstractmethod
+    def count(self, text: str) -> int:
+        """Number of tokens in text."""
+
+
+class ApproximateTokenizer(Tokenizer):
+    """Estimate used when no vocabulary file is available.
+
+    ASCII text averages about 4 characters per token; other scripts and emoji
+    take far more, roughly one token per 3 bytes of UTF-8.
+    """
+
+    name = "approximate"
+
+    def count(self, text: str) -> int:
+        if text.isascii():
+            return len(text) // 4
+        non_ascii_bytes = len(text.encode("utf-8"))
+        ascii_chars = sum(1 for char in text if char < "\x80")
+        non_ascii_bytes -= ascii_chars
+        return ascii_chars // 4 + (non_ascii_bytes + 2) // 3
+
+
+def _bytes_to_unicode() -> Dict[int, str]:
+    """GPT-2's reversible byte -> printable character mapping used by byte-level BPE files."""
+    printable = list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1)) + list(range(ord("®"), ord("ÿ") + 1))
+    characters = printable[:]
+    extra = 0
+    for byte in range(256):
+        if byte not in printable:
+            printable.append(byte)
+            characters.append(256 + extra)
+            extra += 1
+    return {byte: chr(character) for byte, character in zip(printable, characters)}
+
+
+class BPETokenizer(Tokenizer):
+    """Byte-level BPE token counter driven by a merge-rank table."""
+
+    def __init__(self, name: str, ranks: Dict[bytes, int]):
+        self.name = name
+        self.ranks = ranks
+        self._piece_counts: Dict[bytes, int] = {}
+
+    @classmethod
+    def from_tiktoken_file(cls, path: str, name: Optional[str] = None) -> "BPETokenizer":
+        """Load a tiktoken vocabulary ("<base64 token> <rank>" per line)."""
+        ranks = {}
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                token, rank = line.split()
+                ranks[base64.b64decode(token)] = int(rank)
+        return cls(name or os.path.splitext(os.path.basename(path))[0], ranks)
+
+    @classmethod
+    def from_huggingface_file(cls, path: str, name: Optional[str] = None) -> "BPETokenizer":
+        """Load a Hugging Face tokenizer.json with a byte-level BPE model.
+
+        Token ids are used as merge ranks, which holds for byte-level BPE
+        vocabularies (GPT-2 style, Llama 3).
+
+        Raises:
+            ValueError: If the file isn't a byte-level BPE tokenizer
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        model = data.get("model") or {}
+        if model.get("type") != "BPE" or not isinstance(model.get("vocab"), dict):
+            raise ValueError(f"{path} is not a BPE tokenizer")
+
+        byte_decoder = {character: byte for byte, character in _bytes_to_unicode().items()}
+        ranks = {}
+        for token, token_id in model["vocab"].items():
+            try:
+                ranks[bytes(byte_decoder[character] for character in token)] = token_id
+            except KeyError:
+                raise ValueError(f"{path} is not a byte-level BPE tokenizer")
+        if name is None:
+            name = os.path.splitext(os.path.basename(path))[0]
+            if name == "tokenizer":
+                name = os.path.basename(os.path.dirname(os.path.abspath(path)))
+        return cls(name, ranks)
+
+    def _count_piece(self, piece: bytes) -> int:
+        if piece in self.ranks:
+            return 1
+        cached = self._piece_counts.get(piece)
+        if cached is not None:
+            return cached
+
+        # Repeatedly merge the adjacent pair with the lowest rank
+        parts = [piece[i:i + 1] for i in range(len(piece))]
+        while len(parts) > 1:
+            best_rank = None
+            best_index = -1
+            for i in range(len(parts) - 1):
+                rank = self.ranks.get(parts[i] + parts[i + 1])
+                if rank is not None and (best_rank is None or rank < best_rank):
+                    best_rank = rank
+                    best_index = i
+            if best_rank is None:
+                break
+            parts[best_index:best_index + 2] = [parts[best_index] + parts[best_index + 1]]
+
+        if len(self._piece_counts) > 100000:
+            self._piece_counts.clear()
+        self._piece_counts[piece] = len(parts)
+        return len(parts)
+
+    def count(self, text: str) -> int:
+        total = 0
+        for match in _PRETOKENIZE.finditer(text):
+            piece = match.group().encode("utf-8")
+            for start in range(0, len(piece), _MAX_PIECE_BYTES):
+                total += self._count_piece(piece[start:start + _MAX_PIECE_BYTES])
+        return total
+
+
+class TokenizerRegistry:
+    """Pick and lazily load the tokenizer for a model name."""
+
+    def __init__(self, vocab_dir: str = "tokenizers", model_families: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            vocab_dir: Directory holding the vocabulary files
+            model_families: Extra or overriding model prefix -> family mappings
+        """
+        self.vocab_dir = vocab_dir
+        self.model_families = dict(DEFAULT_MODEL_FAMILIES)
+        self.model_families.update(model_families or {})
+        self.fallback = ApproximateTokenizer()
+        self.tokenizers: Dict[str, Tokenizer] = {}
+
+    def register(self, family: str, tokenizer: Tokenizer) -> None:
+        """Use a custom tokenizer for a model family."""
+        self.tokenizers[family] = tokenizer
+
+    def family_for_model(self, model: Optional[str]) -> Optional[str]:
+        return match_model_prefix(model, self.model_families)
+
+    def _vocab_paths(self, family: str) -> List[Tuple[str, str]]:
+        return [
+            (os.path.join(self.vocab_dir, f"{family}.tiktoken"), "tiktoken"),
+            (os.path.join(self.vocab_dir, f"{family}.json"), "huggingface"),
+            (os.path.join(self.vocab_dir, family, "tokenizer.json"), "huggingface"),
+        ]
+
+    def _load(self, family: str) -> Tokenizer:
+        for path, file_format in self._vocab_paths(family):
+            if not os.path.exists(path):
+                continue
+            try:
+                if file_format == "tiktoken":
+                    tokenizer = BPETokenizer.from_tiktoken_file(path, family)
+                else:
+                    tokenizer = BPETokenizer.from_huggingface_file(path, family)
+                logger.info("Loaded '%s' vocabulary from %s (%s tokens)", family, path, len(tokenizer.ranks))
+                return tokenizer
+            except (OSError, ValueError) as e:
+                logger.warning("Could not load %s: %s", path, e)
+        logger.info("No vocabulary for '%s' in %s, using approximate counts", family, self.vocab_dir)
+        return self.fallback
+
+    def for_model(self, model: Optional[str]) -> Tokenizer:
+        """Get the tokenizer for a model (the approximate one if its vocabulary isn't available)."""
+        family = self.family_for_model(model)
+        if family is None:
+            return self.fallback
+        if family not in self.tokenizers:
+            self.tokenizers[family] = self._load(family)
+        return self.tokenizers[family]
+
+
+class TokenCounter:
+    """Memoized token counts per (tokenizer, message content)."""
+
+    def __init__(self, registry: TokenizerRegistry, cache_size: int = 20000):
+        self.registry = registry
+        self.cache_size = cache_size
+        self.cache: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, text: str, model: Optional[str] = None) -> int:
+        """Count tokens in text for a model."""
+        if not text:
+            return 0
+        tokenizer = self.registry.for_model(model)
+        # Keyed by the content itself: history messages are the same string
+        # objects every turn, so their hash is cached and lookups are cheap
+        key = (tokenizer.name, text)
+        count = self.cache.get(key)
+        if count is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return count
+
+        self.misses += 1
+        count = tokenizer.count(text)
+        self.cache[key] = count
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return count
+
+    def clear(self) -> None:
+        self.cache.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "cached_messages": len(self.cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "tokenizers": {family: tokenizer.name for family, tokenizer in list(self.registry.tokenizers.items())}
+        }
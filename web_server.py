@@ -3,12 +3,19 @@ from flask import Flask, render_template, request, jsonify, send_from_directory
 import json
 import os
 import base64
+import tempfile
+import threading
+import uuid
 from werkzeug.utils import secure_filename
 from config_manager import ConfigManager
 from preset_manager import PresetManager
 from character_manager import CharacterManager
 from user_characters_manager import UserCharactersManager
 from lorebook_manager import LorebookManager
+from lorebook_importer import LorebookImporter
+from bot_logging import bot_logging, get_logger
+
+lorebook_logger = get_logger("lorebook")
 
 class WebServer:
     def __init__(self, config_manager: ConfigManager, bot_instance=None):
@@ -18,7 +25,11 @@ class WebServer:
         self.preset_manager = PresetManager()
         self.character_manager = CharacterManager()
         self.user_characters_manager = UserCharactersManager()
-        self.lorebook_manager = LorebookManager()
+        self.lorebook_manager = LorebookManager(
+            storage=config_manager.get("lorebook_storage", {}).get("backend", "json")
+        )
+        # Streaming lorebook imports running in the background, by job id
+        self.lorebook_imports = {}
         
         self.setup_routes()
     
@@ -40,6 +51,19 @@ class WebServer:
     def setup_routes(self):
         """Setup Flask routes."""
         
+        # Routes that change files the bot builds prompts from
+        prompt_file_routes = ('/api/presets', '/api/characters', '/api/user_characters', '/api/lorebook')
+        
+        @self.app.after_request
+        def invalidate_prompt_context(response):
+            """Make the bot rebuild its compiled prompt context after prompt files were edited."""
+            if (request.method in ('POST', 'PUT', 'DELETE') and request.path.startswith(prompt_file_routes)
+                    and response.status_code < 400):
+                bot = self.bot_instance
+                if bot and hasattr(bot, 'invalidate_prompt_context'):
+                    bot.invalidate_prompt_context()
+            return response
+        
         @self.app.route('/')
         def index():
             """Serve main configuration page."""
@@ -105,7 +129,64 @@ class WebServer:
                 status["issues"].append("Bot instance has no 'guilds' attribute")
             
             return jsonify(status)
-        
+
+        @self.app.route('/api/metrics', methods=['GET'])
+        def get_metrics():
+            """Get generation latency metrics from the running bot."""
+            bot = self.bot_instance
+            if not bot or not hasattr(bot, 'generation_metrics'):
+                return jsonify({"status": "error", "message": "Bot is not running"}), 400
+            metrics = bot.generation_metrics.snapshot()
+            if hasattr(bot, 'scheduler'):
+                metrics["scheduler"] = bot.scheduler.snapshot()
+            if hasattr(bot, 'resilience'):
+                metrics["resilience"] = bot.resilience.snapshot()
+            if hasattr(bot, 'hedger'):
+                metrics["hedging"] = bot.hedger.snapshot()
+            if hasattr(bot, 'prefix_stability'):
+                metrics["prefix_stability"] = bot.prefix_stability.snapshot()
+            if hasattr(bot, 'prompt_context_cache'):
+                metrics["prompt_context_cache"] = bot.prompt_context_cache.snapshot()
+            if hasattr(bot, 'token_counter'):
+                metrics["tokenizer"] = bot.token_counter.snapshot()
+            if hasattr(bot, 'context_trimmer'):
+                metrics["context_trimmer"] = bot.context_trimmer.snapshot()
+            if hasattr(bot, 'last_budget_allocations'):
+                metrics["token_budget"] = {str(channel_id): allocation for channel_id, allocation in list(bot.last_budget_allocations.items())}
+            if hasattr(bot, 'history_summarizer'):
+                metrics["history_summary"] = bot.history_summarizer.snapshot()
+            metrics["logging"] = bot_logging.snapshot()
+            if hasattr(bot, 'config_manager'):
+                metrics["config_persistence"] = bot.config_manager.persistence_snapshot()
+            if hasattr(bot, 'lorebook_manager'):
+                metrics["lorebook_vectors"] = bot.lorebook_manager.vector_index.snapshot()
+                metrics["lorebook_activations"] = bot.lorebook_manager.activations.snapshot()
+                metrics["lorebook_recursion"] = bot.lorebook_manager.trigger_graph.snapshot()
+                metrics["lorebook_section_cache"] = bot.lorebook_manager.section_cache_snapshot()
+                if bot.lorebook_manager.store is not None:
+                    metrics["lorebook_storage"] = bot.lorebook_manager.store.snapshot()
+            return jsonify(metrics)
+
+        @self.app.route('/api/prompt_cache/invalidate', methods=['POST'])
+        def invalidate_prompt_cache():
+            """Force the bot to reload character cards, user characters and lorebooks."""
+            bot = self.bot_instance
+            if not bot or not hasattr(bot, 'invalidate_prompt_context'):
+                return jsonify({"status": "error", "message": "Bot is not running"}), 400
+            bot.invalidate_prompt_context()
+            return jsonify({"status": "success", "message": "Prompt context cache cleared"})
+
+        @self.app.route('/api/rate_limits', methods=['GET'])
+        def get_rate_limits():
+            """Get the live rate-limit buckets of every endpoint the bot has used."""
+            bot = self.bot_instance
+            if not bot or not hasattr(bot, 'rate_limiter'):
+                return jsonify({"status": "error", "message": "Bot is not running"}), 400
+            return jsonify({
+                "settings": bot.get_rate_limit_config(),
+                "endpoints": bot.rate_limiter.snapshot()
+            })
+
         @self.app.route('/api/config', methods=['GET'])
         def get_config():
             """Get current configuration."""
@@ -171,6 +252,28 @@ class WebServer:
                 # Update config file
                 self.config_manager.update_config(data)
                 
+                # Apply new scheduler and retry settings to the running bot
+                if 'scheduler' in data and self.bot_instance and hasattr(self.bot_instance, 'configure_scheduler'):
+                    self.bot_instance.configure_scheduler()
+                if 'resilience' in data and self.bot_instance and hasattr(self.bot_instance, 'configure_resilience'):
+                    self.bot_instance.configure_resilience()
+                if 'hedging' in data and self.bot_instance and hasattr(self.bot_instance, 'configure_hedging'):
+                    self.bot_instance.configure_hedging()
+                if 'rate_limits' in data and self.bot_instance and hasattr(self.bot_instance, 'configure_rate_limits'):
+                    self.bot_instance.configure_rate_limits()
+                if 'tokenizer' in data and self.bot_instance and hasattr(self.bot_instance, 'configure_tokenizer'):
+                    self.bot_instance.configure_tokenizer()
+                if 'token_budget' in data and self.bot_instance and hasattr(self.bot_instance, 'configure_token_budget'):
+                    self.bot_instance.configure_token_budget()
+                if 'history_summary' in data and self.bot_instance and hasattr(self.bot_instance, 'configure_history_summary'):
+                    self.bot_instance.configure_history_summary()
+                if 'lorebook_vectors' in data and self.bot_instance and hasattr(self.bot_instance, 'configure_lorebook_vectors'):
+                    self.bot_instance.configure_lorebook_vectors()
+                if 'lorebook_recursion' in data and self.bot_instance and hasattr(self.bot_instance, 'configure_lorebook_recursion'):
+                    self.bot_instance.configure_lorebook_recursion()
+                if 'logging' in data and self.bot_instance and hasattr(self.bot_instance, 'configure_logging'):
+                    self.bot_instance.configure_logging()
+                
                 # Apply changes to running bot if available
                 if openai_config_changed and self.bot_instance:
                     # Get all current values (use new if provided, otherwise get from config)
@@ -274,6 +377,10 @@ class WebServer:
                         return jsonify({"status": "error", "message": "Cannot create new config with hidden API key"}), 400
                 
                 self.config_manager.save_api_config(config_name, api_key, base_url, model)
+                
+                # Make the running bot reconnect with the new settings
+                if self.bot_instance and hasattr(self.bot_instance, 'invalidate_api_config'):
+                    self.bot_instance.invalidate_api_config(config_name)
                 return jsonify({"status": "success", "message": f"API configuration '{config_name}' saved"})
             except Exception as e:
                 return jsonify({"status": "error", "message": str(e)}), 400
@@ -283,6 +390,8 @@ class WebServer:
             """Delete an API configuration."""
             try:
                 if self.config_manager.delete_api_config(config_name):
+                    if self.bot_instance and hasattr(self.bot_instance, 'invalidate_api_config'):
+                        self.bot_instance.invalidate_api_config(config_name)
                     return jsonify({"status": "success", "message": f"API configuration '{config_name}' deleted"})
                 else:
                     return jsonify({"status": "error", "message": "Configuration not found"}), 404
@@ -565,7 +674,12 @@ class WebServer:
                     key, content, keywords, 
                     always_active=always_active,
                     activation_type=activation_type,
-                    lorebook_name=lorebook_name
+                    lorebook_name=lorebook_name,
+                    case_sensitive=bool(data.get('case_sensitive', False)),
+                    match_whole_words=bool(data.get('match_whole_words', False)),
+                    sticky=int(data.get('sticky') or 0),
+                    cooldown=int(data.get('cooldown') or 0),
+                    no_recurse=bool(data.get('no_recurse', False))
                 )
                 return jsonify({"status": "success", "message": f"Lorebook entry '{key}' saved"})
             except Exception as e:
@@ -623,6 +737,51 @@ class WebServer:
             except Exception as e:
                 return jsonify({"status": "error", "message": str(e)}), 400
         
+        @self.app.route('/api/lorebooks/import_file', methods=['POST'])
+        def import_lorebook_file_upload():
+            """Import a (large) lorebook or SillyTavern world info file in the background."""
+            try:
+                if 'file' not in request.files or request.files['file'].filename == '':
+                    return jsonify({"status": "error", "message": "No file provided"}), 400
+                
+                file = request.files['file']
+                name = request.form.get('name') or os.path.splitext(file.filename)[0] or None
+                merge = request.form.get('merge', 'true').lower() == 'true'
+                
+                # Copy the upload to disk so the import can read it after this request ends
+                fd, path = tempfile.mkstemp(suffix='.json')
+                os.close(fd)
+                file.save(path)
+                
+                # Forget imports whose progress nobody asked for in a while
+                for finished_job in [job for job, importer in self.lorebook_imports.items() if importer.expired()]:
+                    del self.lorebook_imports[finished_job]
+                
+                job_id = uuid.uuid4().hex
+                importer = LorebookImporter(self.lorebook_manager)
+                self.lorebook_imports[job_id] = importer
+                
+                def run_import():
+                    try:
+                        importer.import_path(path, name, merge)
+                    except Exception as e:
+                        lorebook_logger.warning("Import of %s failed: %s", file.filename, e)
+                    finally:
+                        os.remove(path)
+                
+                threading.Thread(target=run_import, daemon=True).start()
+                return jsonify({"status": "success", "job_id": job_id})
+            except Exception as e:
+                return jsonify({"status": "error", "message": str(e)}), 400
+        
+        @self.app.route('/api/lorebooks/import_file/<job_id>', methods=['GET'])
+        def import_lorebook_file_progress(job_id):
+            """Progress of a background lorebook import (entries imported, entries per second)."""
+            importer = self.lorebook_imports.get(job_id)
+            if importer is None:
+                return jsonify({"error": "Import not found"}), 404
+            return jsonify(importer.snapshot())
+        
         # Multiple Lorebooks API endpoints
         @self.app.route('/api/lorebooks', methods=['GET'])
         def list_lorebooks():
@@ -633,6 +792,18 @@ class WebServer:
             except Exception as e:
                 return jsonify({"error": str(e)}), 500
         
+        @self.app.route('/api/lorebooks/search', methods=['GET'])
+        def search_lorebooks():
+            """Search lorebook entries by key, keywords and content."""
+            try:
+                query = request.args.get('q', '')
+                lorebook_name = request.args.get('lorebook') or None
+                limit = request.args.get('limit', 50, type=int)
+                results = self.lorebook_manager.search_entries(query, lorebook_name, limit)
+                return jsonify({"results": results})
+            except Exception as e:
+                return jsonify({"error": str(e)}), 500
+        
         @self.app.route('/api/lorebooks/<name>', methods=['GET'])
         def get_lorebook(name):
             """Get a specific lorebook."""
@@ -654,9 +825,10 @@ class WebServer:
                 # Support both old single character and new multiple characters
                 linked_character = data.get('linked_character') if 'linked_character' in data else None
                 linked_characters = data.get('linked_characters') if 'linked_characters' in data else None
+                scan_depth = data.get('scan_depth')
                 
                 if self.lorebook_manager.update_lorebook_metadata(
-                    name, description, enabled, linked_character, linked_characters
+                    name, description, enabled, linked_character, linked_characters, scan_depth
                 ):
                     return jsonify({"status": "success", "message": f"Lorebook '{name}' updated"})
                 return jsonify({"status": "error", "message": "Lorebook not found"}), 404
@@ -737,10 +909,7 @@ class WebServer:
                 cp_total = data.get('cp_total', 0)
                 
                 # Update CP total in config
-                if 'cp_tracking' not in self.config_manager.config:
-                    self.config_manager.config['cp_tracking'] = {}
-                self.config_manager.config['cp_tracking']['cp_total'] = cp_total
-                self.config_manager.save_config()
+                self.config_manager.set('cp_tracking.cp_total', cp_total)
                 
                 # Update all channels in the bot if it's running
                 if self.bot_instance:
@@ -887,6 +1056,10 @@ class WebServer:
                 self.config_manager.set(f'server_configs.{server_id}.preset', preset)
                 self.config_manager.set(f'server_configs.{server_id}.api_config', api_config)
                 self.config_manager.set(f'server_configs.{server_id}.character', character)
+                if 'failover_api_configs' in data:
+                    # Ordered list of saved API config names to fail over to
+                    failover = [name for name in (data.get('failover_api_configs') or []) if name]
+                    self.config_manager.set(f'server_configs.{server_id}.failover_api_configs', failover)
                 
                 return jsonify({
                     "status": "success",
@@ -908,6 +1081,10 @@ class WebServer:
                 self.config_manager.set(f'channel_configs.{channel_id}.preset', preset)
                 self.config_manager.set(f'channel_configs.{channel_id}.api_config', api_config)
                 self.config_manager.set(f'channel_configs.{channel_id}.character', character)
+                if 'failover_api_configs' in data:
+                    # Ordered list of saved API config names to fail over to
+                    failover = [name for name in (data.get('failover_api_configs') or []) if name]
+                    self.config_manager.set(f'channel_configs.{channel_id}.failover_api_configs', failover)
                 
                 return jsonify({
                     "status": "success",
@@ -932,6 +1109,7 @@ class WebServer:
                         'preset': config.get('preset', ''),
                         'api_config': config.get('api_config', ''),
                         'character': config.get('character', ''),
+                        'failover_api_configs': config.get('failover_api_configs', []),
                         'from_config': True  # Flag to indicate this is from config, not Discord
                     })
                 
@@ -944,6 +1122,7 @@ class WebServer:
                         'preset': config.get('preset', ''),
                         'api_config': config.get('api_config', ''),
                         'character': config.get('character', ''),
+                        'failover_api_configs': config.get('failover_api_configs', []),
                         'from_config': True  # Flag to indicate this is from config, not Discord
                     })
                 
@@ -958,10 +1137,7 @@ class WebServer:
         def delete_server_config(server_id):
             """Delete configuration for a specific server."""
             try:
-                server_configs = self.config_manager.get('server_configs', {})
-                if server_id in server_configs:
-                    del server_configs[server_id]
-                    self.config_manager.set('server_configs', server_configs)
+                if self.config_manager.delete(f'server_configs.{server_id}'):
                     return jsonify({
                         "status": "success",
                         "message": f"Server configuration deleted"
@@ -978,10 +1154,7 @@ class WebServer:
         def delete_channel_config(channel_id):
             """Delete configuration for a specific channel."""
             try:
-                channel_configs = self.config_manager.get('channel_configs', {})
-                if channel_id in channel_configs:
-                    del channel_configs[channel_id]
-                    self.config_manager.set('channel_configs', channel_configs)
+                if self.config_manager.delete(f'channel_configs.{channel_id}'):
                     return jsonify({
                         "status": "success",
                         "message": f"Channel configuration deleted"